@@ -0,0 +1,283 @@
+"""
+Billing Ticker: Charge active sessions for elapsed minutes while they run
+
+Without this, sessions are only billed when end_rtc_session runs, so a client
+can stay on a long video call well past their balance. Every tick, each
+worker calls bill_active_sessions for its hash shard of the active sessions
+until the shard is drained. The RPC bills the least recently billed sessions
+first, advances last_billed_at and credits_charged, and takes one debit per
+client per call.
+
+Sharding: session ids hash into 1024 buckets (computed in Postgres) and each
+of the --shards (at most 1024) covers an equal range of them, read through
+an index. One worker process runs per shard, so a shard is only ever billed
+by one ticker. Run all shards on one host, or split them across hosts with
+--shard-ids. Each worker runs an asyncio loop with
+--concurrency calls in flight. Rows are claimed with SKIP LOCKED, so
+concurrent calls on one shard split the work. The charge is a running total
+(owed = cost so far - credits_charged), so an overlapping or repeated call
+never bills a minute twice.
+
+Sessions whose client can't pay get credits_exhausted_at while still active
+(reported as "exhausted") so the RTC layer can cut the call; billing_status
+stays 'processing' so reconciliation still collects them if they're closed
+outside end_rtc_session.
+
+Usage:
+    python execution/billing_ticker.py                              # one worker, every session
+    python execution/billing_ticker.py --shards 8                   # 8 worker processes on this host
+    python execution/billing_ticker.py --shards 16 --shard-ids 0-7  # host A
+    python execution/billing_ticker.py --shards 16 --shard-ids 8-15 # host B
+    python execution/billing_ticker.py --ticks 1                    # a single pass (cron)
+
+Requirements:
+    - .env file with SUPABASE_URL and SUPABASE_KEY (service_role key: the RPC
+      is not granted to anon/authenticated), or DATABASE_URL for --target sql
+    - python-dotenv==1.0.1, requests==2.31.0
+    - psycopg2-binary==2.9.9 (only for --target sql)
+    - Migration 20260219000000_add_incremental_billing.sql applied
+
+Outputs:
+    stdout - One line per shard per tick: sessions billed, sessions/sec,
+             credits, exhausted sessions, tick lag (how late the tick started)
+             and billing lag (how far past the interval sessions waited)
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import signal
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from dotenv import load_dotenv
+
+from bench_rtc_sessions import LOCK_ERROR_CODES, RestRpcClient, RpcError, SqlRpcClient
+
+# Load environment variables
+load_dotenv()
+
+SUPABASE_URL = os.getenv('SUPABASE_URL')
+SUPABASE_KEY = os.getenv('SUPABASE_KEY')
+
+# Worth retrying: lost lock fights, gateway overload, dropped connections
+RETRYABLE_CODES = set(LOCK_ERROR_CODES) | {'network', '429', '502', '503', '504'}
+
+
+# ==================
+# ONE TICK
+# ==================
+
+class TickStats:
+    def __init__(self):
+        self.billed = 0
+        self.credits = 0
+        self.exhausted = 0
+        self.calls = 0
+        self.errors = 0
+        self.max_billing_lag = 0.0
+
+    def add(self, rows: List[dict]):
+        self.calls += 1
+        self.billed += len(rows)
+        self.credits += sum(row['credits_debited'] for row in rows)
+        self.exhausted += sum(1 for row in rows if row['exhausted'])
+        if rows:
+            self.max_billing_lag = max(self.max_billing_lag, max(row['lag_seconds'] or 0 for row in rows))
+
+
+async def call_with_retry(loop, executor, client, args: dict, max_retries: int = 4) -> List[dict]:
+    attempt = 0
+    while True:
+        try:
+            return await loop.run_in_executor(executor, client.call_rows, 'bill_active_sessions', args)
+        except RpcError as e:
+            attempt += 1
+            if e.code not in RETRYABLE_CODES or attempt > max_retries:
+                raise
+            await asyncio.sleep(min(5.0, 0.2 * 2 ** attempt) * random.uniform(0.5, 1.5))
+
+
+async def run_tick(loop, executor, client, shard: int, config: argparse.Namespace) -> TickStats:
+    """Drain the shard: each drainer calls until a page comes back short"""
+    stats = TickStats()
+    args = {
+        'p_shard': shard,
+        'p_shard_count': config.shards,
+        'p_limit': config.batch_size,
+        'p_interval_seconds': config.interval_seconds,
+    }
+
+    async def drain():
+        while True:
+            try:
+                rows = await call_with_retry(loop, executor, client, args)
+            except RpcError as e:
+                stats.errors += 1
+                print(f"   [FAIL] shard {shard}: {e.code} {str(e)}")
+                return
+            stats.add(rows)
+            if len(rows) < config.batch_size:
+                return
+
+    await asyncio.gather(*(drain() for _ in range(config.concurrency)))
+    return stats
+
+
+# ==================
+# WORKER PROCESS
+# ==================
+
+async def run_shard(shard: int, config: argparse.Namespace) -> int:
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass    # Windows: Ctrl-C still ends the process, just not between ticks
+
+    client = (SqlRpcClient(config.database_url, config.concurrency) if config.target == 'sql'
+              else RestRpcClient(SUPABASE_URL, SUPABASE_KEY))
+    executor = ThreadPoolExecutor(max_workers=config.concurrency, thread_name_prefix=f'ticker-{shard}')
+    label = f"shard {shard}/{config.shards}"
+
+    tick = missed = failed_ticks = 0
+    totals = TickStats()
+    next_tick = loop.time()
+    try:
+        while not stop.is_set() and (config.ticks is None or tick < config.ticks):
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=max(0.0, next_tick - loop.time()))
+                break
+            except asyncio.TimeoutError:
+                pass
+
+            started = loop.time()
+            tick_lag = started - next_tick
+            stats = await run_tick(loop, executor, client, shard, config)
+            elapsed = loop.time() - started
+            tick += 1
+
+            totals.billed += stats.billed
+            totals.credits += stats.credits
+            totals.exhausted += stats.exhausted
+            totals.calls += stats.calls
+            totals.errors += stats.errors
+            failed_ticks += 1 if stats.errors else 0
+
+            rate = stats.billed / elapsed if elapsed > 0 else 0.0
+            print(f"[{time.strftime('%H:%M:%S')}] {label} tick {tick}: {stats.billed} billed "
+                  f"({rate:.0f}/s, {stats.calls} call(s), {elapsed:.2f}s), {stats.credits} credits, "
+                  f"{stats.exhausted} exhausted, tick lag {tick_lag:.2f}s, "
+                  f"billing lag {stats.max_billing_lag:.1f}s", flush=True)
+
+            # Fixed schedule; a tick that overran skips the slots it covered
+            # instead of firing them back to back
+            next_tick += config.tick_seconds
+            if next_tick < loop.time():
+                skipped = int((loop.time() - next_tick) // config.tick_seconds) + 1
+                missed += skipped
+                next_tick += skipped * config.tick_seconds
+                print(f"   [WARN] {label}: tick took {elapsed:.1f}s, skipped {skipped} slot(s)", flush=True)
+    finally:
+        executor.shutdown(wait=True)
+        client.close()
+
+    print(f"[*] {label} stopped after {tick} tick(s): {totals.billed} billed, {totals.credits} credits, "
+          f"{totals.exhausted} exhausted, {missed} missed slot(s), {totals.errors} error(s)", flush=True)
+    return 1 if failed_ticks else 0
+
+
+def shard_main(shard: int, config: argparse.Namespace):
+    sys.exit(asyncio.run(run_shard(shard, config)))
+
+
+# ==================
+# ENTRY POINT
+# ==================
+
+def parse_shard_ids(text: Optional[str], shards: int) -> List[int]:
+    if not text:
+        return list(range(shards))
+    ids = set()
+    for part in text.split(','):
+        if '-' in part:
+            low, high = part.split('-', 1)
+            ids.update(range(int(low), int(high) + 1))
+        else:
+            ids.add(int(part))
+    if not ids or min(ids) < 0 or max(ids) >= shards:
+        raise ValueError(f"shard ids must be within 0..{shards - 1}")
+    return sorted(ids)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Bill active sessions every tick, sharded across processes")
+    parser.add_argument('--shards', type=int, default=1, help="Total number of shards across all hosts")
+    parser.add_argument('--shard-ids', help="Shards this host runs, e.g. 0-3,6 (default: all)")
+    parser.add_argument('--tick-seconds', type=float, default=60.0, help="Time between ticks")
+    parser.add_argument('--interval-seconds', type=int, default=60,
+                        help="Bill a session at most this often (should match --tick-seconds)")
+    parser.add_argument('--batch-size', type=int, default=500, help="Sessions per bill_active_sessions call")
+    parser.add_argument('--concurrency', type=int, default=2, help="Calls in flight per shard")
+    parser.add_argument('--ticks', type=int, help="Stop after this many ticks (default: run until stopped)")
+    parser.add_argument('--target', choices=['rest', 'sql'], default='rest')
+    parser.add_argument('--database-url', default=os.getenv('DATABASE_URL'), help="Postgres URL for --target sql")
+    return parser.parse_args()
+
+
+def main():
+    """Start one worker process per shard and wait for them"""
+    args = parse_args()
+
+    if args.target == 'rest' and (not SUPABASE_URL or not SUPABASE_KEY):
+        print("❌ Error: SUPABASE_URL and SUPABASE_KEY must be set in .env file")
+        return 1
+    if args.target == 'sql' and not args.database_url:
+        print("❌ Error: --target sql requires --database-url (or DATABASE_URL in .env)")
+        return 1
+    if not 1 <= args.shards <= 1024:
+        print("❌ Error: --shards must be between 1 and 1024")
+        return 1
+    if args.interval_seconds < 1:
+        print("❌ Error: --interval-seconds must be at least 1")
+        return 1
+    try:
+        shard_ids = parse_shard_ids(args.shard_ids, args.shards)
+    except ValueError as e:
+        print(f"❌ Error: Invalid --shard-ids: {str(e)}")
+        return 1
+
+    print(f"\n[*] Billing ticker: shard(s) {','.join(map(str, shard_ids))} of {args.shards}, "
+          f"every {args.tick_seconds:g}s, {args.concurrency} call(s) in flight per shard")
+
+    if len(shard_ids) == 1:
+        return asyncio.run(run_shard(shard_ids[0], args))
+
+    workers = [multiprocessing.Process(target=shard_main, args=(shard, args), name=f'billing-shard-{shard}')
+               for shard in shard_ids]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        # Workers got the same SIGINT and stop after their current tick
+        for worker in workers:
+            worker.join()
+
+    failed = [worker.name for worker in workers if worker.exitcode != 0]
+    if failed:
+        print(f"❌ Error: {len(failed)} worker(s) exited with errors: {', '.join(failed)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    exit_code = main()
+    sys.exit(exit_code)
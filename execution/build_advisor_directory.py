@@ -0,0 +1,393 @@
+"""
+Advisor Directory Snapshot: Precomputed, versioned listing for the CDN
+
+Browse pages (AdvisorsListing, the home page sections, search) need every
+advisor with a few profile fields, filtered by status/specialty/top-rated and
+sorted. Serving that from Postgres means RLS and a join on every page load
+for data that changes a few times a minute at most. This job builds the
+whole listing once into a compact static artifact the frontend can fetch
+instead of falling back to src/data/advisors.ts:
+
+    advisors    one row per advisor in "recommended" order (online first, then
+                top rated, then most experienced), pre-joined with profiles and
+                shaped like the frontend's Advisor type (fields listed once)
+    lists       sorted index lists: top_rated, online, price_low and one per
+                specialty, all pointing into `advisors`
+
+Only public listing fields are published (no emails, credits or birth data).
+Status is as of the build; pair it with live presence for the online badge.
+
+Refresh is incremental: only advisor_details and advisor profiles whose
+updated_at moved since the last run are fetched and merged into the cached
+records, plus a cheap id scan to drop deleted advisors. --full rebuilds.
+updated_at is NOW() at the writing transaction's start, so a row can commit
+with a timestamp older than rows this run already read; the saved cursor is
+held --settle-seconds behind the run's start and later runs re-read that
+window (merging a row twice is harmless).
+
+Versioning: the snapshot is hashed (excluding its build time). If nothing
+changed, no new version is written. Otherwise it's written as
+directory-v<version>-<hash>.json.gz (and .json.br when brotli is installed),
+an immutable file safe to cache forever. latest.json, meant to be cached
+briefly, points at it.
+
+Usage:
+    python execution/build_advisor_directory.py               # incremental refresh
+    python execution/build_advisor_directory.py --full        # rebuild from scratch
+    python execution/build_advisor_directory.py --output-dir public/directory --keep 3
+    python execution/build_advisor_directory.py --settle-seconds 300   # tolerate longer transactions
+
+Requirements:
+    - .env file with SUPABASE_URL and SUPABASE_KEY (service_role key: anon only
+      sees online/active advisors through RLS, the listing shows all of them)
+    - python-dotenv==1.0.1, requests==2.31.0
+    - brotli (optional, for .json.br)
+
+Outputs:
+    <output-dir>/directory-v<version>-<hash>.json.gz   The snapshot (default .tmp/advisor_directory)
+    <output-dir>/latest.json                            Manifest: version, file names, sha256, count
+    <output-dir>/state.json                             Cached records and (updated_at, id) cursors
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import requests
+from dotenv import load_dotenv
+
+from supabase_transport import auth_headers, get_transport
+
+# Load environment variables
+load_dotenv()
+
+SUPABASE_URL = os.getenv('SUPABASE_URL')
+SUPABASE_KEY = os.getenv('SUPABASE_KEY')
+
+REST_URL = f"{SUPABASE_URL}/rest/v1"
+
+HEADERS = auth_headers(SUPABASE_KEY)
+
+OUTPUT_DIR = Path('.tmp') / 'advisor_directory'
+
+FORMAT_VERSION = 1
+
+DETAIL_COLUMNS = ('id,title,bio_short,specialties,years_experience,price_per_minute,'
+                  'discounted_price,free_minutes,status,is_top_rated,updated_at')
+PROFILE_COLUMNS = 'id,full_name,avatar_url,created_at,updated_at'
+
+# Frontend Advisor fields, in the order each snapshot row lists them
+FIELDS = ('id', 'name', 'title', 'avatar', 'status', 'pricePerMinute', 'discountedPrice', 'freeMinutes',
+          'specialties', 'description', 'isTopRated', 'yearStarted')
+
+STATUS_RANK = {'online': 0, 'active': 0, 'busy': 1}
+
+# PostgREST keeps URLs manageable at this many ids per in.(...) filter
+IDS_PER_REQUEST = 200
+
+NIL_ID = '00000000-0000-0000-0000-000000000000'
+
+
+# ==================
+# FETCHING
+# ==================
+
+def keyset_filter(keys: Tuple[str, ...], after: Tuple[str, ...]) -> str:
+    """PostgREST or=(...) filter for rows sorting after `after` in `keys` order"""
+    # (a, b) > (x, y)  becomes  a > x OR (a = x AND b > y); values are quoted
+    # because timestamps contain characters PostgREST's filter syntax reserves
+    terms = []
+    for depth, key in enumerate(keys):
+        conditions = [f'{keys[i]}.eq."{after[i]}"' for i in range(depth)] + [f'{key}.gt."{after[depth]}"']
+        terms.append(f"and({','.join(conditions)})" if depth else conditions[0])
+    return f"({','.join(terms)})"
+
+
+def fetch_pages(table: str, params: dict, page_size: int, keys: Tuple[str, ...] = ('id',),
+                after: Optional[Tuple[str, ...]] = None) -> Iterator[dict]:
+    """
+    Keyset-paged GET in `keys` order, starting after `after`. Unlike offsets,
+    rows updated mid-run can't shift the pages and make others get skipped.
+    """
+    while True:
+        page_params = {**params, 'order': ','.join(keys), 'limit': page_size}
+        if after:
+            page_params['or'] = keyset_filter(keys, after)
+        response = get_transport().get(f"{REST_URL}/{table}", headers=HEADERS, params=page_params)
+        response.raise_for_status()
+        rows = response.json()
+        yield from rows
+        if len(rows) < page_size:
+            return
+        after = tuple(rows[-1][key] for key in keys)
+
+
+def fetch_by_ids(table: str, columns: str, ids: Iterable[str], page_size: int) -> List[dict]:
+    ids = sorted(ids)
+    rows: List[dict] = []
+    for start in range(0, len(ids), IDS_PER_REQUEST):
+        chunk = ids[start:start + IDS_PER_REQUEST]
+        rows.extend(fetch_pages(table, {'select': columns, 'id': f"in.({','.join(chunk)})"}, page_size))
+    return rows
+
+
+def fetch_since(table: str, params: dict, cursor: Optional[dict], page_size: int) -> List[dict]:
+    """Rows after the (updated_at, id) cursor; every row (id order, so NULL updated_at too) without one"""
+    if not cursor:
+        return list(fetch_pages(table, params, page_size))
+    return list(fetch_pages(table, params, page_size, keys=('updated_at', 'id'),
+                            after=(cursor['updated_at'], cursor['id'])))
+
+
+def fetch_changes(state: dict, page_size: int) -> Tuple[List[dict], List[dict]]:
+    """advisor_details and advisor profiles changed since the cursors (everything when there are none)"""
+    cursors = state['cursors']
+    details = fetch_since('advisor_details', {'select': DETAIL_COLUMNS}, cursors.get('details'), page_size)
+    profiles = fetch_since('profiles', {'select': PROFILE_COLUMNS, 'role': 'eq.advisor'},
+                           cursors.get('profiles'), page_size)
+
+    # A change on one side needs the other half of the record, unless it's cached
+    records = state['records']
+    missing_details = ({row['id'] for row in profiles} - {row['id'] for row in details}
+                       - {record_id for record_id, record in records.items() if record.get('detail')})
+    missing_profiles = ({row['id'] for row in details} - {row['id'] for row in profiles}
+                        - {record_id for record_id, record in records.items() if record.get('profile')})
+    if missing_details:
+        details.extend(fetch_by_ids('advisor_details', DETAIL_COLUMNS, missing_details, page_size))
+    if missing_profiles:
+        profiles.extend(fetch_by_ids('profiles', PROFILE_COLUMNS, missing_profiles, page_size))
+    return details, profiles
+
+
+def fetch_live_ids(page_size: int) -> set:
+    return {row['id'] for row in fetch_pages('advisor_details', {'select': 'id'}, page_size)}
+
+
+# ==================
+# MERGING
+# ==================
+
+def advance_cursor(cursor: Optional[dict], rows: List[dict], horizon: datetime) -> Optional[dict]:
+    """
+    The newest (updated_at, id) among rows stamped before `horizon`. Rows
+    past it stay ahead of the cursor and are read again next run, so
+    transactions still open at fetch time are picked up once they commit.
+    """
+    best = (datetime.fromisoformat(cursor['updated_at']), cursor['id']) if cursor else None
+    for row in rows:
+        if not row.get('updated_at'):
+            continue
+        key = (datetime.fromisoformat(row['updated_at']), row['id'])
+        if key[0] <= horizon and (best is None or key > best):
+            best, cursor = key, {'updated_at': row['updated_at'], 'id': row['id']}
+    return cursor
+
+
+def merge(state: dict, details: List[dict], profiles: List[dict], live_ids: Optional[set],
+          horizon: datetime) -> Dict[str, int]:
+    """Fold fetched rows into the cached records; returns counts of what changed"""
+    records = state['records']
+    counts = {'details': 0, 'profiles': 0, 'removed': 0}
+    for row in details:
+        records.setdefault(row['id'], {})['detail'] = row
+        counts['details'] += 1
+    for row in profiles:
+        # Profiles without advisor details aren't listed (yet)
+        if row['id'] in records:
+            records[row['id']]['profile'] = row
+            counts['profiles'] += 1
+
+    if live_ids is not None:
+        for record_id in [record_id for record_id in records if record_id not in live_ids]:
+            del records[record_id]
+            counts['removed'] += 1
+
+    cursors = state['cursors']
+    cursors['details'] = advance_cursor(cursors.get('details'), details, horizon)
+    cursors['profiles'] = advance_cursor(cursors.get('profiles'), profiles, horizon)
+    return counts
+
+
+# ==================
+# SNAPSHOT
+# ==================
+
+def advisor_entry(record: dict, year: int) -> Optional[dict]:
+    detail, profile = record.get('detail'), record.get('profile')
+    if not detail or not profile:
+        return None
+    experience = detail.get('years_experience')
+    return {
+        'id': detail['id'],
+        'name': profile.get('full_name') or detail.get('title') or '',
+        'title': detail.get('title') or '',
+        'avatar': profile.get('avatar_url'),
+        'status': detail.get('status') or 'offline',
+        'pricePerMinute': float(detail['price_per_minute']),
+        'discountedPrice': float(detail['discounted_price']) if detail.get('discounted_price') is not None else None,
+        'freeMinutes': detail.get('free_minutes') or 0,
+        'specialties': detail.get('specialties') or [],
+        'description': detail.get('bio_short') or '',
+        'isTopRated': bool(detail.get('is_top_rated')),
+        'yearStarted': year - experience if experience is not None else None,
+    }
+
+
+def effective_price(advisor: dict) -> float:
+    return advisor['discountedPrice'] or advisor['pricePerMinute']
+
+
+def build_snapshot(records: Dict[str, dict], year: int) -> dict:
+    """Rows in recommended order plus sorted index lists into them (no version or build time)"""
+    advisors = [entry for entry in (advisor_entry(record, year) for record in records.values()) if entry]
+    advisors.sort(key=lambda a: (STATUS_RANK.get(a['status'], 2), not a['isTopRated'],
+                                 a['yearStarted'] or year, a['name'], a['id']))
+
+    by_specialty: Dict[str, List[int]] = {}
+    for index, advisor in enumerate(advisors):
+        for specialty in advisor['specialties']:
+            by_specialty.setdefault(specialty, []).append(index)
+
+    return {
+        'format': FORMAT_VERSION,
+        'fields': list(FIELDS),
+        'advisors': [[advisor[name] for name in FIELDS] for advisor in advisors],
+        'lists': {
+            'top_rated': [i for i, a in enumerate(advisors) if a['isTopRated']],
+            'online': [i for i, a in enumerate(advisors) if STATUS_RANK.get(a['status']) == 0],
+            'price_low': sorted(range(len(advisors)), key=lambda i: (effective_price(advisors[i]), i)),
+            'specialties': dict(sorted(by_specialty.items())),
+        },
+    }
+
+
+def encode(snapshot: dict) -> bytes:
+    return json.dumps(snapshot, separators=(',', ':'), sort_keys=True, ensure_ascii=False).encode('utf-8')
+
+
+def write_atomic(path: Path, data: bytes):
+    partial = path.with_name(path.name + '.partial')
+    partial.write_bytes(data)
+    partial.replace(path)
+
+
+def publish(output_dir: Path, state: dict, snapshot: dict, content_hash: str, keep: int) -> dict:
+    """Write the next version and point latest.json at it; prune all but the newest `keep`"""
+    state['version'] += 1
+    generated_at = datetime.now(timezone.utc).isoformat()
+    body = encode({**snapshot, 'version': state['version'], 'generated_at': generated_at})
+    stem = f"directory-v{state['version']:06d}-{content_hash[:10]}"
+
+    files = {'gzip': f"{stem}.json.gz"}
+    # mtime=0 so the same snapshot always compresses to the same bytes
+    write_atomic(output_dir / files['gzip'], gzip.compress(body, compresslevel=9, mtime=0))
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+    if brotli is not None:
+        files['brotli'] = f"{stem}.json.br"
+        write_atomic(output_dir / files['brotli'], brotli.compress(body, quality=11))
+
+    manifest = {
+        'version': state['version'],
+        'generated_at': generated_at,
+        'sha256': content_hash,
+        'count': len(snapshot['advisors']),
+        'bytes': len(body),
+        'files': files,
+    }
+    write_atomic(output_dir / 'latest.json', json.dumps(manifest, indent=2).encode('utf-8'))
+
+    versions = sorted(output_dir.glob('directory-v*.json.*'))
+    stems = sorted({path.name.split('.', 1)[0] for path in versions})
+    for old in stems[:-keep] if keep > 0 else []:
+        for path in output_dir.glob(f"{old}.json.*"):
+            path.unlink()
+    return manifest
+
+
+def load_state(path: Path, full: bool) -> dict:
+    if path.exists():
+        state = json.loads(path.read_text(encoding='utf-8'))
+        if full:
+            # Keep the version sequence going; drop everything else
+            return {'version': state.get('version', 0), 'hash': None, 'cursors': {}, 'records': {}}
+        # Cursors used to be a bare timestamp; the nil id re-reads that whole timestamp
+        for name, cursor in state['cursors'].items():
+            if isinstance(cursor, str):
+                state['cursors'][name] = {'updated_at': cursor, 'id': NIL_ID}
+        return state
+    return {'version': 0, 'hash': None, 'cursors': {}, 'records': {}}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build the precomputed advisor directory snapshot")
+    parser.add_argument('--output-dir', default=str(OUTPUT_DIR), help="Where snapshots and state are written")
+    parser.add_argument('--full', action='store_true', help="Rebuild from scratch instead of refreshing")
+    parser.add_argument('--page-size', type=int, default=1000, help="Rows per PostgREST request")
+    parser.add_argument('--keep', type=int, default=5, help="Snapshot versions to keep (0 keeps all)")
+    parser.add_argument('--settle-seconds', type=int, default=120,
+                        help="Hold the cursors this far behind the run's start, for transactions that "
+                             "commit late (and clock skew between this host and the database)")
+    return parser.parse_args()
+
+
+def main():
+    """Refresh the cached records, then publish a new version if the listing changed"""
+    args = parse_args()
+
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        print("❌ Error: SUPABASE_URL and SUPABASE_KEY must be set in .env file")
+        return 1
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    state_path = output_dir / 'state.json'
+    state = load_state(state_path, args.full)
+    incremental = bool(state['cursors'])
+
+    started = time.perf_counter()
+    horizon = datetime.now(timezone.utc) - timedelta(seconds=args.settle_seconds)
+    try:
+        details, profiles = fetch_changes(state, args.page_size)
+        # A full fetch already saw every live advisor
+        live_ids = fetch_live_ids(args.page_size) if incremental else {row['id'] for row in details}
+    except requests.RequestException as e:
+        print(f"❌ Error: {str(e)}")
+        return 1
+    counts = merge(state, details, profiles, live_ids, horizon)
+    fetch_seconds = time.perf_counter() - started
+
+    snapshot = build_snapshot(state['records'], datetime.now(timezone.utc).year)
+    content_hash = hashlib.sha256(encode(snapshot)).hexdigest()
+    changed = content_hash != state.get('hash')
+    manifest = publish(output_dir, state, snapshot, content_hash, args.keep) if changed else None
+    state['hash'] = content_hash
+    write_atomic(state_path, json.dumps(state, separators=(',', ':')).encode('utf-8'))
+
+    print(f"\n{'='*60}")
+    print("  Advisor Directory")
+    print(f"{'='*60}\n")
+    print(f"Mode:               {'incremental' if incremental else 'full'} ({fetch_seconds:.2f}s fetching)")
+    print(f"Fetched:            {counts['details']} advisor_details, {counts['profiles']} profiles, "
+          f"{counts['removed']} removed")
+    print(f"Advisors listed:    {len(snapshot['advisors'])} ({len(snapshot['lists']['specialties'])} specialties)")
+    if manifest:
+        print(f"Published:          v{manifest['version']} {', '.join(manifest['files'].values())} "
+              f"({manifest['bytes']:,} bytes before compression)")
+    else:
+        print(f"Published:          nothing, unchanged since v{state['version']}")
+    return 0
+
+
+if __name__ == "__main__":
+    exit_code = main()
+    sys.exit(exit_code)
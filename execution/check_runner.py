@@ -0,0 +1,213 @@
+"""
+Check Runner: Concurrent execution for verification scripts
+
+Runs declared verification checks on a bounded thread pool. A check starts as
+soon as every check it depends on has finished, so independent checks overlap
+their network round-trips instead of waiting on each other.
+
+Each check's console output is buffered while it runs and replayed in
+declaration order, so the `[OK]/[FAIL]` output reads exactly as it did when
+the checks ran one at a time.
+
+Usage:
+    from check_runner import Check, run_checks
+
+    results = run_checks([
+        Check('tables', verify_tables_exist),
+        Check('rpc_functions', verify_rpc_functions),
+        Check('test_data', check_test_data, depends_on=('tables',)),
+    ])
+
+Environment:
+    CHECK_WORKERS - Max checks running at once (default: 8, use 1 for serial runs)
+
+Requirements:
+    - Python 3.8+ (standard library only)
+"""
+
+import io
+import os
+import sys
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_WORKERS = 8
+
+
+@dataclass(frozen=True)
+class Check:
+    """
+    A named verification check and the checks that must finish before it.
+
+    Structural checks depend only on the schema, so their passing results can
+    be reused from the verification cache while the schema is unchanged.
+    """
+    name: str
+    func: Callable[[], bool]
+    depends_on: Tuple[str, ...] = ()
+    structural: bool = False
+
+
+class _ThreadLocalStdout:
+    """
+    Stand-in for sys.stdout that routes writes into a per-thread buffer.
+
+    Worker threads write into their check's buffer; every other thread
+    (including the one replaying buffers) writes through to the wrapped stream.
+    Wrapping whatever sys.stdout currently is keeps nested runners working.
+    """
+
+    def __init__(self, target):
+        self._target = target
+        self._local = threading.local()
+
+    def capture(self, buffer: Optional[io.StringIO]):
+        self._local.buffer = buffer
+
+    def write(self, text: str) -> int:
+        buffer = getattr(self._local, 'buffer', None)
+        return (buffer if buffer is not None else self._target).write(text)
+
+    def flush(self):
+        if getattr(self._local, 'buffer', None) is None:
+            self._target.flush()
+
+    def __getattr__(self, name):
+        # encoding, isatty(), fileno(), ... come from the real stream
+        return getattr(self._target, name)
+
+
+def get_max_workers() -> int:
+    """Read the worker cap from CHECK_WORKERS, falling back to the default"""
+    try:
+        return max(1, int(os.getenv('CHECK_WORKERS', DEFAULT_WORKERS)))
+    except ValueError:
+        return DEFAULT_WORKERS
+
+
+def validate_checks(checks: Sequence[Check]):
+    """Reject duplicate names, unknown dependencies and dependency cycles"""
+    names = [check.name for check in checks]
+    duplicates = {name for name in names if names.count(name) > 1}
+    if duplicates:
+        raise ValueError(f"Duplicate check names: {', '.join(sorted(duplicates))}")
+
+    by_name = {check.name: check for check in checks}
+    for check in checks:
+        unknown = [dep for dep in check.depends_on if dep not in by_name]
+        if unknown:
+            raise ValueError(f"Check '{check.name}' depends on unknown check(s): {', '.join(unknown)}")
+
+    # Depth-first walk; a node seen again while still on the stack is a cycle
+    visiting, done = set(), set()
+
+    def visit(name: str, path: List[str]):
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"Dependency cycle: {' -> '.join(path + [name])}")
+        visiting.add(name)
+        for dep in by_name[name].depends_on:
+            visit(dep, path + [name])
+        visiting.discard(name)
+        done.add(name)
+
+    for name in names:
+        visit(name, [])
+
+
+def _run_one(check: Check, stdout: _ThreadLocalStdout, recorder=None) -> Tuple[bool, str]:
+    """Run a single check with its output captured; a crash counts as a failure"""
+    buffer = io.StringIO()
+    stdout.capture(buffer)
+    try:
+        if recorder is not None:
+            with recorder.check(check.name):
+                passed = bool(check.func())
+        else:
+            passed = bool(check.func())
+    except Exception as e:
+        print(f"[FAIL] Check '{check.name}' crashed: {str(e)}")
+        passed = False
+    finally:
+        stdout.capture(None)
+    return passed, buffer.getvalue()
+
+
+def run_checks(checks: Sequence[Check], max_workers: Optional[int] = None, cache=None,
+               recorder=None, on_result: Optional[Callable[[str, bool, str], None]] = None) -> Dict[str, bool]:
+    """
+    Run checks concurrently, respecting dependencies.
+
+    Dependencies only order execution: a dependent check still runs when its
+    dependency fails, matching the one-at-a-time behaviour of the scripts.
+
+    Args:
+        cache: Optional VerificationCache; structural checks with a cached
+            pass are replayed instead of run, and fresh results are recorded
+        recorder: Optional instrumentation.Recorder; each check is timed and
+            the HTTP calls it makes are attributed to it
+        on_result: Optional callback(name, passed, output), called as each
+            check finishes (cached replays included)
+
+    Returns:
+        Dict of check name -> passed, in declaration order
+    """
+    validate_checks(checks)
+    workers = max_workers or get_max_workers()
+
+    outputs: Dict[str, str] = {}
+    results: Dict[str, bool] = {}
+    started = set()
+    next_to_print = 0
+
+    stdout = _ThreadLocalStdout(sys.stdout)
+    sys.stdout = stdout
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='check') as pool:
+            running = {}
+
+            def submit_ready():
+                for check in checks:
+                    if check.name in started:
+                        continue
+                    if all(dep in results for dep in check.depends_on):
+                        started.add(check.name)
+                        cached = cache.lookup(check.name) if cache and check.structural else None
+                        if cached is not None:
+                            results[check.name], outputs[check.name] = True, cached
+                            if recorder:
+                                recorder.record_result(check.name, True, cached=True)
+                            if on_result:
+                                on_result(check.name, True, cached)
+                        else:
+                            running[pool.submit(_run_one, check, stdout, recorder)] = check
+
+            submit_ready()
+            while running or next_to_print < len(checks):
+                finished = ()
+                if running:
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    check = running.pop(future)
+                    results[check.name], outputs[check.name] = future.result()
+                    if recorder:
+                        recorder.record_result(check.name, results[check.name])
+                    if cache and check.structural:
+                        cache.record(check.name, results[check.name], outputs[check.name])
+                    if on_result:
+                        on_result(check.name, results[check.name], outputs[check.name])
+
+                # Replay every finished check whose predecessors have been printed
+                while next_to_print < len(checks) and checks[next_to_print].name in results:
+                    stdout.write(outputs.pop(checks[next_to_print].name))
+                    stdout.flush()
+                    next_to_print += 1
+
+                submit_ready()
+    finally:
+        sys.stdout = stdout._target
+
+    return {check.name: results[check.name] for check in checks}
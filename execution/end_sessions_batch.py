@@ -0,0 +1,390 @@
+"""
+Bulk Session Finalization: End many RTC sessions with end_rtc_sessions
+
+Collects pending session closures, de-duplicates them and submits them in
+sized batches to the set-based end_rtc_sessions RPC (one statement per batch
+instead of one end_rtc_session call per session). Batches run on a bounded
+pool; a batch that loses a lock fight or hits a transient error is retried.
+
+Closures come from one of:
+    --input FILE       JSON array or NDJSON of
+                       {"session_id", "billable_minutes", "connection_quality"?}
+    --advisor-id ID    every active session of one advisor (bulk disconnect);
+                       billable minutes = whole minutes since started_at
+
+--bench N creates 2N throwaway sessions, ends N by looping end_rtc_session
+and N through batches, and compares wall time and sessions/sec.
+
+Usage:
+    python execution/end_sessions_batch.py --input .tmp/room_teardown.ndjson --batch-size 200
+    python execution/end_sessions_batch.py --advisor-id 4f1c... --connection-quality lost
+    python execution/end_sessions_batch.py --bench 1000 --concurrency 8
+
+Requirements:
+    - .env file with SUPABASE_URL and SUPABASE_KEY (service_role key: the RPC
+      is not granted to anon/authenticated)
+    - python-dotenv==1.0.1, requests==2.31.0
+    - psycopg2-binary==2.9.9 (only for --target sql)
+    - Migration 20260218000000_add_end_rtc_sessions.sql applied
+
+WARNING: --bench creates sessions and deducts real credits from the sampled
+clients. It refuses non-local targets unless --allow-remote is passed.
+
+Outputs:
+    stdout - Per-batch progress and a summary
+    .tmp/bench/end_sessions_<timestamp>.json - --bench results
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+from dotenv import load_dotenv
+
+from bench_rtc_sessions import (
+    LOCK_ERROR_CODES, OUTPUT_DIR, RestRpcClient, RpcError, SqlRpcClient,
+    fetch_profile_ids, is_local, summarize_latencies,
+)
+from import_advisor_details import iter_records
+from supabase_transport import Transport, auth_headers, get_transport
+
+# Load environment variables
+load_dotenv()
+
+SUPABASE_URL = os.getenv('SUPABASE_URL')
+SUPABASE_KEY = os.getenv('SUPABASE_KEY')
+
+REST_URL = f"{SUPABASE_URL}/rest/v1"
+
+HEADERS = auth_headers(SUPABASE_KEY)
+
+QUALITIES = ('excellent', 'good', 'poor', 'lost')
+
+# Worth retrying: lost lock fights, gateway overload, dropped connections
+RETRYABLE_CODES = set(LOCK_ERROR_CODES) | {'network', '429', '502', '503', '504'}
+
+# Parameter types for --target sql (psycopg2 would send text[])
+ARRAY_CASTS = {
+    'p_session_ids': 'uuid[]',
+    'p_billable_minutes': 'integer[]',
+    'p_connection_qualities': 'connection_quality[]',
+}
+
+
+# ==================
+# CLOSURES
+# ==================
+
+def load_closures(path: Path) -> Iterable[dict]:
+    for record in iter_records(path):
+        yield {
+            'session_id': record['session_id'],
+            'billable_minutes': int(record['billable_minutes']),
+            'connection_quality': record.get('connection_quality'),
+            'client_id': record.get('client_id'),
+        }
+
+
+def advisor_closures(advisor_id: str, quality: Optional[str]) -> List[dict]:
+    """Every active session of an advisor, billed for whole elapsed minutes"""
+    response = get_transport().get(f"{REST_URL}/sessions", headers=HEADERS, params={
+        'select': 'id,client_id,started_at',
+        'advisor_id': f'eq.{advisor_id}',
+        'status': 'eq.active',
+    })
+    response.raise_for_status()
+    now = datetime.now(timezone.utc)
+    closures = []
+    for row in response.json():
+        started = datetime.fromisoformat(row['started_at'].replace('Z', '+00:00')) if row['started_at'] else now
+        closures.append({
+            'session_id': row['id'],
+            # Same rounding as trigger_update_session_billing
+            'billable_minutes': max(0, int((now - started).total_seconds()) // 60),
+            'connection_quality': quality,
+            'client_id': row['client_id'],
+        })
+    return closures
+
+
+def group_closures(closures: Iterable[dict], batch_size: int) -> List[List[dict]]:
+    """
+    De-duplicate by session (the last report wins) and cut into batches.
+
+    Sorting by client keeps each client's sessions together, so concurrent
+    batches rarely debit the same profile. When they do overlap, the RPC
+    locks sessions and then profiles in id order, so one waits for the
+    other instead of deadlocking.
+    """
+    latest: Dict[str, dict] = {}
+    for closure in closures:
+        latest[closure['session_id']] = closure
+    ordered = sorted(latest.values(), key=lambda c: (c.get('client_id') or '', c['session_id']))
+    return [ordered[start:start + batch_size] for start in range(0, len(ordered), batch_size)]
+
+
+# ==================
+# SUBMISSION
+# ==================
+
+class Totals:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.submitted = self.completed = self.failed = self.credits = self.retries = 0
+        self.batch_errors = 0
+        self.latencies: List[float] = []
+
+    def add(self, submitted: int, results: Optional[List[dict]], elapsed_ms: float, retries: int):
+        with self.lock:
+            self.submitted += submitted
+            self.retries += retries
+            self.latencies.append(round(elapsed_ms, 3))
+            if results is None:
+                self.batch_errors += 1
+                return
+            self.completed += sum(1 for row in results if row['final_status'] == 'completed')
+            self.failed += sum(1 for row in results if row['final_status'] == 'failed')
+            self.credits += sum(row['credits_deducted'] or 0 for row in results)
+
+    @property
+    def skipped(self) -> int:
+        return self.submitted - self.completed - self.failed
+
+
+def end_batch(client, batch: List[dict], max_retries: int = 5) -> Tuple[List[dict], int]:
+    """End one batch; returns the RPC rows and how many retries it took"""
+    args = {
+        'p_session_ids': [closure['session_id'] for closure in batch],
+        'p_billable_minutes': [closure['billable_minutes'] for closure in batch],
+    }
+    if any(closure.get('connection_quality') for closure in batch):
+        args['p_connection_qualities'] = [closure.get('connection_quality') or 'good' for closure in batch]
+
+    attempt = 0
+    while True:
+        try:
+            return client.call_rows('end_rtc_sessions', args, ARRAY_CASTS), attempt
+        except RpcError as e:
+            attempt += 1
+            if e.code not in RETRYABLE_CODES or attempt > max_retries:
+                raise
+            time.sleep(min(10.0, 0.2 * 2 ** attempt) * random.uniform(0.5, 1.5))
+
+
+def submit_batches(client, batches: List[List[dict]], concurrency: int, verbose: bool = True) -> Totals:
+    totals = Totals()
+
+    def run(index: int, batch: List[dict]):
+        started = time.perf_counter()
+        try:
+            results, retries = end_batch(client, batch)
+        except RpcError as e:
+            totals.add(len(batch), None, (time.perf_counter() - started) * 1000, 0)
+            print(f"   [FAIL] Batch {index + 1}: {e.code} {str(e)}")
+            return
+        totals.add(len(batch), results, (time.perf_counter() - started) * 1000, retries)
+        if verbose:
+            print(f"   [OK] Batch {index + 1}/{len(batches)}: {len(results)} of {len(batch)} session(s) ended")
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='end-batch') as pool:
+        for index, batch in enumerate(batches):
+            pool.submit(run, index, batch)
+    return totals
+
+
+# ==================
+# BENCHMARK
+# ==================
+
+def create_sessions(client, count: int, client_ids: List[str], advisor_ids: List[str],
+                    rng: random.Random, concurrency: int) -> List[str]:
+    def start(_):
+        return client.call('start_rtc_session', {
+            'p_client_id': rng.choice(client_ids),
+            'p_advisor_id': rng.choice(advisor_ids),
+            'p_type': rng.choice(['chat', 'audio', 'video']),
+            'p_rate_per_minute': 1.0,
+            'p_free_minutes': 0,
+        })
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='bench-start') as pool:
+        return list(pool.map(start, range(count)))
+
+
+def run_bench(client, args) -> dict:
+    client_ids = fetch_profile_ids('client', 50)
+    advisor_ids = fetch_profile_ids('advisor', 20)
+    if not client_ids or not advisor_ids:
+        raise RuntimeError("Need client and advisor profiles to benchmark (seed a local database first)")
+
+    rng = random.Random(args.seed)
+    print(f"[*] Creating {2 * args.bench} sessions...")
+    session_ids = create_sessions(client, 2 * args.bench, client_ids, advisor_ids, rng, args.concurrency)
+    closures = [{'session_id': session_id, 'billable_minutes': rng.randint(1, 30),
+                 'connection_quality': rng.choice(QUALITIES)} for session_id in session_ids]
+    looped, batched = closures[:args.bench], closures[args.bench:]
+
+    # Baseline: one end_rtc_session call per session
+    latencies: List[float] = []
+    lock = threading.Lock()
+    errors = [0]
+
+    def end_one(closure):
+        started = time.perf_counter()
+        try:
+            client.call('end_rtc_session', {
+                'p_session_id': closure['session_id'],
+                'p_billable_minutes': closure['billable_minutes'],
+                'p_connection_quality': closure['connection_quality'],
+            })
+        except RpcError:
+            with lock:
+                errors[0] += 1
+        with lock:
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    print(f"[*] Ending {len(looped)} sessions with end_rtc_session...")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix='bench-end') as pool:
+        list(pool.map(end_one, looped))
+    loop_seconds = time.perf_counter() - started
+
+    print(f"[*] Ending {len(batched)} sessions with end_rtc_sessions (batches of {args.batch_size})...")
+    started = time.perf_counter()
+    totals = submit_batches(client, group_closures(batched, args.batch_size), args.concurrency, verbose=False)
+    batch_seconds = time.perf_counter() - started
+
+    return {
+        'sessions_per_mode': args.bench,
+        'batch_size': args.batch_size,
+        'concurrency': args.concurrency,
+        'loop': {
+            'wall_seconds': round(loop_seconds, 3),
+            'sessions_per_second': round(len(looped) / loop_seconds, 1) if loop_seconds else None,
+            'round_trips': len(looped),
+            'errors': errors[0],
+            'latency': summarize_latencies(latencies),
+        },
+        'batch': {
+            'wall_seconds': round(batch_seconds, 3),
+            'sessions_per_second': round(len(batched) / batch_seconds, 1) if batch_seconds else None,
+            'round_trips': len(totals.latencies) + totals.retries,
+            'errors': totals.batch_errors,
+            'ended': totals.completed + totals.failed,
+            'latency': summarize_latencies(totals.latencies),
+        },
+        'speedup': round(loop_seconds / batch_seconds, 2) if batch_seconds else None,
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="End RTC sessions in batches with end_rtc_sessions")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--input', help="JSON/NDJSON file of session closures")
+    source.add_argument('--advisor-id', help="End every active session of this advisor")
+    source.add_argument('--bench', type=int, metavar='N', help="Compare N looped ends with N batched ends")
+    parser.add_argument('--connection-quality', choices=QUALITIES, help="Quality for --advisor-id closures")
+    parser.add_argument('--batch-size', type=int, default=200, help="Sessions per end_rtc_sessions call")
+    parser.add_argument('--concurrency', type=int, default=4, help="Calls in flight at once")
+    parser.add_argument('--target', choices=['rest', 'sql'], default='rest')
+    parser.add_argument('--database-url', default=os.getenv('DATABASE_URL'), help="Postgres URL for --target sql")
+    parser.add_argument('--seed', type=int, default=11, help="Random seed for --bench")
+    parser.add_argument('--dry-run', action='store_true', help="Group and print batches without ending anything")
+    parser.add_argument('--allow-remote', action='store_true', help="Allow --bench against non-local targets")
+    return parser.parse_args()
+
+
+def main():
+    """Group closures and end them batch by batch (or benchmark both paths)"""
+    args = parse_args()
+
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        print("❌ Error: SUPABASE_URL and SUPABASE_KEY must be set in .env file")
+        return 1
+    if args.target == 'sql' and not args.database_url:
+        print("❌ Error: --target sql requires --database-url (or DATABASE_URL in .env)")
+        return 1
+
+    target_url = args.database_url if args.target == 'sql' else SUPABASE_URL
+    if args.bench and not is_local(target_url) and not args.allow_remote:
+        print(f"❌ Error: Refusing to benchmark non-local target {urlparse(target_url).hostname} (use --allow-remote)")
+        return 1
+
+    # Benchmarks measure raw calls; real runs get the shared transport's retries and limits
+    client = (SqlRpcClient(args.database_url, args.concurrency) if args.target == 'sql'
+              else RestRpcClient(SUPABASE_URL, SUPABASE_KEY, Transport.raw() if args.bench else None))
+
+    if args.bench:
+        print(f"\n[*] Benchmarking session finalization on {urlparse(target_url).hostname}")
+        try:
+            report = run_bench(client, args)
+        except (RpcError, RuntimeError) as e:
+            print(f"❌ Error: {str(e)}")
+            return 1
+        finally:
+            client.close()
+
+        print(f"\n{'='*60}")
+        print("  end_rtc_session loop vs end_rtc_sessions batches")
+        print(f"{'='*60}\n")
+        for mode in ('loop', 'batch'):
+            result = report[mode]
+            print(f"{mode:<6} {result['wall_seconds']:>8.2f}s  {result['sessions_per_second']:>8} sessions/s  "
+                  f"{result['round_trips']:>6} round-trip(s)  p95 {result['latency']['p95_ms']:.1f}ms")
+        print(f"\nSpeedup: {report['speedup']}x")
+
+        OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+        output_path = OUTPUT_DIR / f"end_sessions_{datetime.now():%Y%m%d_%H%M%S}.json"
+        output_path.write_text(json.dumps(report, indent=2), encoding='utf-8')
+        print(f"\n[*] Results written to {output_path}")
+        return 0 if report['loop']['errors'] == 0 and report['batch']['errors'] == 0 else 1
+
+    try:
+        if args.input:
+            closures = list(load_closures(Path(args.input)))
+        else:
+            closures = advisor_closures(args.advisor_id, args.connection_quality)
+    except (OSError, ValueError, KeyError, requests.RequestException) as e:
+        print(f"❌ Error: Could not load session closures: {str(e)}")
+        return 1
+
+    batches = group_closures(closures, args.batch_size)
+    print("\n[*] Ending RTC sessions")
+    print(f"[*] {len(closures)} closure(s) -> {sum(len(b) for b in batches)} session(s) in {len(batches)} batch(es)")
+
+    if args.dry_run:
+        for index, batch in enumerate(batches):
+            print(f"   Batch {index + 1}: {len(batch)} session(s), {batch[0]['session_id']} .. {batch[-1]['session_id']}")
+        return 0
+
+    started = time.perf_counter()
+    totals = submit_batches(client, batches, args.concurrency)
+    elapsed = time.perf_counter() - started
+    client.close()
+
+    print(f"\n{'='*60}")
+    print("  Session Finalization Summary")
+    print(f"{'='*60}\n")
+    print(f"Completed:        {totals.completed}")
+    print(f"Billing failed:   {totals.failed} (client couldn't cover the batch)")
+    print(f"Skipped:          {totals.skipped} (not active, or in a failed batch)")
+    print(f"Credits deducted: {totals.credits} (net of refunds)")
+    print(f"Batches:          {len(batches)} ({totals.batch_errors} failed, {totals.retries} retries)")
+    print(f"Throughput:       {totals.submitted / elapsed if elapsed else 0:.1f} sessions/s over {elapsed:.1f}s")
+
+    return 0 if totals.batch_errors == 0 else 1
+
+
+if __name__ == "__main__":
+    exit_code = main()
+    sys.exit(exit_code)
@@ -0,0 +1,375 @@
+"""
+History Export: Constant-memory streaming export of sessions and messages
+
+Streams a whole table through PostgREST with keyset pagination and writes
+rows to disk as it goes, so memory stays at one page per worker no matter
+how many rows there are:
+
+    sessions  ordered by (started_at, id)
+    messages  ordered by (created_at, id)
+
+The time range is split into windows that are exported in parallel, sharing
+the keep-alive pool and rate limit of supabase_transport.py. Every window writes numbered segment files; a segment is
+written as `.partial` and renamed when complete, and the window's cursor is
+checkpointed at that moment. After an interruption, --resume deletes any
+`.partial` files and continues each window from its last completed segment.
+
+Usage:
+    python execution/export_history.py --table messages --workers 8 --window-hours 24
+    python execution/export_history.py --table sessions --since 2026-01-01 --until 2026-02-01 --format parquet
+    python execution/export_history.py --table messages --resume
+
+Requirements:
+    - .env file with SUPABASE_URL and SUPABASE_KEY (service_role key; RLS hides
+      other users' rows from anon)
+    - python-dotenv==1.0.1, requests==2.31.0
+    - pyarrow (only for --format parquet)
+
+Outputs:
+    .tmp/export/<table>/manifest.json                  Windows, format, completion state
+    .tmp/export/<table>/w0003-s00001.ndjson.gz         NDJSON segments (or .parquet)
+    .tmp/export/<table>/w0003.state.json               Per-window checkpoint
+"""
+
+import argparse
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import requests
+from dotenv import load_dotenv
+
+from migration_schema import load_schema_from_migrations
+from supabase_transport import auth_headers, get_transport
+
+# Load environment variables
+load_dotenv()
+
+SUPABASE_URL = os.getenv('SUPABASE_URL')
+SUPABASE_KEY = os.getenv('SUPABASE_KEY')
+
+REST_URL = f"{SUPABASE_URL}/rest/v1"
+
+HEADERS = auth_headers(SUPABASE_KEY)
+
+EXPORT_ROOT = Path('.tmp') / 'export'
+
+# Keyset ordering column per exportable table (id breaks ties)
+TIME_COLUMNS = {
+    'sessions': 'started_at',
+    'messages': 'created_at',
+}
+
+
+def parse_time(text: str) -> datetime:
+    value = datetime.fromisoformat(text.replace('Z', '+00:00'))
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+# ==================
+# WRITERS
+# ==================
+
+class NdjsonSegmentWriter:
+    """Gzipped NDJSON, one JSON object per line"""
+
+    extension = '.ndjson.gz'
+
+    def __init__(self, path: Path, columns: Dict[str, str]):
+        self.file = gzip.open(path, 'wt', encoding='utf-8', compresslevel=6)
+
+    def write(self, rows: List[dict]):
+        for row in rows:
+            self.file.write(json.dumps(row, separators=(',', ':'), default=str))
+            self.file.write('\n')
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetSegmentWriter:
+    """Columnar Parquet, one row group per page, typed from the migration schema"""
+
+    extension = '.parquet'
+
+    def __init__(self, path: Path, columns: Dict[str, str]):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            print("❌ Error: --format parquet requires pyarrow (pip install pyarrow)")
+            sys.exit(1)
+        self.pa = pa
+        self.columns = columns
+        self.schema = pa.schema([(name, self._arrow_type(column_type)) for name, column_type in columns.items()])
+        self.writer = pq.ParquetWriter(str(path), self.schema, compression='zstd')
+
+    def _arrow_type(self, column_type: str):
+        pa = self.pa
+        if column_type.endswith('[]'):
+            return pa.list_(pa.string())
+        if column_type in ('integer', 'smallint'):
+            return pa.int32()
+        if column_type == 'bigint':
+            return pa.int64()
+        if column_type in ('numeric', 'real', 'double precision'):
+            return pa.float64()
+        if column_type == 'boolean':
+            return pa.bool_()
+        if column_type.startswith('timestamp'):
+            return pa.timestamp('us', tz='UTC')
+        return pa.string()
+
+    def write(self, rows: List[dict]):
+        data = {}
+        for name, column_type in self.columns.items():
+            values = [row.get(name) for row in rows]
+            if column_type.startswith('timestamp'):
+                values = [parse_time(value) if value else None for value in values]
+            elif column_type in ('json', 'jsonb'):
+                values = [json.dumps(value) if value is not None else None for value in values]
+            data[name] = values
+        self.writer.write_table(self.pa.Table.from_pydict(data, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+WRITERS = {'ndjson': NdjsonSegmentWriter, 'parquet': ParquetSegmentWriter}
+
+
+# ==================
+# WINDOWS
+# ==================
+
+def fetch_bound(table: str, direction: str) -> Optional[str]:
+    """Earliest or latest non-null timestamp in the table"""
+    column = TIME_COLUMNS[table]
+    response = get_transport().get(f"{REST_URL}/{table}", headers=HEADERS, params={
+        'select': column, column: 'not.is.null', 'order': f'{column}.{direction}', 'limit': 1,
+    })
+    response.raise_for_status()
+    rows = response.json()
+    return rows[0][column] if rows else None
+
+
+def plan_windows(since: datetime, until: datetime, window: timedelta, include_nulls: bool) -> List[dict]:
+    windows = []
+    start = since
+    while start < until:
+        end = min(start + window, until)
+        windows.append({'index': len(windows), 'start': start.isoformat(), 'end': end.isoformat()})
+        start = end
+    if include_nulls:
+        # Rows without a timestamp can't fall in any window; export them by id alone
+        windows.append({'index': len(windows), 'start': None, 'end': None, 'nulls': True})
+    return windows
+
+
+class ExportWindow:
+    """Exports one time window, segment by segment"""
+
+    def __init__(self, table: str, window: dict, output_dir: Path, writer_class, columns: Dict[str, str],
+                 page_size: int, rows_per_segment: int):
+        self.table = table
+        self.time_column = TIME_COLUMNS[table]
+        self.window = window
+        self.output_dir = output_dir
+        self.writer_class = writer_class
+        self.columns = columns
+        self.page_size = page_size
+        self.rows_per_segment = rows_per_segment
+        self.state_path = output_dir / f"w{window['index']:04d}.state.json"
+        self.state = self._load_state()
+
+    def _load_state(self) -> dict:
+        if self.state_path.exists():
+            return json.loads(self.state_path.read_text(encoding='utf-8'))
+        return {'cursor': None, 'segments': 0, 'rows': 0, 'done': False}
+
+    def _save_state(self):
+        temp = self.state_path.with_suffix('.tmp')
+        temp.write_text(json.dumps(self.state, indent=2), encoding='utf-8')
+        temp.replace(self.state_path)
+
+    def _params(self) -> dict:
+        column = self.time_column
+        params = {'select': ','.join(self.columns), 'limit': self.page_size}
+        cursor = self.state['cursor']
+        if self.window.get('nulls'):
+            params[column] = 'is.null'
+            params['order'] = 'id.asc'
+            if cursor:
+                params['id'] = f"gt.{cursor['id']}"
+            return params
+
+        params['order'] = f'{column}.asc,id.asc'
+        params['and'] = f'({column}.gte."{self.window["start"]}",{column}.lt."{self.window["end"]}")'
+        if cursor:
+            params['or'] = (f'({column}.gt."{cursor["ts"]}",'
+                            f'and({column}.eq."{cursor["ts"]}",id.gt.{cursor["id"]}))')
+        return params
+
+    def _fetch_page(self) -> List[dict]:
+        # The transport retries 429/5xx and dropped connections with backoff
+        try:
+            response = get_transport().get(f"{REST_URL}/{self.table}", headers=HEADERS,
+                                           params=self._params(), timeout=(10, 120))
+        except requests.RequestException as e:
+            raise RuntimeError(f"Window {self.window['index']}: giving up: {str(e)}")
+        if response.status_code != 200:
+            raise RuntimeError(f"Window {self.window['index']}: HTTP {response.status_code}: {response.text}")
+        return response.json()
+
+    def run(self) -> int:
+        """Export until the window is exhausted; returns rows written this run"""
+        written = 0
+        while not self.state['done']:
+            segment = self.state['segments'] + 1
+            final_path = self.output_dir / f"w{self.window['index']:04d}-s{segment:05d}{self.writer_class.extension}"
+            partial_path = final_path.with_name(final_path.name + '.partial')
+            writer = self.writer_class(partial_path, self.columns)
+            segment_rows = 0
+            cursor = self.state['cursor']
+            exhausted = False
+            try:
+                while segment_rows < self.rows_per_segment:
+                    rows = self._fetch_page()
+                    if rows:
+                        writer.write(rows)
+                        segment_rows += len(rows)
+                        last = rows[-1]
+                        self.state['cursor'] = {'ts': last.get(self.time_column), 'id': last['id']}
+                    if len(rows) < self.page_size:
+                        exhausted = True
+                        break
+            except BaseException:
+                writer.close()
+                self.state['cursor'] = cursor     # Segment never completed; don't advance
+                raise
+            writer.close()
+
+            if segment_rows:
+                partial_path.replace(final_path)
+                self.state['segments'] = segment
+                self.state['rows'] += segment_rows
+                written += segment_rows
+            else:
+                partial_path.unlink()
+            self.state['done'] = exhausted
+            self._save_state()
+        return written
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Stream sessions or messages to NDJSON/Parquet files")
+    parser.add_argument('--table', choices=sorted(TIME_COLUMNS), required=True)
+    parser.add_argument('--format', choices=sorted(WRITERS), default='ndjson')
+    parser.add_argument('--since', help="Start of range (ISO 8601, inclusive); default: earliest row")
+    parser.add_argument('--until', help="End of range (ISO 8601, exclusive); default: just after the latest row")
+    parser.add_argument('--window-hours', type=float, default=24, help="Width of each parallel window")
+    parser.add_argument('--workers', type=int, default=4, help="Windows exported at once")
+    parser.add_argument('--page-size', type=int, default=1000, help="Rows per request")
+    parser.add_argument('--rows-per-segment', type=int, default=500000, help="Rows per output file")
+    parser.add_argument('--output-dir', help="Default: .tmp/export/<table>")
+    parser.add_argument('--resume', action='store_true', help="Continue an interrupted export")
+    return parser.parse_args()
+
+
+def main():
+    """Plan windows, export them in parallel and report throughput"""
+    args = parse_args()
+
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        print("❌ Error: SUPABASE_URL and SUPABASE_KEY must be set in .env file")
+        return 1
+
+    output_dir = Path(args.output_dir) if args.output_dir else EXPORT_ROOT / args.table
+    manifest_path = output_dir / 'manifest.json'
+    columns = {name: column.type for name, column in load_schema_from_migrations().tables[args.table].items()}
+
+    if args.resume:
+        if not manifest_path.exists():
+            print(f"❌ Error: No export to resume in {output_dir}")
+            return 1
+        manifest = json.loads(manifest_path.read_text(encoding='utf-8'))
+        for partial in output_dir.glob('*.partial'):
+            partial.unlink()
+    else:
+        if manifest_path.exists():
+            print(f"❌ Error: {output_dir} already holds an export (use --resume or --output-dir)")
+            return 1
+        try:
+            if args.since:
+                first = parse_time(args.since)
+            else:
+                first = parse_time(fetch_bound(args.table, 'asc'))
+            if args.until:
+                last = parse_time(args.until)
+            else:
+                last = parse_time(fetch_bound(args.table, 'desc')) + timedelta(microseconds=1)
+        except (requests.RequestException, ValueError, TypeError) as e:
+            print(f"❌ Error: Could not determine time range ({str(e)}); is the table empty?")
+            return 1
+        windows = plan_windows(first, last, timedelta(hours=args.window_hours),
+                               include_nulls=not args.since and not args.until)
+        manifest = {
+            'table': args.table,
+            'format': args.format,
+            'columns': columns,
+            'since': first.isoformat(),
+            'until': last.isoformat(),
+            'windows': windows,
+            'created_at': datetime.now(timezone.utc).isoformat(),
+        }
+        output_dir.mkdir(parents=True, exist_ok=True)
+        manifest_path.write_text(json.dumps(manifest, indent=2), encoding='utf-8')
+
+    writer_class = WRITERS[manifest['format']]
+    print(f"\n[*] Exporting {manifest['table']} ({manifest['since']} -> {manifest['until']})")
+    print(f"[*] {len(manifest['windows'])} window(s), {args.workers} worker(s), format {manifest['format']}")
+    print(f"[*] Output: {output_dir}")
+
+    lock = threading.Lock()
+    totals = {'rows': 0, 'failed': 0}
+    started = time.perf_counter()
+
+    def export(window: dict):
+        exporter = ExportWindow(manifest['table'], window, output_dir, writer_class, manifest['columns'],
+                                args.page_size, args.rows_per_segment)
+        return window, exporter.run(), exporter.state['rows']
+
+    with ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix='export') as pool:
+        futures = [pool.submit(export, window) for window in manifest['windows']]
+        for future in as_completed(futures):
+            try:
+                window, written, window_total = future.result()
+            except RuntimeError as e:
+                print(f"   [FAIL] {str(e)}")
+                with lock:
+                    totals['failed'] += 1
+                continue
+            with lock:
+                totals['rows'] += written
+            label = 'null timestamps' if window.get('nulls') else f"{window['start'][:19]} -> {window['end'][:19]}"
+            print(f"   [OK] Window {window['index']:>4} ({label}): {window_total} row(s)")
+
+    elapsed = time.perf_counter() - started
+    print(f"\n[*] Exported {totals['rows']} row(s) this run in {elapsed:.1f}s "
+          f"({totals['rows'] / elapsed if elapsed else 0:.0f} rows/s)")
+    if totals['failed']:
+        print(f"[WARNING] {totals['failed']} window(s) failed; re-run with --resume to finish them")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    exit_code = main()
+    sys.exit(exit_code)
@@ -0,0 +1,463 @@
+"""
+Synthetic Dataset Generator: Fill a local Postgres with realistic volume
+
+Generates profiles (clients and advisors), advisor_details, sessions and
+messages and streams them in with COPY from parallel worker processes.
+Nothing is inserted row by row, so tens of millions of rows load in minutes.
+
+Distributions:
+    - advisor popularity is Zipf-like (a handful of advisors take most sessions)
+    - client activity is skewed (most clients have a few sessions, some many)
+    - session type/status follow SESSION_TYPES / SESSION_STATUSES (session_type
+      and session_status enums); completed sessions are priced like
+      end_rtc_session would have priced them
+    - messages arrive in bursts a few seconds apart, separated by pauses; the
+      per-session count is log-normal around --messages-per-session
+
+Output is deterministic: the same --seed, --chunk-size and --until give the
+same rows whatever --workers is, because every chunk draws from its own
+seeded generator and profile ids are derived from (seed, role, index).
+Clients with credits get an 'opening' credit_ledger row so the ledger still
+sums to each balance.
+
+Loads run with session_replication_role = replica, so the generated profiles
+don't need auth.users rows and no triggers fire (a superuser connection is
+required, as on the local stack). Load into a fresh database (supabase db
+reset); running twice with the same seed collides on primary keys.
+
+Usage:
+    python execution/generate_dataset.py --sessions 1000000 --messages-per-session 10 --workers 8
+    python execution/generate_dataset.py --clients 20000 --advisors 500 --sessions 200000 --seed 7
+    python execution/generate_dataset.py --sessions 100000 --dry-run     # sizes only
+
+Requirements:
+    - psycopg2-binary==2.9.9, python-dotenv==1.0.1
+    - DATABASE_URL in .env (or --database-url) pointing at a local Postgres
+      with the migrations applied
+
+Outputs:
+    stdout - Rows and rows/sec per table
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+import random
+import sys
+import time
+import uuid
+from bisect import bisect_left
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal, ROUND_CEILING
+from itertools import accumulate
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
+from urllib.parse import urlparse
+
+from dotenv import load_dotenv
+
+from bench_rtc_sessions import _import_psycopg2, is_local
+
+# Load environment variables
+load_dotenv()
+
+# Weights follow the session_type / session_status enums
+SESSION_TYPES = (('chat', 0.60), ('audio', 0.25), ('video', 0.15))
+SESSION_STATUSES = (('completed', 0.85), ('cancelled', 0.08), ('pending', 0.05), ('active', 0.02))
+CONNECTION_QUALITIES = (('excellent', 0.35), ('good', 0.50), ('poor', 0.12), ('lost', 0.03))
+ADVISOR_STATUSES = (('offline', 0.55), ('online', 0.35), ('busy', 0.10))
+
+SPECIALTIES = (
+    'intuitive-readings', 'astrology', 'numerology', 'tarot', 'dreams', 'palm', 'love', 'future',
+    'career', 'mediums', 'energy', 'compatibility', 'aura', 'past-lives', 'spiritual-coaching',
+)
+TITLES = ('Tarot Reader', 'Astrologer', 'Psychic Medium', 'Love Psychic', 'Dream Interpreter',
+          'Numerologist', 'Energy Healer', 'Life Coach', 'Clairvoyant')
+PHRASES = ('Hello', 'Thank you', 'I see a change coming', 'Tell me more about that',
+           'The cards show a new beginning', 'What should I focus on?', 'That makes sense',
+           'Your energy feels calm today', 'Is there someone new?', 'Let me pull another card')
+
+ZIPF_EXPONENT = 1.1
+
+# Fixed so the default output is the same on every run
+DEFAULT_UNTIL = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+COLUMNS: Dict[str, Tuple[str, ...]] = {
+    'profiles': ('id', 'email', 'full_name', 'username', 'credits', 'role', 'created_at', 'updated_at'),
+    'advisor_details': ('id', 'title', 'bio_short', 'specialties', 'years_experience', 'price_per_minute',
+                        'free_minutes', 'status', 'is_top_rated', 'updated_at'),
+    'credit_ledger': ('user_id', 'delta', 'balance_after', 'reason', 'created_at'),
+    'sessions': ('id', 'client_id', 'advisor_id', 'type', 'status', 'started_at', 'ended_at', 'cost_total',
+                 'rate_per_minute', 'billable_minutes', 'free_minutes_applied', 'billing_status',
+                 'connection_quality', 'last_billed_at', 'credits_charged'),
+    'messages': ('id', 'session_id', 'sender_id', 'content', 'created_at'),
+}
+
+
+@dataclass(frozen=True)
+class DatasetSpec:
+    clients: int
+    advisors: int
+    sessions: int
+    messages_per_session: float
+    seed: int
+    until: datetime
+    days: int = 365
+    chunk_size: int = 20000
+
+    def profile_id(self, role: str, index: int) -> str:
+        digest = hashlib.md5(f"{self.seed}:{role}:{index}".encode()).digest()
+        return str(uuid.UUID(bytes=digest, version=4))
+
+    def rng(self, *parts) -> random.Random:
+        # str seeds are hashed with SHA-512: stable across runs and processes
+        return random.Random(':'.join(str(part) for part in (self.seed,) + parts))
+
+
+_CUMULATIVE: Dict[int, Tuple[List[str], List[float]]] = {}
+
+
+def weighted(rng: random.Random, table: Sequence[Tuple[str, float]]) -> str:
+    if id(table) not in _CUMULATIVE:
+        _CUMULATIVE[id(table)] = ([value for value, _ in table], list(accumulate(weight for _, weight in table)))
+    values, cumulative = _CUMULATIVE[id(table)]
+    return rng.choices(values, cum_weights=cumulative)[0]
+
+
+_ZIPF_CACHE: Dict[int, List[float]] = {}
+
+
+def zipf_index(rng: random.Random, n: int) -> int:
+    """Index in 0..n-1, rank r drawn with weight 1 / (r + 1) ** ZIPF_EXPONENT"""
+    if n not in _ZIPF_CACHE:
+        _ZIPF_CACHE[n] = list(accumulate(1 / (rank + 1) ** ZIPF_EXPONENT for rank in range(n)))
+    cumulative = _ZIPF_CACHE[n]
+    return bisect_left(cumulative, rng.random() * cumulative[-1])
+
+
+# ==================
+# ROW GENERATORS
+# ==================
+
+def profile_rows(spec: DatasetSpec, role: str, start: int, stop: int) -> Iterator[tuple]:
+    rng = spec.rng('profiles', role, start)
+    for index in range(start, stop):
+        created = spec.until - timedelta(days=spec.days * rng.random() * 1.5)
+        credits = int(rng.paretovariate(1.5) * 20) if role == 'client' else 0
+        yield (spec.profile_id(role, index), f"{role}{index}.s{spec.seed}@example.test",
+               f"{role.title()} {index}", f"{role}_{spec.seed}_{index}", credits, role, created, created)
+
+
+def advisor_detail_rows(spec: DatasetSpec, start: int, stop: int) -> Iterator[tuple]:
+    rng = spec.rng('advisor_details', start)
+    for index in range(start, stop):
+        specialties = rng.sample(SPECIALTIES, rng.randint(1, 4))
+        # Popular (low-index) advisors charge more
+        price = Decimal(str(round(1.99 + 7.0 * rng.random() * (1.0 if index < 50 else 0.6), 2)))
+        yield (spec.profile_id('advisor', index), rng.choice(TITLES),
+               f"{specialties[0].replace('-', ' ').title()} readings", specialties, rng.randint(1, 30), price,
+               rng.choice((0, 0, 3, 5)), weighted(rng, ADVISOR_STATUSES), rng.random() < 0.1, spec.until)
+
+
+def opening_ledger_rows(spec: DatasetSpec, start: int, stop: int) -> Iterator[tuple]:
+    for row in profile_rows(spec, 'client', start, stop):
+        credits, created = row[4], row[6]
+        if credits > 0:
+            yield (row[0], credits, credits, 'opening', created)
+
+
+def session_rows(spec: DatasetSpec, chunk: int) -> List[tuple]:
+    rng = spec.rng('sessions', chunk)
+    start = chunk * spec.chunk_size
+    rows = []
+    for _ in range(start, min(spec.sessions, start + spec.chunk_size)):
+        status = weighted(rng, SESSION_STATUSES)
+        client = spec.profile_id('client', int(spec.clients * rng.random() ** 2))
+        advisor_index = zipf_index(rng, spec.advisors)
+        advisor = spec.profile_id('advisor', advisor_index)
+        rate = Decimal(str(round(1.99 + 7.0 * (1 - advisor_index / spec.advisors) * rng.random(), 2)))
+        free = rng.choice((0, 0, 0, 3, 5))
+
+        if status == 'active':
+            started = spec.until - timedelta(minutes=rng.uniform(0, 90))
+        else:
+            started = spec.until - timedelta(days=spec.days * rng.random())
+        ended = cost = last_billed = None
+        minutes = charged = 0
+        billing = 'pending'
+        if status == 'completed':
+            minutes = max(1, int(rng.lognormvariate(2.3, 0.8)))
+            ended = started + timedelta(minutes=minutes, seconds=rng.randint(0, 59))
+            cost = max(Decimal(0), (minutes - free) * rate)
+            charged = int(cost.to_integral_value(rounding=ROUND_CEILING))
+            billing = 'completed' if rng.random() < 0.98 else 'failed'
+            last_billed = ended
+        elif status == 'cancelled':
+            ended = started + timedelta(seconds=rng.randint(5, 120))
+            billing = 'refunded' if rng.random() < 0.2 else 'pending'
+
+        rows.append((str(uuid.UUID(int=rng.getrandbits(128), version=4)), client, advisor,
+                     weighted(rng, SESSION_TYPES), status, started, ended, cost, rate, minutes, free,
+                     billing, weighted(rng, CONNECTION_QUALITIES), last_billed, charged))
+    return rows
+
+
+def message_rows(spec: DatasetSpec, chunk: int, sessions: List[tuple]) -> Iterator[tuple]:
+    rng = spec.rng('messages', chunk)
+    # log-normal with mean messages_per_session: mu = ln(mean) - sigma^2 / 2
+    sigma = 1.0
+    mu = math.log(max(spec.messages_per_session, 0.01)) - sigma ** 2 / 2
+    for session in sessions:
+        session_id, client, advisor, status, started = session[0], session[1], session[2], session[4], session[5]
+        if status in ('pending', 'cancelled'):
+            continue
+        count = int(rng.lognormvariate(mu, sigma))
+        at = started
+        sender = client
+        sent = 0
+        while sent < count:
+            # A burst from one side, then a pause while the other side reads
+            for _ in range(min(count - sent, rng.randint(1, 5))):
+                at += timedelta(seconds=rng.uniform(1, 8))
+                yield (str(uuid.UUID(int=rng.getrandbits(128), version=4)), session_id, sender,
+                       rng.choice(PHRASES), at)
+                sent += 1
+            at += timedelta(seconds=rng.uniform(15, 120))
+            sender = advisor if sender == client else client
+
+
+# ==================
+# COPY STREAMING
+# ==================
+
+def _copy_text(value) -> str:
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        text = 't' if value else 'f'
+    elif isinstance(value, datetime):
+        text = value.isoformat()
+    elif isinstance(value, (list, tuple)):
+        text = '{' + ','.join('"' + str(item).replace('\\', '\\\\').replace('"', '\\"') + '"' for item in value) + '}'
+    elif isinstance(value, dict):
+        text = json.dumps(value)
+    else:
+        text = str(value)
+    return text.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+class CopyStream:
+    """File-like view of rows in COPY text format, read by copy_expert in chunks"""
+
+    def __init__(self, rows: Iterable[tuple]):
+        self.rows = iter(rows)
+        self.buffer = b''
+        self.count = 0
+
+    def read(self, size: int = -1) -> bytes:
+        parts = [self.buffer]
+        length = len(self.buffer)
+        while size < 0 or length < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            line = ('\t'.join(_copy_text(value) for value in row) + '\n').encode('utf-8')
+            parts.append(line)
+            length += len(line)
+            self.count += 1
+        data = b''.join(parts)
+        if size < 0:
+            self.buffer = b''
+            return data
+        self.buffer = data[size:]
+        return data[:size]
+
+    def readline(self, size: int = -1) -> bytes:
+        return self.read(size)
+
+
+def copy_rows(cursor, table: str, rows: Iterable[tuple]) -> int:
+    stream = CopyStream(rows)
+    cursor.copy_expert(f"COPY public.{table} ({', '.join(COLUMNS[table])}) FROM STDIN", stream, size=1 << 16)
+    return stream.count
+
+
+# ==================
+# LOADING
+# ==================
+
+def plan_tasks(spec: DatasetSpec) -> List[Tuple[str, int, int]]:
+    """Independent units of work; profiles first so small loads look sane mid-run"""
+    tasks = []
+    for role, total in (('client', spec.clients), ('advisor', spec.advisors)):
+        for start in range(0, total, spec.chunk_size):
+            tasks.append((role, start, min(total, start + spec.chunk_size)))
+    for chunk in range(math.ceil(spec.sessions / spec.chunk_size)):
+        tasks.append(('sessions', chunk, chunk))
+    return tasks
+
+
+def run_task(cursor, spec: DatasetSpec, task: Tuple[str, int, int]) -> Dict[str, int]:
+    kind, start, stop = task
+    if kind == 'client':
+        return {'profiles': copy_rows(cursor, 'profiles', profile_rows(spec, 'client', start, stop)),
+                'credit_ledger': copy_rows(cursor, 'credit_ledger', opening_ledger_rows(spec, start, stop))}
+    if kind == 'advisor':
+        return {'profiles': copy_rows(cursor, 'profiles', profile_rows(spec, 'advisor', start, stop)),
+                'advisor_details': copy_rows(cursor, 'advisor_details', advisor_detail_rows(spec, start, stop))}
+    sessions = session_rows(spec, start)
+    return {'sessions': copy_rows(cursor, 'sessions', sessions),
+            'messages': copy_rows(cursor, 'messages', message_rows(spec, start, sessions))}
+
+
+def ensure_partitions(cursor, spec: DatasetSpec):
+    """messages is partitioned by month; create every month the generated messages fall in"""
+    # A session's messages run on a little past its start, so past `until` too
+    cursor.execute("SELECT public.ensure_message_partitions(%s, %s)",
+                   ((spec.until - timedelta(days=spec.days)).date(), (spec.until + timedelta(days=7)).date()))
+
+
+def load(cursor, spec: DatasetSpec) -> Dict[str, int]:
+    """Load everything through one cursor, in the caller's transaction"""
+    ensure_partitions(cursor, spec)
+    cursor.execute("SET LOCAL session_replication_role = replica")
+    counts: Dict[str, int] = {}
+    for task in plan_tasks(spec):
+        for table, rows in run_task(cursor, spec, task).items():
+            counts[table] = counts.get(table, 0) + rows
+    cursor.execute("SET LOCAL session_replication_role = origin")
+    return counts
+
+
+_worker_connection = None
+
+
+def _init_worker(database_url: str):
+    global _worker_connection
+    psycopg2, _ = _import_psycopg2()
+    _worker_connection = psycopg2.connect(database_url)
+    with _worker_connection.cursor() as cursor:
+        cursor.execute("SET session_replication_role = replica")
+    _worker_connection.commit()
+
+
+def _run_worker_task(args) -> Dict[str, int]:
+    spec, task = args
+    with _worker_connection.cursor() as cursor:
+        counts = run_task(cursor, spec, task)
+    _worker_connection.commit()
+    return counts
+
+
+def parallel_load(database_url: str, spec: DatasetSpec, workers: int, progress: bool = True) -> Dict[str, int]:
+    """One connection per worker process, one committed transaction per task"""
+    tasks = plan_tasks(spec)
+    counts: Dict[str, int] = {}
+    started = time.perf_counter()
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(database_url,)) as pool:
+        for done, result in enumerate(pool.imap_unordered(_run_worker_task, [(spec, task) for task in tasks]), 1):
+            for table, rows in result.items():
+                counts[table] = counts.get(table, 0) + rows
+            if progress:
+                total = sum(counts.values())
+                print(f"\r   {done}/{len(tasks)} chunks, {total:,} rows "
+                      f"({total / (time.perf_counter() - started):,.0f} rows/s)", end='', flush=True)
+    if progress:
+        print()
+    return counts
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate a deterministic synthetic dataset with COPY")
+    parser.add_argument('--database-url', default=os.getenv('DATABASE_URL'), help="Postgres URL (local)")
+    parser.add_argument('--sessions', type=int, default=100000, help="Sessions to generate")
+    parser.add_argument('--clients', type=int, help="Client profiles (default: sessions / 10)")
+    parser.add_argument('--advisors', type=int, help="Advisor profiles (default: sessions / 100)")
+    parser.add_argument('--messages-per-session', type=float, default=10.0, help="Mean messages per started session")
+    parser.add_argument('--seed', type=int, default=1, help="Seed; same seed, same rows")
+    parser.add_argument('--until', default=DEFAULT_UNTIL.isoformat(),
+                        help="Newest timestamp in the data (ISO 8601); part of the reproducible output")
+    parser.add_argument('--days', type=int, default=365, help="How far back sessions go")
+    parser.add_argument('--chunk-size', type=int, default=20000, help="Rows per generated chunk (per transaction)")
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) - 1), help="Worker processes")
+    parser.add_argument('--no-analyze', action='store_true', help="Skip ANALYZE after loading")
+    parser.add_argument('--dry-run', action='store_true', help="Print the planned sizes and exit")
+    parser.add_argument('--allow-remote', action='store_true', help="Allow loading into a non-local database")
+    return parser.parse_args()
+
+
+def main():
+    """Generate and COPY the dataset from parallel workers"""
+    args = parse_args()
+
+    try:
+        until = datetime.fromisoformat(args.until)
+    except ValueError:
+        print(f"❌ Error: Invalid --until: {args.until}")
+        return 1
+    if until.tzinfo is None:
+        until = until.replace(tzinfo=timezone.utc)
+
+    spec = DatasetSpec(
+        clients=args.clients or max(100, args.sessions // 10),
+        advisors=args.advisors or max(10, args.sessions // 100),
+        sessions=args.sessions,
+        messages_per_session=args.messages_per_session,
+        seed=args.seed,
+        until=until,
+        days=args.days,
+        chunk_size=args.chunk_size,
+    )
+
+    print(f"\n[*] Dataset (seed {spec.seed}): {spec.clients:,} clients, {spec.advisors:,} advisors, "
+          f"{spec.sessions:,} sessions, ~{int(spec.sessions * 0.87 * spec.messages_per_session):,} messages")
+    if args.dry_run:
+        print(f"[*] {len(plan_tasks(spec))} chunk(s) of up to {spec.chunk_size:,}")
+        return 0
+
+    if not args.database_url:
+        print("❌ Error: --database-url (or DATABASE_URL in .env) is required")
+        return 1
+    if not is_local(args.database_url) and not args.allow_remote:
+        print(f"❌ Error: Refusing to load into non-local database {urlparse(args.database_url).hostname} "
+              f"(use --allow-remote)")
+        return 1
+
+    psycopg2, _ = _import_psycopg2()
+    print(f"[*] Loading with {args.workers} worker(s)...")
+    started = time.perf_counter()
+    try:
+        connection = psycopg2.connect(args.database_url)
+        with connection, connection.cursor() as cursor:
+            ensure_partitions(cursor, spec)
+        connection.close()
+        counts = parallel_load(args.database_url, spec, args.workers)
+    except psycopg2.Error as e:
+        print(f"\n❌ Error: {str(e).strip()}")
+        return 1
+    elapsed = time.perf_counter() - started
+
+    if not args.no_analyze:
+        print("[*] Analyzing...")
+        connection = psycopg2.connect(args.database_url)
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {', '.join('public.' + table for table in COLUMNS)}")
+        connection.close()
+
+    print(f"\n{'='*60}")
+    print("  Dataset Loaded")
+    print(f"{'='*60}\n")
+    for table, rows in counts.items():
+        print(f"{table:<18}{rows:>14,}")
+    total = sum(counts.values())
+    print(f"\n{total:,} rows in {elapsed:.1f}s ({total / elapsed:,.0f} rows/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    exit_code = main()
+    sys.exit(exit_code)
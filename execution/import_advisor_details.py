@@ -0,0 +1,364 @@
+"""
+Advisor Import: Bulk upsert advisor profiles into advisor_details
+
+Streams a JSON array or NDJSON file of advisor profiles, validates each row
+and upserts them in chunks with PostgREST bulk POST
+(on_conflict=id, Prefer: resolution=merge-duplicates), so re-running an
+import updates existing advisors instead of failing on duplicates.
+
+Chunks are sent from a bounded worker pool whose concurrency adapts to the
+server: every 429/5xx halves the number of chunks in flight (honouring
+Retry-After) and each success grows it back by one step, up to --workers.
+A chunk that keeps failing with a transient error is retried on its own;
+a chunk rejected outright (e.g. one row violates a constraint) is split in
+half until the offending rows are isolated, so one bad row never blocks the
+rest of the file.
+
+Usage:
+    python execution/import_advisor_details.py .tmp/profiles.ndjson
+    python execution/import_advisor_details.py profiles.json --chunk-size 500 --workers 8
+    python execution/import_advisor_details.py profiles.json --dry-run
+
+Requirements:
+    - .env file with SUPABASE_URL and SUPABASE_KEY (service_role key; RLS only
+      lets advisors update their own row)
+    - python-dotenv==1.0.1, requests==2.31.0
+    - Each advisor's profiles row must already exist (advisor_details.id
+      references profiles.id)
+
+Outputs:
+    .tmp/import_advisor_rejects.ndjson - Rows that failed validation or the upsert, with the reason
+    stdout - Progress and a throughput report
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import requests
+from dotenv import load_dotenv
+
+from migration_schema import load_schema_from_migrations
+from supabase_transport import auth_headers, get_transport
+
+# Load environment variables
+load_dotenv()
+
+SUPABASE_URL = os.getenv('SUPABASE_URL')
+SUPABASE_KEY = os.getenv('SUPABASE_KEY')
+
+REST_URL = f"{SUPABASE_URL}/rest/v1"
+
+HEADERS = auth_headers(SUPABASE_KEY, {
+    'Content-Type': 'application/json',
+    'Prefer': 'resolution=merge-duplicates,return=minimal',
+})
+
+REJECTS_PATH = Path('.tmp') / 'import_advisor_rejects.ndjson'
+
+TRANSIENT_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+class TransientError(Exception):
+    """Server asked us to slow down or was briefly unavailable"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RejectedError(Exception):
+    """Server refused the chunk's contents; retrying unchanged won't help"""
+
+
+# ==================
+# INPUT
+# ==================
+
+def iter_records(path: Path) -> Iterator[dict]:
+    """Yield objects from a JSON array or NDJSON file without loading it whole"""
+    with path.open('r', encoding='utf-8') as f:
+        head = f.read(1)
+        while head and head.isspace():
+            head = f.read(1)
+        if head != '[':
+            # NDJSON: one object per line
+            first_line = head + f.readline()
+            if first_line.strip():
+                yield json.loads(first_line)
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+
+        # JSON array: decode one element at a time from a sliding buffer
+        decoder = json.JSONDecoder()
+        buffer = ''
+        eof = False
+        while True:
+            buffer = buffer.lstrip().lstrip(',').lstrip()
+            if buffer.startswith(']'):
+                return
+            try:
+                record, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                chunk = f.read(1 << 16)
+                eof = not chunk
+                buffer += chunk
+                continue
+            yield record
+            buffer = buffer[end:]
+
+
+def validate(record: dict, columns: Dict[str, str]) -> Tuple[Optional[dict], Optional[str]]:
+    """Return (row to upsert, None) or (None, reason)"""
+    if not isinstance(record, dict):
+        return None, 'not a JSON object'
+    try:
+        row_id = str(uuid.UUID(str(record.get('id'))))
+    except ValueError:
+        return None, 'id is missing or not a UUID'
+    title = record.get('title')
+    if not isinstance(title, str) or not title.strip():
+        return None, 'title is required'
+    try:
+        price = Decimal(str(record.get('price_per_minute')))
+    except InvalidOperation:
+        return None, 'price_per_minute is missing or not a number'
+    if not price.is_finite() or price < 0:
+        return None, 'price_per_minute must be a non-negative number'
+
+    # Only columns advisor_details actually has; unknown keys would fail the whole chunk
+    row = {key: value for key, value in record.items() if key in columns}
+    row.update({'id': row_id, 'title': title.strip(), 'price_per_minute': str(price)})
+    return row, None
+
+
+# ==================
+# BACKPRESSURE
+# ==================
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit: halve on overload, add 1/limit per success.
+
+    Workers acquire a slot before each request; when the limit drops, new
+    requests wait until enough in-flight ones finish.
+    """
+
+    def __init__(self, maximum: int):
+        self.maximum = maximum
+        self.limit = float(maximum)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                wait = self.paused_until - time.monotonic()
+                if wait <= 0 and self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                self.condition.wait(timeout=wait if wait > 0 else None)
+
+    def release(self, overloaded: bool = False, retry_after: Optional[float] = None):
+        with self.condition:
+            self.in_flight -= 1
+            if overloaded:
+                self.limit = max(1.0, self.limit / 2)
+                if retry_after:
+                    self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+            else:
+                self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+
+# ==================
+# UPSERT
+# ==================
+
+class Importer:
+    def __init__(self, workers: int, max_retries: int):
+        self.limiter = AdaptiveLimiter(workers)
+        self.max_retries = max_retries
+        self.lock = threading.Lock()
+        self.upserted = self.rejected = self.retries = self.chunks = 0
+        REJECTS_PATH.parent.mkdir(parents=True, exist_ok=True)
+        self.rejects = REJECTS_PATH.open('w', encoding='utf-8')
+
+    def reject(self, record, reason: str):
+        with self.lock:
+            self.rejected += 1
+            self.rejects.write(json.dumps({'reason': reason, 'record': record}, default=str) + '\n')
+
+    def post(self, rows: List[dict]):
+        """One bulk upsert request under the concurrency limiter"""
+        self.limiter.acquire()
+        try:
+            # retries=0: overload has to reach the AIMD limiter and the retry loop below
+            response = get_transport().post(
+                f"{REST_URL}/advisor_details",
+                headers=HEADERS,
+                params={'on_conflict': 'id'},
+                data=json.dumps(rows),
+                timeout=(10, 120),
+                retries=0
+            )
+        except requests.RequestException as e:
+            self.limiter.release(overloaded=True)
+            raise TransientError(str(e))
+
+        if response.status_code in TRANSIENT_STATUSES:
+            retry_after = response.headers.get('Retry-After')
+            try:
+                retry_after = float(retry_after) if retry_after else None
+            except ValueError:
+                retry_after = None
+            self.limiter.release(overloaded=True, retry_after=retry_after)
+            raise TransientError(f"HTTP {response.status_code}", retry_after)
+        self.limiter.release()
+        if response.status_code >= 400:
+            raise RejectedError(f"HTTP {response.status_code}: {response.text[:300]}")
+
+    def upsert(self, rows: List[dict]):
+        """Upsert a chunk: retry transient failures, bisect rejected ones"""
+        attempt = 0
+        while True:
+            try:
+                self.post(rows)
+                with self.lock:
+                    self.upserted += len(rows)
+                return
+            except TransientError as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    for row in rows:
+                        self.reject(row, f"gave up after {self.max_retries} retries ({str(e)})")
+                    return
+                with self.lock:
+                    self.retries += 1
+                time.sleep(e.retry_after or min(30.0, 0.5 * 2 ** attempt))
+            except RejectedError as e:
+                if len(rows) == 1:
+                    self.reject(rows[0], str(e))
+                    return
+                middle = len(rows) // 2
+                self.upsert(rows[:middle])
+                self.upsert(rows[middle:])
+                return
+
+    def run_chunk(self, rows: List[dict]):
+        self.upsert(rows)
+        with self.lock:
+            self.chunks += 1
+            if self.chunks % 20 == 0:
+                print(f"   [OK] {self.chunks} chunk(s), {self.upserted} upserted, "
+                      f"concurrency {self.limiter.limit:.1f}")
+
+    def close(self):
+        self.rejects.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Bulk upsert advisor profiles into advisor_details")
+    parser.add_argument('input', help="JSON array or NDJSON file of advisor profiles")
+    parser.add_argument('--chunk-size', type=int, default=100, help="Rows per bulk POST")
+    parser.add_argument('--workers', type=int, default=4, help="Maximum chunks in flight")
+    parser.add_argument('--max-retries', type=int, default=6, help="Retries per chunk on 429/5xx/network errors")
+    parser.add_argument('--dry-run', action='store_true', help="Validate only, don't write")
+    return parser.parse_args()
+
+
+def main():
+    """Stream, validate and upsert advisor profiles"""
+    args = parse_args()
+
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        print("❌ Error: SUPABASE_URL and SUPABASE_KEY must be set in .env file")
+        return 1
+
+    path = Path(args.input)
+    if not path.exists():
+        print(f"❌ Error: Input file not found: {path}")
+        return 1
+
+    columns = {name: column.type for name, column in load_schema_from_migrations().tables['advisor_details'].items()}
+
+    print(f"\n[*] Importing advisor profiles from {path}")
+    print(f"[*] Environment: {SUPABASE_URL}")
+    print(f"[*] Chunk size {args.chunk_size}, up to {args.workers} worker(s){' (dry run)' if args.dry_run else ''}")
+
+    importer = Importer(args.workers, args.max_retries)
+    # PostgREST bulk inserts need identical keys in every object, so rows are
+    # chunked per key set; a missing key must not null out an existing value
+    pending: Dict[Tuple[str, ...], List[dict]] = {}
+    read = valid = 0
+    # Bound queued chunks so reading never runs far ahead of the upserts
+    slots = threading.BoundedSemaphore(args.workers * 2)
+    started = time.perf_counter()
+
+    def run(rows):
+        try:
+            importer.run_chunk(rows)
+        finally:
+            slots.release()
+
+    def submit(pool, rows):
+        if args.dry_run:
+            return
+        slots.acquire()
+        pool.submit(run, rows)
+
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix='import') as pool:
+            for record in iter_records(path):
+                read += 1
+                row, reason = validate(record, columns)
+                if row is None:
+                    importer.reject(record, reason)
+                    continue
+                valid += 1
+                key = tuple(sorted(row))
+                chunk = pending.setdefault(key, [])
+                chunk.append(row)
+                if len(chunk) >= args.chunk_size:
+                    submit(pool, pending.pop(key))
+            for rows in pending.values():
+                submit(pool, rows)
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        print(f"❌ Error: Could not parse {path} after {read} record(s): {str(e)}")
+        importer.close()
+        return 1
+    importer.close()
+
+    elapsed = time.perf_counter() - started
+
+    print(f"\n{'='*60}")
+    print("  Import Summary")
+    print(f"{'='*60}\n")
+    print(f"Records read:  {read}")
+    print(f"Valid:         {valid}")
+    print(f"Upserted:      {importer.upserted}")
+    print(f"Rejected:      {importer.rejected} (see {REJECTS_PATH})")
+    print(f"Retries:       {importer.retries}")
+    print(f"Concurrency:   {importer.limiter.limit:.1f} at finish (max {args.workers})")
+    rate = (valid if args.dry_run else importer.upserted) / elapsed if elapsed else 0
+    print(f"Throughput:    {rate:.0f} rows/s over {elapsed:.1f}s")
+
+    return 0 if importer.rejected == 0 else 1
+
+
+if __name__ == "__main__":
+    exit_code = main()
+    sys.exit(exit_code)
@@ -0,0 +1,489 @@
+"""
+Telemetry Ingester: Stream WebRTC stats samples into session_telemetry
+
+Reads NDJSON samples (files, .gz files or a live stream on stdin) and writes
+them to the day-partitioned public.session_telemetry table in micro-batches:
+each batch is COPYed into a temp staging table and moved across with
+INSERT ... ON CONFLICT DO NOTHING, so a re-sent or replayed sample is a
+no-op instead of a failed batch. A batch is flushed when it reaches
+--batch-size rows or its oldest row has waited --flush-seconds, so a quiet
+stream still lands within seconds.
+
+Every --rollup-seconds (and once at the end) the sessions touched since the
+last rollup are passed to rollup_session_quality(), which rewrites their
+session_quality_summaries rows and sessions.connection_quality. The hot
+sessions row is written at most once per rollup, not once per sample.
+
+Input lines are WebRTCStats objects (src/types/webrtc.ts) plus ids, e.g.:
+
+    {"sessionId": "...", "participantId": "...", "timestamp": 1771632000000,
+     "roundTripTime": 48, "jitter": 3.2, "packetsLost": 4, "packetsReceived": 2210,
+     "bytesSent": 391000, "bytesReceived": 402112, "audioLevel": 0.12,
+     "connectionQuality": "good"}
+
+Column names (session_id, participant_id, sampled_at, rtt_ms, ...) are accepted
+too. `timestamp` may be epoch milliseconds, epoch seconds or ISO 8601. Lines
+that don't parse, or whose time is outside [now - --max-age-days, now + 5 min],
+are skipped and written to the rejects file.
+
+Usage:
+    python execution/ingest_telemetry.py samples.ndjson more-samples.ndjson.gz
+    stats-exporter | python execution/ingest_telemetry.py -                     # live stream
+    python execution/ingest_telemetry.py - --batch-size 20000 --flush-seconds 2
+    python execution/ingest_telemetry.py --rollup-only --since-hours 24         # backfill summaries
+    python execution/ingest_telemetry.py --rollup-only --retention-days 30      # + drop old partitions
+
+Requirements:
+    - psycopg2-binary==2.9.9, python-dotenv==1.0.1
+    - DATABASE_URL in .env (or --database-url) with the telemetry migration applied
+
+Outputs:
+    stdout                         - Batches, rows/sec, duplicates, rejects, rollups
+    .tmp/telemetry/rejects.ndjson  - Rejected lines with the reason (appended)
+"""
+
+import argparse
+import gzip
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+
+from bench_rtc_sessions import _import_psycopg2
+from generate_dataset import CONNECTION_QUALITIES, CopyStream
+
+# Load environment variables
+load_dotenv()
+
+OUTPUT_DIR = Path('.tmp/telemetry')
+
+COLUMNS = ('session_id', 'participant_id', 'sampled_at', 'rtt_ms', 'jitter_ms', 'packets_lost',
+           'packets_received', 'bytes_sent', 'bytes_received', 'audio_level', 'quality')
+
+# Column -> accepted keys: the column name first, then the WebRTCStats name
+ALIASES = {
+    'session_id': ('session_id', 'sessionId'),
+    'participant_id': ('participant_id', 'participantId', 'user_id', 'userId'),
+    'sampled_at': ('sampled_at', 'timestamp'),
+    'rtt_ms': ('rtt_ms', 'roundTripTime'),
+    'jitter_ms': ('jitter_ms', 'jitter'),
+    'packets_lost': ('packets_lost', 'packetsLost'),
+    'packets_received': ('packets_received', 'packetsReceived'),
+    'bytes_sent': ('bytes_sent', 'bytesSent'),
+    'bytes_received': ('bytes_received', 'bytesReceived'),
+    'audio_level': ('audio_level', 'audioLevel'),
+    'quality': ('quality', 'connectionQuality'),
+}
+# Column -> exclusive upper bound (packet counters are INTEGER, byte counters BIGINT)
+INTEGER_COLUMNS = {
+    'packets_lost': 2 ** 31,
+    'packets_received': 2 ** 31,
+    'bytes_sent': 2 ** 63,
+    'bytes_received': 2 ** 63,
+}
+FLOAT_COLUMNS = {'rtt_ms', 'jitter_ms', 'audio_level'}
+QUALITIES = {name for name, _ in CONNECTION_QUALITIES}
+
+MAX_CLOCK_SKEW = timedelta(minutes=5)
+
+
+class RejectedSample(ValueError):
+    """A line that can't become a session_telemetry row"""
+
+
+# ==================
+# PARSING
+# ==================
+
+def _field(record: dict, column: str):
+    for key in ALIASES[column]:
+        if key in record:
+            return record[key]
+    return None
+
+
+def parse_time(value) -> datetime:
+    if isinstance(value, bool) or value is None:
+        raise RejectedSample("missing timestamp")
+    if isinstance(value, (int, float)):
+        # performance.timeOrigin-based stats are milliseconds; anything this
+        # large can't be seconds (year 5138)
+        seconds = value / 1000 if value > 1e11 else value
+        try:
+            return datetime.fromtimestamp(seconds, tz=timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            raise RejectedSample(f"bad timestamp {value!r}")
+    try:
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        raise RejectedSample(f"bad timestamp {value!r}")
+    # UTC, so .date() names the same day as the partition bounds
+    return parsed.astimezone(timezone.utc) if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def parse_sample(record, now: datetime, max_age: timedelta) -> tuple:
+    """One NDJSON object -> a row in COLUMNS order; raises RejectedSample"""
+    if not isinstance(record, dict):
+        raise RejectedSample("not a JSON object")
+
+    row = {}
+    for column in ('session_id', 'participant_id'):
+        value = _field(record, column)
+        try:
+            row[column] = str(uuid.UUID(str(value)))
+        except (TypeError, ValueError):
+            raise RejectedSample(f"bad {column} {value!r}")
+
+    row['sampled_at'] = parse_time(_field(record, 'sampled_at'))
+    if not now - max_age <= row['sampled_at'] <= now + MAX_CLOCK_SKEW:
+        raise RejectedSample(f"sampled_at {row['sampled_at'].isoformat()} outside the accepted window")
+
+    for column in [*INTEGER_COLUMNS, *FLOAT_COLUMNS]:
+        value = _field(record, column)
+        if value is None:
+            row[column] = None
+            continue
+        if (isinstance(value, bool) or not isinstance(value, (int, float)) or value != value or value < 0
+                or value >= INTEGER_COLUMNS.get(column, float('inf'))):
+            raise RejectedSample(f"bad {column} {value!r}")
+        row[column] = int(value) if column in INTEGER_COLUMNS else float(value)
+
+    quality = _field(record, 'quality')
+    if quality is not None and quality not in QUALITIES:
+        raise RejectedSample(f"bad quality {quality!r}")
+    row['quality'] = quality
+
+    return tuple(row[column] for column in COLUMNS)
+
+
+# ==================
+# INPUT
+# ==================
+
+def read_lines(sources: List[str]) -> Iterator[Tuple[str, int, str]]:
+    """(source, line number, line) for every non-blank line of every source"""
+    for source in sources:
+        if source == '-':
+            stream = sys.stdin
+        elif source.endswith('.gz'):
+            stream = gzip.open(source, 'rt', encoding='utf-8')
+        else:
+            stream = open(source, 'r', encoding='utf-8')
+        try:
+            for number, line in enumerate(stream, 1):
+                if line.strip():
+                    yield source, number, line
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+
+class LineReader(threading.Thread):
+    """Reads lines on a thread so the main loop can flush on time while stdin is quiet"""
+
+    END = object()
+
+    def __init__(self, sources: List[str], max_queued: int):
+        super().__init__(name='telemetry-reader', daemon=True)
+        self.sources = sources
+        self.lines: 'queue.Queue' = queue.Queue(maxsize=max_queued)
+        self.error: Optional[BaseException] = None
+
+    def run(self):
+        try:
+            for item in read_lines(self.sources):
+                self.lines.put(item)
+        except (OSError, UnicodeDecodeError) as e:
+            self.error = e
+        finally:
+            self.lines.put(self.END)
+
+
+# ==================
+# WRITING
+# ==================
+
+class TelemetryWriter:
+    """One connection: ensures partitions, COPYs batches and runs rollups"""
+
+    def __init__(self, psycopg2, database_url: str):
+        self.psycopg2 = psycopg2
+        self.database_url = database_url
+        self.known_days: Set[date] = set()
+        self.connect()
+
+    def connect(self):
+        self.connection = self.psycopg2.connect(self.database_url)
+        with self.connection.cursor() as cursor:
+            # Same columns and types, but a plain table; emptied at every commit
+            cursor.execute("""
+                CREATE TEMP TABLE IF NOT EXISTS telemetry_staging
+                  (LIKE public.session_telemetry) ON COMMIT DELETE ROWS
+            """)
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def ensure_days(self, days: Iterable[date]):
+        """Create missing daily partitions, committed on their own so COPY never waits on DDL locks"""
+        missing = sorted(set(days) - self.known_days)
+        if not missing:
+            return
+        with self.connection.cursor() as cursor:
+            for day in missing:
+                cursor.execute("SELECT public.ensure_session_telemetry_partitions(%s, %s)", (day, day))
+                if cursor.fetchone()[0]:
+                    print(f"   [*] Created partition for {day.isoformat()}")
+        self.connection.commit()
+        self.known_days.update(missing)
+
+    def write(self, rows: List[tuple]) -> int:
+        """COPY one batch through staging; returns rows inserted (the rest were duplicates)"""
+        for attempt in range(2):
+            try:
+                self.ensure_days({row[2].date() for row in rows})
+                with self.connection.cursor() as cursor:
+                    cursor.copy_expert(f"COPY telemetry_staging ({', '.join(COLUMNS)}) FROM STDIN",
+                                       CopyStream(rows), size=1 << 16)
+                    cursor.execute(f"""
+                        INSERT INTO public.session_telemetry ({', '.join(COLUMNS)})
+                        SELECT {', '.join(COLUMNS)} FROM telemetry_staging
+                        ON CONFLICT DO NOTHING
+                    """)
+                    inserted = cursor.rowcount
+                self.connection.commit()
+                return inserted
+            except (self.psycopg2.OperationalError, self.psycopg2.InterfaceError) as e:
+                # Dropped connection: the batch is idempotent, so reconnect and resend it once
+                if attempt:
+                    raise
+                print(f"   [WARN] Connection lost ({str(e).strip()}); reconnecting")
+                try:
+                    self.connection.close()
+                except self.psycopg2.Error:
+                    pass
+                self.connect()
+        return 0
+
+    def rollup(self, session_ids: List[str], chunk_size: int) -> int:
+        """Recompute quality summaries, one short transaction per chunk of sessions"""
+        written = 0
+        with self.connection.cursor() as cursor:
+            for start in range(0, len(session_ids), chunk_size):
+                cursor.execute("SELECT public.rollup_session_quality(%s::uuid[])",
+                               (session_ids[start:start + chunk_size],))
+                written += cursor.fetchone()[0]
+                self.connection.commit()
+        return written
+
+    def sessions_since(self, since: datetime) -> List[str]:
+        with self.connection.cursor() as cursor:
+            cursor.execute("SELECT DISTINCT session_id::text FROM public.session_telemetry WHERE sampled_at >= %s",
+                           (since,))
+            session_ids = [row[0] for row in cursor.fetchall()]
+        self.connection.commit()
+        return session_ids
+
+    def drop_before(self, day: date) -> int:
+        with self.connection.cursor() as cursor:
+            cursor.execute("SELECT public.drop_session_telemetry_partitions(%s)", (day,))
+            dropped = cursor.fetchone()[0]
+        self.connection.commit()
+        self.known_days = {known for known in self.known_days if known >= day}
+        return dropped
+
+
+# ==================
+# INGEST LOOP
+# ==================
+
+class Stats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.lines = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.batches = 0
+        self.rollups = 0
+
+    def line(self) -> str:
+        elapsed = time.perf_counter() - self.started
+        rate = self.inserted / elapsed if elapsed else 0.0
+        return (f"{self.lines:,} line(s), {self.inserted:,} inserted, {self.duplicates:,} duplicate(s), "
+                f"{self.rejected:,} rejected, {self.batches:,} batch(es), {rate:,.0f} rows/s")
+
+
+def ingest(writer: TelemetryWriter, reader: LineReader, config: argparse.Namespace, stats: Stats):
+    max_age = timedelta(days=config.max_age_days)
+    rejects_path = OUTPUT_DIR / 'rejects.ndjson'
+    batch: List[tuple] = []
+    batch_started = 0.0
+    touched: Set[str] = set()
+    last_rollup = last_report = time.monotonic()
+    done = False
+
+    def flush():
+        nonlocal batch
+        if batch:
+            inserted = writer.write(batch)
+            stats.inserted += inserted
+            stats.duplicates += len(batch) - inserted
+            stats.batches += 1
+            # Only written rows count, so a rollup never runs ahead of its samples
+            touched.update(row[0] for row in batch)
+            batch = []
+
+    def rollup():
+        nonlocal touched, last_rollup
+        if touched:
+            stats.rollups += writer.rollup(sorted(touched), config.rollup_chunk)
+            touched = set()
+        last_rollup = time.monotonic()
+
+    while not done:
+        timeout = None
+        if batch:
+            timeout = max(0.0, batch_started + config.flush_seconds - time.monotonic())
+        try:
+            item = reader.lines.get(timeout=timeout if timeout is not None else 1.0)
+        except queue.Empty:
+            item = None
+
+        if item is LineReader.END:
+            done = True
+        elif item is not None:
+            source, number, line = item
+            stats.lines += 1
+            try:
+                row = parse_sample(json.loads(line), datetime.now(timezone.utc), max_age)
+            except (ValueError, RejectedSample) as e:
+                # json.JSONDecodeError is a ValueError too
+                stats.rejected += 1
+                with open(rejects_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps({'source': source, 'line': number, 'reason': str(e),
+                                        'text': line.rstrip('\n')[:2000]}) + '\n')
+            else:
+                if not batch:
+                    batch_started = time.monotonic()
+                batch.append(row)
+
+        now = time.monotonic()
+        if batch and (done or len(batch) >= config.batch_size or now - batch_started >= config.flush_seconds):
+            flush()
+        if config.rollup_seconds and now - last_rollup >= config.rollup_seconds:
+            rollup()
+        if now - last_report >= config.progress_seconds:
+            last_report = now
+            print(f"   {stats.line()}")
+
+    if reader.error:
+        print(f"   [WARN] Input stopped early: {str(reader.error)}")
+    if config.rollup_at_end:
+        rollup()
+
+
+# ==================
+# MAIN
+# ==================
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Ingest NDJSON WebRTC stats into session_telemetry")
+    parser.add_argument('sources', nargs='*', default=[],
+                        help="NDJSON files (.gz ok); '-' reads stdin")
+    parser.add_argument('--database-url', default=os.getenv('DATABASE_URL'), help="Postgres URL")
+    parser.add_argument('--batch-size', type=int, default=5000, help="Rows per COPY batch (default: 5000)")
+    parser.add_argument('--flush-seconds', type=float, default=1.0,
+                        help="Flush a partial batch once its oldest row is this old (default: 1.0)")
+    parser.add_argument('--rollup-seconds', type=float, default=60.0,
+                        help="Roll up touched sessions this often while ingesting; 0 disables (default: 60)")
+    parser.add_argument('--rollup-chunk', type=int, default=500, help="Sessions per rollup transaction (default: 500)")
+    parser.add_argument('--no-rollup-at-end', dest='rollup_at_end', action='store_false',
+                        help="Skip the final rollup after the input ends")
+    parser.add_argument('--max-age-days', type=float, default=7.0,
+                        help="Reject samples older than this (default: 7)")
+    parser.add_argument('--ahead-days', type=int, default=7, help="Create partitions this many days ahead (default: 7)")
+    parser.add_argument('--retention-days', type=int,
+                        help="Drop daily partitions older than this many days before ingesting")
+    parser.add_argument('--rollup-only', action='store_true',
+                        help="Don't read input; roll up sessions with samples in the last --since-hours")
+    parser.add_argument('--since-hours', type=float, default=24.0, help="Window for --rollup-only (default: 24)")
+    parser.add_argument('--progress-seconds', type=float, default=10.0, help="Seconds between progress lines")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    if not args.database_url:
+        print("❌ Error: --database-url (or DATABASE_URL in .env) is required")
+        return 1
+    if not args.rollup_only and not args.sources:
+        print("❌ Error: Give NDJSON files to ingest ('-' for stdin), or --rollup-only")
+        return 1
+    if args.batch_size < 1 or args.flush_seconds <= 0 or args.rollup_chunk < 1:
+        print("❌ Error: --batch-size, --flush-seconds and --rollup-chunk must be positive")
+        return 1
+    if args.retention_days is not None and args.retention_days < args.max_age_days:
+        print("❌ Error: --retention-days must be at least --max-age-days, or fresh samples would be dropped")
+        return 1
+
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    psycopg2, _ = _import_psycopg2()
+
+    try:
+        writer = TelemetryWriter(psycopg2, args.database_url)
+    except psycopg2.Error as e:
+        print(f"❌ Error: Cannot connect: {str(e).strip()}")
+        return 1
+
+    stats = Stats()
+    try:
+        today = datetime.now(timezone.utc).date()
+        if args.retention_days is not None:
+            dropped = writer.drop_before(today - timedelta(days=args.retention_days))
+            print(f"[*] Dropped {dropped} partition(s) older than {args.retention_days} day(s)")
+
+        if args.rollup_only:
+            since = datetime.now(timezone.utc) - timedelta(hours=args.since_hours)
+            session_ids = writer.sessions_since(since)
+            print(f"[*] Rolling up {len(session_ids):,} session(s) with samples since {since.isoformat(timespec='seconds')}")
+            stats.rollups = writer.rollup(session_ids, args.rollup_chunk)
+        else:
+            writer.ensure_days(today + timedelta(days=offset) for offset in range(-1, args.ahead_days + 1))
+            print(f"[*] Ingesting {', '.join(args.sources)} "
+                  f"(batches of {args.batch_size:,}, flushed after {args.flush_seconds:g}s)")
+            reader = LineReader(args.sources, max_queued=args.batch_size * 4)
+            reader.start()
+            ingest(writer, reader, args, stats)
+    except KeyboardInterrupt:
+        print("\n[WARN] Interrupted; the current batch was not written (re-send it, duplicates are skipped)")
+    except psycopg2.Error as e:
+        print(f"❌ Error: {str(e).strip()}")
+        return 1
+    finally:
+        writer.close()
+
+    print(f"\n{'='*60}")
+    print("  Telemetry Ingest Summary")
+    print(f"{'='*60}")
+    if not args.rollup_only:
+        print(f"   {stats.line()}")
+    print(f"   {stats.rollups:,} session quality summar{'y' if stats.rollups == 1 else 'ies'} written")
+    if stats.rejected:
+        print(f"   [WARN] Rejected lines: {OUTPUT_DIR / 'rejects.ndjson'}")
+    return 0
+
+
+if __name__ == "__main__":
+    exit_code = main()
+    sys.exit(exit_code)
@@ -0,0 +1,366 @@
+"""
+Instrumentation: Per-check and per-HTTP-call metrics for execution scripts
+
+Records, for every check and every HTTP request a script makes:
+    - wall time (request sent -> body read)
+    - server time (Kong's X-Kong-Upstream-Latency, or a Server-Timing dur)
+    - status code, bytes sent/received, and which supabase_transport try it was
+    - whether the TCP connection was reused or newly opened
+
+`install()` hooks requests.Session.send, so calls made through the
+module-level helpers (requests.get/post) are captured the same way as calls
+on a shared Session. Requests made while a check runs are attributed to it.
+
+Usage:
+    from instrumentation import Recorder
+
+    recorder = Recorder(profile=args.profile)
+    recorder.install()
+    results = run_checks(CHECKS, recorder=recorder)
+    recorder.uninstall()
+    paths = recorder.write_reports('verify_story_1_1', SUPABASE_URL)
+
+Environment:
+    EXECUTION_METRICS - Set to 0 to skip writing metric files
+
+Outputs:
+    .tmp/metrics/<script>_<timestamp>.json    - Full report (every call and check)
+    .tmp/metrics/<script>.prom                - Prometheus text exposition of the latest run
+                                                (point node_exporter's textfile collector here)
+    .tmp/metrics/<script>_<timestamp>.pstats  - cProfile stats with profile=True
+                                                (view with `snakeviz` or `python -m pstats`)
+"""
+
+import cProfile
+import json
+import os
+import pstats
+import re
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+import requests
+
+from supabase_transport import current_attempt
+
+METRICS_DIR = Path('.tmp') / 'metrics'
+
+
+def metrics_enabled() -> bool:
+    return os.getenv('EXECUTION_METRICS', '1') != '0'
+
+
+@dataclass
+class HttpCall:
+    method: str
+    endpoint: str
+    status: Optional[int]
+    wall_ms: float
+    server_ms: Optional[float]
+    bytes_sent: int
+    bytes_received: int
+    attempt: int  # 0 for a first try, n for the transport's nth retry
+    reused_connection: Optional[bool]
+    check: Optional[str]
+    error: Optional[str] = None
+
+
+@dataclass
+class CheckTiming:
+    name: str
+    wall_ms: float
+    passed: Optional[bool]
+    cached: bool = False
+
+
+def _server_ms(headers) -> Optional[float]:
+    """Upstream (PostgREST) time as reported by the gateway"""
+    upstream = headers.get('X-Kong-Upstream-Latency')
+    if upstream is not None:
+        try:
+            return float(upstream)
+        except ValueError:
+            pass
+    timing = headers.get('Server-Timing')
+    if timing:
+        durations = [float(value) for value in re.findall(r'dur=([\d.]+)', timing)]
+        if durations:
+            return sum(durations)
+    return None
+
+
+def _body_size(body) -> int:
+    if body is None:
+        return 0
+    if isinstance(body, str):
+        return len(body.encode('utf-8'))
+    if isinstance(body, (bytes, bytearray)):
+        return len(body)
+    return 0
+
+
+def _tag_connection(response: requests.Response, *args, **kwargs):
+    """
+    Response hook: runs before the body is read, while urllib3 still holds
+    the connection. A connection object seen before means keep-alive reuse.
+    """
+    raw = response.raw
+    connection = getattr(raw, 'connection', None) or getattr(raw, '_connection', None)
+    if connection is not None:
+        response._instrument_reused = getattr(connection, '_instrument_seen', False)
+        connection._instrument_seen = True
+    return response
+
+
+class Recorder:
+    """Collects HTTP and check metrics for one script run"""
+
+    def __init__(self, profile: bool = False):
+        self.calls: List[HttpCall] = []
+        self.checks: Dict[str, CheckTiming] = {}
+        self.profile = profile
+        self.stats: Optional[pstats.Stats] = None
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.started = time.time()
+        self.started_perf = time.perf_counter()
+        self.finished_perf: Optional[float] = None
+        self._original_send = None
+
+    # ------------------
+    # HTTP
+    # ------------------
+
+    def install(self):
+        """Record every requests.Session.send in this process"""
+        if self._original_send is not None:
+            return
+        original = requests.Session.send
+        recorder = self
+
+        def send(session, request, **kwargs):
+            response_hooks = request.hooks.setdefault('response', [])
+            if _tag_connection not in response_hooks:
+                response_hooks.insert(0, _tag_connection)
+            started = time.perf_counter()
+            try:
+                response = original(session, request, **kwargs)
+            except requests.RequestException as e:
+                recorder._record_call(request, None, time.perf_counter() - started, str(e))
+                raise
+            recorder._record_call(request, response, time.perf_counter() - started)
+            return response
+
+        self._original_send = original
+        requests.Session.send = send
+
+    def uninstall(self):
+        if self._original_send is not None:
+            requests.Session.send = self._original_send
+            self._original_send = None
+        if self.finished_perf is None:
+            self.finished_perf = time.perf_counter()
+
+    def _record_call(self, request, response, elapsed: float, error: Optional[str] = None):
+        received = 0
+        if response is not None:
+            if response._content_consumed:
+                received = len(response.content)
+            else:
+                # stream=True callers haven't read the body yet; count what's declared
+                received = int(response.headers.get('Content-Length') or 0)
+        call = HttpCall(
+            method=request.method,
+            endpoint=urlparse(request.url).path or '/',
+            status=response.status_code if response is not None else None,
+            wall_ms=round(elapsed * 1000, 3),
+            server_ms=_server_ms(response.headers) if response is not None else None,
+            bytes_sent=_body_size(request.body),
+            bytes_received=received,
+            attempt=current_attempt(),
+            reused_connection=getattr(response, '_instrument_reused', None),
+            check=getattr(self.local, 'check', None),
+            error=error,
+        )
+        with self.lock:
+            self.calls.append(call)
+
+    # ------------------
+    # CHECKS
+    # ------------------
+
+    @contextmanager
+    def check(self, name: str):
+        """Time one check; HTTP calls in this thread are attributed to it"""
+        self.local.check = name
+        profiler = cProfile.Profile() if self.profile else None
+        started = time.perf_counter()
+        if profiler:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler:
+                profiler.disable()
+            elapsed = time.perf_counter() - started
+            self.local.check = None
+            with self.lock:
+                self.checks[name] = CheckTiming(name, round(elapsed * 1000, 3), None)
+                if profiler:
+                    # cProfile only sees its own thread, so each check gets a
+                    # profiler and the stats are merged
+                    if self.stats is None:
+                        self.stats = pstats.Stats(profiler)
+                    else:
+                        self.stats.add(profiler)
+
+    def record_result(self, name: str, passed: bool, cached: bool = False):
+        with self.lock:
+            timing = self.checks.setdefault(name, CheckTiming(name, 0.0, None))
+            timing.passed = passed
+            timing.cached = cached
+
+    # ------------------
+    # REPORTS
+    # ------------------
+
+    def summary(self) -> dict:
+        """Aggregate calls per (method, endpoint)"""
+        endpoints: Dict[str, dict] = {}
+        for call in self.calls:
+            key = f"{call.method} {call.endpoint}"
+            entry = endpoints.setdefault(key, {
+                'method': call.method, 'endpoint': call.endpoint, 'count': 0, 'errors': 0,
+                'wall_ms': 0.0, 'server_ms': 0.0, 'bytes_sent': 0, 'bytes_received': 0,
+                'server_timed': 0, 'retries': 0, 'reused': 0, 'statuses': {},
+            })
+            entry['count'] += 1
+            entry['errors'] += 1 if call.status is None or call.status >= 400 else 0
+            entry['wall_ms'] += call.wall_ms
+            entry['server_ms'] += call.server_ms or 0.0
+            entry['server_timed'] += 1 if call.server_ms is not None else 0
+            entry['bytes_sent'] += call.bytes_sent
+            entry['bytes_received'] += call.bytes_received
+            entry['retries'] += 1 if call.attempt else 0
+            entry['reused'] += 1 if call.reused_connection else 0
+            status = str(call.status) if call.status is not None else 'error'
+            entry['statuses'][status] = entry['statuses'].get(status, 0) + 1
+        return endpoints
+
+    def to_prometheus(self, script: str, environment: str) -> str:
+        def labels(**values) -> str:
+            escaped = {key: str(value).replace('\\', '\\\\').replace('"', '\\"') for key, value in values.items()}
+            return '{' + ','.join(f'{key}="{value}"' for key, value in escaped.items()) + '}'
+
+        base = {'script': script, 'environment': environment}
+        finished = self.finished_perf or time.perf_counter()
+        lines = []
+
+        def metric(name: str, kind: str, help_text: str, samples: List[tuple]):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample_labels, value in samples:
+                lines.append(f"{name}{labels(**base, **sample_labels)} {value}")
+
+        metric('execution_run_timestamp_seconds', 'gauge', 'Unix time the run started',
+               [({}, round(self.started, 3))])
+        metric('execution_run_duration_seconds', 'gauge', 'Wall time of the run',
+               [({}, round(finished - self.started_perf, 6))])
+        checks = list(self.checks.values())
+        metric('execution_check_duration_seconds', 'gauge', 'Wall time of each check',
+               [({'check': c.name}, c.wall_ms / 1000) for c in checks])
+        metric('execution_check_passed', 'gauge', '1 if the check passed',
+               [({'check': c.name}, int(bool(c.passed))) for c in checks])
+        metric('execution_check_cached', 'gauge', '1 if the result was replayed from the verification cache',
+               [({'check': c.name}, int(c.cached)) for c in checks])
+
+        status_counts: Dict[tuple, int] = {}
+        for call in self.calls:
+            key = (call.method, call.endpoint, str(call.status) if call.status is not None else 'error')
+            status_counts[key] = status_counts.get(key, 0) + 1
+        metric('execution_http_requests_total', 'counter', 'HTTP requests by endpoint and status',
+               [({'method': m, 'endpoint': e, 'status': s}, n) for (m, e, s), n in sorted(status_counts.items())])
+
+        endpoints = list(self.summary().values())
+
+        def per_endpoint(field: str, scale: float = 1.0):
+            return [({'method': e['method'], 'endpoint': e['endpoint']}, round(e[field] * scale, 6)) for e in endpoints]
+
+        def summary(name: str, help_text: str, sums: List[tuple], counts: List[tuple]):
+            # One summary family: _sum and _count share the HELP/TYPE of the base name
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} summary")
+            for suffix, samples in (('_sum', sums), ('_count', counts)):
+                for sample_labels, value in samples:
+                    lines.append(f"{name}{suffix}{labels(**base, **sample_labels)} {value}")
+
+        summary('execution_http_request_duration_seconds', 'Client-side wall time per request',
+                per_endpoint('wall_ms', 0.001), per_endpoint('count'))
+        summary('execution_http_server_duration_seconds', 'Upstream time reported by the gateway',
+                per_endpoint('server_ms', 0.001), per_endpoint('server_timed'))
+        metric('execution_http_sent_bytes_total', 'counter', 'Request body bytes', per_endpoint('bytes_sent'))
+        metric('execution_http_received_bytes_total', 'counter', 'Response body bytes', per_endpoint('bytes_received'))
+        metric('execution_http_retries_total', 'counter',
+               'Retries sent by supabase_transport (each also counted in execution_http_requests_total)',
+               per_endpoint('retries'))
+        metric('execution_http_connections_reused_total', 'counter', 'Requests served on a kept-alive connection',
+               per_endpoint('reused'))
+        return '\n'.join(lines) + '\n'
+
+    def write_reports(self, script: str, base_url: Optional[str]) -> List[Path]:
+        """Write the JSON report, the .prom file and (if profiling) pstats"""
+        if self.finished_perf is None:
+            self.finished_perf = time.perf_counter()
+        if not metrics_enabled():
+            return []
+
+        environment = urlparse(base_url or '').netloc or 'unknown'
+        stamp = datetime.fromtimestamp(self.started, timezone.utc).strftime('%Y%m%d_%H%M%S')
+        METRICS_DIR.mkdir(parents=True, exist_ok=True)
+
+        report_path = METRICS_DIR / f"{script}_{stamp}.json"
+        report_path.write_text(json.dumps({
+            'script': script,
+            'environment': environment,
+            'started_at': datetime.fromtimestamp(self.started, timezone.utc).isoformat(),
+            'duration_ms': round((self.finished_perf - self.started_perf) * 1000, 3),
+            'checks': [asdict(timing) for timing in self.checks.values()],
+            'endpoints': list(self.summary().values()),
+            'calls': [asdict(call) for call in self.calls],
+        }, indent=2), encoding='utf-8')
+
+        prom_path = METRICS_DIR / f"{script}.prom"
+        # Write-then-rename so a scraper never reads a half-written file
+        temp = prom_path.with_suffix('.prom.tmp')
+        temp.write_text(self.to_prometheus(script, environment), encoding='utf-8')
+        temp.replace(prom_path)
+
+        paths = [report_path, prom_path]
+        if self.stats is not None:
+            stats_path = METRICS_DIR / f"{script}_{stamp}.pstats"
+            self.stats.dump_stats(str(stats_path))
+            paths.append(stats_path)
+        return paths
+
+    def print_timings(self, limit: int = 5):
+        """Console table of check durations and the slowest endpoints"""
+        print(f"{'Check':<28}{'Time':>10}  Result")
+        for timing in sorted(self.checks.values(), key=lambda t: -t.wall_ms):
+            result = 'cached' if timing.cached else ('passed' if timing.passed else 'failed')
+            print(f"{timing.name:<28}{timing.wall_ms:>8.0f}ms  {result}")
+
+        endpoints = sorted(self.summary().values(), key=lambda e: -e['wall_ms'])[:limit]
+        if endpoints:
+            reused = sum(1 for call in self.calls if call.reused_connection)
+            print(f"\n{'Endpoint':<40}{'Calls':>6}{'Avg':>10}{'Server':>10}")
+            for entry in endpoints:
+                label = f"{entry['method']} {entry['endpoint']}"[:39]
+                server = f"{entry['server_ms'] / entry['count']:.0f}ms" if entry['server_ms'] else '-'
+                print(f"{label:<40}{entry['count']:>6}{entry['wall_ms'] / entry['count']:>8.0f}ms{server:>10}")
+            print(f"\nHTTP: {len(self.calls)} request(s), {reused} on reused connection(s)")
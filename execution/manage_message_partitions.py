@@ -0,0 +1,647 @@
+"""
+Message Partitions: Create ahead, archive old months, restore on demand
+
+public.messages is partitioned by month (UTC) on created_at (migration
+20260223000000). This job keeps it that way:
+
+    ahead       creates the next --ahead-months partitions (default: 3), so
+                inserts never hit a missing month
+    retention   with --retention-months N, every month older than N months
+                is detached (DETACH PARTITION ... CONCURRENTLY, so reads and
+                inserts on newer months never wait), written to a gzipped
+                CSV archive, read back and counted, recorded in
+                message_archives and dropped
+    restore     --restore YYYY-MM loads an archived month back into its
+                partition and keeps it attached for --keep-days before
+                retention archives it again
+
+Archiving is resumable. A month whose partition was detached but never
+dropped (the job died mid-way) is picked up again on the next run, and a
+failed archive re-attaches the partition. Restored rows whose session or
+sender has since been deleted are skipped, as ON DELETE CASCADE would have
+removed them.
+
+Archive files:
+    <archive-dir>/messages_<YYYY-MM>.csv.gz  - id, session_id, sender_id, content, created_at (UTC), with header
+    <archive-dir>/messages_<YYYY-MM>.json    - Rows, sha256 and columns; enough to restore without the registry
+
+--bench shows what partitioning buys as history grows. In a transaction
+that is rolled back, it seeds a month of recent traffic with
+generate_dataset.py, then adds older months of history step by step. At
+each step it times recent-message reads (a session's latest page) and
+single-row inserts, against the partitioned table and an unpartitioned copy
+with the old indexes.
+
+Usage:
+    python execution/manage_message_partitions.py                              # create partitions ahead
+    python execution/manage_message_partitions.py --retention-months 12        # ... and archive older months
+    python execution/manage_message_partitions.py --retention-months 12 --dry-run
+    python execution/manage_message_partitions.py --restore 2025-03 --keep-days 14
+    python execution/manage_message_partitions.py --list
+    python execution/manage_message_partitions.py --bench --history-months 0,6,12,24 --rows-per-month 250000
+
+Requirements:
+    - psycopg2-binary==2.9.9, python-dotenv==1.0.1
+    - DATABASE_URL in .env (or --database-url) as the table owner, Postgres 14+
+      (DETACH CONCURRENTLY); --bench needs a local superuser connection
+
+Outputs:
+    stdout - Partitions created, archived and restored
+    .tmp/message_archive/ - Archive files (or --archive-dir, e.g. a mounted bucket)
+    .tmp/message_partitions/bench_<timestamp>.json - Bench results (--bench)
+"""
+
+import argparse
+import csv
+import gzip
+import hashlib
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import time
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List
+from urllib.parse import urlparse
+
+from dotenv import load_dotenv
+
+from bench_rtc_sessions import _import_psycopg2, is_local
+from generate_dataset import DEFAULT_UNTIL, DatasetSpec, load
+
+# Load environment variables
+load_dotenv()
+
+ARCHIVE_DIR = Path('.tmp') / 'message_archive'
+OUTPUT_DIR = Path('.tmp') / 'message_partitions'
+
+COLUMNS = ('id', 'session_id', 'sender_id', 'content', 'created_at')
+PARTITION_NAME = re.compile(r'^messages_p(\d{4})(\d{2})$')
+
+
+class ArchiveError(Exception):
+    """An archive could not be written, verified or restored"""
+
+
+# ==================
+# MONTHS AND PARTITIONS
+# ==================
+
+def month_start(day: date) -> date:
+    return date(day.year, day.month, 1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def parse_month(text: str) -> date:
+    try:
+        return datetime.strptime(text, '%Y-%m').date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected YYYY-MM, got '{text}'")
+
+
+def partition_name(month: date) -> str:
+    return f"messages_p{month:%Y%m}"
+
+
+def month_bounds(month: date) -> tuple:
+    start = datetime(month.year, month.month, 1, tzinfo=timezone.utc)
+    end_month = add_months(month, 1)
+    return start, datetime(end_month.year, end_month.month, 1, tzinfo=timezone.utc)
+
+
+def list_partitions(cursor) -> List[Dict]:
+    """Every messages_pYYYYMM table, attached or left detached by an interrupted archive"""
+    cursor.execute("""
+        SELECT c.relname,
+               i.inhrelid IS NOT NULL AS attached,
+               COALESCE(i.inhdetachpending, FALSE) AS detach_pending,
+               GREATEST(c.reltuples, 0)::BIGINT AS estimated_rows,
+               pg_total_relation_size(c.oid) AS bytes
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        LEFT JOIN pg_inherits i ON i.inhrelid = c.oid AND i.inhparent = 'public.messages'::regclass
+        WHERE n.nspname = 'public' AND c.relkind = 'r' AND c.relname ~ '^messages_p[0-9]{6}$'
+        ORDER BY c.relname
+    """)
+    partitions = []
+    for name, attached, pending, rows, size in cursor.fetchall():
+        match = PARTITION_NAME.match(name)
+        partitions.append({'name': name, 'month': date(int(match.group(1)), int(match.group(2)), 1),
+                           'attached': attached, 'detach_pending': pending, 'estimated_rows': rows, 'bytes': size})
+    return partitions
+
+
+def load_archives(cursor) -> Dict[date, Dict]:
+    cursor.execute("""
+        SELECT partition_month, partition_name, row_count, file_name, file_bytes, sha256,
+               archived_at, restored_at, keep_until
+        FROM public.message_archives
+    """)
+    names = [column[0] for column in cursor.description]
+    return {row[0]: dict(zip(names, row)) for row in cursor.fetchall()}
+
+
+def ensure_ahead(cursor, months_ahead: int) -> int:
+    """Current month through months_ahead months from now"""
+    current = month_start(datetime.now(timezone.utc).date())
+    cursor.execute("SELECT public.ensure_message_partitions(%s, %s)", (current, add_months(current, months_ahead)))
+    return cursor.fetchone()[0]
+
+
+# ==================
+# ARCHIVE
+# ==================
+
+def sha256_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def count_archived_rows(path: Path) -> int:
+    """Read the whole archive back; catches truncated or corrupt files before the partition is dropped"""
+    with gzip.open(path, 'rt', encoding='utf-8', newline='') as file:
+        reader = csv.reader(file)
+        header = next(reader, None)
+        if tuple(header or ()) != COLUMNS:
+            raise ArchiveError(f"{path.name}: unexpected header {header}")
+        return sum(1 for _ in reader)
+
+
+def detach(connection, partition: Dict):
+    """DETACH ... CONCURRENTLY runs outside a transaction; FINALIZE completes one that was interrupted"""
+    connection.commit()
+    connection.autocommit = True
+    try:
+        with connection.cursor() as cursor:
+            mode = 'FINALIZE' if partition['detach_pending'] else 'CONCURRENTLY'
+            cursor.execute(f'ALTER TABLE public.messages DETACH PARTITION public."{partition["name"]}" {mode}')
+    finally:
+        connection.autocommit = False
+
+
+def reattach(connection, partition: Dict):
+    start, end = month_bounds(partition['month'])
+    with connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE public.messages ATTACH PARTITION public."{partition["name"]}" '
+                       f'FOR VALUES FROM (%s) TO (%s)', (start, end))
+    connection.commit()
+
+
+def archive_partition(connection, partition: Dict, archive_dir: Path) -> Dict:
+    """Detach, write, verify, record, drop. Until the drop commits, the data is still in the database."""
+    if partition['attached']:
+        detach(connection, partition)
+
+    month = partition['month']
+    path = archive_dir / f"messages_{month:%Y-%m}.csv.gz"
+    partial = path.with_name(path.name + '.partial')
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL TimeZone = 'UTC'")
+            cursor.execute(f'SELECT COUNT(*) FROM public."{partition["name"]}"')
+            row_count = cursor.fetchone()[0]
+            with open(partial, 'wb') as raw:
+                with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6) as archive:
+                    cursor.copy_expert(
+                        f'COPY (SELECT {", ".join(COLUMNS)} FROM public."{partition["name"]}" '
+                        f'ORDER BY created_at, id) TO STDOUT WITH (FORMAT csv, HEADER)', archive)
+                raw.flush()
+                os.fsync(raw.fileno())
+
+        written = count_archived_rows(partial)
+        if written != row_count:
+            raise ArchiveError(f"{partial.name}: {written:,} row(s) written, partition has {row_count:,}")
+        os.replace(partial, path)
+        checksum, size = sha256_file(path), path.stat().st_size
+        path.with_suffix('').with_suffix('.json').write_text(json.dumps({
+            'partition': partition['name'], 'month': month.isoformat(), 'rows': row_count,
+            'sha256': checksum, 'columns': list(COLUMNS), 'archived_at': datetime.now(timezone.utc).isoformat(),
+        }, indent=2), encoding='utf-8')
+
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO public.message_archives
+                  (partition_month, partition_name, row_count, file_name, file_bytes, sha256)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                ON CONFLICT (partition_month) DO UPDATE SET
+                  partition_name = EXCLUDED.partition_name,
+                  row_count = EXCLUDED.row_count,
+                  file_name = EXCLUDED.file_name,
+                  file_bytes = EXCLUDED.file_bytes,
+                  sha256 = EXCLUDED.sha256,
+                  archived_at = NOW(),
+                  restored_at = NULL,
+                  keep_until = NULL
+            """, (month, partition['name'], row_count, path.name, size, checksum))
+            cursor.execute(f'DROP TABLE public."{partition["name"]}"')
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        partial.unlink(missing_ok=True)
+        # Put the month back where the app can read it; the next run retries
+        try:
+            reattach(connection, partition)
+        except Exception as e:
+            connection.rollback()
+            print(f"[WARN] {partition['name']} left detached ({str(e).strip()}); the next run resumes it")
+        raise
+    return {'partition': partition['name'], 'rows': row_count, 'file': str(path), 'bytes': size}
+
+
+def apply_retention(connection, retention_months: int, archive_dir: Path, dry_run: bool) -> int:
+    """Archive every month older than the window; returns how many failed"""
+    cutoff = add_months(month_start(datetime.now(timezone.utc).date()), -retention_months)
+    now = datetime.now(timezone.utc)
+    with connection.cursor() as cursor:
+        partitions = list_partitions(cursor)
+        archives = load_archives(cursor)
+    connection.commit()
+
+    for partition in partitions:
+        if not partition['attached'] and partition['month'] >= cutoff:
+            print(f"[WARN] {partition['name']} is detached but inside the retention window; left alone")
+    due = []
+    for partition in partitions:
+        if partition['month'] >= cutoff:
+            continue
+        hold = archives.get(partition['month'], {}).get('keep_until')
+        if partition['attached'] and hold and hold > now:
+            print(f"[*] {partition['name']} restored, kept until {hold:%Y-%m-%d %H:%M}")
+            continue
+        due.append(partition)
+
+    if not due:
+        print(f"[OK] Nothing older than {cutoff:%Y-%m} to archive")
+        return 0
+    if dry_run:
+        for partition in due:
+            print(f"[*] Would archive {partition['name']} (~{partition['estimated_rows']:,} rows, "
+                  f"{partition['bytes'] / 1024 / 1024:,.1f} MB)")
+        return 0
+
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    failed = 0
+    for partition in due:
+        started = time.perf_counter()
+        try:
+            result = archive_partition(connection, partition, archive_dir)
+        except Exception as e:
+            failed += 1
+            print(f"[FAIL] {partition['name']}: {str(e).strip()}")
+            continue
+        print(f"[OK] Archived {result['partition']}: {result['rows']:,} rows -> {result['file']} "
+              f"({result['bytes'] / 1024 / 1024:,.1f} MB, {time.perf_counter() - started:.1f}s)")
+    return failed
+
+
+# ==================
+# RESTORE
+# ==================
+
+def restore_month(connection, month: date, archive_dir: Path, keep_days: int) -> Dict:
+    with connection.cursor() as cursor:
+        archives = load_archives(cursor)
+    record = archives.get(month)
+    path = archive_dir / (record['file_name'] if record else f"messages_{month:%Y-%m}.csv.gz")
+    if not path.exists():
+        raise ArchiveError(f"No archive for {month:%Y-%m} at {path}")
+
+    sidecar = path.with_suffix('').with_suffix('.json')
+    expected = record['sha256'] if record else (json.loads(sidecar.read_text(encoding='utf-8'))['sha256']
+                                                 if sidecar.exists() else None)
+    if expected and sha256_file(path) != expected:
+        raise ArchiveError(f"{path.name}: checksum does not match the archive record")
+
+    with connection.cursor() as cursor:
+        cursor.execute("SET LOCAL TimeZone = 'UTC'")
+        if any(p['month'] == month and not p['attached'] for p in list_partitions(cursor)):
+            raise ArchiveError(f"{partition_name(month)} is detached mid-archive; run retention first")
+        cursor.execute("SELECT public.ensure_message_partitions(%s, %s)", (month, month))
+        cursor.execute("""
+            CREATE TEMP TABLE message_restore (LIKE public.messages INCLUDING DEFAULTS) ON COMMIT DROP
+        """)
+        with gzip.open(path, 'rb') as archive:
+            cursor.copy_expert(f"COPY message_restore ({', '.join(COLUMNS)}) FROM STDIN WITH (FORMAT csv, HEADER)",
+                               archive)
+        cursor.execute("SELECT COUNT(*) FROM message_restore")
+        loaded = cursor.fetchone()[0]
+        cursor.execute("""
+            INSERT INTO public.messages (id, session_id, sender_id, content, created_at)
+            SELECT r.id, r.session_id, r.sender_id, r.content, r.created_at
+            FROM message_restore r
+            WHERE EXISTS (SELECT 1 FROM public.sessions s WHERE s.id = r.session_id)
+              AND EXISTS (SELECT 1 FROM public.profiles p WHERE p.id = r.sender_id)
+            ON CONFLICT DO NOTHING
+        """)
+        inserted = cursor.rowcount
+        cursor.execute("""
+            UPDATE public.message_archives
+            SET restored_at = NOW(), keep_until = NOW() + make_interval(days => %s)
+            WHERE partition_month = %s
+        """, (keep_days, month))
+    connection.commit()
+    return {'month': month, 'loaded': loaded, 'inserted': inserted}
+
+
+# ==================
+# LIST
+# ==================
+
+def print_listing(cursor):
+    partitions = list_partitions(cursor)
+    archives = load_archives(cursor)
+    now = datetime.now(timezone.utc)
+
+    print(f"\n{'='*60}")
+    print("  Message Partitions")
+    print(f"{'='*60}\n")
+    print(f"   {'month':<9} {'state':<22} {'rows (est.)':>12} {'size MB':>10}")
+    attached_months = set()
+    for partition in partitions:
+        state = 'attached' if partition['attached'] else 'detached (archiving)'
+        if partition['detach_pending']:
+            state = 'detach pending'
+        hold = archives.get(partition['month'], {}).get('keep_until')
+        if partition['attached'] and hold and hold > now:
+            state = f"restored until {hold:%m-%d}"
+        attached_months.add(partition['month'])
+        print(f"   {partition['month']:%Y-%m}   {state:<22} {partition['estimated_rows']:>12,} "
+              f"{partition['bytes'] / 1024 / 1024:>10,.1f}")
+    for month, record in sorted(archives.items()):
+        if month not in attached_months:
+            print(f"   {month:%Y-%m}   {'archived':<22} {record['row_count']:>12,} "
+                  f"{record['file_bytes'] / 1024 / 1024:>10,.1f}  {record['file_name']}")
+
+
+# ==================
+# BENCHMARK
+# ==================
+
+RECENT_READ = """
+    SELECT id, sender_id, content, created_at FROM {table}
+    WHERE session_id = %s AND created_at >= %s
+    ORDER BY created_at DESC LIMIT 50
+"""
+INSERT_ONE = "INSERT INTO {table} (session_id, sender_id, content, created_at) VALUES (%s, %s, %s, %s)"
+
+HISTORY_ROWS = """
+    INSERT INTO public.messages (id, session_id, sender_id, content, created_at)
+    SELECT gen_random_uuid(), pool.ids[1 + g %% pool.n], pool.senders[1 + g %% pool.n],
+           'history message ' || g, %(start)s::timestamptz + random() * (%(end)s::timestamptz - %(start)s::timestamptz)
+    FROM (
+      SELECT array_agg(id) AS ids, array_agg(client_id) AS senders, COUNT(*)::INTEGER AS n
+      FROM (SELECT id, client_id FROM public.sessions ORDER BY md5(id::text) LIMIT 10000) sample
+    ) pool, generate_series(1, %(rows)s) g
+"""
+
+
+def _percentiles(timings: List[float]) -> Dict[str, float]:
+    ordered = sorted(timings)
+    return {'p50_ms': round(statistics.median(ordered), 3),
+            'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3)}
+
+
+def measure(cursor, table: str, sessions: List[tuple], until: datetime, rng: random.Random) -> Dict:
+    """Latest-page reads for each sample session (after a warm-up pass), then as many single-row inserts"""
+    read_sql, insert_sql = RECENT_READ.format(table=table), INSERT_ONE.format(table=table)
+    for session_id, _, started in sessions:
+        cursor.execute(read_sql, (session_id, started))
+        cursor.fetchall()
+    reads = []
+    for session_id, _, started in sessions:
+        begun = time.perf_counter()
+        cursor.execute(read_sql, (session_id, started))
+        cursor.fetchall()
+        reads.append((time.perf_counter() - begun) * 1000)
+    inserts = []
+    for session_id, sender_id, _ in sessions:
+        at = until - timedelta(seconds=rng.uniform(0, 3600))
+        begun = time.perf_counter()
+        cursor.execute(insert_sql, (session_id, sender_id, 'bench message', at))
+        inserts.append((time.perf_counter() - begun) * 1000)
+    return {'read': _percentiles(reads), 'insert': _percentiles(inserts)}
+
+
+def run_bench(connection, config: argparse.Namespace) -> Dict:
+    """Everything happens in one transaction that the caller rolls back"""
+    history_steps = sorted(set(config.history_months))
+    report = {'started_at': datetime.now().isoformat(), 'sessions': config.sessions,
+              'rows_per_month': config.rows_per_month, 'samples': config.samples, 'steps': []}
+    rng = random.Random(config.seed)
+    until = DEFAULT_UNTIL
+    recent_month = month_start((until - timedelta(days=30)).date())
+
+    with connection.cursor() as cursor:
+        cursor.execute("SET LOCAL TimeZone = 'UTC'")
+        print(f"[*] Seeding a month of recent traffic: {config.sessions:,} sessions (rolled back afterwards)...")
+        counts = load(cursor, DatasetSpec(
+            clients=max(100, config.sessions // 10),
+            advisors=max(10, config.sessions // 100),
+            sessions=config.sessions,
+            messages_per_session=10,
+            seed=config.seed,
+            until=until,
+            days=30,
+        ))
+        total_rows = counts.get('messages', 0)
+
+        # The old layout, for comparison: one heap, primary key on id, three btrees
+        cursor.execute("""
+            CREATE TABLE public.messages_unpartitioned_bench (LIKE public.messages INCLUDING DEFAULTS);
+            ALTER TABLE public.messages_unpartitioned_bench
+              ADD PRIMARY KEY (id),
+              ADD FOREIGN KEY (session_id) REFERENCES public.sessions(id) ON DELETE CASCADE,
+              ADD FOREIGN KEY (sender_id) REFERENCES public.profiles(id) ON DELETE CASCADE;
+            CREATE INDEX ON public.messages_unpartitioned_bench(session_id, created_at);
+            CREATE INDEX ON public.messages_unpartitioned_bench(sender_id);
+            CREATE INDEX ON public.messages_unpartitioned_bench(created_at);
+            INSERT INTO public.messages_unpartitioned_bench SELECT * FROM public.messages;
+        """)
+
+        # Sessions from the last week that have messages: the chats people have open
+        cursor.execute("""
+            SELECT s.id, s.client_id, s.started_at FROM public.sessions s
+            WHERE s.started_at >= %s AND EXISTS (SELECT 1 FROM public.messages m WHERE m.session_id = s.id)
+            ORDER BY md5(s.id::text) LIMIT %s
+        """, (until - timedelta(days=7), config.samples))
+        sessions = cursor.fetchall()
+        if not sessions:
+            raise ValueError("No recent sessions with messages were generated (raise --sessions)")
+
+        history = 0
+        for target in history_steps:
+            while history < target:
+                history += 1
+                month = add_months(recent_month, -history)
+                start, end = month_bounds(month)
+                cursor.execute("SELECT public.ensure_message_partitions(%s, %s)", (month, month))
+                cursor.execute("SET LOCAL session_replication_role = replica")
+                cursor.execute(HISTORY_ROWS, {'start': start, 'end': end, 'rows': config.rows_per_month})
+                cursor.execute("""
+                    INSERT INTO public.messages_unpartitioned_bench
+                    SELECT * FROM public.messages WHERE created_at >= %s AND created_at < %s
+                """, (start, end))
+                cursor.execute("SET LOCAL session_replication_role = origin")
+                total_rows += config.rows_per_month
+                print(f"\r   {history} month(s) of history added ({total_rows:,} messages)", end='', flush=True)
+            if history:
+                print()
+            cursor.execute("ANALYZE public.messages, public.messages_unpartitioned_bench")
+            partitions = sum(1 for partition in list_partitions(cursor) if partition['attached'])
+
+            step = {'history_months': target, 'messages': total_rows, 'partitions': partitions,
+                    'partitioned': measure(cursor, 'public.messages', sessions, until, rng),
+                    'unpartitioned': measure(cursor, 'public.messages_unpartitioned_bench', sessions, until, rng)}
+            total_rows += len(sessions)  # measure() inserted one row per sample session
+            report['steps'].append(step)
+            print(f"[OK] {target} month(s) of history: read p50 {step['partitioned']['read']['p50_ms']:.3f} ms, "
+                  f"insert p50 {step['partitioned']['insert']['p50_ms']:.3f} ms")
+    return report
+
+
+def print_bench(report: Dict):
+    print(f"\n{'='*60}")
+    print(f"  Recent Messages vs History Size (median of {report['samples']} / p95, ms)")
+    print(f"{'='*60}\n")
+    print(f"   {'history':>8} {'messages':>12} {'parts':>6}  {'read part.':>16} {'read unpart.':>16}"
+          f"  {'insert part.':>16} {'insert unpart.':>16}")
+    for step in report['steps']:
+        cells = []
+        for kind in ('read', 'insert'):
+            for layout in ('partitioned', 'unpartitioned'):
+                result = step[layout][kind]
+                cells.append(f"{result['p50_ms']:>7.3f} / {result['p95_ms']:<7.3f}")
+        print(f"   {step['history_months']:>6}mo {step['messages']:>12,} {step['partitions']:>6}  "
+              f"{cells[0]:>16} {cells[1]:>16}  {cells[2]:>16} {cells[3]:>16}")
+    first, last = report['steps'][0], report['steps'][-1]
+    if first is not last:
+        growth = last['messages'] / max(1, first['messages'])
+        print(f"\n   History grew {growth:,.1f}x; partitioned p50 changed "
+              f"{last['partitioned']['read']['p50_ms'] / first['partitioned']['read']['p50_ms']:.2f}x (reads), "
+              f"{last['partitioned']['insert']['p50_ms'] / first['partitioned']['insert']['p50_ms']:.2f}x (inserts)")
+
+
+# ==================
+# MAIN
+# ==================
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Create, archive and restore monthly messages partitions")
+    parser.add_argument('--database-url', default=os.getenv('DATABASE_URL'), help="Postgres URL")
+    parser.add_argument('--ahead-months', type=int, default=3, help="Partitions kept ahead of now (default: 3)")
+    parser.add_argument('--retention-months', type=int,
+                        help="Archive months older than this many months (default: keep everything)")
+    parser.add_argument('--archive-dir', type=Path, default=ARCHIVE_DIR, help=f"Archive files (default: {ARCHIVE_DIR})")
+    parser.add_argument('--restore', type=parse_month, action='append', default=[], metavar='YYYY-MM',
+                        help="Load an archived month back (repeatable)")
+    parser.add_argument('--keep-days', type=int, default=30,
+                        help="Days a restored month stays attached before it is archived again (default: 30)")
+    parser.add_argument('--list', action='store_true', help="Show partitions and archives, then exit")
+    parser.add_argument('--dry-run', action='store_true', help="Show what retention would archive")
+    parser.add_argument('--bench', action='store_true', help="Benchmark recent reads/inserts as history grows (local)")
+    parser.add_argument('--history-months', default='0,6,12,24',
+                        help="Months of older history at each --bench step (default: 0,6,12,24)")
+    parser.add_argument('--rows-per-month', type=int, default=250000, help="History messages per month (--bench)")
+    parser.add_argument('--sessions', type=int, default=20000, help="Recent sessions seeded for --bench")
+    parser.add_argument('--samples', type=int, default=200, help="Reads and inserts timed per --bench step")
+    parser.add_argument('--seed', type=int, default=23, help="Seed for the --bench data")
+    parser.add_argument('--allow-remote', action='store_true', help="Allow --bench against a non-local database")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    if not args.database_url:
+        print("❌ Error: --database-url (or DATABASE_URL in .env) is required")
+        return 1
+    if args.ahead_months < 0 or args.keep_days < 0 or (args.retention_months is not None and args.retention_months < 1):
+        print("❌ Error: --ahead-months and --keep-days can't be negative, --retention-months must be at least 1")
+        return 1
+    try:
+        args.history_months = [int(value) for value in args.history_months.split(',') if value.strip()]
+    except ValueError:
+        print(f"❌ Error: Invalid --history-months: {args.history_months}")
+        return 1
+    if args.bench and (not args.history_months or min(args.history_months) < 0 or args.samples < 1):
+        print("❌ Error: --history-months must be non-negative month counts and --samples positive")
+        return 1
+    if args.bench and not is_local(args.database_url) and not args.allow_remote:
+        print(f"❌ Error: Refusing to benchmark non-local database {urlparse(args.database_url).hostname} "
+              f"(use --allow-remote)")
+        return 1
+
+    psycopg2, _ = _import_psycopg2()
+    try:
+        connection = psycopg2.connect(args.database_url)
+    except psycopg2.Error as e:
+        print(f"❌ Error: Could not connect: {str(e).strip()}")
+        return 1
+
+    try:
+        if args.bench:
+            try:
+                report = run_bench(connection, args)
+            finally:
+                # Never keep the generated history or the comparison table
+                connection.rollback()
+            print_bench(report)
+            OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+            output_path = OUTPUT_DIR / f"bench_{datetime.now():%Y%m%d_%H%M%S}.json"
+            output_path.write_text(json.dumps(report, indent=2, default=str), encoding='utf-8')
+            print(f"\n[*] Results written to {output_path}")
+            return 0
+
+        if args.list:
+            with connection.cursor() as cursor:
+                print_listing(cursor)
+            connection.rollback()
+            return 0
+
+        failed = 0
+        with connection.cursor() as cursor:
+            created = ensure_ahead(cursor, args.ahead_months)
+        connection.commit()
+        print(f"[OK] Partitions through {add_months(month_start(datetime.now(timezone.utc).date()), args.ahead_months):%Y-%m} "
+              f"exist ({created} created)")
+
+        for month in args.restore:
+            try:
+                result = restore_month(connection, month, args.archive_dir, args.keep_days)
+            except (ArchiveError, OSError, psycopg2.Error) as e:
+                connection.rollback()
+                failed += 1
+                print(f"[FAIL] Restore {month:%Y-%m}: {str(e).strip()}")
+                continue
+            skipped = result['loaded'] - result['inserted']
+            print(f"[OK] Restored {month:%Y-%m}: {result['inserted']:,} of {result['loaded']:,} rows"
+                  f"{f' ({skipped:,} already present or orphaned)' if skipped else ''}, kept {args.keep_days} day(s)")
+
+        if args.retention_months:
+            failed += apply_retention(connection, args.retention_months, args.archive_dir, args.dry_run)
+    except (psycopg2.Error, ValueError) as e:
+        connection.rollback()
+        print(f"❌ Error: {str(e).strip()}")
+        return 1
+    finally:
+        connection.close()
+
+    if failed:
+        print(f"\n[WARNING] {failed} operation(s) failed; rerun to retry")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    exit_code = main()
+    sys.exit(exit_code)
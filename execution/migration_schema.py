@@ -0,0 +1,271 @@
+"""
+Migration Schema: Build the schema model from supabase/migrations/*.sql
+
+Replays the DDL in the migration files (in filename order) far enough to know
+which tables, columns, enums and RPCs the database ends up with, producing
+the same SchemaModel that schema_introspection.py builds from a live
+PostgREST. Used wherever a schema is needed without a database, e.g. the
+offline PostgREST stand-in.
+
+Understood statements:
+    - CREATE TABLE (skips PARTITION OF children and LIKE clauses)
+    - ALTER TABLE ... ADD/DROP/RENAME COLUMN, RENAME TO
+    - DROP TABLE
+    - CREATE TYPE ... AS ENUM (also inside DO $$ ... $$ blocks)
+    - CREATE [OR REPLACE] FUNCTION (trigger functions are not RPCs)
+
+Anything else (indexes, policies, grants, comments) is ignored. Only objects
+in the public schema are modelled, matching what PostgREST exposes.
+
+Usage:
+    from migration_schema import load_schema_from_migrations
+
+    schema = load_schema_from_migrations()
+    schema.tables['sessions']['type'].enum_values   # ('chat', 'audio', 'video')
+
+Requirements:
+    - Python 3.8+ (standard library only)
+"""
+
+import re
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from schema_introspection import Column, Rpc, SchemaModel
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / 'supabase' / 'migrations'
+
+# Leading words of a column-list entry that are table constraints, not columns
+CONSTRAINT_KEYWORDS = ('constraint', 'primary', 'unique', 'check', 'foreign', 'exclude', 'like')
+
+# Canonical spelling PostgREST reports for common type aliases
+TYPE_ALIASES = {
+    'int': 'integer',
+    'int4': 'integer',
+    'int8': 'bigint',
+    'serial': 'integer',
+    'bigserial': 'bigint',
+    'bool': 'boolean',
+    'decimal': 'numeric',
+    'float8': 'double precision',
+    'timestamptz': 'timestamp with time zone',
+    'timestamp': 'timestamp without time zone',
+    'time': 'time without time zone',
+    'varchar': 'character varying',
+}
+
+
+def strip_comments(sql: str) -> str:
+    sql = re.sub(r'/\*.*?\*/', ' ', sql, flags=re.DOTALL)
+    return re.sub(r'--[^\n]*', '', sql)
+
+
+def split_top_level(text: str, separator: str = ',') -> List[str]:
+    """Split on separator, ignoring separators inside parentheses or quotes"""
+    parts, depth, quoted, current = [], 0, False, []
+    for char in text:
+        if char == "'":
+            quoted = not quoted
+        elif not quoted and char == '(':
+            depth += 1
+        elif not quoted and char == ')':
+            depth -= 1
+        if char == separator and depth == 0 and not quoted:
+            parts.append(''.join(current).strip())
+            current = []
+        else:
+            current.append(char)
+    if ''.join(current).strip():
+        parts.append(''.join(current).strip())
+    return parts
+
+
+def _table_name(qualified: str) -> Optional[str]:
+    """'public.profiles' / 'profiles' -> 'profiles'; other schemas -> None"""
+    qualified = qualified.replace('"', '')
+    if '.' in qualified:
+        schema, name = qualified.split('.', 1)
+        return name if schema == 'public' else None
+    return qualified
+
+
+def normalize_type(type_sql: str, enums: Dict[str, Tuple[str, ...]]) -> str:
+    """'DECIMAL(10, 2)' -> 'numeric', 'TEXT[]' -> 'text[]', 'public.billing_status' -> 'billing_status'"""
+    text = re.sub(r'\s+', ' ', type_sql.strip().lower())
+    is_array = text.endswith('[]')
+    text = text[:-2].strip() if is_array else text
+    text = re.sub(r'\(.*?\)', '', text).strip()
+    if text.startswith('public.'):
+        text = text[len('public.'):]
+    if text in ('timestamp with time zone', 'timestamp without time zone', 'time with time zone',
+                'time without time zone', 'double precision', 'character varying'):
+        pass
+    elif text.startswith('timestamp'):
+        text = 'timestamp with time zone' if 'with time zone' in text else 'timestamp without time zone'
+    elif text.startswith('time'):
+        text = 'time with time zone' if 'with time zone' in text else 'time without time zone'
+    else:
+        text = TYPE_ALIASES.get(text, text)
+    return text + ('[]' if is_array else '')
+
+
+# Column type runs until the first constraint keyword
+_COLUMN_RE = re.compile(
+    r'^"?(?P<name>\w+)"?\s+(?P<type>.+?)'
+    r'(?=\s+(?:not\s+null|null|default|primary\s+key|references|unique|check|constraint|generated|collate)\b|$)'
+    r'(?P<rest>.*)$',
+    re.IGNORECASE | re.DOTALL
+)
+_DEFAULT_RE = re.compile(
+    r'\bdefault\s+(.+?)(?=\s+(?:not\s+null|null|primary\s+key|references|unique|check|constraint)\b|$)',
+    re.IGNORECASE | re.DOTALL
+)
+
+
+def parse_column(definition: str, enums: Dict[str, Tuple[str, ...]]) -> Optional[Column]:
+    """Parse one column definition; returns None for table constraints"""
+    if definition.split(None, 1)[0].lower() in CONSTRAINT_KEYWORDS:
+        return None
+    match = _COLUMN_RE.match(definition.strip())
+    if not match:
+        return None
+    column_type = normalize_type(match.group('type'), enums)
+    default = _DEFAULT_RE.search(match.group('rest'))
+    return Column(
+        name=match.group('name'),
+        type=column_type,
+        enum_values=enums.get(column_type),
+        default=default.group(1).strip() if default else None,
+    )
+
+
+def _parse_function(statement: str, model: SchemaModel):
+    match = re.match(
+        r'create\s+(?:or\s+replace\s+)?function\s+([\w."]+)\s*\((.*?)\)\s*returns\s+(.+?)\s+(?:as|language)\b',
+        statement, re.IGNORECASE | re.DOTALL
+    )
+    if not match:
+        return
+    name = _table_name(match.group(1))
+    returns = re.sub(r'\s+', ' ', match.group(3).strip().lower())
+    if name is None or returns == 'trigger':
+        return
+
+    args, required = {}, []
+    for arg in split_top_level(match.group(2)):
+        arg_match = re.match(r'^(?:in\s+)?(\w+)\s+(.+?)(\s+default\s+.+|\s*=\s*.+)?$', arg, re.IGNORECASE | re.DOTALL)
+        if not arg_match:
+            continue
+        args[arg_match.group(1)] = normalize_type(arg_match.group(2), model.enums)
+        if not arg_match.group(3):
+            required.append(arg_match.group(1))
+    model.rpcs[name] = Rpc(name, args, tuple(required), returns)
+
+
+def _parse_create_table(statement: str, model: SchemaModel):
+    match = re.match(r'create\s+table\s+(?:if\s+not\s+exists\s+)?([\w."]+)\s*(.*)$', statement,
+                     re.IGNORECASE | re.DOTALL)
+    if not match:
+        return
+    name = _table_name(match.group(1))
+    body = match.group(2).strip()
+    if name is None or re.match(r'partition\s+of\b', body, re.IGNORECASE) or not body.startswith('('):
+        return
+
+    # Column list is the first balanced parenthesised group
+    depth = 0
+    for index, char in enumerate(body):
+        depth += {'(': 1, ')': -1}.get(char, 0)
+        if depth == 0:
+            break
+    columns = {}
+    for definition in split_top_level(body[1:index]):
+        column = parse_column(definition, model.enums)
+        if column:
+            columns[column.name] = column
+    if name not in model.tables or not re.match(r'create\s+table\s+if\s+not\s+exists', statement, re.IGNORECASE):
+        model.tables[name] = columns
+
+
+def _parse_alter_table(statement: str, model: SchemaModel):
+    match = re.match(r'alter\s+table\s+(?:if\s+exists\s+)?(?:only\s+)?([\w."]+)\s+(.*)$', statement,
+                     re.IGNORECASE | re.DOTALL)
+    if not match:
+        return
+    name = _table_name(match.group(1))
+    if name is None or name not in model.tables:
+        return
+    columns = model.tables[name]
+
+    rename_table = re.match(r'rename\s+to\s+"?(\w+)"?$', match.group(2).strip(), re.IGNORECASE)
+    if rename_table:
+        model.tables[rename_table.group(1)] = model.tables.pop(name)
+        return
+
+    for action in split_top_level(match.group(2)):
+        add = re.match(r'add\s+column\s+(?:if\s+not\s+exists\s+)?(.+)$', action, re.IGNORECASE | re.DOTALL)
+        drop = re.match(r'drop\s+column\s+(?:if\s+exists\s+)?"?(\w+)"?', action, re.IGNORECASE)
+        rename = re.match(r'rename\s+column\s+"?(\w+)"?\s+to\s+"?(\w+)"?', action, re.IGNORECASE)
+        if add:
+            column = parse_column(add.group(1), model.enums)
+            if column and column.name not in columns:
+                columns[column.name] = column
+        elif drop:
+            columns.pop(drop.group(1), None)
+        elif rename and rename.group(1) in columns:
+            column = columns.pop(rename.group(1))
+            columns[rename.group(2)] = Column(rename.group(2), column.type, column.enum_values, column.default)
+
+
+def apply_migration(sql: str, model: SchemaModel):
+    """Apply one migration file's DDL to the model, statement by statement"""
+    sql = strip_comments(sql)
+
+    # Function bodies contain semicolons; pull functions out before splitting
+    for function in re.finditer(r'create\s+(?:or\s+replace\s+)?function\b.*?\$(\w*)\$.*?\$\1\$', sql,
+                                re.IGNORECASE | re.DOTALL):
+        _parse_function(function.group(0), model)
+    sql = re.sub(r'create\s+(?:or\s+replace\s+)?function\b.*?\$(\w*)\$.*?\$\1\$', ' ', sql,
+                 flags=re.IGNORECASE | re.DOTALL)
+
+    # Whatever is left of DO blocks splits into plain DDL statements
+    for statement in sql.split(';'):
+        statement = re.sub(r'^\s*(?:do\s+\$\w*\$\s*)?(?:begin|declare)?\s*', '', statement.strip(),
+                           flags=re.IGNORECASE)
+        statement = re.sub(r'^(?:if\s+.+?\s+then\s+)', '', statement, flags=re.IGNORECASE | re.DOTALL)
+        lowered = statement.lower()
+
+        enum = re.match(r'create\s+type\s+([\w."]+)\s+as\s+enum\s*\((.*)\)', statement, re.IGNORECASE | re.DOTALL)
+        if enum:
+            name = _table_name(enum.group(1))
+            if name:
+                values = tuple(value.strip().strip("'") for value in split_top_level(enum.group(2)))
+                model.enums.setdefault(name, values)
+        elif lowered.startswith('create table'):
+            _parse_create_table(statement, model)
+        elif lowered.startswith('alter table'):
+            _parse_alter_table(statement, model)
+        elif lowered.startswith('drop table'):
+            for target in re.sub(r'drop\s+table\s+(?:if\s+exists\s+)?', '', statement, flags=re.IGNORECASE).split(','):
+                name = _table_name(target.strip().split()[0]) if target.strip() else None
+                model.tables.pop(name, None)
+
+    # Columns declared before their enum existed pick up the values now
+    for table, columns in model.tables.items():
+        for column_name, column in columns.items():
+            if column.enum_values is None and column.type in model.enums:
+                columns[column_name] = Column(column.name, column.type, model.enums[column.type], column.default)
+
+
+def load_schema_from_migrations(migrations_dir: Path = MIGRATIONS_DIR) -> SchemaModel:
+    """Replay every migration in filename order"""
+    model = SchemaModel()
+    for path in sorted(migrations_dir.glob('*.sql')):
+        apply_migration(path.read_text(encoding='utf-8'), model)
+    return model
+
+
+def latest_migration_version(migrations_dir: Path = MIGRATIONS_DIR) -> Optional[str]:
+    """Version prefix of the newest migration file (what get_schema_version() reports)"""
+    versions = [path.name.split('_', 1)[0] for path in migrations_dir.glob('*.sql')]
+    return max(versions) if versions else None
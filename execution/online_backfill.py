@@ -0,0 +1,517 @@
+"""
+Online Backfill Runner: Table-rewriting schema changes without downtime
+
+Changes like 20260214000000's TEXT -> enum conversion of sessions.type and
+sessions.status were written as one UPDATE over every row plus DROP/RENAME,
+holding ACCESS EXCLUSIVE for the whole rewrite. This runner does the same
+change in expand/backfill/contract phases instead:
+
+    prepare   Add the new column (metadata-only), a trigger that keeps it in
+              step with new writes, and a NOT VALID check that it's filled
+    backfill  Fill the new column in keyset-ordered chunks, one short
+              transaction per chunk, checkpointed after every commit
+    finalize  VALIDATE the check and build any indexes CONCURRENTLY (online),
+              then swap the columns in one short transaction with a tight
+              lock_timeout, retried until it gets its lock
+
+Backfill pacing:
+    - --batch-size rows per chunk, halved when a chunk runs over
+      --target-batch-ms or times out on a lock, grown again when chunks are fast
+    - --sleep-ms pause after every chunk (the sleep budget given to other traffic)
+    - pauses while replication replay lag exceeds --max-replication-lag or more
+      than --max-lock-waiters backends are waiting on locks on the table
+
+Progress prints rows/sec and an ETA. The summary reports the longest time
+any transaction held locks: the slowest chunk and the final swap.
+
+Usage:
+    python execution/online_backfill.py sessions_status_enum --phases prepare,backfill
+    python execution/online_backfill.py sessions_status_enum --phases finalize
+    python execution/online_backfill.py --job-file .tmp/my_backfill.json --resume
+    python execution/online_backfill.py --list
+
+Requirements:
+    - psycopg2-binary==2.9.9, python-dotenv==1.0.1
+    - DATABASE_URL in .env (or --database-url); the role must own the table
+
+Outputs:
+    .tmp/backfill/<job>.json - Checkpoint (last key, counts); --resume continues from it
+    stdout - Progress with rows/sec and ETA, then a summary with the longest lock held
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from bench_rtc_sessions import _import_psycopg2
+
+# Load environment variables
+load_dotenv()
+
+CHECKPOINT_DIR = Path('.tmp') / 'backfill'
+
+LOCK_NOT_AVAILABLE = '55P03'
+
+
+@dataclass(frozen=True)
+class BackfillJob:
+    name: str
+    table: str
+    description: str
+    set_sql: str                        # SET clause for one row, e.g. "status_new = ..."
+    pending_sql: str                    # true for rows the backfill still has to touch
+    prepare: Tuple[str, ...] = ()       # autocommit, one statement at a time
+    finalize_online: Tuple[str, ...] = ()   # autocommit (VALIDATE, CREATE INDEX CONCURRENTLY)
+    swap: Tuple[str, ...] = ()          # one transaction under --swap-lock-timeout
+    key: str = 'id'
+    replaces_column: Optional[str] = None   # dropped by the swap; checked for dependents first
+
+
+# ==================
+# JOBS
+# ==================
+
+def _enum_conversion(column: str, enum: str, values: Tuple[str, ...], fallback: str,
+                     indexes: Tuple[Tuple[str, str], ...] = ()) -> BackfillJob:
+    """
+    TEXT -> enum conversion of sessions.<column>, as 20260214000000 did it but
+    online. `indexes` are (name, definition using <column>_new) pairs rebuilt
+    before the swap; dropping the old column drops the old indexes. Triggers
+    whose WHEN clause reads the column (sessions_stamp_billing_change) are
+    dropped before the swap and recreated on the renamed column after it.
+    """
+    new = f"{column}_new"
+    expression = (f"CASE {{row}}{column}::text "
+                  + ' '.join(f"WHEN '{value}' THEN '{value}'" for value in values)
+                  + f" ELSE '{fallback}' END::{enum}")
+    return BackfillJob(
+        name=f"sessions_{column}_enum",
+        table='public.sessions',
+        description=f"Convert sessions.{column} to the {enum} enum",
+        set_sql=f"{new} = {expression.format(row='')}",
+        pending_sql=f"{new} IS NULL",
+        prepare=(
+            f"ALTER TABLE public.sessions ADD COLUMN IF NOT EXISTS {new} {enum}",
+            f"""CREATE OR REPLACE FUNCTION public.sessions_{new}_sync()
+                RETURNS TRIGGER AS $$
+                BEGIN
+                  -- Every new row version must satisfy the NOT VALID check,
+                  -- so rows the backfill hasn't reached yet are filled by
+                  -- any update (the ticker's last_billed_at, ending a
+                  -- session), not only by updates of {column}
+                  IF TG_OP = 'INSERT' OR NEW.{new} IS NULL OR NEW.{column} IS DISTINCT FROM OLD.{column} THEN
+                    NEW.{new} := {expression.format(row='NEW.')};
+                  END IF;
+                  RETURN NEW;
+                END;
+                $$ LANGUAGE plpgsql""",
+            f"DROP TRIGGER IF EXISTS sessions_{new}_sync ON public.sessions",
+            f"""CREATE TRIGGER sessions_{new}_sync
+                BEFORE INSERT OR UPDATE ON public.sessions
+                FOR EACH ROW EXECUTE FUNCTION public.sessions_{new}_sync()""",
+            f"ALTER TABLE public.sessions DROP CONSTRAINT IF EXISTS sessions_{new}_not_null",
+            f"ALTER TABLE public.sessions ADD CONSTRAINT sessions_{new}_not_null CHECK ({new} IS NOT NULL) NOT VALID",
+        ),
+        finalize_online=(
+            f"ALTER TABLE public.sessions VALIDATE CONSTRAINT sessions_{new}_not_null",
+        ) + tuple(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name}_new ON public.sessions {definition}"
+            for name, definition in indexes
+        ),
+        swap=(
+            f"DROP TRIGGER IF EXISTS sessions_{new}_sync ON public.sessions",
+            # Triggers reading the old column would block DROP COLUMN; their
+            # definitions name the column, so they rebind to the renamed one
+            f"""CREATE TEMP TABLE swap_dependent_triggers ON COMMIT DROP AS
+                SELECT t.tgname, pg_get_triggerdef(t.oid) AS definition
+                FROM pg_trigger t
+                JOIN pg_depend d ON d.classid = 'pg_trigger'::regclass AND d.objid = t.oid
+                JOIN pg_attribute a ON a.attrelid = d.refobjid AND a.attnum = d.refobjsubid
+                WHERE d.refobjid = 'public.sessions'::regclass AND a.attname = '{column}' AND NOT t.tgisinternal""",
+            """DO $$
+               DECLARE v_trigger RECORD;
+               BEGIN
+                 FOR v_trigger IN SELECT DISTINCT tgname FROM swap_dependent_triggers LOOP
+                   EXECUTE format('DROP TRIGGER %I ON public.sessions', v_trigger.tgname);
+                 END LOOP;
+               END $$""",
+            f"ALTER TABLE public.sessions DROP COLUMN {column}",
+            f"ALTER TABLE public.sessions RENAME COLUMN {new} TO {column}",
+            """DO $$
+               DECLARE v_trigger RECORD;
+               BEGIN
+                 FOR v_trigger IN SELECT DISTINCT definition FROM swap_dependent_triggers LOOP
+                   EXECUTE v_trigger.definition;
+                 END LOOP;
+               END $$""",
+            f"ALTER TABLE public.sessions ALTER COLUMN {column} SET DEFAULT '{fallback}'::{enum}",
+            # Proven by the validated check, so no table scan under the lock
+            f"ALTER TABLE public.sessions ALTER COLUMN {column} SET NOT NULL",
+            f"ALTER TABLE public.sessions DROP CONSTRAINT sessions_{new}_not_null",
+            f"DROP FUNCTION IF EXISTS public.sessions_{new}_sync()",
+        ) + tuple(f"ALTER INDEX public.{name}_new RENAME TO {name}" for name, _ in indexes),
+        replaces_column=column,
+    )
+
+
+JOBS: Dict[str, BackfillJob] = {job.name: job for job in (
+    _enum_conversion('type', 'session_type', ('chat', 'audio', 'video'), 'chat'),
+    _enum_conversion(
+        'status', 'session_status', ('pending', 'active', 'completed', 'cancelled'), 'pending',
+        indexes=(
+            ('idx_sessions_status', '(status_new)'),
+            ('idx_sessions_status_started_at', '(status_new, started_at)'),
+            ('idx_sessions_connection_quality', "(connection_quality) WHERE status_new = 'active'"),
+            ('idx_sessions_active_last_billed_at', "(last_billed_at NULLS FIRST) WHERE status_new = 'active'"),
+            ('idx_sessions_active_shard_bucket',
+             "((hashtext(id::text) & 1023), last_billed_at NULLS FIRST) WHERE status_new = 'active'"),
+        ),
+    ),
+)}
+
+
+def load_job_file(path: Path) -> BackfillJob:
+    data = json.loads(path.read_text(encoding='utf-8'))
+    for name in ('prepare', 'finalize_online', 'swap'):
+        data[name] = tuple(data.get(name, ()))
+    return BackfillJob(**data)
+
+
+# ==================
+# BACKFILL
+# ==================
+
+@dataclass
+class Progress:
+    last_key: Optional[str] = None
+    scanned: int = 0
+    updated: int = 0
+    batches: int = 0
+    elapsed: float = 0.0
+    done: bool = False
+    longest_lock_ms: float = 0.0
+    throttled_seconds: float = 0.0
+    lock_timeouts: int = 0
+
+    @classmethod
+    def load(cls, path: Path) -> 'Progress':
+        return cls(**json.loads(path.read_text(encoding='utf-8')))
+
+    def save(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        partial = path.with_suffix('.json.partial')
+        partial.write_text(json.dumps(self.__dict__, indent=2), encoding='utf-8')
+        partial.replace(path)
+
+
+def batch_sql(job: BackfillJob, first: bool) -> str:
+    after = '' if first else f"WHERE {job.key} > %(last)s"
+    return f"""
+        WITH batch AS (
+            SELECT {job.key} AS k FROM {job.table} {after} ORDER BY {job.key} LIMIT %(limit)s
+        ),
+        updated AS (
+            UPDATE {job.table} t SET {job.set_sql}
+            FROM batch WHERE t.{job.key} = batch.k AND ({job.pending_sql})
+            RETURNING 1
+        )
+        SELECT (SELECT k FROM batch ORDER BY k DESC LIMIT 1), (SELECT count(*) FROM batch),
+               (SELECT count(*) FROM updated)
+    """
+
+
+class Throttle:
+    """Checks the replicas and lock queue from a separate autocommit connection"""
+
+    def __init__(self, connection, table: str, max_lag: float, max_waiters: int):
+        self.connection = connection
+        self.table = table
+        self.max_lag = max_lag
+        self.max_waiters = max_waiters
+
+    def replication_lag(self, cursor) -> float:
+        cursor.execute("SELECT COALESCE(MAX(EXTRACT(EPOCH FROM replay_lag)), 0) FROM pg_stat_replication")
+        return float(cursor.fetchone()[0])
+
+    def lock_waiters(self, cursor) -> int:
+        cursor.execute("SELECT count(*) FROM pg_locks WHERE NOT granted AND relation = %s::regclass", (self.table,))
+        return cursor.fetchone()[0]
+
+    def wait(self) -> Tuple[float, Optional[str]]:
+        """Block until the database has headroom; returns (seconds waited, last reason)"""
+        waited, reason = 0.0, None
+        with self.connection.cursor() as cursor:
+            while True:
+                lag, waiters = self.replication_lag(cursor), self.lock_waiters(cursor)
+                if lag <= self.max_lag and waiters <= self.max_waiters:
+                    return waited, reason
+                reason = f"replication lag {lag:.1f}s" if lag > self.max_lag else f"{waiters} lock waiter(s)"
+                time.sleep(1.0)
+                waited += 1.0
+
+
+def estimate_rows(cursor, table: str) -> int:
+    cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", (table,))
+    return max(0, cursor.fetchone()[0])
+
+
+def run_backfill(psycopg2, connection, monitor, job: BackfillJob, progress: Progress,
+                 checkpoint: Path, config: argparse.Namespace) -> bool:
+    throttle = Throttle(monitor, job.table, config.max_replication_lag, config.max_lock_waiters)
+    with monitor.cursor() as cursor:
+        total = estimate_rows(cursor, job.table)
+    batch_size = config.batch_size
+    run_started = time.perf_counter() - progress.elapsed
+    last_report = 0.0
+    print(f"[*] Backfilling {job.table} (~{total:,} rows) from "
+          f"{progress.last_key or 'the start'}, batches of {batch_size}")
+
+    while not progress.done:
+        waited, reason = throttle.wait()
+        if waited:
+            progress.throttled_seconds += waited
+            print(f"   [WAIT] {waited:.0f}s for {reason}")
+
+        started = time.perf_counter()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL lock_timeout = %s", (f"{config.lock_timeout_ms}ms",))
+                cursor.execute(batch_sql(job, progress.last_key is None),
+                               {'last': progress.last_key, 'limit': batch_size})
+                last_key, scanned, updated = cursor.fetchone()
+            connection.commit()
+        except psycopg2.Error as e:
+            connection.rollback()
+            if e.pgcode != LOCK_NOT_AVAILABLE:
+                raise
+            progress.lock_timeouts += 1
+            batch_size = max(config.min_batch_size, batch_size // 2)
+            print(f"   [WARN] Lock timeout; retrying with batches of {batch_size}")
+            time.sleep(config.sleep_ms / 1000 * 4)
+            continue
+        held_ms = (time.perf_counter() - started) * 1000
+
+        progress.batches += 1
+        progress.scanned += scanned
+        progress.updated += updated
+        progress.longest_lock_ms = max(progress.longest_lock_ms, held_ms)
+        progress.elapsed = time.perf_counter() - run_started
+        if last_key is None or scanned < batch_size:
+            progress.done = True
+        else:
+            progress.last_key = str(last_key)
+        progress.save(checkpoint)
+
+        # Keep each transaction short; grow back slowly when there's room
+        if held_ms > config.target_batch_ms:
+            batch_size = max(config.min_batch_size, batch_size // 2)
+        elif held_ms < config.target_batch_ms / 2:
+            batch_size = min(config.max_batch_size, int(batch_size * 1.25) + 1)
+
+        if progress.done or progress.elapsed - last_report >= config.progress_seconds:
+            last_report = progress.elapsed
+            rate = progress.scanned / progress.elapsed if progress.elapsed else 0.0
+            remaining = max(0, total - progress.scanned)
+            eta = f"{remaining / rate:,.0f}s" if rate and not progress.done else '-'
+            print(f"   {progress.scanned:,}/{total:,} scanned, {progress.updated:,} updated, "
+                  f"{rate:,.0f} rows/s, ETA {eta}, batch {batch_size}, slowest batch {progress.longest_lock_ms:.0f}ms")
+
+        if config.sleep_ms:
+            time.sleep(config.sleep_ms / 1000)
+
+    return True
+
+
+# ==================
+# PREPARE / FINALIZE
+# ==================
+
+def run_statements(psycopg2, connection, statements: Tuple[str, ...], lock_timeout_ms: int, retries: int):
+    """Autocommit DDL, one statement at a time, retried when it can't get its lock"""
+    connection.autocommit = True
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SET lock_timeout = %s", (f"{lock_timeout_ms}ms",))
+            for statement in statements:
+                print(f"   {' '.join(statement.split())[:100]}")
+                for attempt in range(retries + 1):
+                    try:
+                        cursor.execute(statement)
+                        break
+                    except psycopg2.Error as e:
+                        if e.pgcode != LOCK_NOT_AVAILABLE or attempt == retries:
+                            raise
+                        time.sleep(min(10.0, 0.5 * 2 ** attempt))
+            cursor.execute("RESET lock_timeout")
+    finally:
+        connection.autocommit = False
+
+
+def blocking_dependents(cursor, table: str, column: str) -> List[str]:
+    """
+    Objects that would make the swap's DROP COLUMN fail (views, policies,
+    multi-column constraints...). Indexes and single-column constraints are
+    dropped with the column and triggers are recreated by the swap, so only
+    the rest is reported.
+    """
+    cursor.execute("""
+        SELECT DISTINCT pg_describe_object(d.classid, d.objid, d.objsubid)
+        FROM pg_depend d
+        JOIN pg_attribute a ON a.attrelid = d.refobjid AND a.attnum = d.refobjsubid
+        WHERE d.refobjid = %s::regclass AND a.attname = %s
+          AND d.deptype = 'n'
+          AND d.classid <> 'pg_trigger'::regclass
+        ORDER BY 1
+    """, (table, column))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def run_swap(psycopg2, connection, job: BackfillJob, config: argparse.Namespace) -> float:
+    """The contract step: every statement in one transaction; returns ms the locks were held"""
+    for attempt in range(config.swap_retries + 1):
+        started = time.perf_counter()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL lock_timeout = %s", (f"{config.swap_lock_timeout_ms}ms",))
+                for statement in job.swap:
+                    cursor.execute(statement)
+            connection.commit()
+            return (time.perf_counter() - started) * 1000
+        except psycopg2.Error as e:
+            connection.rollback()
+            if e.pgcode != LOCK_NOT_AVAILABLE or attempt == config.swap_retries:
+                raise
+            print(f"   [WARN] Swap couldn't get its lock (attempt {attempt + 1}); retrying")
+            time.sleep(min(10.0, 0.5 * 2 ** attempt))
+    return 0.0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run table-rewriting schema changes in online, chunked phases")
+    parser.add_argument('job', nargs='?', help=f"Built-in job ({', '.join(JOBS)})")
+    parser.add_argument('--job-file', help="JSON file with a BackfillJob definition")
+    parser.add_argument('--list', action='store_true', help="List built-in jobs and exit")
+    parser.add_argument('--phases', default='prepare,backfill', help="Comma-separated: prepare, backfill, finalize")
+    parser.add_argument('--database-url', default=os.getenv('DATABASE_URL'), help="Postgres URL")
+    parser.add_argument('--batch-size', type=int, default=1000, help="Initial rows per chunk")
+    parser.add_argument('--min-batch-size', type=int, default=100)
+    parser.add_argument('--max-batch-size', type=int, default=20000)
+    parser.add_argument('--target-batch-ms', type=float, default=200, help="Shrink chunks that run longer than this")
+    parser.add_argument('--sleep-ms', type=float, default=50, help="Pause after every chunk")
+    parser.add_argument('--lock-timeout-ms', type=int, default=2000, help="lock_timeout for each chunk and DDL")
+    parser.add_argument('--max-replication-lag', type=float, default=5.0, help="Pause above this replay lag (s)")
+    parser.add_argument('--max-lock-waiters', type=int, default=0, help="Pause while more backends wait on the table")
+    parser.add_argument('--swap-lock-timeout-ms', type=int, default=500, help="lock_timeout for the final swap")
+    parser.add_argument('--swap-retries', type=int, default=20)
+    parser.add_argument('--progress-seconds', type=float, default=5.0, help="Seconds between progress lines")
+    parser.add_argument('--resume', action='store_true', help="Continue from the checkpoint")
+    return parser.parse_args()
+
+
+def main():
+    """Run the requested phases of one backfill job"""
+    args = parse_args()
+
+    if args.list:
+        for job in JOBS.values():
+            print(f"{job.name:<24} {job.description}")
+        return 0
+    if args.job_file:
+        try:
+            job = load_job_file(Path(args.job_file))
+        except (OSError, ValueError, TypeError) as e:
+            print(f"❌ Error: Could not load {args.job_file}: {str(e)}")
+            return 1
+    elif args.job in JOBS:
+        job = JOBS[args.job]
+    else:
+        print(f"❌ Error: Unknown job {args.job!r} (use --list, or --job-file)")
+        return 1
+    if not args.database_url:
+        print("❌ Error: --database-url (or DATABASE_URL in .env) is required")
+        return 1
+
+    phases = [phase.strip() for phase in args.phases.split(',') if phase.strip()]
+    unknown = set(phases) - {'prepare', 'backfill', 'finalize'}
+    if unknown:
+        print(f"❌ Error: Unknown phase(s): {', '.join(sorted(unknown))}")
+        return 1
+
+    checkpoint = CHECKPOINT_DIR / f"{job.name}.json"
+    progress = Progress.load(checkpoint) if args.resume and checkpoint.exists() else Progress()
+    if 'backfill' in phases and not args.resume and checkpoint.exists():
+        print(f"❌ Error: {checkpoint} exists; pass --resume to continue it or delete it to start over")
+        return 1
+
+    psycopg2, _ = _import_psycopg2()
+    try:
+        connection = psycopg2.connect(args.database_url)
+        monitor = psycopg2.connect(args.database_url)
+        monitor.autocommit = True
+    except psycopg2.Error as e:
+        print(f"❌ Error: Could not connect: {str(e).strip()}")
+        return 1
+
+    print(f"\n[*] {job.name}: {job.description}")
+    swap_ms = None
+    started = time.perf_counter()
+    try:
+        # Refuse before hours of backfill, not at the swap
+        if job.replaces_column and ('prepare' in phases or 'finalize' in phases):
+            with monitor.cursor() as cursor:
+                blockers = blocking_dependents(cursor, job.table, job.replaces_column)
+            if blockers:
+                print(f"❌ Error: The swap would drop {job.table}.{job.replaces_column}, which is used by: "
+                      f"{'; '.join(blockers)}. Drop or rewrite them first.")
+                return 1
+        if 'prepare' in phases:
+            print("\n[*] Prepare")
+            run_statements(psycopg2, connection, job.prepare, args.lock_timeout_ms, args.swap_retries)
+        if 'backfill' in phases:
+            print("\n[*] Backfill")
+            run_backfill(psycopg2, connection, monitor, job, progress, checkpoint, args)
+        if 'finalize' in phases:
+            if not progress.done and not (checkpoint.exists() and Progress.load(checkpoint).done):
+                print("❌ Error: Backfill hasn't finished; run the backfill phase (with --resume) first")
+                return 1
+            print("\n[*] Finalize (online)")
+            run_statements(psycopg2, connection, job.finalize_online, args.lock_timeout_ms, args.swap_retries)
+            print("\n[*] Swap")
+            swap_ms = run_swap(psycopg2, connection, job, args)
+    except KeyboardInterrupt:
+        print(f"\n[*] Interrupted; resume with --resume (checkpoint {checkpoint})")
+        return 1
+    except psycopg2.Error as e:
+        print(f"❌ Error: {str(e).strip()}")
+        return 1
+    finally:
+        connection.close()
+        monitor.close()
+
+    print(f"\n{'='*60}")
+    print(f"  {job.name} Summary")
+    print(f"{'='*60}\n")
+    if 'backfill' in phases:
+        rate = progress.scanned / progress.elapsed if progress.elapsed else 0.0
+        print(f"Rows scanned:        {progress.scanned:,} ({progress.updated:,} updated)")
+        print(f"Batches:             {progress.batches:,} ({progress.lock_timeouts} lock timeout(s))")
+        print(f"Throughput:          {rate:,.0f} rows/s")
+        print(f"Throttled:           {progress.throttled_seconds:.0f}s")
+        print(f"Longest batch lock:  {progress.longest_lock_ms:.0f}ms")
+    if swap_ms is not None:
+        print(f"Swap lock held:      {swap_ms:.0f}ms (ACCESS EXCLUSIVE)")
+    print(f"Wall time:           {time.perf_counter() - started:.1f}s  (finished {datetime.now():%H:%M:%S})")
+    return 0
+
+
+if __name__ == "__main__":
+    exit_code = main()
+    sys.exit(exit_code)
@@ -0,0 +1,1022 @@
+"""
+PostgREST Stand-in: Offline local API for fast verification and load runs
+
+A small in-process HTTP server that answers like Supabase's PostgREST, built
+from the schema in supabase/migrations/*.sql (see migration_schema.py):
+
+    GET  /rest/v1/                 OpenAPI document (with ETag)
+    GET  /rest/v1/<table>          select, filters (eq/neq/gt/gte/lt/lte/in/is/like),
+                                   or=()/and=() trees, order, limit, offset
+    POST /rest/v1/<table>          insert / upsert (on_conflict + Prefer: resolution=...)
+    PATCH|DELETE /rest/v1/<table>  filtered update / delete
+    POST /rest/v1/rpc/<fn>         argument validation + Python implementations of
+                                   the app's RPCs (see RPC_HANDLERS)
+
+Rows live in memory. Unknown tables, columns, enum values and RPC signatures
+fail with the same SQLSTATE/HTTP status PostgREST would return, so check
+logic, concurrency and retry behaviour can be exercised in milliseconds.
+Latency and failure profiles simulate far-away regions and flaky gateways.
+
+Limitations: no RLS, no triggers apart from the credit ledger's opening
+entry, no resource embedding (`select=rel(...)`), and RPCs without a Python
+handler return null.
+
+Usage:
+    # Standalone, then point the scripts at it
+    python execution/postgrest_standin.py --port 54330 --seed-profiles 50 --profile cross-region
+    SUPABASE_URL=http://127.0.0.1:54330 SUPABASE_KEY=local python execution/verify_story_1_1.py
+
+    # In-process
+    from postgrest_standin import PostgrestStandin
+    with PostgrestStandin(profile='flaky') as standin:
+        standin.url   # use as SUPABASE_URL
+
+Profiles (--profile): lan, cross-region, flaky, overloaded; or set
+--latency-ms/--jitter-ms/--error-rate/--error-status directly.
+
+Requirements:
+    - Python 3.8+ (standard library only)
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from dataclasses import dataclass, replace
+from datetime import datetime, timezone
+from decimal import Decimal, ROUND_CEILING
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlparse
+
+from migration_schema import latest_migration_version, load_schema_from_migrations
+from schema_introspection import SchemaModel
+
+DEFAULT_PORT = 54330
+
+RESERVED_PARAMS = {'select', 'order', 'limit', 'offset', 'on_conflict', 'columns', 'or', 'and'}
+
+# Swagger type for each Postgres type PostgREST reports
+SWAGGER_TYPES = {
+    'integer': 'integer', 'bigint': 'integer', 'smallint': 'integer',
+    'numeric': 'number', 'real': 'number', 'double precision': 'number',
+    'boolean': 'boolean',
+}
+
+
+# ==================
+# FAULT PROFILES
+# ==================
+
+@dataclass(frozen=True)
+class FaultProfile:
+    latency_ms: float = 0
+    jitter_ms: float = 0
+    error_rate: float = 0
+    error_status: int = 503
+
+
+PROFILES = {
+    'none': FaultProfile(),
+    'lan': FaultProfile(latency_ms=2, jitter_ms=1),
+    'cross-region': FaultProfile(latency_ms=120, jitter_ms=30),
+    'flaky': FaultProfile(latency_ms=40, jitter_ms=20, error_rate=0.05, error_status=503),
+    'overloaded': FaultProfile(latency_ms=300, jitter_ms=150, error_rate=0.10, error_status=429),
+}
+
+
+# ==================
+# ERRORS AND VALUES
+# ==================
+
+class PostgrestError(Exception):
+    """Error returned to the client in PostgREST's JSON error shape"""
+
+    def __init__(self, status: int, code: str, message: str, details: Optional[str] = None):
+        super().__init__(message)
+        self.status = status
+        self.body = {'code': code, 'message': message, 'details': details, 'hint': None}
+
+
+def now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def evaluate_default(expression: Optional[str]) -> Any:
+    """Turn the SQL defaults used in the migrations into Python values"""
+    if expression is None:
+        return None
+    text = re.sub(r'::[\w\s\[\]]+$', '', expression.strip())
+    lowered = text.lower()
+    if lowered in ('gen_random_uuid()', 'uuid_generate_v4()'):
+        return str(uuid.uuid4())
+    if lowered in ('now()', 'current_timestamp'):
+        return now_iso()
+    if lowered in ('true', 'false'):
+        return lowered == 'true'
+    if lowered == 'null':
+        return None
+    if text.startswith("'") and text.endswith("'"):
+        value = text[1:-1]
+        if expression.strip().endswith('::jsonb'):
+            return json.loads(value)
+        return value
+    try:
+        return int(text)
+    except ValueError:
+        try:
+            return float(text)
+        except ValueError:
+            return None
+
+
+def _coerce(value: Any, text: str) -> Any:
+    """Coerce a filter literal to the type of the row value it's compared with"""
+    if isinstance(value, bool):
+        return text.lower() == 'true'
+    if isinstance(value, (int, float)):
+        try:
+            return float(text)
+        except ValueError:
+            return text
+    return text
+
+
+def _compare(value: Any, op: str, text: str) -> bool:
+    if op == 'is':
+        target = {'null': None, 'true': True, 'false': False}.get(text.lower(), text)
+        return value is target if target is None or isinstance(target, bool) else value == target
+    if value is None:
+        return False
+    if op == 'in':
+        options = [option.strip().strip('"') for option in text.strip('()').split(',')]
+        return any(value == _coerce(value, option) for option in options)
+    if op in ('like', 'ilike'):
+        pattern = '^' + re.escape(text).replace(r'\*', '.*').replace('%', '.*') + '$'
+        return re.match(pattern, str(value), re.IGNORECASE if op == 'ilike' else 0) is not None
+    other = _coerce(value, text)
+    compare_value = float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else value
+    try:
+        return {
+            'eq': compare_value == other, 'neq': compare_value != other,
+            'gt': compare_value > other, 'gte': compare_value >= other,
+            'lt': compare_value < other, 'lte': compare_value <= other,
+        }[op]
+    except KeyError:
+        raise PostgrestError(400, 'PGRST100', f"Unsupported operator '{op}'")
+    except TypeError:
+        return False
+
+
+# ==================
+# FILTER PARSING
+# ==================
+
+def _split_logic(text: str) -> List[str]:
+    """Split the inside of or=(...)/and=(...) on top-level commas"""
+    parts, depth, quoted, current = [], 0, False, ''
+    for char in text:
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == '(':
+            depth += 1
+        elif not quoted and char == ')':
+            depth -= 1
+        if char == ',' and depth == 0 and not quoted:
+            parts.append(current)
+            current = ''
+        else:
+            current += char
+    if current:
+        parts.append(current)
+    return parts
+
+
+def parse_condition(text: str) -> Callable[[dict], bool]:
+    """'col.op.value', 'and(...)' or 'or(...)' -> row predicate"""
+    logic = re.match(r'^(not\.)?(and|or)\((.*)\)$', text, re.DOTALL)
+    if logic:
+        children = [parse_condition(part) for part in _split_logic(logic.group(3))]
+        combine = all if logic.group(2) == 'and' else any
+        negate = bool(logic.group(1))
+        return lambda row: combine(child(row) for child in children) != negate
+
+    column, _, rest = text.partition('.')
+    return parse_filter(column, rest)
+
+
+def parse_filter(column: str, expression: str) -> Callable[[dict], bool]:
+    """'eq.5' / 'not.is.null' -> row predicate for one column"""
+    negate = expression.startswith('not.')
+    if negate:
+        expression = expression[len('not.'):]
+    op, _, value = expression.partition('.')
+    if len(value) >= 2 and value.startswith('"') and value.endswith('"'):
+        value = value[1:-1]
+    return lambda row: _compare(row.get(column), op, value) != negate
+
+
+def _scalar_matches(column_type: str, value: Any) -> bool:
+    """Would Postgres accept this JSON value for a numeric/boolean column?"""
+    if column_type in ('integer', 'smallint', 'bigint'):
+        return isinstance(value, int) and not isinstance(value, bool) or \
+            isinstance(value, str) and re.fullmatch(r'-?\d+', value.strip()) is not None
+    if column_type in ('numeric', 'real', 'double precision'):
+        if isinstance(value, bool):
+            return False
+        try:
+            float(value)
+            return True
+        except (TypeError, ValueError):
+            return False
+    if column_type == 'boolean':
+        return isinstance(value, bool)
+    return True
+
+
+# ==================
+# STORE
+# ==================
+
+# Python versions of AFTER INSERT triggers, keyed by table
+AFTER_INSERT: Dict[str, Callable[['Store', dict], None]] = {}
+
+
+class Store:
+    """In-memory tables; one lock makes every request behave like a transaction"""
+
+    def __init__(self, schema: SchemaModel):
+        self.schema = schema
+        self.rows: Dict[str, List[dict]] = {table: [] for table in schema.tables}
+        self.lock = threading.RLock()
+
+    def columns(self, table: str):
+        if table not in self.schema.tables:
+            raise PostgrestError(404, '42P01', f'relation "public.{table}" does not exist')
+        return self.schema.tables[table]
+
+    def validate_row(self, table: str, row: dict):
+        columns = self.columns(table)
+        for name, value in row.items():
+            column = columns.get(name)
+            if column is None:
+                raise PostgrestError(400, 'PGRST204', f"Could not find the '{name}' column of '{table}' in the schema cache")
+            if column.enum_values and value is not None and value not in column.enum_values:
+                raise PostgrestError(400, '22P02', f'invalid input value for enum {column.type}: "{value}"')
+            if value is not None and not _scalar_matches(column.type, value):
+                raise PostgrestError(400, '22P02', f'invalid input syntax for type {column.type}: "{value}"')
+
+    def insert(self, table: str, row: dict) -> dict:
+        self.validate_row(table, row)
+        full = {name: evaluate_default(column.default) for name, column in self.columns(table).items()}
+        full.update(row)
+        if 'id' in full and full['id'] is not None and self.find(table, full['id']):
+            raise PostgrestError(409, '23505', f'duplicate key value violates unique constraint "{table}_pkey"')
+        self.rows[table].append(full)
+        trigger = AFTER_INSERT.get(table)
+        if trigger is not None:
+            trigger(self, full)
+        return full
+
+    def find(self, table: str, row_id: Any) -> Optional[dict]:
+        for row in self.rows[table]:
+            if row.get('id') == row_id:
+                return row
+        return None
+
+    def select(self, table: str, predicates: List[Callable[[dict], bool]]) -> List[dict]:
+        self.columns(table)
+        return [row for row in self.rows[table] if all(predicate(row) for predicate in predicates)]
+
+
+# ==================
+# RPC IMPLEMENTATIONS
+# ==================
+
+RPC_HANDLERS: Dict[str, Callable[[Store, dict], Any]] = {}
+
+
+def rpc(name: str):
+    """Register a Python implementation for an RPC declared in the migrations"""
+    def register(func):
+        RPC_HANDLERS[name] = func
+        return func
+    return register
+
+
+def _require_profile(store: Store, profile_id: str, table: str, column: str):
+    if store.find('profiles', profile_id) is None:
+        raise PostgrestError(
+            409, '23503',
+            f'insert or update on table "{table}" violates foreign key constraint "{table}_{column}_fkey"'
+        )
+
+
+@rpc('get_schema_version')
+def _get_schema_version(store: Store, args: dict):
+    return latest_migration_version()
+
+
+def _post_credit_entry(store: Store, user_id: str, delta: int, reason: str,
+                       session_id: Optional[str] = None) -> Optional[int]:
+    """Mirror of post_credit_entry: conditional balance change plus ledger row"""
+    profile = store.find('profiles', user_id)
+    balance = (profile.get('credits') or 0) + delta if profile is not None else None
+    if balance is None or balance < 0:
+        return None
+    profile['credits'] = balance
+    profile['updated_at'] = now_iso()
+    _append_ledger(store, user_id, delta, balance, reason, session_id)
+    return balance
+
+
+def _append_ledger(store: Store, user_id: str, delta: int, balance: int, reason: str, session_id: Optional[str]):
+    ledger = store.rows['credit_ledger']
+    ledger.append({
+        'id': len(ledger) + 1,      # Append-only, so the count is the identity
+        'user_id': user_id,
+        'delta': delta,
+        'balance_after': balance,
+        'reason': reason,
+        'session_id': session_id,
+        'created_at': now_iso(),
+    })
+
+
+def _open_credit_ledger(store: Store, profile: dict):
+    if (profile.get('credits') or 0) > 0:
+        _append_ledger(store, profile['id'], profile['credits'], profile['credits'], 'opening', None)
+
+
+AFTER_INSERT['profiles'] = _open_credit_ledger
+
+
+def _require_positive(amount):
+    if amount is None or amount < 0:
+        raise PostgrestError(400, 'P0001', 'Amount must be positive')
+
+
+@rpc('post_credit_entry')
+def _post_credit_entry_rpc(store: Store, args: dict):
+    if not args['p_delta']:
+        raise PostgrestError(400, 'P0001', 'Credit entry delta must be non-zero')
+    return _post_credit_entry(store, args['p_user_id'], args['p_delta'], args['p_reason'], args.get('p_session_id'))
+
+
+@rpc('add_credits')
+def _add_credits(store: Store, args: dict):
+    _require_positive(args['amount'])
+    if args['amount'] == 0:
+        return True
+    return _post_credit_entry(store, args['user_id'], args['amount'], 'credit') is not None
+
+
+@rpc('deduct_credits')
+def _deduct_credits(store: Store, args: dict):
+    _require_positive(args['amount'])
+    if args['amount'] == 0:
+        return True
+    return _post_credit_entry(store, args['user_id'], -args['amount'], 'debit') is not None
+
+
+@rpc('start_rtc_session')
+def _start_rtc_session(store: Store, args: dict):
+    _require_profile(store, args['p_client_id'], 'sessions', 'client_id')
+    _require_profile(store, args['p_advisor_id'], 'sessions', 'advisor_id')
+    session = store.insert('sessions', {
+        'client_id': args['p_client_id'],
+        'advisor_id': args['p_advisor_id'],
+        'type': args['p_type'],
+        'status': 'active',
+        'rate_per_minute': args['p_rate_per_minute'],
+        'free_minutes_applied': args.get('p_free_minutes', 0),
+        'started_at': now_iso(),
+        'billing_status': 'pending',
+        'connection_quality': 'good',
+    })
+    return session['id']
+
+
+def _session_cost(minutes: int, session: dict) -> Decimal:
+    """public.session_cost: minutes count the whole session, free minutes are taken off here"""
+    rate = Decimal(str(session.get('rate_per_minute') or 0))
+    return max(Decimal(0), (minutes - (session.get('free_minutes_applied') or 0)) * rate)
+
+
+def _credits_due(session: dict, cost: Optional[Decimal]) -> int:
+    """CEIL(cost) net of what the billing ticker already took; negative means a refund"""
+    total = int(cost.to_integral_value(rounding=ROUND_CEILING)) if cost is not None else 0
+    return total - (session.get('credits_charged') or 0)
+
+
+def _remaining_credits(session: dict, cost: Optional[Decimal]) -> int:
+    """Credits still owed for a cost (the ticker never refunds)"""
+    return max(0, _credits_due(session, cost))
+
+
+def _settle_batch(store: Store, entries: List[Tuple[dict, int]], reason: str) -> set:
+    """
+    One balance change per client for (session, signed credits) entries:
+    refunds always apply, debits only if the balance plus the refunds covers
+    them. Ledger rows go refunds first, then session id order. Returns the
+    ids of the sessions whose entry was applied.
+    """
+    by_client: Dict[str, List[Tuple[dict, int]]] = {}
+    for session, credits in entries:
+        if credits:
+            by_client.setdefault(session['client_id'], []).append((session, credits))
+    applied = set()
+    for client_id, client_entries in by_client.items():
+        profile = store.find('profiles', client_id)
+        if profile is None:
+            continue
+        debit = sum(credits for _, credits in client_entries if credits > 0)
+        refund = -sum(credits for _, credits in client_entries if credits < 0)
+        paid = (profile.get('credits') or 0) + refund >= debit
+        if not paid and not refund:
+            continue
+        balance = profile.get('credits') or 0
+        for session, credits in sorted(client_entries, key=lambda entry: (entry[1] > 0, entry[0]['id'])):
+            if credits > 0 and not paid:
+                continue
+            balance -= credits
+            _append_ledger(store, client_id, -credits, balance, reason, session['id'])
+            applied.add(session['id'])
+        profile['credits'] = balance
+        profile['updated_at'] = now_iso()
+    return applied
+
+
+def _elapsed_minutes(session: dict) -> int:
+    started = datetime.fromisoformat(session['started_at'])
+    # floor(EXTRACT(EPOCH ...) / 60), like bill_active_sessions
+    return max(0, int((datetime.now(timezone.utc) - started).total_seconds() // 60))
+
+
+@rpc('end_rtc_session')
+def _end_rtc_session(store: Store, args: dict):
+    session = store.find('sessions', args['p_session_id'])
+    if session is None or session.get('status') != 'active':
+        raise PostgrestError(400, 'P0001', 'Session not found or not active')
+
+    total_cost = _session_cost(args['p_billable_minutes'], session)
+    credits = _credits_due(session, total_cost)
+
+    paid = True
+    if credits > 0:
+        paid = _post_credit_entry(store, session['client_id'], -credits, 'session', session['id']) is not None
+    elif credits < 0 and _post_credit_entry(store, session['client_id'], -credits, 'session', session['id']) is None:
+        credits = 0
+
+    session.update({
+        'status': 'completed',
+        'ended_at': now_iso(),
+        'billable_minutes': args['p_billable_minutes'],
+        'cost_total': float(total_cost),
+        'connection_quality': args.get('p_connection_quality', 'good'),
+        'credits_charged': (session.get('credits_charged') or 0) + (credits if paid else 0),
+        'last_billed_at': now_iso(),
+        'billing_status': 'completed' if paid else 'failed',
+    })
+    return True
+
+
+@rpc('end_rtc_sessions')
+def _end_rtc_sessions(store: Store, args: dict):
+    session_ids, minutes = args['p_session_ids'], args['p_billable_minutes']
+    qualities = args.get('p_connection_qualities')
+    if len(session_ids) != len(minutes) or (qualities is not None and len(qualities) != len(session_ids)):
+        raise PostgrestError(400, 'P0001',
+                             'p_session_ids, p_billable_minutes and p_connection_qualities must have the same length')
+    for session_id, session_minutes in zip(session_ids, minutes):
+        if session_id is not None and session_minutes is None:
+            raise PostgrestError(400, '22004', f"p_billable_minutes is NULL for session {session_id}")
+
+    targets = {}
+    for index, session_id in enumerate(session_ids):
+        session = store.find('sessions', session_id)
+        if session_id in targets or session is None or session.get('status') != 'active':
+            continue
+        cost = _session_cost(minutes[index], session)
+        quality = (qualities[index] if qualities else None) or 'good'
+        targets[session_id] = (session, minutes[index], quality, cost, _credits_due(session, cost))
+
+    applied = _settle_batch(store, [(session, credits) for session, _, _, _, credits in targets.values()],
+                            'session')
+
+    results = []
+    for session_id, (session, session_minutes, quality, cost, credits) in targets.items():
+        paid = credits <= 0 or session_id in applied
+        credits = credits if session_id in applied else 0
+        session.update({
+            'status': 'completed',
+            'ended_at': now_iso(),
+            'billable_minutes': session_minutes,
+            'cost_total': float(cost) if cost is not None else None,
+            'connection_quality': quality,
+            'credits_charged': (session.get('credits_charged') or 0) + credits,
+            'last_billed_at': now_iso(),
+            'billing_status': 'completed' if paid else 'failed',
+        })
+        results.append({'session_id': session_id, 'final_status': session['billing_status'],
+                        'credits_deducted': credits})
+    return results
+
+
+@rpc('reconcile_session_billing')
+def _reconcile_session_billing(store: Store, args: dict):
+    targets, seen = [], set()
+    for session_id, cost in zip(args['p_session_ids'], args['p_costs']):
+        session = store.find('sessions', session_id)
+        # A repeated id keeps its first entry
+        if session_id in seen:
+            continue
+        seen.add(session_id)
+        if session is None or session.get('status') != 'completed' \
+                or session.get('billing_status') not in ('pending', 'processing'):
+            continue
+        cost = Decimal(str(cost)) if cost is not None else None
+        if cost is not None and cost != _session_cost(session.get('billable_minutes') or 0, session):
+            continue
+        targets.append((session, cost, _credits_due(session, cost)))
+
+    # One balance change per client, all-or-nothing for that client's debits
+    applied = _settle_batch(store, [(session, credits) for session, cost, credits in targets if cost is not None],
+                            'reconciliation')
+
+    results = []
+    for session, cost, credits in targets:
+        paid = cost is not None and (credits <= 0 or session['id'] in applied)
+        credits = credits if session['id'] in applied else 0
+        if cost is not None:
+            session['cost_total'] = float(cost)
+        session['credits_charged'] = (session.get('credits_charged') or 0) + credits
+        session['billing_status'] = 'completed' if paid else 'failed'
+        session['last_billed_at'] = now_iso()
+        results.append({'session_id': session['id'], 'final_status': session['billing_status'],
+                        'credits_deducted': credits})
+    return results
+
+
+@rpc('bill_active_sessions')
+def _bill_active_sessions(store: Store, args: dict):
+    shard, shard_count = args.get('p_shard', 0), args.get('p_shard_count', 1)
+    limit, interval = args.get('p_limit', 500), args.get('p_interval_seconds', 60)
+    if not 1 <= shard_count <= 1024:
+        raise PostgrestError(400, 'P0001', 'p_shard_count must be between 1 and 1024')
+    if not 0 <= shard < shard_count:
+        raise PostgrestError(400, 'P0001', f'Shard {shard} is outside 0..{shard_count - 1}')
+    if interval < 1:
+        raise PostgrestError(400, 'P0001', 'p_interval_seconds must be at least 1')
+
+    now = datetime.now(timezone.utc)
+    due = []
+    for session in store.rows['sessions']:
+        last_billed = datetime.fromisoformat(session['last_billed_at']) if session.get('last_billed_at') else None
+        # uuid bits instead of hashtext(): any stable bucket will do here
+        bucket = uuid.UUID(session['id']).int & 1023
+        if session.get('status') != 'active' or not session.get('started_at') \
+                or session.get('rate_per_minute') is None \
+                or (last_billed is not None and (now - last_billed).total_seconds() < interval) \
+                or not shard * 1024 // shard_count <= bucket < (shard + 1) * 1024 // shard_count:
+            continue
+        due.append((session, last_billed))
+    due.sort(key=lambda item: (item[1] is not None, item[1] or now))
+    due = due[:limit]
+
+    owed = {}
+    for session, _ in due:
+        owed[session['id']] = _remaining_credits(session, _session_cost(_elapsed_minutes(session), session))
+
+    per_client: Dict[str, int] = {}
+    for session, _ in due:
+        if owed[session['id']] > 0:
+            per_client[session['client_id']] = per_client.get(session['client_id'], 0) + owed[session['id']]
+    debited = set()
+    for client_id, credits in per_client.items():
+        profile = store.find('profiles', client_id)
+        if profile is not None and (profile.get('credits') or 0) >= credits:
+            balance = profile['credits']
+            profile['credits'] -= credits
+            profile['updated_at'] = now_iso()
+            debited.add(client_id)
+            for session, _ in sorted(due, key=lambda item: item[0]['id']):
+                if session['client_id'] == client_id and owed[session['id']] > 0:
+                    balance -= owed[session['id']]
+                    _append_ledger(store, client_id, -owed[session['id']], balance, 'session', session['id'])
+
+    results = []
+    for session, last_billed in due:
+        credits = owed[session['id']]
+        paid = credits == 0 or session['client_id'] in debited
+        if credits > 0 and paid:
+            session['credits_charged'] = (session.get('credits_charged') or 0) + credits
+        session['last_billed_at'] = now_iso()
+        session['billing_status'] = 'processing'
+        session['credits_exhausted_at'] = None if paid else (session.get('credits_exhausted_at') or now_iso())
+        results.append({
+            'session_id': session['id'],
+            'credits_debited': credits if credits > 0 and paid else 0,
+            'exhausted': not paid,
+            'lag_seconds': (now - last_billed).total_seconds() - interval if last_billed else 0,
+        })
+    return results
+
+
+@rpc('update_billing_status')
+def _update_billing_status(store: Store, args: dict):
+    session = store.find('sessions', args['p_session_id'])
+    if session is not None:
+        session['billing_status'] = args['p_billing_status']
+        session['last_billed_at'] = now_iso()
+    return True
+
+
+# ==================
+# OPENAPI DOCUMENT
+# ==================
+
+def _property(column_type: str, enum_values: Optional[Tuple[str, ...]]) -> dict:
+    if enum_values:
+        return {'format': f'public.{column_type}', 'type': 'string', 'enum': list(enum_values)}
+    if column_type.endswith('[]'):
+        return {'format': column_type, 'type': 'array', 'items': {'type': 'string'}}
+    prop = {'format': column_type}
+    if column_type not in ('json', 'jsonb'):
+        prop['type'] = SWAGGER_TYPES.get(column_type, 'string')
+    return prop
+
+
+def schema_to_openapi(schema: SchemaModel) -> dict:
+    """Render the model the way PostgREST's root endpoint does"""
+    definitions, paths = {}, {'/': {}}
+    for table, columns in schema.tables.items():
+        definitions[table] = {
+            'type': 'object',
+            'properties': {name: _property(col.type, col.enum_values) for name, col in columns.items()},
+        }
+        paths[f'/{table}'] = {'get': {}, 'post': {}, 'patch': {}, 'delete': {}}
+    for name, function in schema.rpcs.items():
+        properties = {
+            arg: _property(arg_type, schema.enums.get(arg_type)) for arg, arg_type in function.args.items()
+        }
+        paths[f'/rpc/{name}'] = {'post': {'parameters': [{
+            'in': 'body', 'name': 'args', 'required': True,
+            'schema': {'type': 'object', 'properties': properties, 'required': list(function.required_args)},
+        }]}}
+    return {
+        'swagger': '2.0',
+        'info': {'title': 'PostgREST stand-in', 'version': latest_migration_version() or 'unknown'},
+        'definitions': definitions,
+        'paths': paths,
+    }
+
+
+# ==================
+# HTTP HANDLER
+# ==================
+
+class StandinHandler(BaseHTTPRequestHandler):
+    server_version = 'postgrest-standin'
+    protocol_version = 'HTTP/1.1'       # Keep-alive, like the real gateway
+    # Send headers and body in one write; split small writes hit Nagle +
+    # delayed ACK and add ~40ms per request on keep-alive connections
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    @property
+    def standin(self) -> 'PostgrestStandin':
+        return self.server.standin
+
+    def log_message(self, format, *args):
+        if self.standin.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_HEAD(self):
+        self._dispatch('HEAD')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PATCH(self):
+        self._dispatch('PATCH')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def _send(self, status: int, body: Any = None, headers: Optional[Dict[str, str]] = None):
+        payload = b'' if body is None else json.dumps(body, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(payload)
+
+    def _read_body(self) -> Any:
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return None
+        try:
+            return json.loads(self.rfile.read(length))
+        except ValueError:
+            raise PostgrestError(400, 'PGRST102', 'Empty or invalid json')
+
+    def _dispatch(self, method: str):
+        parsed = urlparse(self.path)
+        # Drain the body first so a keep-alive connection stays in sync on errors
+        try:
+            body = self._read_body() if method in ('POST', 'PATCH') else None
+        except PostgrestError as e:
+            self._send(e.status, e.body)
+            return
+
+        if not self.headers.get('apikey'):
+            self._send(401, {'message': 'No API key found in request'})
+            return
+
+        if self.standin.inject_fault(self):
+            return
+
+        path = parsed.path
+        if not path.startswith('/rest/v1'):
+            self._send(404, {'message': 'no Route matched with those values'})
+            return
+        resource = path[len('/rest/v1'):].strip('/')
+        params = parse_qsl(parsed.query, keep_blank_values=True)
+
+        try:
+            if resource == '':
+                document = self.standin.openapi
+                etag = '"' + hashlib.sha256(json.dumps(document, sort_keys=True).encode()).hexdigest()[:32] + '"'
+                self._send(200, document, {'ETag': etag})
+            elif resource.startswith('rpc/'):
+                args = body if method == 'POST' else dict(params)
+                self._send(200, self.standin.call_rpc(resource[len('rpc/'):], args or {}))
+            else:
+                self._handle_table(method, resource, params, body)
+        except PostgrestError as e:
+            self._send(e.status, e.body)
+
+    def _handle_table(self, method: str, table: str, params: List[Tuple[str, str]], body: Any):
+        store = self.standin.store
+        prefer = self.headers.get('Prefer', '')
+        query = dict(params)
+        predicates = [
+            parse_condition(f"{key}{value}") if key in ('or', 'and') else parse_filter(key, value)
+            for key, value in params if key not in RESERVED_PARAMS or key in ('or', 'and')
+        ]
+
+        with store.lock:
+            columns = store.columns(table)
+            for key, _ in params:
+                if key not in RESERVED_PARAMS and key not in columns:
+                    raise PostgrestError(400, '42703', f'column {table}.{key} does not exist')
+
+            if method in ('GET', 'HEAD'):
+                rows = self._apply_order(store.select(table, predicates), query.get('order'), columns)
+                offset = int(query.get('offset') or 0)
+                limit = int(query['limit']) if query.get('limit') else None
+                page = rows[offset:offset + limit if limit is not None else None]
+                headers = {'Content-Range': f"{offset}-{offset + len(page) - 1 if page else '*'}/"
+                                            f"{len(rows) if 'count=exact' in prefer else '*'}"}
+                self._send(200, self._project(page, query.get('select', '*'), table, columns), headers)
+
+            elif method == 'POST':
+                rows = body if isinstance(body, list) else [body or {}]
+                # A bulk POST is one statement: any bad row fails the whole request
+                for row in rows:
+                    store.validate_row(table, row)
+                written = [self._upsert(store, table, row, query.get('on_conflict'), prefer) for row in rows]
+                written = [row for row in written if row is not None]
+                self._finish_write(201, written, query.get('select', '*'), table, columns, prefer)
+
+            elif method == 'PATCH':
+                store.validate_row(table, body or {})
+                matched = store.select(table, predicates)
+                for row in matched:
+                    row.update(body or {})
+                self._finish_write(200, matched, query.get('select', '*'), table, columns, prefer)
+
+            elif method == 'DELETE':
+                matched = store.select(table, predicates)
+                store.rows[table] = [row for row in store.rows[table] if row not in matched]
+                self._finish_write(200, matched, query.get('select', '*'), table, columns, prefer)
+
+    def _upsert(self, store: Store, table: str, row: dict, on_conflict: Optional[str], prefer: str) -> Optional[dict]:
+        if 'resolution=' not in prefer:
+            return store.insert(table, row)
+        keys = (on_conflict or 'id').split(',')
+        for existing in store.rows[table]:
+            if all(existing.get(key) == row.get(key) for key in keys):
+                if 'resolution=ignore-duplicates' in prefer:
+                    return None
+                store.validate_row(table, row)
+                existing.update(row)
+                return existing
+        return store.insert(table, row)
+
+    def _finish_write(self, status: int, rows: List[dict], select: str, table: str, columns, prefer: str):
+        if 'return=representation' in prefer:
+            self._send(status, self._project(rows, select, table, columns))
+        else:
+            self._send(204 if status == 200 else status)
+
+    @staticmethod
+    def _apply_order(rows: List[dict], order: Optional[str], columns) -> List[dict]:
+        if not order:
+            return rows
+        # Stable sorts applied from the last key to the first
+        for term in reversed(order.split(',')):
+            parts = term.split('.')
+            column, descending = parts[0], 'desc' in parts[1:]
+            nulls_first = 'nullsfirst' in parts[1:] or (descending and 'nullslast' not in parts[1:])
+            if column not in columns:
+                raise PostgrestError(400, '42703', f'column {column} does not exist')
+            present = sorted((row for row in rows if row.get(column) is not None),
+                             key=lambda row: row[column], reverse=descending)
+            missing = [row for row in rows if row.get(column) is None]
+            rows = missing + present if nulls_first else present + missing
+        return rows
+
+    @staticmethod
+    def _project(rows: List[dict], select: str, table: str, columns) -> List[dict]:
+        fields = []
+        for item in _split_logic(select or '*'):
+            item = item.strip()
+            if '(' in item:
+                raise PostgrestError(400, 'PGRST100', 'Resource embedding is not supported by the stand-in')
+            base = item.split('::')[0]
+            alias, _, name = base.rpartition(':')
+            if name == '*':
+                fields.extend((column, column) for column in columns)
+                continue
+            if name not in columns:
+                raise PostgrestError(400, '42703', f'column {table}.{name} does not exist')
+            fields.append((alias or name, name))
+        return [{alias: row.get(name) for alias, name in fields} for row in rows]
+
+
+# ==================
+# SERVER
+# ==================
+
+class PostgrestStandin:
+    """Owns the HTTP server thread, in-memory store and fault profile"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, profile: str = 'none',
+                 fault: Optional[FaultProfile] = None, schema: Optional[SchemaModel] = None,
+                 seed: Optional[int] = None, verbose: bool = False):
+        self.schema = schema or load_schema_from_migrations()
+        self.store = Store(self.schema)
+        self.openapi = schema_to_openapi(self.schema)
+        self.fault = fault or PROFILES[profile]
+        self.random = random.Random(seed)
+        self.verbose = verbose
+        self._random_lock = threading.Lock()
+
+        self.httpd = ThreadingHTTPServer((host, port), StandinHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.standin = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """Base URL to use as SUPABASE_URL"""
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'PostgrestStandin':
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def inject_fault(self, handler: StandinHandler) -> bool:
+        """Sleep for the profile's latency; returns True if a failure was sent instead"""
+        with self._random_lock:
+            delay = max(0.0, self.fault.latency_ms + self.random.uniform(-1, 1) * self.fault.jitter_ms)
+            fail = self.random.random() < self.fault.error_rate
+        if delay:
+            time.sleep(delay / 1000)
+        if fail:
+            headers = {'Retry-After': '1'} if self.fault.error_status == 429 else None
+            handler._send(self.fault.error_status, {'message': 'Injected failure (stand-in fault profile)'}, headers)
+        return fail
+
+    def call_rpc(self, name: str, args: dict) -> Any:
+        function = self.schema.rpcs.get(name)
+        unknown = set(args) - set(function.args) if function else set()
+        missing = set(function.required_args) - set(args) if function else set()
+        if function is None or unknown or missing:
+            signature = ', '.join(sorted(args))
+            raise PostgrestError(404, 'PGRST202',
+                                 f"Could not find the function public.{name}({signature}) in the schema cache")
+        for arg, value in args.items():
+            enum_values = self.schema.enums.get(function.args[arg])
+            if enum_values and value not in enum_values:
+                raise PostgrestError(400, '22P02', f'invalid input value for enum {function.args[arg]}: "{value}"')
+
+        handler = RPC_HANDLERS.get(name)
+        if handler is None:
+            return None
+        with self.store.lock:
+            return handler(self.store, args)
+
+    def seed_profiles(self, count: int, credits: int = 1000, advisor_share: float = 0.2):
+        """Create client and advisor profiles (advisors get active advisor_details)"""
+        with self.store.lock:
+            for index in range(count):
+                is_advisor = index < max(1, int(count * advisor_share))
+                profile = self.store.insert('profiles', {
+                    'id': str(uuid.UUID(int=self.random.getrandbits(128), version=4)),
+                    'email': f"{'advisor' if is_advisor else 'client'}{index}@standin.local",
+                    'username': f"user{index}",
+                    'role': 'advisor' if is_advisor else 'client',
+                    'credits': credits,
+                })
+                if is_advisor and 'advisor_details' in self.schema.tables:
+                    self.store.insert('advisor_details', {
+                        'id': profile['id'],
+                        'title': f"Advisor {index}",
+                        'price_per_minute': 2.99,
+                        'status': 'online',
+                    })
+
+    def load_rows(self, data: Dict[str, List[dict]]):
+        """Bulk-load rows, e.g. from a JSON fixture {table: [rows]}"""
+        with self.store.lock:
+            for table, rows in data.items():
+                for row in rows:
+                    self.store.insert(table, row)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve an offline PostgREST stand-in built from the migrations")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='none', help="Latency/failure preset")
+    parser.add_argument('--latency-ms', type=float, help="Override the profile's base latency")
+    parser.add_argument('--jitter-ms', type=float, help="Override the profile's latency jitter (+/-)")
+    parser.add_argument('--error-rate', type=float, help="Override the fraction of requests that fail")
+    parser.add_argument('--error-status', type=int, help="Override the HTTP status of injected failures")
+    parser.add_argument('--seed-profiles', type=int, default=0, help="Create N client/advisor profiles")
+    parser.add_argument('--data', help="JSON fixture {table: [rows]} to load at startup")
+    parser.add_argument('--seed', type=int, help="Random seed for reproducible faults and ids")
+    parser.add_argument('--verbose', action='store_true', help="Log every request")
+    return parser.parse_args()
+
+
+def main():
+    """Run the stand-in until interrupted"""
+    args = parse_args()
+
+    fault = PROFILES[args.profile]
+    overrides = {
+        'latency_ms': args.latency_ms, 'jitter_ms': args.jitter_ms,
+        'error_rate': args.error_rate, 'error_status': args.error_status,
+    }
+    fault = replace(fault, **{key: value for key, value in overrides.items() if value is not None})
+
+    standin = PostgrestStandin(args.host, args.port, fault=fault, seed=args.seed, verbose=args.verbose)
+    if args.seed_profiles:
+        standin.seed_profiles(args.seed_profiles)
+    if args.data:
+        with open(args.data, encoding='utf-8') as f:
+            standin.load_rows(json.load(f))
+
+    print(f"[*] PostgREST stand-in listening on {standin.url}")
+    print(f"[*] {len(standin.schema.tables)} tables, {len(standin.schema.rpcs)} RPCs from supabase/migrations")
+    print(f"[*] Fault profile: {fault}")
+    print(f"[*] Use: SUPABASE_URL={standin.url} SUPABASE_KEY=local")
+    try:
+        standin.httpd.serve_forever()
+    except KeyboardInterrupt:
+        print("\n[*] Stopped")
+    finally:
+        standin.httpd.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    exit_code = main()
+    sys.exit(exit_code)
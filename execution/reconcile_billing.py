@@ -0,0 +1,277 @@
+"""
+Billing Reconciliation Worker: Finalize sessions stuck in pending/processing
+
+Streams completed sessions whose billing_status is still 'pending' or
+'processing' using keyset pagination on (last_billed_at NULLS FIRST, id),
+the exact key of the partial index idx_sessions_last_billed_at (rebuilt in
+20260216000000), so each page is an index range scan rather than a sort of
+every stuck session. For each page it recomputes the cost from
+billable_minutes, free_minutes_applied and rate_per_minute, then finalizes
+the whole page with ONE call to the reconcile_session_billing RPC (one
+debit per client, sessions that can't be priced or paid are flagged
+'failed').
+
+Pages are submitted to a bounded pool so several batches are in flight at
+once. Progress is checkpointed after each contiguous run of finished pages,
+so an interrupted run resumes where it stopped (--resume).
+
+Usage:
+    python execution/reconcile_billing.py [--batch-size 500] [--concurrency 4]
+                                          [--grace-minutes 10] [--resume] [--dry-run]
+
+Requirements:
+    - .env file with SUPABASE_URL and SUPABASE_KEY (service_role key: the RPC
+      is not granted to anon/authenticated)
+    - python-dotenv==1.0.1, requests==2.31.0
+    - Migration 20260216000000_add_billing_reconciliation.sql applied
+
+Outputs:
+    .tmp/reconcile_billing_cursor.json - Resumable keyset cursor
+    stdout - Per-batch progress and a throughput report
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import requests
+from dotenv import load_dotenv
+
+from supabase_transport import auth_headers, get_transport
+
+# Load environment variables
+load_dotenv()
+
+SUPABASE_URL = os.getenv('SUPABASE_URL')
+SUPABASE_KEY = os.getenv('SUPABASE_KEY')
+
+REST_URL = f"{SUPABASE_URL}/rest/v1"
+
+HEADERS = auth_headers(SUPABASE_KEY, {'Content-Type': 'application/json'})
+
+CURSOR_PATH = Path('.tmp') / 'reconcile_billing_cursor.json'
+
+SELECT_COLUMNS = 'id,client_id,billable_minutes,free_minutes_applied,rate_per_minute,last_billed_at'
+
+
+def session_cost(session: dict) -> Optional[Decimal]:
+    """
+    Same formula as end_rtc_session:
+        GREATEST(0, (billable_minutes - free_minutes_applied) * rate_per_minute)
+
+    Returns None when the session has no rate and can't be priced.
+    """
+    if session.get('rate_per_minute') is None:
+        return None
+    minutes = (session.get('billable_minutes') or 0) - (session.get('free_minutes_applied') or 0)
+    return max(Decimal(0), minutes * Decimal(str(session['rate_per_minute'])))
+
+
+def keyset_filter(cursor: Optional[Tuple[Optional[str], str]]) -> dict:
+    """
+    PostgREST filter for rows after the cursor in (last_billed_at NULLS FIRST, id) order.
+
+    Never-billed sessions (last_billed_at IS NULL) sort first; once the cursor
+    moves into timestamped rows, ties on last_billed_at are broken by id.
+    """
+    if cursor is None:
+        return {}
+    last_billed_at, last_id = cursor
+    if last_billed_at is None:
+        return {'or': f'(and(last_billed_at.is.null,id.gt.{last_id}),last_billed_at.not.is.null)'}
+    return {'or': f'(last_billed_at.gt."{last_billed_at}",and(last_billed_at.eq."{last_billed_at}",id.gt.{last_id}))'}
+
+
+def fetch_page(cursor, batch_size: int, ended_before: str) -> List[dict]:
+    params = {
+        'select': SELECT_COLUMNS,
+        'status': 'eq.completed',
+        'billing_status': 'in.(pending,processing)',
+        'ended_at': f'lt.{ended_before}',
+        'order': 'last_billed_at.asc.nullsfirst,id.asc',
+        'limit': batch_size,
+        **keyset_filter(cursor),
+    }
+    response = get_transport().get(f"{REST_URL}/sessions", headers=HEADERS, params=params)
+    if response.status_code != 200:
+        raise RuntimeError(f"Error reading stuck sessions (HTTP {response.status_code}): {response.text}")
+    return response.json()
+
+
+def reconcile_batch(sessions: List[dict]) -> List[dict]:
+    """Finalize one page with a single RPC call"""
+    costs = [session_cost(session) for session in sessions]
+    # Safe to resend: the RPC skips sessions that are already finalized
+    response = get_transport().post(
+        f"{REST_URL}/rpc/reconcile_session_billing",
+        headers=HEADERS,
+        json={
+            'p_session_ids': [session['id'] for session in sessions],
+            # Decimal strings keep the exact 2dp value the RPC compares against
+            'p_costs': [str(cost) if cost is not None else None for cost in costs],
+        },
+        timeout=(10, 120),
+        idempotent=True
+    )
+    if response.status_code != 200:
+        raise RuntimeError(f"reconcile_session_billing failed (HTTP {response.status_code}): {response.text}")
+    return response.json()
+
+
+def load_cursor() -> Optional[Tuple[Optional[str], str]]:
+    if not CURSOR_PATH.exists():
+        return None
+    state = json.loads(CURSOR_PATH.read_text(encoding='utf-8'))
+    return state['last_billed_at'], state['id']
+
+
+def save_cursor(cursor: Tuple[Optional[str], str]):
+    CURSOR_PATH.parent.mkdir(parents=True, exist_ok=True)
+    CURSOR_PATH.write_text(json.dumps({
+        'last_billed_at': cursor[0],
+        'id': cursor[1],
+        'saved_at': datetime.now(timezone.utc).isoformat(),
+    }, indent=2), encoding='utf-8')
+
+
+class Progress:
+    """Counts results and advances the checkpoint past contiguous finished pages"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.scanned = self.finalized = self.flagged = self.skipped = self.credits = self.batches = 0
+        self.errors = 0
+        self.page_cursors: List[Tuple[Optional[str], str]] = []
+        self.page_done: List[bool] = []
+        self.checkpointed = 0
+
+    def add_page(self, cursor) -> int:
+        with self.lock:
+            self.page_cursors.append(cursor)
+            self.page_done.append(False)
+            return len(self.page_cursors) - 1
+
+    def finish_page(self, index: int, submitted: int, results: Optional[List[dict]], persist: bool):
+        with self.lock:
+            self.batches += 1
+            self.scanned += submitted
+            if results is None:
+                self.errors += 1
+            else:
+                self.finalized += sum(1 for row in results if row['final_status'] == 'completed')
+                self.flagged += sum(1 for row in results if row['final_status'] == 'failed')
+                self.skipped += submitted - len(results)
+                self.credits += sum(row['credits_deducted'] or 0 for row in results)
+                self.page_done[index] = True
+
+            # A failed page holds the checkpoint back so --resume retries it
+            while self.checkpointed < len(self.page_done) and self.page_done[self.checkpointed]:
+                self.checkpointed += 1
+            if persist and self.checkpointed:
+                save_cursor(self.page_cursors[self.checkpointed - 1])
+
+
+def process_page(index: int, sessions: List[dict], progress: Progress, dry_run: bool):
+    try:
+        if dry_run:
+            results = [
+                {'final_status': 'completed' if session_cost(session) is not None else 'failed', 'credits_deducted': 0}
+                for session in sessions
+            ]
+        else:
+            results = reconcile_batch(sessions)
+    except (requests.RequestException, RuntimeError) as e:
+        print(f"   [FAIL] Batch {index + 1}: {str(e)}")
+        results = None
+    progress.finish_page(index, len(sessions), results, persist=not dry_run)
+    if results is not None:
+        print(f"   [OK] Batch {index + 1}: {len(sessions)} session(s), "
+              f"{sum(1 for row in results if row['final_status'] == 'completed')} finalized")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Finalize billing for sessions stuck in pending/processing")
+    parser.add_argument('--batch-size', type=int, default=500, help="Sessions per page and per RPC call")
+    parser.add_argument('--concurrency', type=int, default=4, help="Batches in flight at once")
+    parser.add_argument('--grace-minutes', type=float, default=10,
+                        help="Only touch sessions that ended at least this long ago")
+    parser.add_argument('--max-batches', type=int, help="Stop after this many pages")
+    parser.add_argument('--resume', action='store_true', help="Continue from the saved cursor")
+    parser.add_argument('--dry-run', action='store_true', help="Compute costs without calling the RPC")
+    return parser.parse_args()
+
+
+def main():
+    """Stream stuck sessions and reconcile them batch by batch"""
+    args = parse_args()
+
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        print("❌ Error: SUPABASE_URL and SUPABASE_KEY must be set in .env file")
+        return 1
+
+    cursor = load_cursor() if args.resume else None
+    ended_before = (datetime.now(timezone.utc) - timedelta(minutes=args.grace_minutes)).isoformat()
+
+    print("\n[*] Starting billing reconciliation")
+    print(f"[*] Environment: {SUPABASE_URL}")
+    print(f"[*] Batch size {args.batch_size}, concurrency {args.concurrency}, "
+          f"sessions ended before {ended_before}{' (dry run)' if args.dry_run else ''}")
+    if cursor:
+        print(f"[*] Resuming after last_billed_at={cursor[0]}, id={cursor[1]}")
+
+    progress = Progress()
+    started = time.perf_counter()
+    # Bounded in-flight batches: paging blocks once `concurrency` are outstanding
+    slots = threading.BoundedSemaphore(args.concurrency)
+
+    def run(index, sessions):
+        try:
+            process_page(index, sessions, progress, args.dry_run)
+        finally:
+            slots.release()
+
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix='reconcile') as pool:
+            pages = 0
+            while args.max_batches is None or pages < args.max_batches:
+                sessions = fetch_page(cursor, args.batch_size, ended_before)
+                if not sessions:
+                    break
+                cursor = (sessions[-1]['last_billed_at'], sessions[-1]['id'])
+                index = progress.add_page(cursor)
+                slots.acquire()
+                pool.submit(run, index, sessions)
+                pages += 1
+                if len(sessions) < args.batch_size:
+                    break
+    except (requests.RequestException, RuntimeError) as e:
+        print(f"❌ Error: {str(e)}")
+        print("   [TIP] Re-run with --resume to continue from the last checkpoint")
+
+    elapsed = time.perf_counter() - started
+
+    print(f"\n{'='*60}")
+    print("  Reconciliation Summary")
+    print(f"{'='*60}\n")
+    print(f"Batches:          {progress.batches} ({progress.errors} failed)")
+    print(f"Sessions scanned: {progress.scanned}")
+    print(f"Finalized:        {progress.finalized}")
+    print(f"Flagged failed:   {progress.flagged}")
+    print(f"Skipped:          {progress.skipped} (locked or changed since read; picked up next run)")
+    print(f"Credits deducted: {progress.credits} (net of refunds)")
+    print(f"Throughput:       {progress.scanned / elapsed if elapsed else 0:.1f} sessions/s over {elapsed:.1f}s")
+
+    return 0 if progress.errors == 0 else 1
+
+
+if __name__ == "__main__":
+    exit_code = main()
+    sys.exit(exit_code)
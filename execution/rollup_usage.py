@@ -0,0 +1,437 @@
+"""
+Usage Rollups: Keep hourly/daily earnings and usage rollups up to date
+
+Calls refresh_usage_rollups() (migration 20260222000000) until it has caught
+up. Each call reads the next batch of sessions past the high-water mark on
+GREATEST(ended_at, last_billed_at) and applies each one's contribution
+(sessions, billable minutes, credits charged, credits refunded) to
+usage_rollups_hourly and usage_rollups_daily, for the advisor and the client,
+by session type. A session that is seen again, e.g. refunded after it was
+rolled up, is applied as its new contribution minus the one recorded in
+session_usage_contributions, so late corrections land in the original
+bucket without rescanning sessions.
+
+Dashboards then read a few rollup rows instead of aggregating all of
+sessions:
+
+    -- An advisor's net earnings per day, last 30 days
+    SELECT bucket_date, SUM(credits_gross - credits_refunded)
+    FROM usage_rollups_daily
+    WHERE role = 'advisor' AND profile_id = :advisor AND bucket_date >= CURRENT_DATE - 30
+    GROUP BY bucket_date;
+
+--bench seeds a local database with generate_dataset.py (in a transaction
+that is rolled back), builds the rollups, and times the dashboard queries
+against the equivalent raw scans of sessions. It then refunds --refunds
+sessions, refreshes again and checks both sides still agree.
+
+Usage:
+    python execution/rollup_usage.py                          # catch up once
+    python execution/rollup_usage.py --watch 60               # keep catching up every minute
+    python execution/rollup_usage.py --recheck-hours 24       # re-read the last day first (safe, idempotent)
+    python execution/rollup_usage.py --rebuild                # from scratch
+    python execution/rollup_usage.py --bench --sessions 10000000
+    python execution/rollup_usage.py --bench --no-seed        # existing data (e.g. a generate_dataset.py load)
+
+Requirements:
+    - psycopg2-binary==2.9.9, python-dotenv==1.0.1
+    - DATABASE_URL in .env (or --database-url) with the usage rollup migration
+      applied; --bench needs a local superuser connection (seeding skips triggers)
+
+Outputs:
+    stdout - Sessions read/changed and the watermark per refresh; bench table
+    .tmp/usage_rollups/bench_<timestamp>.json - Bench results (--bench)
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from pathlib import Path
+from typing import Dict, List, Tuple
+from urllib.parse import urlparse
+
+from dotenv import load_dotenv
+
+from bench_rtc_sessions import _import_psycopg2, is_local
+from generate_dataset import DEFAULT_UNTIL, DatasetSpec, load
+
+# Load environment variables
+load_dotenv()
+
+OUTPUT_DIR = Path('.tmp') / 'usage_rollups'
+
+
+# ==================
+# REFRESH
+# ==================
+
+def refresh(connection, batch_size: int, settle_seconds: int, commit: bool = True) -> Dict:
+    """Call refresh_usage_rollups() until it catches up; one transaction per batch when committing"""
+    totals = {'scanned': 0, 'changed': 0, 'batches': 0, 'watermark': None, 'seconds': 0.0}
+    started = time.perf_counter()
+    with connection.cursor() as cursor:
+        while True:
+            cursor.execute("SELECT * FROM public.refresh_usage_rollups(%s, %s)", (batch_size, settle_seconds))
+            scanned, changed, watermark, caught_up = cursor.fetchone()
+            if commit:
+                connection.commit()
+            totals['scanned'] += scanned
+            totals['changed'] += changed
+            totals['batches'] += 1
+            totals['watermark'] = watermark
+            if caught_up:
+                break
+    totals['seconds'] = time.perf_counter() - started
+    return totals
+
+
+def describe_refresh(totals: Dict) -> str:
+    watermark = totals['watermark']
+    # psycopg2 reads the initial '-infinity' as datetime.min
+    if watermark is None or watermark.year < 2:
+        mark = "nothing rolled up yet"
+    else:
+        lag = datetime.now(timezone.utc) - watermark
+        mark = f"watermark {watermark.isoformat(timespec='seconds')} ({lag.total_seconds() / 60:,.1f} min behind)"
+    rate = totals['scanned'] / totals['seconds'] if totals['seconds'] else 0.0
+    return (f"{totals['scanned']:,} session(s) read, {totals['changed']:,} changed, "
+            f"{totals['batches']} batch(es), {rate:,.0f} sessions/s, {mark}")
+
+
+def rebuild(cursor):
+    """Empty the rollups and reset the mark (caller's transaction)"""
+    cursor.execute("""
+        TRUNCATE public.usage_rollups_hourly, public.usage_rollups_daily, public.session_usage_contributions
+    """)
+    cursor.execute("""
+        UPDATE public.usage_rollup_state
+        SET watermark = '-infinity', last_session_id = '00000000-0000-0000-0000-000000000000', updated_at = NOW()
+        WHERE id
+    """)
+
+
+# ==================
+# BENCHMARK
+# ==================
+
+NET_RAW = "COALESCE(SUM(s.credits_charged) FILTER (WHERE s.billing_status IS DISTINCT FROM 'refunded'), 0)"
+NET_ROLLUP = "SUM(r.credits_gross - r.credits_refunded)"
+
+# name -> (raw scan of sessions, the same answer from the rollups)
+BENCH_QUERIES: Dict[str, Tuple[str, str]] = {
+    # Advisor dashboard: earnings chart
+    'advisor_daily_earnings_30d': (
+        f"""
+        SELECT (s.ended_at AT TIME ZONE 'UTC')::date, COUNT(*), SUM(s.billable_minutes), {NET_RAW}
+        FROM public.sessions s
+        WHERE s.advisor_id = %(advisor)s AND s.ended_at >= %(since_30)s
+        GROUP BY 1 ORDER BY 1
+        """,
+        f"""
+        SELECT r.bucket_date, SUM(r.sessions), SUM(r.minutes), {NET_ROLLUP}
+        FROM public.usage_rollups_daily r
+        WHERE r.role = 'advisor' AND r.profile_id = %(advisor)s AND r.bucket_date >= %(since_30)s
+        GROUP BY 1 HAVING SUM(r.sessions) > 0 ORDER BY 1
+        """,
+    ),
+    # Advisor dashboard: today by hour
+    'advisor_hourly_last_48h': (
+        f"""
+        SELECT date_trunc('hour', s.ended_at, 'UTC'), COUNT(*), SUM(s.billable_minutes), {NET_RAW}
+        FROM public.sessions s
+        WHERE s.advisor_id = %(advisor)s AND s.ended_at >= %(since_48h)s
+        GROUP BY 1 ORDER BY 1
+        """,
+        f"""
+        SELECT r.bucket_start, SUM(r.sessions), SUM(r.minutes), {NET_ROLLUP}
+        FROM public.usage_rollups_hourly r
+        WHERE r.role = 'advisor' AND r.profile_id = %(advisor)s AND r.bucket_start >= %(since_48h)s
+        GROUP BY 1 HAVING SUM(r.sessions) > 0 ORDER BY 1
+        """,
+    ),
+    # Client history page: lifetime spend by session type
+    'client_spend_by_type': (
+        f"""
+        SELECT COALESCE(s.type, 'chat'), COUNT(*), SUM(s.billable_minutes), {NET_RAW}
+        FROM public.sessions s
+        WHERE s.client_id = %(client)s AND s.ended_at IS NOT NULL
+        GROUP BY 1 ORDER BY 1
+        """,
+        f"""
+        SELECT r.session_type, SUM(r.sessions), SUM(r.minutes), {NET_ROLLUP}
+        FROM public.usage_rollups_daily r
+        WHERE r.role = 'client' AND r.profile_id = %(client)s
+        GROUP BY 1 HAVING SUM(r.sessions) > 0 ORDER BY 1
+        """,
+    ),
+    # Admin: platform minutes by type per day
+    'platform_minutes_by_type_90d': (
+        """
+        SELECT (s.ended_at AT TIME ZONE 'UTC')::date, COALESCE(s.type, 'chat'), SUM(s.billable_minutes)
+        FROM public.sessions s
+        WHERE s.ended_at >= %(since_90)s
+        GROUP BY 1, 2 ORDER BY 1, 2
+        """,
+        """
+        SELECT r.bucket_date, r.session_type, SUM(r.minutes)
+        FROM public.usage_rollups_daily r
+        WHERE r.role = 'advisor' AND r.bucket_date >= %(since_90)s
+        GROUP BY 1, 2 HAVING SUM(r.sessions) > 0 ORDER BY 1, 2
+        """,
+    ),
+    # Admin: top earners
+    'top_advisors_30d': (
+        f"""
+        SELECT s.advisor_id, {NET_RAW} AS net
+        FROM public.sessions s
+        WHERE s.ended_at >= %(since_30)s
+        GROUP BY 1 ORDER BY net DESC, 1 LIMIT 10
+        """,
+        f"""
+        SELECT r.profile_id, {NET_ROLLUP} AS net
+        FROM public.usage_rollups_daily r
+        WHERE r.role = 'advisor' AND r.bucket_date >= %(since_30)s
+        GROUP BY 1 ORDER BY net DESC, 1 LIMIT 10
+        """,
+    ),
+}
+
+
+def _normalize(rows: List[tuple]) -> List[tuple]:
+    """Compare answers, not types: numeric vs bigint, date vs timestamptz at midnight UTC"""
+    normalized = []
+    for row in rows:
+        values = []
+        for value in row:
+            if isinstance(value, Decimal):
+                value = int(value) if value == value.to_integral_value() else float(value)
+            elif isinstance(value, (datetime, date)):
+                value = value.isoformat()
+            else:
+                value = str(value) if value is not None and not isinstance(value, int) else value
+            values.append(value)
+        normalized.append(tuple(values))
+    return normalized
+
+
+def bench_params(cursor) -> Dict:
+    """Busiest advisor and client, and windows ending at the newest ended_at"""
+    cursor.execute("SELECT MAX(ended_at) FROM public.sessions")
+    newest = cursor.fetchone()[0] or datetime.now(timezone.utc)
+    cursor.execute("""
+        SELECT advisor_id FROM public.sessions WHERE ended_at IS NOT NULL
+        GROUP BY advisor_id ORDER BY COUNT(*) DESC LIMIT 1
+    """)
+    advisor = cursor.fetchone()
+    cursor.execute("""
+        SELECT client_id FROM public.sessions WHERE ended_at IS NOT NULL
+        GROUP BY client_id ORDER BY COUNT(*) DESC LIMIT 1
+    """)
+    client = cursor.fetchone()
+    today = newest.astimezone(timezone.utc).date()
+    return {
+        'advisor': advisor[0] if advisor else None,
+        'client': client[0] if client else None,
+        'since_30': today - timedelta(days=30),
+        'since_90': today - timedelta(days=90),
+        'since_48h': newest.replace(minute=0, second=0, microsecond=0) - timedelta(hours=48),
+    }
+
+
+def time_query(cursor, sql: str, params: Dict, repeat: int) -> Tuple[float, List[tuple]]:
+    """Median wall time in ms after one warm-up run, and the rows"""
+    cursor.execute(sql, params)
+    rows = cursor.fetchall()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        cursor.execute(sql, params)
+        cursor.fetchall()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), rows
+
+
+def compare_queries(cursor, params: Dict, repeat: int) -> List[Dict]:
+    results = []
+    for name, (raw_sql, rollup_sql) in BENCH_QUERIES.items():
+        raw_ms, raw_rows = time_query(cursor, raw_sql, params, repeat)
+        rollup_ms, rollup_rows = time_query(cursor, rollup_sql, params, repeat)
+        results.append({
+            'query': name,
+            'raw_ms': round(raw_ms, 2),
+            'rollup_ms': round(rollup_ms, 2),
+            'speedup': round(raw_ms / rollup_ms, 1) if rollup_ms else None,
+            'rows': len(raw_rows),
+            'match': _normalize(raw_rows) == _normalize(rollup_rows),
+        })
+    return results
+
+
+def print_comparison(title: str, results: List[Dict]):
+    print(f"\n   {title}")
+    print(f"   {'query':<30} {'raw ms':>10} {'rollup ms':>10} {'speedup':>8} {'rows':>6}  match")
+    for result in results:
+        speedup = f"{result['speedup']:,.1f}x" if result['speedup'] else '-'
+        print(f"   {result['query']:<30} {result['raw_ms']:>10,.2f} {result['rollup_ms']:>10,.2f} "
+              f"{speedup:>8} {result['rows']:>6}  {'[OK]' if result['match'] else '[FAIL]'}")
+
+
+def run_bench(connection, config: argparse.Namespace) -> Dict:
+    """Everything happens in one transaction that the caller rolls back"""
+    report = {'started_at': datetime.now().isoformat(), 'sessions': config.sessions, 'seed': config.seed}
+    with connection.cursor() as cursor:
+        # Day buckets are UTC; make date comparisons in the raw queries UTC too
+        cursor.execute("SET LOCAL TimeZone = 'UTC'")
+        if not config.no_seed:
+            print(f"[*] Seeding {config.sessions:,} sessions (rolled back afterwards)...")
+            started = time.perf_counter()
+            load(cursor, DatasetSpec(
+                clients=max(100, config.sessions // 10),
+                advisors=max(10, config.sessions // 100),
+                sessions=config.sessions,
+                messages_per_session=0,
+                seed=config.seed,
+                until=DEFAULT_UNTIL,
+            ))
+            report['seed_seconds'] = round(time.perf_counter() - started, 1)
+            print(f"   Seeded in {report['seed_seconds']:,}s")
+        cursor.execute("ANALYZE public.sessions")
+        cursor.execute("SELECT COUNT(*) FROM public.sessions")
+        report['total_sessions'] = cursor.fetchone()[0]
+
+        print("[*] Building rollups from scratch...")
+        rebuild(cursor)
+        build = refresh(connection, config.batch_size, settle_seconds=0, commit=False)
+        report['build'] = {key: value for key, value in build.items() if key != 'watermark'}
+        print(f"   {describe_refresh(build)}")
+        cursor.execute("ANALYZE public.usage_rollups_hourly, public.usage_rollups_daily")
+
+        params = bench_params(cursor)
+        if params['advisor'] is None:
+            raise ValueError("No ended sessions to benchmark (seed some, or drop --no-seed)")
+        report['initial'] = compare_queries(cursor, params, config.repeat)
+        print_comparison(f"Dashboard queries, {report['total_sessions']:,} sessions (median of {config.repeat})",
+                         report['initial'])
+
+        # Late refunds of already rolled-up sessions, half of them the busiest advisor's
+        print(f"\n[*] Refunding {config.refunds:,} rolled-up session(s) and refreshing...")
+        cursor.execute("""
+            UPDATE public.sessions SET billing_status = 'refunded'
+            WHERE id IN (
+              (SELECT id FROM public.sessions
+               WHERE billing_status = 'completed' AND credits_charged > 0 AND advisor_id = %(advisor)s
+               ORDER BY md5(id::text) LIMIT %(half)s)
+              UNION
+              (SELECT id FROM public.sessions
+               WHERE billing_status = 'completed' AND credits_charged > 0
+               ORDER BY md5(id::text) LIMIT %(half)s)
+            )
+        """, {'advisor': params['advisor'], 'half': max(1, config.refunds // 2)})
+        report['refunded'] = cursor.rowcount
+        correction = refresh(connection, config.batch_size, settle_seconds=0, commit=False)
+        report['correction'] = {key: value for key, value in correction.items() if key != 'watermark'}
+        print(f"   {describe_refresh(correction)}")
+        report['after_refunds'] = compare_queries(cursor, params, config.repeat)
+        print_comparison("After refunds", report['after_refunds'])
+    return report
+
+
+# ==================
+# MAIN
+# ==================
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Maintain (or benchmark) the incremental usage rollups")
+    parser.add_argument('--database-url', default=os.getenv('DATABASE_URL'), help="Postgres URL")
+    parser.add_argument('--batch-size', type=int, default=5000, help="Sessions per refresh transaction (default: 5000)")
+    parser.add_argument('--settle-seconds', type=int, default=120,
+                        help="Leave sessions stamped this recently for the next refresh (default: 120)")
+    parser.add_argument('--recheck-hours', type=float,
+                        help="Move the mark back this many hours first, re-reading recent sessions")
+    parser.add_argument('--rebuild', action='store_true', help="Empty the rollups and rebuild them from all sessions")
+    parser.add_argument('--watch', type=float, metavar='SECONDS', help="Keep refreshing every SECONDS")
+    parser.add_argument('--bench', action='store_true', help="Benchmark rollup vs raw dashboard queries (local)")
+    parser.add_argument('--sessions', type=int, default=10_000_000, help="Sessions to seed for --bench (default: 10M)")
+    parser.add_argument('--seed', type=int, default=21, help="Seed for the --bench data")
+    parser.add_argument('--no-seed', action='store_true', help="Benchmark the sessions already in the database")
+    parser.add_argument('--refunds', type=int, default=1000, help="Sessions refunded in the --bench correction step")
+    parser.add_argument('--repeat', type=int, default=5, help="Timed runs per --bench query (median reported)")
+    parser.add_argument('--allow-remote', action='store_true', help="Allow --bench against a non-local database")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    if not args.database_url:
+        print("❌ Error: --database-url (or DATABASE_URL in .env) is required")
+        return 1
+    if args.batch_size < 1 or args.settle_seconds < 0:
+        print("❌ Error: --batch-size must be positive and --settle-seconds not negative")
+        return 1
+    if args.bench and not is_local(args.database_url) and not args.allow_remote:
+        print(f"❌ Error: Refusing to benchmark non-local database {urlparse(args.database_url).hostname} "
+              f"(use --allow-remote)")
+        return 1
+
+    psycopg2, _ = _import_psycopg2()
+    try:
+        connection = psycopg2.connect(args.database_url)
+    except psycopg2.Error as e:
+        print(f"❌ Error: Could not connect: {str(e).strip()}")
+        return 1
+
+    try:
+        if args.bench:
+            try:
+                report = run_bench(connection, args)
+            finally:
+                # Never keep the generated rows, the refunds or the rebuilt rollups
+                connection.rollback()
+            OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+            output_path = OUTPUT_DIR / f"bench_{datetime.now():%Y%m%d_%H%M%S}.json"
+            output_path.write_text(json.dumps(report, indent=2, default=str), encoding='utf-8')
+            print(f"\n[*] Results written to {output_path}")
+            mismatches = [r['query'] for r in report['initial'] + report['after_refunds'] if not r['match']]
+            if mismatches:
+                print(f"\n❌ Rollups disagree with the raw scan: {', '.join(sorted(set(mismatches)))}")
+                return 1
+            print("\n✅ Rollups match the raw scan before and after refunds")
+            return 0
+
+        with connection.cursor() as cursor:
+            if args.rebuild:
+                rebuild(cursor)
+                print("[*] Rollups emptied; rebuilding from all ended sessions")
+            if args.recheck_hours:
+                cursor.execute("SELECT public.rewind_usage_rollups(NOW() - make_interval(secs => %s))",
+                               (args.recheck_hours * 3600,))
+                print(f"[*] Mark moved back to {cursor.fetchone()[0]}")
+        connection.commit()
+
+        while True:
+            totals = refresh(connection, args.batch_size, args.settle_seconds)
+            print(f"[OK] {describe_refresh(totals)}")
+            if not args.watch:
+                break
+            time.sleep(args.watch)
+    except KeyboardInterrupt:
+        connection.rollback()
+        print("\n[*] Stopped (every committed batch is kept; the next run continues from the mark)")
+    except (psycopg2.Error, ValueError) as e:
+        connection.rollback()
+        print(f"❌ Error: {str(e).strip()}")
+        return 1
+    finally:
+        connection.close()
+    return 0
+
+
+if __name__ == "__main__":
+    exit_code = main()
+    sys.exit(exit_code)
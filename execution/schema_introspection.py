@@ -0,0 +1,184 @@
+"""
+Schema Introspection: PostgREST OpenAPI -> in-memory schema model
+
+PostgREST describes every exposed table, view and RPC in the OpenAPI (Swagger
+2.0) document served at the API root (`/rest/v1/`). This module fetches that
+document once and indexes it so verification scripts can check tables,
+columns, enums and RPC signatures in memory instead of probing each object
+with its own request (and without calling RPCs that write to the database).
+
+Usage:
+    from schema_introspection import get_schema
+
+    schema = get_schema(REST_URL, HEADERS)
+    schema.has_table('profiles')
+    schema.missing_columns('sessions', ['id', 'type', 'status'])
+    schema.rpc_signature_issues('add_credits', ['user_id', 'amount'])
+    schema.enums['session_type']        # ('chat', 'audio', 'video')
+
+Notes:
+    - Enum types are discovered from column formats (e.g. `public.session_type`),
+      so an enum only shows up once some exposed column uses it.
+    - Newer Supabase projects only serve the OpenAPI document to the
+      service_role/secret key; an anon key gets HTTP 401/403.
+
+Requirements:
+    - requests==2.31.0
+"""
+
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import requests
+
+from supabase_transport import get_transport
+
+
+class SchemaIntrospectionError(Exception):
+    """Raised when the OpenAPI document cannot be fetched or parsed"""
+
+
+@dataclass(frozen=True)
+class Column:
+    name: str
+    type: str                                   # Postgres type, schema prefix stripped
+    enum_values: Optional[Tuple[str, ...]] = None
+    default: Optional[str] = None               # SQL default (only known when built from migrations)
+
+
+@dataclass(frozen=True)
+class Rpc:
+    name: str
+    args: Dict[str, str]                        # argument name -> Postgres type
+    required_args: Tuple[str, ...] = ()
+    returns: str = ''                           # Return type (only known when built from migrations)
+
+
+@dataclass
+class SchemaModel:
+    tables: Dict[str, Dict[str, Column]] = field(default_factory=dict)
+    rpcs: Dict[str, Rpc] = field(default_factory=dict)
+    enums: Dict[str, Tuple[str, ...]] = field(default_factory=dict)
+
+    def has_table(self, table: str) -> bool:
+        return table in self.tables
+
+    def missing_columns(self, table: str, columns: Sequence[str]) -> List[str]:
+        """Columns not present on the table (all of them if the table is missing)"""
+        existing = self.tables.get(table, {})
+        return [column for column in columns if column not in existing]
+
+    def rpc_signature_issues(self, name: str, expected_args: Sequence[str]) -> List[str]:
+        """
+        Compare an RPC against the argument names the app calls it with.
+
+        Returns:
+            Human-readable problems; empty when the RPC matches
+        """
+        rpc = self.rpcs.get(name)
+        if rpc is None:
+            return ['does not exist']
+
+        issues = []
+        missing = [arg for arg in expected_args if arg not in rpc.args]
+        unexpected_required = [arg for arg in rpc.required_args if arg not in expected_args]
+        if missing:
+            issues.append(f"missing argument(s): {', '.join(missing)}")
+        if unexpected_required:
+            issues.append(f"unexpected required argument(s): {', '.join(unexpected_required)}")
+        return issues
+
+
+def _strip_schema(type_name: str) -> str:
+    """'public.session_type' -> 'session_type'; built-in formats pass through"""
+    return type_name.split('.', 1)[1] if type_name.startswith('public.') else type_name
+
+
+def parse_openapi(document: dict) -> SchemaModel:
+    """Index a PostgREST OpenAPI document into a SchemaModel"""
+    if not isinstance(document, dict) or 'paths' not in document:
+        raise SchemaIntrospectionError("Response is not a PostgREST OpenAPI document")
+
+    model = SchemaModel()
+
+    # Tables and views: one definition per exposed relation
+    for table_name, definition in (document.get('definitions') or {}).items():
+        columns = {}
+        for column_name, prop in (definition.get('properties') or {}).items():
+            column_type = _strip_schema(prop.get('format') or prop.get('type') or 'unknown')
+            enum_values = tuple(prop['enum']) if prop.get('enum') else None
+            columns[column_name] = Column(column_name, column_type, enum_values)
+            if enum_values:
+                model.enums[column_type] = enum_values
+        model.tables[table_name] = columns
+
+    # RPCs: POST /rpc/<name> carries the arguments as a single body parameter
+    for path, operations in document['paths'].items():
+        if not path.startswith('/rpc/'):
+            continue
+        name = path[len('/rpc/'):]
+        args, required = {}, ()
+        for parameter in (operations.get('post') or {}).get('parameters') or []:
+            schema = parameter.get('schema') or {}
+            if parameter.get('in') == 'body' and 'properties' in schema:
+                args = {
+                    arg: _strip_schema(prop.get('format') or prop.get('type') or 'unknown')
+                    for arg, prop in schema['properties'].items()
+                }
+                required = tuple(schema.get('required') or ())
+        model.rpcs[name] = Rpc(name, args, required)
+
+    return model
+
+
+def fetch_schema(rest_url: str, headers: Dict[str, str], timeout: float = 30) -> SchemaModel:
+    """Fetch and parse the OpenAPI document (one HTTP request)"""
+    try:
+        response = get_transport().get(
+            f"{rest_url}/",
+            headers={**headers, 'Accept': 'application/openapi+json'},
+            timeout=timeout
+        )
+    except requests.RequestException as e:
+        raise SchemaIntrospectionError(f"Error fetching OpenAPI document: {str(e)}")
+
+    if response.status_code in (401, 403):
+        raise SchemaIntrospectionError(
+            f"OpenAPI document not readable with this key (HTTP {response.status_code}); "
+            "use the service_role key"
+        )
+    if response.status_code != 200:
+        raise SchemaIntrospectionError(f"Error fetching OpenAPI document (HTTP {response.status_code})")
+
+    try:
+        document = response.json()
+    except ValueError:
+        raise SchemaIntrospectionError("OpenAPI document is not valid JSON")
+    return parse_openapi(document)
+
+
+# One fetch per REST URL per process; concurrent checks wait on the first fetch.
+# A failed fetch is cached too, so every check reports it without re-fetching.
+_schemas: Dict[str, object] = {}
+_schemas_lock = threading.Lock()
+
+
+def get_schema(rest_url: str, headers: Dict[str, str]) -> SchemaModel:
+    """Return the cached schema model for rest_url, fetching it on first use"""
+    with _schemas_lock:
+        if rest_url not in _schemas:
+            try:
+                _schemas[rest_url] = fetch_schema(rest_url, headers)
+            except SchemaIntrospectionError as e:
+                _schemas[rest_url] = e
+        cached = _schemas[rest_url]
+    if isinstance(cached, SchemaIntrospectionError):
+        raise cached
+    return cached
+
+
+def invalidate_schema(rest_url: str):
+    """Forget the cached schema for rest_url so the next get_schema() re-fetches it"""
+    with _schemas_lock:
+        _schemas.pop(rest_url, None)
@@ -0,0 +1,358 @@
+"""
+Supabase Transport: Shared, resilient HTTP for every execution script
+
+Module-level requests.get/post open a new connection per call, wait forever
+on a stalled PostgREST and fire bursts straight at the project's rate limits.
+Every script talks to Supabase through one Transport per process instead:
+
+    keep-alive pool     one requests.Session with a pooled adapter, shared by
+                        all threads (urllib3's pool is thread-safe)
+    timeouts            (connect, read) applied to every call that doesn't set one
+    concurrency cap     at most max_per_host requests in flight per host
+    rate limit          token bucket per host: rate_per_second, bursts up to burst
+    retries             exponential backoff with full jitter; Retry-After is honored
+    circuit breaker     per host: after breaker_failures consecutive 5xx/network
+                        failures, calls fail fast with CircuitOpenError for
+                        breaker_reset_seconds, then a single probe decides
+
+Retries only repeat what is safe to repeat. GET/HEAD/PUT/DELETE/OPTIONS are
+retried on network errors, 429 and 5xx. POST and PATCH (RPCs, inserts) are only
+retried when the request provably never left (connect timeout, refused or
+unresolvable connection) or on 429; a dropped connection or TLS failure may
+come after the server ran the call. Pass idempotent=True for reads-as-RPC and on_conflict upserts. After
+the last retry the final response is returned as-is, so callers' existing
+status-code handling still applies. CircuitOpenError is a
+requests.ConnectionError, so existing `except requests.RequestException`
+handlers cover it.
+
+Usage:
+    from supabase_transport import auth_headers, get_transport
+
+    http = get_transport()
+    response = http.get(f"{REST_URL}/profiles", headers=HEADERS, params={'limit': 5})
+    response = http.post(f"{REST_URL}/rpc/get_schema_version", headers=HEADERS, json={}, idempotent=True)
+
+    Transport.raw()     # pooling and timeouts only, for benchmarks that must see every failure
+
+Environment:
+    SUPABASE_HTTP_RPS          - Requests per second per host (default: 50, 0 disables)
+    SUPABASE_HTTP_BURST        - Token bucket size (default: 2x the rate)
+    SUPABASE_HTTP_MAX_PER_HOST - Requests in flight per host (default: 16, 0 disables)
+    SUPABASE_HTTP_TIMEOUT      - Read timeout in seconds (default: 60; connect is 10)
+    SUPABASE_HTTP_RETRIES      - Retries per call (default: 4)
+
+    Limits are per process: the billing ticker's shard processes each get
+    their own, so size SUPABASE_HTTP_RPS per process.
+
+Requirements:
+    - requests==2.31.0
+"""
+
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+BREAKER_STATUSES = {500, 502, 503, 504}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'}
+
+DEFAULT_CONNECT_TIMEOUT = 10.0
+
+
+def _env_number(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+def auth_headers(key: Optional[str], extra: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """apikey + bearer headers for a Supabase key, plus any extra headers"""
+    return {'apikey': key, 'Authorization': f'Bearer {key}', **(extra or {})}
+
+
+def never_sent(error: requests.RequestException) -> bool:
+    """
+    True when the connection failed before any of the request was written,
+    so even a POST is safe to resend. requests.ConnectionError also wraps
+    mid-request failures (RemoteDisconnected, reset, SSL), so it isn't enough.
+    """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(error, requests.exceptions.ConnectionError) and isinstance(reason, NewConnectionError)
+
+
+# Which try of a Transport.request is on the wire in this thread (0 = the
+# first). Each try is its own Session.send, so instrumentation.Recorder reads
+# this to tell retries apart; urllib3's own retry history is always empty
+# here because the adapter's retries are off.
+_attempt = threading.local()
+
+
+def current_attempt() -> int:
+    return getattr(_attempt, 'value', 0)
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """The host failed repeatedly; calls fail fast until the breaker's probe succeeds"""
+
+
+# ==================
+# RATE LIMIT AND BREAKER
+# ==================
+
+class TokenBucket:
+    """Reserve-then-sleep token bucket: callers queue fairly, the lock is never held while waiting"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Take one token; returns seconds waited"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+class CircuitBreaker:
+    """closed -> open after `failures` consecutive failures -> half-open probe after `reset_seconds`"""
+
+    def __init__(self, failures: int, reset_seconds: float):
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self.consecutive = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        return 'half-open' if self.probing else 'open'
+
+    def before_call(self, host: str) -> bool:
+        """Raises CircuitOpenError while open; returns True when this call is the probe"""
+        with self.lock:
+            if self.opened_at is None:
+                return False
+            remaining = self.opened_at + self.reset_seconds - time.monotonic()
+            if remaining > 0 or self.probing:
+                raise CircuitOpenError(f"Circuit open for {host} after {self.consecutive} consecutive "
+                                       f"failure(s); retrying in {max(remaining, 0):.1f}s")
+            # This call is the probe; everyone else keeps failing fast until it finishes
+            self.probing = True
+            return True
+
+    def abandon_probe(self):
+        """The probe ended without an outcome (not an HTTP failure); let the next call probe"""
+        with self.lock:
+            self.probing = False
+
+    def record(self, failed: bool) -> bool:
+        """Returns True when this failure opened (or re-opened) the circuit"""
+        with self.lock:
+            was_probe, self.probing = self.probing, False
+            if not failed:
+                self.consecutive = 0
+                self.opened_at = None
+                return False
+            self.consecutive += 1
+            if was_probe or (self.opened_at is None and self.consecutive >= self.failures):
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+
+class _Host:
+    def __init__(self, transport: 'Transport'):
+        self.bucket = TokenBucket(transport.rate_per_second, transport.burst) if transport.rate_per_second > 0 else None
+        self.slots = threading.BoundedSemaphore(transport.max_per_host) if transport.max_per_host > 0 else None
+        self.breaker = (CircuitBreaker(transport.breaker_failures, transport.breaker_reset_seconds)
+                        if transport.breaker_failures > 0 else None)
+
+
+# ==================
+# TRANSPORT
+# ==================
+
+class Transport:
+    def __init__(self, rate_per_second: float = 50.0, burst: Optional[float] = None, max_per_host: int = 16,
+                 timeout: Tuple[float, float] = (DEFAULT_CONNECT_TIMEOUT, 60.0), max_retries: int = 4,
+                 backoff_base: float = 0.25, backoff_max: float = 20.0,
+                 breaker_failures: int = 5, breaker_reset_seconds: float = 30.0):
+        self.rate_per_second = rate_per_second
+        self.burst = burst if burst is not None else max(1.0, rate_per_second * 2)
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker_failures = breaker_failures
+        self.breaker_reset_seconds = breaker_reset_seconds
+
+        self.session = requests.Session()
+        # Enough pooled connections that the concurrency cap, not the pool, is the limit
+        pool_size = max_per_host if max_per_host > 0 else 64
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._hosts: Dict[str, _Host] = {}
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'retries': 0, 'throttled_seconds': 0.0, 'circuit_opened': 0}
+
+    @classmethod
+    def from_env(cls) -> 'Transport':
+        rate = _env_number('SUPABASE_HTTP_RPS', 50)
+        return cls(
+            rate_per_second=rate,
+            burst=_env_number('SUPABASE_HTTP_BURST', max(1.0, rate * 2)),
+            max_per_host=int(_env_number('SUPABASE_HTTP_MAX_PER_HOST', 16)),
+            timeout=(DEFAULT_CONNECT_TIMEOUT, _env_number('SUPABASE_HTTP_TIMEOUT', 60)),
+            max_retries=int(_env_number('SUPABASE_HTTP_RETRIES', 4)),
+        )
+
+    @classmethod
+    def raw(cls, timeout: Tuple[float, float] = (DEFAULT_CONNECT_TIMEOUT, 60.0)) -> 'Transport':
+        """Pooling and timeouts only: no throttling, retries or breaker to hide what's measured"""
+        return cls(rate_per_second=0, max_per_host=0, timeout=timeout, max_retries=0, breaker_failures=0)
+
+    def _host(self, url: str) -> Tuple[str, _Host]:
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = _Host(self)
+            return host, self._hosts[host]
+
+    def _count(self, name: str, amount: float = 1):
+        with self._lock:
+            self.stats[name] += amount
+
+    def _backoff(self, attempt: int, response: Optional[requests.Response]) -> float:
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after:
+                try:
+                    return min(self.backoff_max, float(retry_after))
+                except ValueError:
+                    try:
+                        return min(self.backoff_max, max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time()))
+                    except (TypeError, ValueError):
+                        pass
+        # Full jitter: spreads out callers that failed together
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def request(self, method: str, url: str, retries: Optional[int] = None, idempotent: Optional[bool] = None,
+                **kwargs) -> requests.Response:
+        """requests.Session.request with the cap, bucket, breaker and retries applied"""
+        method = method.upper()
+        kwargs.setdefault('timeout', self.timeout)
+        retries = self.max_retries if retries is None else retries
+        idempotent = method in IDEMPOTENT_METHODS if idempotent is None else idempotent
+        host, state = self._host(url)
+
+        attempt = 0
+        while True:
+            probe = state.breaker.before_call(host) if state.breaker else False
+            recorded = False
+            try:
+                if state.bucket:
+                    waited = state.bucket.acquire()
+                    if waited:
+                        self._count('throttled_seconds', waited)
+
+                response, error = None, None
+                if state.slots:
+                    state.slots.acquire()
+                try:
+                    self._count('requests')
+                    _attempt.value = attempt
+                    response = self.session.request(method, url, **kwargs)
+                except requests.RequestException as e:
+                    error = e
+                finally:
+                    _attempt.value = 0
+                    if state.slots:
+                        state.slots.release()
+
+                failed = error is not None or response.status_code in BREAKER_STATUSES
+                recorded = True
+                if state.breaker and state.breaker.record(failed):
+                    self._count('circuit_opened')
+            finally:
+                # Anything else raised (a hook, a bad argument, Ctrl-C) says nothing
+                # about the host, but must not leave the breaker waiting on this probe
+                if probe and not recorded:
+                    state.breaker.abandon_probe()
+
+            if error is not None:
+                retryable = idempotent or never_sent(error)
+            else:
+                retryable = response.status_code in RETRY_STATUSES and (idempotent or response.status_code == 429)
+            if not retryable or attempt >= retries:
+                if error is not None:
+                    raise error
+                return response
+
+            time.sleep(self._backoff(attempt, response))
+            attempt += 1
+            self._count('retries')
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def head(self, url: str, **kwargs) -> requests.Response:
+        return self.request('HEAD', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def patch(self, url: str, **kwargs) -> requests.Response:
+        return self.request('PATCH', url, **kwargs)
+
+    def delete(self, url: str, **kwargs) -> requests.Response:
+        return self.request('DELETE', url, **kwargs)
+
+    def breaker_states(self) -> Dict[str, str]:
+        with self._lock:
+            return {host: state.breaker.state for host, state in self._hosts.items() if state.breaker}
+
+    def close(self):
+        self.session.close()
+
+
+# One transport per process, so every check and worker thread shares the
+# pool, the bucket and the breaker. Rebuilt after fork (multiprocessing).
+_shared: Optional[Transport] = None
+_shared_pid: Optional[int] = None
+_shared_lock = threading.Lock()
+
+
+def get_transport() -> Transport:
+    """The process-wide transport, configured from the environment on first use"""
+    global _shared, _shared_pid
+    with _shared_lock:
+        if _shared is None or _shared_pid != os.getpid():
+            _shared = Transport.from_env()
+            _shared_pid = os.getpid()
+        return _shared
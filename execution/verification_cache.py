@@ -0,0 +1,220 @@
+"""
+Verification Cache: Skip structural checks when the schema hasn't changed
+
+Structural checks (tables, columns, enums, RPC signatures) give the same answer
+for as long as the schema stays the same. This cache stores the output of
+passing structural checks on disk, keyed by a fingerprint of:
+
+    - the verify script itself (changing a check invalidates its entries)
+    - the target REST URL
+    - every `supabase/migrations/*.sql` file (name + content hash)
+    - the server's schema version (`get_schema_version()` RPC), falling back
+      to the OpenAPI document's ETag
+
+A later run with the same fingerprint replays the cached output instead of
+running those checks; liveness and data checks always run. If no server
+marker can be read, the cache is bypassed for that run.
+
+Usage:
+    from verification_cache import open_cache
+
+    cache = open_cache(__file__, REST_URL, HEADERS)     # None when disabled
+    results = run_checks(CHECKS, cache=cache)
+    if cache:
+        cache.save()
+
+Environment:
+    VERIFY_CACHE             - Set to 0 to disable caching (default: 1)
+    VERIFY_CACHE_TTL_HOURS   - Entry lifetime in hours (default: 24)
+    VERIFY_CACHE_MAX_ENTRIES - Entries kept before least-recently-used eviction (default: 50)
+
+Outputs:
+    .tmp/verify_cache/<fingerprint>.json
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+import requests
+
+from supabase_transport import get_transport
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+MIGRATIONS_DIR = PROJECT_ROOT / 'supabase' / 'migrations'
+CACHE_DIR = Path('.tmp') / 'verify_cache'
+
+DEFAULT_TTL_HOURS = 24
+DEFAULT_MAX_ENTRIES = 50
+
+
+def _env_number(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+def cache_enabled() -> bool:
+    return os.getenv('VERIFY_CACHE', '1').lower() not in ('0', 'false', 'no', 'off')
+
+
+def hash_file(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def migrations_fingerprint(migrations_dir: Path = MIGRATIONS_DIR) -> str:
+    """Hash of every migration file's name and content, in apply order"""
+    digest = hashlib.sha256()
+    for path in sorted(migrations_dir.glob('*.sql')):
+        digest.update(path.name.encode())
+        digest.update(hash_file(path).encode())
+    return digest.hexdigest()
+
+
+def server_schema_marker(rest_url: str, headers: Dict[str, str], timeout: float = 10) -> Optional[str]:
+    """
+    Cheap identifier for the schema the server is running.
+
+    Prefers the latest applied migration version; falls back to the OpenAPI
+    ETag if the RPC isn't deployed. Returns None if neither is available.
+    """
+    try:
+        # Read-only, so safe to retry like a GET
+        response = get_transport().post(f"{rest_url}/rpc/get_schema_version", headers=headers, json={},
+                                        timeout=timeout, idempotent=True)
+        if response.status_code == 200 and response.json():
+            return f"version:{response.json()}"
+    except (requests.RequestException, ValueError):
+        pass
+
+    try:
+        response = get_transport().head(f"{rest_url}/", headers=headers, timeout=timeout)
+        etag = response.headers.get('ETag')
+        if response.status_code == 200 and etag:
+            return f"etag:{etag}"
+    except requests.RequestException:
+        pass
+
+    return None
+
+
+class VerificationCache:
+    """
+    Cache entry for one fingerprint.
+
+    The check runner calls lookup() before running a structural check and
+    record() after. save() only writes when every recorded structural check
+    passed, so a failing check is always re-run on the next attempt.
+    """
+
+    def __init__(self, fingerprint: str, cache_dir: Path = CACHE_DIR):
+        self.fingerprint = fingerprint
+        self.cache_dir = cache_dir
+        self.path = cache_dir / f"{fingerprint}.json"
+        self.ttl_seconds = _env_number('VERIFY_CACHE_TTL_HOURS', DEFAULT_TTL_HOURS) * 3600
+        self.max_entries = int(_env_number('VERIFY_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES))
+        self._lock = threading.Lock()
+        self._cached: Dict[str, str] = {}
+        self._cached_at: Optional[float] = None
+        self._recorded: Dict[str, str] = {}
+        self._failed = False
+        self._load()
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        try:
+            entry = json.loads(self.path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            self.path.unlink(missing_ok=True)
+            return
+
+        if time.time() - entry.get('created_at', 0) > self.ttl_seconds:
+            self.path.unlink(missing_ok=True)
+            return
+
+        self._cached = entry.get('checks', {})
+        self._cached_at = entry['created_at']
+        # Touch on hit so eviction drops the least recently used entries
+        os.utime(self.path)
+
+    @property
+    def hit(self) -> bool:
+        return bool(self._cached)
+
+    def lookup(self, check_name: str) -> Optional[str]:
+        """Cached console output for a passing check, or None to run it"""
+        output = self._cached.get(check_name)
+        if output is None:
+            return None
+        cached_at = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self._cached_at))
+        return output + f"   [CACHE] Reused result from {cached_at} (schema fingerprint unchanged)\n"
+
+    def record(self, check_name: str, passed: bool, output: str):
+        with self._lock:
+            if passed:
+                self._recorded[check_name] = output
+            else:
+                self._failed = True
+
+    def save(self):
+        """Persist this run's structural results if they all passed, then evict old entries"""
+        if self._failed or not self._recorded:
+            return
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        entry = {
+            'created_at': time.time(),
+            'checks': {**self._cached, **self._recorded},
+        }
+        if self._cached_at is not None and not set(self._recorded) - set(self._cached):
+            entry['created_at'] = self._cached_at      # Replayed only; keep the original age
+        self.path.write_text(json.dumps(entry, indent=2), encoding='utf-8')
+        evict(self.cache_dir, self.max_entries)
+
+    def invalidate(self):
+        self._cached = {}
+        self.path.unlink(missing_ok=True)
+
+
+def evict(cache_dir: Path = CACHE_DIR, max_entries: int = DEFAULT_MAX_ENTRIES):
+    """Delete least recently used entries beyond max_entries"""
+    entries = sorted(cache_dir.glob('*.json'), key=lambda p: p.stat().st_mtime, reverse=True)
+    for path in entries[max_entries:]:
+        path.unlink(missing_ok=True)
+
+
+def clear(cache_dir: Path = CACHE_DIR) -> int:
+    """Delete every cache entry; returns how many were removed"""
+    removed = 0
+    for path in cache_dir.glob('*.json'):
+        path.unlink(missing_ok=True)
+        removed += 1
+    return removed
+
+
+def open_cache(script_path: str, rest_url: str, headers: Dict[str, str]) -> Optional[VerificationCache]:
+    """
+    Build the cache entry for this script and environment.
+
+    Returns:
+        VerificationCache, or None if caching is disabled or the server
+        schema can't be fingerprinted
+    """
+    if not cache_enabled():
+        return None
+
+    marker = server_schema_marker(rest_url, headers)
+    if marker is None:
+        print("[*] Verification cache bypassed (server schema version unavailable)")
+        return None
+
+    digest = hashlib.sha256()
+    for part in (hash_file(Path(script_path)), rest_url, migrations_fingerprint(), marker):
+        digest.update(part.encode())
+        digest.update(b'\0')
+    return VerificationCache(digest.hexdigest()[:32])
@@ -7,19 +7,38 @@ This script verifies that the authentication migration was successful by checkin
 3. Database triggers are active
 4. Basic queries work
 
+Table, column and RPC checks read the PostgREST OpenAPI document once (see
+schema_introspection.py); only the data and RLS checks query tables directly.
+
 Usage:
-    python execution/verify_auth_migration.py
+    python execution/verify_auth_migration.py [--no-cache] [--clear-cache] [--timings] [--profile]
 
 Requirements:
-    - .env file with SUPABASE_URL and SUPABASE_KEY
+    - .env file with SUPABASE_URL and SUPABASE_KEY (service_role key to read the OpenAPI schema)
     - python-dotenv==1.0.1, requests==2.31.0
+
+Environment:
+    CHECK_WORKERS - Max checks running at once (default: 8, use 1 for serial runs)
+    VERIFY_CACHE  - Set to 0 to always run structural checks (see verification_cache.py)
+    EXECUTION_METRICS - Set to 0 to skip writing metric files
+    SUPABASE_HTTP_*   - Rate limit, concurrency cap, timeout and retries (see supabase_transport.py)
+
+Outputs:
+    .tmp/metrics/ - Per-check and per-request timings as JSON and Prometheus
+                    text (see instrumentation.py); cProfile stats with --profile
 """
 
+import argparse
 import os
 import sys
-import requests
 from dotenv import load_dotenv
 
+import verification_cache
+from check_runner import Check, run_checks
+from instrumentation import Recorder
+from schema_introspection import SchemaIntrospectionError, get_schema
+from supabase_transport import auth_headers, get_transport
+
 # Load environment variables
 load_dotenv()
 
@@ -27,20 +46,14 @@ load_dotenv()
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_KEY = os.getenv('SUPABASE_KEY')
 
-if not SUPABASE_URL or not SUPABASE_KEY:
-    print("❌ Error: SUPABASE_URL and SUPABASE_KEY must be set in .env file")
-    sys.exit(1)
-
 # REST API base URL
 REST_URL = f"{SUPABASE_URL}/rest/v1"
 
 # Headers for API requests
-HEADERS = {
-    'apikey': SUPABASE_KEY,
-    'Authorization': f'Bearer {SUPABASE_KEY}',
+HEADERS = auth_headers(SUPABASE_KEY, {
     'Content-Type': 'application/json',
     'Prefer': 'return=minimal'
-}
+})
 
 def print_header(text: str):
     """Print section header"""
@@ -53,18 +66,13 @@ def print_check(passed: bool, message: str):
     icon = "[OK]" if passed else "[FAIL]"
     print(f"{icon} {message}")
 
-def verify_table_exists(table_name: str) -> bool:
-    """Check if a table exists by querying it"""
+def load_schema():
+    """Fetch the schema model (one OpenAPI request per run, shared by all checks)"""
     try:
-        response = requests.get(
-            f"{REST_URL}/{table_name}",
-            headers=HEADERS,
-            params={'select': '*', 'limit': 0}
-        )
-        return response.status_code == 200
-    except Exception as e:
-        print(f"   Error: {str(e)}")
-        return False
+        return get_schema(REST_URL, HEADERS)
+    except SchemaIntrospectionError as e:
+        print_check(False, f"Unable to load schema: {str(e)}")
+        return None
 
 def verify_tables_exist():
     """Verify all required tables exist"""
@@ -78,10 +86,14 @@ def verify_tables_exist():
         'advisor_applications'
     ]
 
+    schema = load_schema()
+    if schema is None:
+        return False
+
     all_exist = True
 
     for table_name in required_tables:
-        exists = verify_table_exists(table_name)
+        exists = schema.has_table(table_name)
         print_check(exists, f"Table '{table_name}' exists")
         if not exists:
             all_exist = False
@@ -92,24 +104,21 @@ def verify_profiles_structure():
     """Verify profiles table has correct columns"""
     print_header("2. Verifying Profiles Table Structure")
 
-    try:
-        response = requests.get(
-            f"{REST_URL}/profiles",
-            headers=HEADERS,
-            params={
-                'select': 'id,email,full_name,username,date_of_birth,time_of_birth,avatar_url,credits,role,created_at,updated_at',
-                'limit': 0
-            }
-        )
+    required_columns = [
+        'id', 'email', 'full_name', 'username', 'date_of_birth', 'time_of_birth',
+        'avatar_url', 'credits', 'role', 'created_at', 'updated_at'
+    ]
 
-        if response.status_code == 200:
-            print_check(True, "Profiles table has all required columns")
-            return True
-        else:
-            print_check(False, f"Profiles table structure issue (HTTP {response.status_code})")
-            return False
-    except Exception as e:
-        print_check(False, f"Profiles table structure issue: {str(e)}")
+    schema = load_schema()
+    if schema is None:
+        return False
+
+    missing = schema.missing_columns('profiles', required_columns)
+    if not missing:
+        print_check(True, "Profiles table has all required columns")
+        return True
+    else:
+        print_check(False, f"Profiles table is missing column(s): {', '.join(missing)}")
         return False
 
 def verify_advisor_applications_accessible():
@@ -117,7 +126,7 @@ def verify_advisor_applications_accessible():
     print_header("3. Verifying Advisor Applications Table")
 
     try:
-        response = requests.get(
+        response = get_transport().get(
             f"{REST_URL}/advisor_applications",
             headers=HEADERS,
             params={'select': '*', 'limit': 1}
@@ -136,50 +145,28 @@ def verify_advisor_applications_accessible():
         return False
 
 def verify_rpc_functions():
-    """Verify RPC helper functions exist"""
+    """Verify RPC helper functions exist with the arguments the app calls them with"""
     print_header("4. Verifying RPC Functions")
 
-    functions_ok = True
-
-    # Test add_credits function
-    try:
-        response = requests.post(
-            f"{SUPABASE_URL}/rest/v1/rpc/add_credits",
-            headers=HEADERS,
-            json={'user_id': '00000000-0000-0000-0000-000000000000', 'amount': 0}
-        )
+    # Checked against the OpenAPI schema, so nothing is executed on the server
+    expected_signatures = {
+        'add_credits': ['user_id', 'amount'],
+        'deduct_credits': ['user_id', 'amount'],
+    }
 
-        # Function exists if we get 200 or 400 (validation error), but not 404
-        if response.status_code in [200, 400]:
-            print_check(True, "Function 'add_credits' exists")
-        elif response.status_code == 404:
-            print_check(False, "Function 'add_credits' does not exist")
-            functions_ok = False
-        else:
-            # Other error, but function likely exists
-            print_check(True, f"Function 'add_credits' exists (HTTP {response.status_code})")
-    except Exception as e:
-        print_check(False, f"Error checking add_credits: {str(e)}")
-        functions_ok = False
+    schema = load_schema()
+    if schema is None:
+        return False
 
-    # Test deduct_credits function
-    try:
-        response = requests.post(
-            f"{SUPABASE_URL}/rest/v1/rpc/deduct_credits",
-            headers=HEADERS,
-            json={'user_id': '00000000-0000-0000-0000-000000000000', 'amount': 0}
-        )
+    functions_ok = True
 
-        if response.status_code in [200, 400]:
-            print_check(True, "Function 'deduct_credits' exists")
-        elif response.status_code == 404:
-            print_check(False, "Function 'deduct_credits' does not exist")
-            functions_ok = False
+    for function_name, args in expected_signatures.items():
+        issues = schema.rpc_signature_issues(function_name, args)
+        if not issues:
+            print_check(True, f"Function '{function_name}' exists")
         else:
-            print_check(True, f"Function 'deduct_credits' exists (HTTP {response.status_code})")
-    except Exception as e:
-        print_check(False, f"Error checking deduct_credits: {str(e)}")
-        functions_ok = False
+            print_check(False, f"Function '{function_name}': {'; '.join(issues)}")
+            functions_ok = False
 
     return functions_ok
 
@@ -188,7 +175,7 @@ def check_test_data():
     print_header("5. Checking for Test Data")
 
     try:
-        response = requests.get(
+        response = get_transport().get(
             f"{REST_URL}/profiles",
             headers=HEADERS,
             params={'select': 'id,email,username,role,credits', 'limit': 5}
@@ -222,7 +209,7 @@ def check_rls_policies():
 
     try:
         # Try to query profiles (should work with anon key due to RLS policies)
-        response = requests.get(
+        response = get_transport().get(
             f"{REST_URL}/profiles",
             headers=HEADERS,
             params={'select': 'id,email', 'limit': 1}
@@ -235,7 +222,7 @@ def check_rls_policies():
             return False
 
         # Try to query advisor_details
-        response = requests.get(
+        response = get_transport().get(
             f"{REST_URL}/advisor_details",
             headers=HEADERS,
             params={'select': 'id,title', 'limit': 1}
@@ -252,19 +239,61 @@ def check_rls_policies():
         print_check(False, f"RLS policy issue: {str(e)}")
         return False
 
+# Checks in report order. None of them read another's results, so they have
+# no dependencies and all run concurrently (bounded by CHECK_WORKERS).
+# Structural checks only depend on the schema and can come from the cache.
+CHECKS = [
+    Check('tables', verify_tables_exist, structural=True),
+    Check('profiles_structure', verify_profiles_structure, structural=True),
+    Check('advisor_applications', verify_advisor_applications_accessible),
+    Check('rpc_functions', verify_rpc_functions, structural=True),
+    Check('test_data', check_test_data),
+    Check('rls_policies', check_rls_policies),
+]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Verify the Supabase auth migration")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Run every check, ignoring cached structural results")
+    parser.add_argument('--clear-cache', action='store_true',
+                        help="Delete all cached results before running")
+    parser.add_argument('--timings', action='store_true',
+                        help="Print per-check and per-endpoint timings after the summary")
+    parser.add_argument('--profile', action='store_true',
+                        help="Write cProfile stats for the checks to .tmp/metrics/")
+    return parser.parse_args()
+
 def main():
     """Run all verification checks"""
+    args = parse_args()
+
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        print("❌ Error: SUPABASE_URL and SUPABASE_KEY must be set in .env file")
+        return 1
+
     print("\n[*] Starting Supabase Auth Migration Verification")
     print(f"[*] Environment: {SUPABASE_URL}")
 
-    results = {
-        'tables': verify_tables_exist(),
-        'profiles_structure': verify_profiles_structure(),
-        'advisor_applications': verify_advisor_applications_accessible(),
-        'rpc_functions': verify_rpc_functions(),
-        'test_data': check_test_data(),
-        'rls_policies': check_rls_policies(),
-    }
+    # Times every check and HTTP request, including the cache and schema lookups
+    recorder = Recorder(profile=args.profile)
+    recorder.install()
+
+    if args.clear_cache:
+        removed = verification_cache.clear()
+        print(f"[*] Cleared {removed} cached verification result(s)")
+
+    # Unchanged schema fingerprint -> structural checks are replayed from disk
+    cache = None if args.no_cache else verification_cache.open_cache(__file__, REST_URL, HEADERS)
+    if cache and cache.hit:
+        print("[*] Schema fingerprint unchanged, reusing cached structural checks")
+
+    # Independent checks run concurrently; output is still printed in this order
+    results = run_checks(CHECKS, cache=cache, recorder=recorder)
+    if cache:
+        cache.save()
+
+    recorder.uninstall()
+    metric_paths = recorder.write_reports(os.path.splitext(os.path.basename(__file__))[0], SUPABASE_URL)
 
     # Summary
     print_header("Verification Summary")
@@ -278,6 +307,12 @@ def main():
 
     print(f"\n[*] Result: {passed_count}/{total_count} checks passed")
 
+    if args.timings:
+        print_header("Timings")
+        recorder.print_timings()
+    if metric_paths:
+        print(f"\n[*] Metrics written to {metric_paths[0].parent}")
+
     if passed_count == total_count:
         print("\n[SUCCESS] All checks passed! Migration was successful.")
         print("\n[*] Next steps:")
@@ -0,0 +1,496 @@
+"""
+Verify Daemon: Continuous verification with diff-only reporting
+
+Runs the checks from verify_auth_migration.py and verify_story_1_1.py in one
+long-lived process instead of a fresh one-shot run every minute. The shared
+transport keeps its connection pool warm between runs, so a liveness round
+costs a few pooled HTTP requests rather than interpreter startup, TLS
+handshakes and the full suite.
+
+Each check runs on its own schedule:
+
+    structural checks   (tables, columns, enums, RPC signatures) every
+                        --schema-interval seconds (default: hourly), and
+                        immediately when the server's schema marker changes
+    liveness checks     (RLS reads, data access) every --liveness-interval
+                        seconds (default: 30)
+    schema marker       get_schema_version() / OpenAPI ETag, polled every
+                        liveness interval (see verification_cache.py)
+
+Nothing is printed while results stay the same. An event is emitted when a
+check changes between pass and fail, or when a failing check starts failing
+for a different reason. Output lines that only carry data (row counts) never
+count as a change.
+
+Usage:
+    python execution/verify_daemon.py
+    python execution/verify_daemon.py --liveness-interval 15 --interval 'story.*=300'
+    python execution/verify_daemon.py --port 8787 --webhook https://hooks.example.com/verify
+    python execution/verify_daemon.py --once        # one round, print status, exit 0/1
+
+    curl localhost:8787/status      # every check's current state (JSON)
+    curl localhost:8787/healthz     # 200 when all checks pass, 503 otherwise
+    curl localhost:8787/metrics     # Prometheus text
+
+Requirements:
+    - .env file with SUPABASE_URL and SUPABASE_KEY (service_role key to read the OpenAPI schema)
+    - python-dotenv==1.0.1, requests==2.31.0
+
+Environment:
+    CHECK_WORKERS   - Max checks running at once (default: 8)
+    SUPABASE_HTTP_* - Rate limit, concurrency cap, timeout and retries (see supabase_transport.py)
+
+Outputs:
+    .tmp/verify_daemon/events.ndjson - One JSON line per change event (appended)
+    .tmp/verify_daemon/status.json   - Latest status, rewritten after each change
+"""
+
+import argparse
+import contextlib
+import fnmatch
+import io
+import json
+import os
+import re
+import signal
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from dotenv import load_dotenv
+
+import verify_auth_migration
+import verify_story_1_1
+from check_runner import Check, run_checks
+from schema_introspection import invalidate_schema
+from supabase_transport import get_transport
+from verification_cache import server_schema_marker
+
+# Load environment variables
+load_dotenv()
+
+SUPABASE_URL = os.getenv('SUPABASE_URL')
+SUPABASE_KEY = os.getenv('SUPABASE_KEY')
+
+OUTPUT_DIR = Path('.tmp/verify_daemon')
+
+# Check name prefix -> verify script; checks are addressed as "<prefix>.<check>"
+SUITES = {
+    'auth': verify_auth_migration,
+    'story': verify_story_1_1,
+}
+
+DEFAULT_SCHEMA_INTERVAL = 3600.0
+DEFAULT_LIVENESS_INTERVAL = 30.0
+
+NUMBER = re.compile(r'\d+(\.\d+)?')
+
+
+def utc_now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec='seconds')
+
+
+# ==================
+# SCHEDULE
+# ==================
+
+@dataclass
+class CheckState:
+    """Latest known result of one check and when it runs next"""
+    check: Check
+    suite: str
+    interval: float
+    next_run: float = 0.0
+    passed: Optional[bool] = None
+    failures: Tuple[str, ...] = ()
+    detail: List[str] = field(default_factory=list)
+    since: Optional[str] = None
+    last_run: Optional[str] = None
+    duration_ms: Optional[float] = None
+    runs: int = 0
+    changes: int = 0
+    # A new result must be seen `confirm` times in a row before it is reported
+    pending: Optional[Tuple[bool, Tuple[str, ...]]] = None
+    pending_count: int = 0
+
+    def to_dict(self) -> Dict:
+        return {
+            'passed': self.passed,
+            'structural': self.check.structural,
+            'interval_seconds': self.interval,
+            'since': self.since,
+            'last_run': self.last_run,
+            'next_run_in_seconds': round(max(0.0, self.next_run - time.monotonic()), 1),
+            'duration_ms': self.duration_ms,
+            'runs': self.runs,
+            'changes': self.changes,
+            'detail': self.detail,
+        }
+
+
+def parse_interval(text: str) -> Tuple[str, float]:
+    pattern, sep, seconds = text.rpartition('=')
+    try:
+        value = float(seconds)
+    except ValueError:
+        value = 0.0
+    if not sep or not pattern or value <= 0:
+        raise argparse.ArgumentTypeError(f"expected PATTERN=SECONDS with SECONDS > 0, got '{text}'")
+    return pattern, value
+
+
+def build_states(suites: List[str], args) -> Dict[str, CheckState]:
+    """Prefix every suite's checks and resolve each one's interval"""
+    states: Dict[str, CheckState] = {}
+    for prefix in suites:
+        for check in SUITES[prefix].CHECKS:
+            name = f"{prefix}.{check.name}"
+            interval = args.schema_interval if check.structural else args.liveness_interval
+            for pattern, seconds in args.interval:
+                if fnmatch.fnmatchcase(name, pattern):
+                    interval = seconds
+                    break
+            renamed = Check(name, check.func, tuple(f"{prefix}.{dep}" for dep in check.depends_on), check.structural)
+            states[name] = CheckState(check=renamed, suite=prefix, interval=interval)
+    return states
+
+
+def result_key(passed: bool, output: str) -> Tuple[Tuple[str, ...], List[str]]:
+    """
+    Failure lines (what identifies a result) and all status lines (shown in /status).
+
+    `[OK] Found 5 profile(s)` changes with the data, so only `[FAIL]` lines
+    take part in change detection, with numbers masked: "circuit open ...
+    retrying in 12.3s" is the same failure on every run.
+    """
+    lines = [line.strip() for line in output.splitlines() if line.strip().startswith('[')]
+    failures = tuple(NUMBER.sub('#', line) for line in lines if line.startswith('[FAIL]'))
+    if not passed and not failures:
+        failures = ('[FAIL] check returned False',)
+    return failures, lines
+
+
+# ==================
+# DAEMON
+# ==================
+
+class VerifyDaemon:
+    def __init__(self, states: Dict[str, CheckState], marker_interval: float, confirm: int = 1,
+                 webhook: Optional[str] = None, quiet: bool = False):
+        self.states = states
+        self.marker_interval = marker_interval
+        self.confirm = max(1, confirm)
+        self.webhook = webhook
+        self.quiet = quiet
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+        self.started_at = utc_now()
+        self.started = time.monotonic()
+        self.marker: Optional[str] = None
+        self.next_marker = 0.0
+        self.rounds = 0
+        self.events = 0
+
+    # ---- status ----
+
+    def healthy(self) -> bool:
+        return all(state.passed for state in self.states.values())
+
+    def status(self) -> Dict:
+        with self.lock:
+            return {
+                'healthy': self.healthy(),
+                'environment': SUPABASE_URL,
+                'started_at': self.started_at,
+                'uptime_seconds': round(time.monotonic() - self.started),
+                'rounds': self.rounds,
+                'events': self.events,
+                'schema_marker': self.marker,
+                'circuit_breakers': get_transport().breaker_states(),
+                'checks': {name: state.to_dict() for name, state in self.states.items()},
+            }
+
+    def metrics(self) -> str:
+        lines = [
+            '# TYPE verify_daemon_check_up gauge',
+            '# TYPE verify_daemon_check_duration_seconds gauge',
+            '# TYPE verify_daemon_check_changes_total counter',
+        ]
+        with self.lock:
+            for name, state in self.states.items():
+                label = f'check="{name}"'
+                if state.passed is not None:
+                    lines.append(f'verify_daemon_check_up{{{label}}} {int(state.passed)}')
+                if state.duration_ms is not None:
+                    lines.append(f'verify_daemon_check_duration_seconds{{{label}}} {state.duration_ms / 1000:.6f}')
+                lines.append(f'verify_daemon_check_changes_total{{{label}}} {state.changes}')
+            lines.append(f'verify_daemon_healthy {int(self.healthy())}')
+        return '\n'.join(lines) + '\n'
+
+    # ---- events ----
+
+    def emit(self, event: Dict):
+        """Print, append to the event log and (optionally) POST one change event; counted only when quiet"""
+        event = {'at': utc_now(), **event}
+        self.events += 1
+        if self.quiet:
+            return
+        OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+        with open(OUTPUT_DIR / 'events.ndjson', 'a', encoding='utf-8') as f:
+            f.write(json.dumps(event) + '\n')
+
+        if event['type'] == 'check':
+            icon = '[OK]' if event['passed'] else '[FAIL]'
+            previous = {None: 'new', True: 'pass', False: 'fail'}[event['previous']]
+            reason = f" - {event['detail'][0]}" if event['detail'] else ''
+            print(f"{event['at']} {icon} {event['check']} ({previous} -> "
+                  f"{'pass' if event['passed'] else 'fail'}){reason}")
+        else:
+            print(f"{event['at']} [*] Schema changed: {event['previous']} -> {event['marker']}")
+        sys.stdout.flush()
+
+        if self.webhook:
+            try:
+                response = get_transport().post(self.webhook, json=event, timeout=(5, 10))
+                if response.status_code >= 300:
+                    print(f"[WARN] Webhook returned HTTP {response.status_code}")
+            except requests.RequestException as e:
+                print(f"[WARN] Webhook failed: {str(e)}")
+
+    def write_status(self):
+        OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+        path = OUTPUT_DIR / 'status.json'
+        tmp = path.with_suffix('.json.tmp')
+        tmp.write_text(json.dumps(self.status(), indent=2), encoding='utf-8')
+        os.replace(tmp, path)
+
+    # ---- scheduling ----
+
+    def poll_marker(self, now: float):
+        """Re-run structural checks right away when the server's schema changes"""
+        if now < self.next_marker:
+            return
+        self.next_marker = now + self.marker_interval
+        marker = server_schema_marker(verify_auth_migration.REST_URL, verify_auth_migration.HEADERS)
+        if marker is None or marker == self.marker:
+            return
+        previous, self.marker = self.marker, marker
+        if previous is None:
+            return
+        self.emit({'type': 'schema', 'previous': previous, 'marker': marker})
+        with self.lock:
+            for state in self.states.values():
+                if state.check.structural:
+                    state.next_run = now
+
+    def run_due(self, now: float) -> List[Dict]:
+        """Run every check that is due in one concurrent batch; returns change events"""
+        due = [state for state in self.states.values() if state.next_run <= now]
+        if not due:
+            return []
+
+        # Structural checks read the process-wide schema cache; drop it so this
+        # round sees the live schema (fetched once, shared by the batch)
+        for prefix in {state.suite for state in due if state.check.structural}:
+            invalidate_schema(SUITES[prefix].REST_URL)
+
+        # Dependencies on checks that aren't due this round are dropped: their
+        # last result stands, and run_checks only orders what it is given
+        names = {state.check.name for state in due}
+        batch = [Check(s.check.name, s.check.func, tuple(d for d in s.check.depends_on if d in names),
+                       s.check.structural) for s in due]
+
+        started: Dict[str, float] = {name: time.monotonic() for name in names}
+        finished: Dict[str, Tuple[bool, str, float]] = {}
+
+        def on_result(name: str, passed: bool, output: str):
+            finished[name] = (passed, output, time.monotonic() - started[name])
+
+        # Checks print their usual report; nobody reads it, only the diff matters
+        with contextlib.redirect_stdout(io.StringIO()):
+            run_checks(batch, on_result=on_result)
+
+        events = []
+        with self.lock:
+            self.rounds += 1
+            for state in due:
+                passed, output, elapsed = finished[state.check.name]
+                failures, lines = result_key(passed, output)
+                state.runs += 1
+                state.last_run = utc_now()
+                state.duration_ms = round(elapsed * 1000, 1)
+                state.next_run = now + state.interval
+                state.detail = lines
+
+                if state.passed == passed and state.failures == failures:
+                    state.pending, state.pending_count = None, 0
+                    continue
+                # The first result is always reported; later ones once confirmed
+                if state.passed is not None and self.confirm > 1:
+                    if state.pending == (passed, failures):
+                        state.pending_count += 1
+                    else:
+                        state.pending, state.pending_count = (passed, failures), 1
+                    if state.pending_count < self.confirm:
+                        # Check again soon rather than waiting a full interval
+                        state.next_run = now + min(state.interval, DEFAULT_LIVENESS_INTERVAL)
+                        continue
+
+                events.append({'type': 'check', 'check': state.check.name, 'passed': passed,
+                               'previous': state.passed,
+                               'detail': [line for line in lines if line.startswith('[FAIL]')]})
+                state.passed, state.failures = passed, failures
+                state.since = state.last_run
+                state.changes += 1
+                state.pending, state.pending_count = None, 0
+        return events
+
+    def tick(self):
+        now = time.monotonic()
+        self.poll_marker(now)
+        events = self.run_due(now)
+        for event in events:
+            self.emit(event)
+        if events:
+            self.write_status()
+
+    def next_wakeup(self) -> float:
+        with self.lock:
+            soonest = min([state.next_run for state in self.states.values()] + [self.next_marker])
+        return max(0.0, min(soonest - time.monotonic(), 5.0))
+
+    def run_forever(self):
+        while not self.stop.is_set():
+            self.tick()
+            self.stop.wait(self.next_wakeup())
+
+
+# ==================
+# HTTP ENDPOINT
+# ==================
+
+def make_handler(daemon: VerifyDaemon):
+    class StatusHandler(BaseHTTPRequestHandler):
+        def _send(self, code: int, body: str, content_type: str):
+            data = body.encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            path = self.path.split('?', 1)[0].rstrip('/') or '/'
+            if path in ('/', '/status'):
+                self._send(200, json.dumps(daemon.status(), indent=2), 'application/json')
+            elif path == '/healthz':
+                healthy = daemon.healthy()
+                self._send(200 if healthy else 503, json.dumps({'healthy': healthy}), 'application/json')
+            elif path == '/metrics':
+                self._send(200, daemon.metrics(), 'text/plain; version=0.0.4')
+            else:
+                self._send(404, json.dumps({'error': 'not found'}), 'application/json')
+
+        def log_message(self, format, *args):
+            # Polled every few seconds by monitors; an access log is just noise
+            pass
+
+    return StatusHandler
+
+
+# ==================
+# MAIN
+# ==================
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Continuously verify the Supabase project, reporting only changes")
+    parser.add_argument('--suites', default=','.join(SUITES),
+                        help=f"Comma-separated check suites (default: {','.join(SUITES)})")
+    parser.add_argument('--schema-interval', type=float, default=DEFAULT_SCHEMA_INTERVAL,
+                        help="Seconds between structural checks (default: 3600)")
+    parser.add_argument('--liveness-interval', type=float, default=DEFAULT_LIVENESS_INTERVAL,
+                        help="Seconds between liveness checks and schema marker polls (default: 30)")
+    parser.add_argument('--interval', type=parse_interval, action='append', default=[], metavar='PATTERN=SECONDS',
+                        help="Override the interval for checks matching a glob, e.g. 'auth.rls_*=10' (repeatable)")
+    parser.add_argument('--confirm', type=int, default=1,
+                        help="Consecutive identical results needed before a change is reported (default: 1)")
+    parser.add_argument('--host', default='127.0.0.1', help="Status endpoint bind address (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8787, help="Status endpoint port, 0 to disable (default: 8787)")
+    parser.add_argument('--webhook', help="POST every change event as JSON to this URL")
+    parser.add_argument('--once', action='store_true', help="Run every check once, print the status and exit")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        print("❌ Error: SUPABASE_URL and SUPABASE_KEY must be set in .env file")
+        return 1
+
+    suites = [name.strip() for name in args.suites.split(',') if name.strip()]
+    unknown = [name for name in suites if name not in SUITES]
+    if unknown or not suites:
+        print(f"❌ Error: Unknown suite(s): {', '.join(unknown) or '(none)'} (choose from {', '.join(SUITES)})")
+        return 1
+    if args.schema_interval <= 0 or args.liveness_interval <= 0:
+        print("❌ Error: --schema-interval and --liveness-interval must be positive")
+        return 1
+
+    states = build_states(suites, args)
+    daemon = VerifyDaemon(states, marker_interval=args.liveness_interval, confirm=args.confirm,
+                          webhook=args.webhook, quiet=args.once)
+
+    if args.once:
+        daemon.tick()
+        print(json.dumps(daemon.status(), indent=2))
+        return 0 if daemon.healthy() else 1
+
+    print(f"[*] Verify daemon for {SUPABASE_URL}")
+    for name, state in states.items():
+        print(f"   {name:<32} every {state.interval:g}s")
+
+    server = None
+    if args.port:
+        try:
+            server = ThreadingHTTPServer((args.host, args.port), make_handler(daemon))
+        except OSError as e:
+            print(f"❌ Error: Cannot listen on {args.host}:{args.port}: {str(e)}")
+            return 1
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name='status-http', daemon=True).start()
+        print(f"[*] Status on http://{args.host}:{server.server_address[1]}/status")
+    print("[*] Reporting changes only (Ctrl+C to stop)\n")
+
+    def request_stop(signum, frame):
+        daemon.stop.set()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    try:
+        daemon.run_forever()
+    finally:
+        if server:
+            server.shutdown()
+            server.server_close()
+        daemon.write_status()
+        get_transport().close()
+
+    status = daemon.status()
+    failing = [name for name, check in status['checks'].items() if check['passed'] is False]
+    print(f"\n[*] Stopped after {status['rounds']} round(s), {status['events']} event(s)")
+    if failing:
+        print(f"[WARN] Failing at shutdown: {', '.join(failing)}")
+    return 0
+
+
+if __name__ == "__main__":
+    exit_code = main()
+    sys.exit(exit_code)
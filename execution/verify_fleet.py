@@ -0,0 +1,413 @@
+"""
+Verify Fleet: Run the verification suites against many Supabase environments at once
+
+The verify scripts check the single project in .env. After a migration is
+rolled out to prod, staging and every preview branch, this runs the same
+checks (the suites of verify_daemon.py) against all of them in parallel and
+prints one matrix of environment x check.
+
+Each environment is verified in its own worker process, started with that
+environment's SUPABASE_URL/SUPABASE_KEY:
+
+    connection pool     the worker's shared transport (supabase_transport.py)
+                        belongs to that environment alone: its own keep-alive
+                        pool, rate limit and circuit breaker
+    isolated failures   a dead project, a bad key, a crash or a hang (--timeout)
+                        fails that environment's row, never the run
+    one check cycle     --parallel environments at a time (default: 16), each
+                        running its checks concurrently (CHECK_WORKERS)
+
+Structural checks always run: the verification cache is not used, since
+fleet runs usually follow a migration.
+
+Manifest (JSON):
+    {
+      "env": {"SUPABASE_HTTP_RPS": "20"},
+      "environments": [
+        {"name": "prod", "url": "https://abcd.supabase.co", "key_env": "SUPABASE_KEY_PROD"},
+        {"name": "staging", "url": "https://efgh.supabase.co", "key_env": "SUPABASE_KEY_STAGING",
+         "env": {"CHECK_WORKERS": "4"}},
+        {"name": "pr-1234", "url": "https://ijkl.supabase.co", "key_env": "SUPABASE_KEY_PREVIEW"}
+      ]
+    }
+
+    key_env names an environment variable (or .env entry) holding the
+    service_role key; "key" is accepted too but keeps the secret in the file.
+    "env" (top level, or per environment) is passed to the worker, e.g. to
+    tune SUPABASE_HTTP_* or CHECK_WORKERS. A bare list of environments works.
+
+Usage:
+    python execution/verify_fleet.py --manifest fleet.json
+    python execution/verify_fleet.py --manifest fleet.json --only 'pr-*' --suites story
+    python execution/verify_fleet.py --manifest fleet.json --parallel 40 --timeout 120
+
+Requirements:
+    - python-dotenv==1.0.1, requests==2.31.0
+
+Environment:
+    CHECK_WORKERS   - Max checks running at once per environment (default: 8)
+    SUPABASE_HTTP_* - Rate limit, concurrency cap, timeout and retries, per environment
+
+Outputs:
+    stdout - One line per environment as it finishes, then the matrix
+    .tmp/verify_fleet/fleet_<timestamp>.json - Every environment's results and failure output
+    .tmp/verify_fleet/fleet_<timestamp>.md   - The matrix as a Markdown table (for PR comments)
+"""
+
+import argparse
+import contextlib
+import fnmatch
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List
+
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+OUTPUT_DIR = Path('.tmp') / 'verify_fleet'
+
+DEFAULT_PARALLEL = 16
+DEFAULT_TIMEOUT = 300.0
+
+
+# ==================
+# WORKER (one environment, in its own process)
+# ==================
+
+def run_worker(suites: List[str]) -> int:
+    """Run the suites against SUPABASE_URL and print the results as one JSON line"""
+    # Imported here: the verify scripts read SUPABASE_URL/KEY at import time,
+    # and only the worker process has this environment's values set
+    from check_runner import Check, run_checks
+    from supabase_transport import get_transport
+    from verify_daemon import SUITES
+
+    checks = []
+    for prefix in suites:
+        for check in SUITES[prefix].CHECKS:
+            checks.append(Check(f"{prefix}.{check.name}", check.func,
+                                tuple(f"{prefix}.{dep}" for dep in check.depends_on), check.structural))
+
+    outputs: Dict[str, str] = {}
+
+    def on_result(name: str, passed: bool, output: str):
+        outputs[name] = output
+
+    started = time.monotonic()
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = run_checks(checks, on_result=on_result)
+    transport = get_transport()
+
+    print(json.dumps({
+        'checks': {name: {'passed': passed, 'output': outputs.get(name, '')} for name, passed in results.items()},
+        'seconds': round(time.monotonic() - started, 2),
+        'transport': dict(transport.stats, breakers=transport.breaker_states()),
+    }))
+    transport.close()
+    return 0
+
+
+# ==================
+# MANIFEST
+# ==================
+
+def load_manifest(path: Path) -> List[Dict]:
+    """Parse and validate the manifest; raises ValueError on anything malformed"""
+    try:
+        document = json.loads(path.read_text(encoding='utf-8'))
+    except (OSError, json.JSONDecodeError) as e:
+        raise ValueError(f"Cannot read manifest {path}: {str(e)}")
+
+    defaults = {}
+    if isinstance(document, dict):
+        defaults = document.get('env') or {}
+        document = document.get('environments')
+    if not isinstance(document, list) or not document:
+        raise ValueError("Manifest must list at least one environment")
+
+    environments, seen = [], set()
+    for index, entry in enumerate(document):
+        if not isinstance(entry, dict) or not entry.get('name') or not entry.get('url'):
+            raise ValueError(f"Environment #{index + 1} needs a 'name' and a 'url'")
+        if entry['name'] in seen:
+            raise ValueError(f"Duplicate environment name: {entry['name']}")
+        if not entry.get('key') and not entry.get('key_env'):
+            raise ValueError(f"Environment '{entry['name']}' needs 'key_env' (or 'key')")
+        seen.add(entry['name'])
+        environments.append({
+            'name': str(entry['name']),
+            'url': str(entry['url']).rstrip('/'),
+            'key': entry.get('key'),
+            'key_env': entry.get('key_env'),
+            'env': {str(k): str(v) for k, v in {**defaults, **(entry.get('env') or {})}.items()},
+        })
+    return environments
+
+
+# ==================
+# FAN-OUT
+# ==================
+
+def _tail(text: str, lines: int = 5) -> str:
+    return '\n'.join(text.strip().splitlines()[-lines:])
+
+
+def verify_environment(environment: Dict, suites: List[str], timeout: float) -> Dict:
+    """Run one environment's worker; every way it can go wrong becomes this row's status"""
+    result = {'name': environment['name'], 'url': environment['url'], 'checks': {}, 'error': None}
+    started = time.monotonic()
+
+    key = environment['key'] or os.getenv(environment['key_env'] or '')
+    if not key:
+        result.update(status='error', seconds=0.0, error=f"{environment['key_env']} is not set")
+        return result
+
+    worker_env = {**os.environ, **environment['env'], 'SUPABASE_URL': environment['url'], 'SUPABASE_KEY': key}
+    command = [sys.executable, str(Path(__file__).resolve()), '--worker', '--suites', ','.join(suites)]
+    try:
+        completed = subprocess.run(command, env=worker_env, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        result.update(status='timeout', seconds=round(time.monotonic() - started, 2),
+                      error=f"No result after {timeout:g}s (worker killed)")
+        return result
+    result['seconds'] = round(time.monotonic() - started, 2)
+
+    lines = completed.stdout.strip().splitlines()
+    try:
+        report = json.loads(lines[-1]) if completed.returncode == 0 and lines else None
+    except json.JSONDecodeError:
+        report = None
+    if report is None:
+        detail = _tail(completed.stderr) or _tail(completed.stdout) or f"exit code {completed.returncode}"
+        result.update(status='error', error=f"Worker failed: {detail}")
+        return result
+
+    result['checks'] = report['checks']
+    result['transport'] = report.get('transport')
+    result['status'] = 'passed' if all(check['passed'] for check in report['checks'].values()) else 'failed'
+    return result
+
+
+def run_fleet(environments: List[Dict], suites: List[str], parallel: int, timeout: float) -> List[Dict]:
+    """Verify every environment, printing a line for each as it finishes; rows come back in manifest order"""
+    width = max(len(environment['name']) for environment in environments)
+    results: Dict[str, Dict] = {}
+    with ThreadPoolExecutor(max_workers=parallel, thread_name_prefix='fleet') as pool:
+        futures = {pool.submit(verify_environment, environment, suites, timeout): environment
+                   for environment in environments}
+        for future in as_completed(futures):
+            result = future.result()
+            results[result['name']] = result
+            passed = sum(check['passed'] for check in result['checks'].values())
+            if result['status'] == 'passed':
+                print(f"[OK]   {result['name']:<{width}}  {passed}/{len(result['checks'])} ({result['seconds']:.1f}s)")
+            elif result['status'] == 'failed':
+                failing = [name for name, check in result['checks'].items() if not check['passed']]
+                print(f"[FAIL] {result['name']:<{width}}  {passed}/{len(result['checks'])} "
+                      f"({result['seconds']:.1f}s): {', '.join(failing)}")
+            else:
+                print(f"[FAIL] {result['name']:<{width}}  {result['status']}: {result['error'].splitlines()[-1]}")
+    return [results[environment['name']] for environment in environments]
+
+
+# ==================
+# REPORT
+# ==================
+
+def check_names(results: List[Dict]) -> List[str]:
+    """Every check seen in any environment, in suite order"""
+    names: List[str] = []
+    for result in results:
+        for name in result['checks']:
+            if name not in names:
+                names.append(name)
+    return names
+
+
+def failure_groups(results: List[Dict]) -> Dict[tuple, List[str]]:
+    """(check, failure lines) -> environments, so one broken migration reads as one row"""
+    from verify_daemon import result_key
+
+    groups: Dict[tuple, List[str]] = defaultdict(list)
+    for result in results:
+        if all_failed(result):
+            continue
+        for name, check in result['checks'].items():
+            if not check['passed']:
+                failures, _ = result_key(False, check['output'])
+                groups[(name, failures)].append(result['name'])
+    return groups
+
+
+def all_failed(result: Dict) -> bool:
+    """Every check failed: the environment is unreachable or misconfigured, not one migration short"""
+    return bool(result['checks']) and not any(check['passed'] for check in result['checks'].values())
+
+
+def first_failure(output: str, limit: int = 160) -> str:
+    lines = [line.strip() for line in output.splitlines() if line.strip().startswith('[FAIL]')]
+    reason = lines[0][len('[FAIL]'):].strip() if lines else 'failed'
+    return reason if len(reason) <= limit else reason[:limit - 3] + '...'
+
+
+def print_matrix(results: List[Dict]):
+    names = check_names(results)
+    width = max([len(result['name']) for result in results] + [len('environment')])
+
+    print(f"\n{'='*60}")
+    print("  Fleet Verification Matrix")
+    print(f"{'='*60}\n")
+    for index, name in enumerate(names, 1):
+        print(f"   {index:>2}  {name}")
+    print("\n   .  passed   X  failed   ?  not run\n")
+
+    header = ' '.join(f"{index:>2}" for index in range(1, len(names) + 1))
+    print(f"   {'environment':<{width}}  {header}  result")
+    for result in results:
+        cells = []
+        for name in names:
+            check = result['checks'].get(name)
+            cells.append(f"{'?' if check is None else '.' if check['passed'] else 'X':>2}")
+        if result['status'] in ('passed', 'failed'):
+            passed = sum(check['passed'] for check in result['checks'].values())
+            outcome = f"{passed}/{len(result['checks'])}"
+        else:
+            outcome = result['status']
+        print(f"   {result['name']:<{width}}  {' '.join(cells)}  {outcome}")
+
+    by_name = {result['name']: result for result in results}
+    groups = failure_groups(results)
+    if groups:
+        print("\n   Failures by check:")
+        for (name, _), environments in sorted(groups.items(), key=lambda item: (-len(item[1]), item[0][0])):
+            # Same masked failure everywhere in the group; show one environment's actual line
+            reason = first_failure(by_name[environments[0]]['checks'][name]['output'])
+            print(f"   [FAIL] {name} in {len(environments)} environment(s): {reason}")
+            print(f"          {', '.join(environments)}")
+    unreachable = [result for result in results if result['status'] not in ('passed', 'failed') or all_failed(result)]
+    if unreachable:
+        print("\n   Not verified:")
+        for result in unreachable:
+            if result['error']:
+                print(f"   [FAIL] {result['name']} ({result['status']}): {result['error']}")
+            else:
+                first = next(iter(result['checks'].values()))
+                print(f"   [FAIL] {result['name']} (every check failed): {first_failure(first['output'])}")
+
+
+def markdown_matrix(results: List[Dict]) -> str:
+    names = check_names(results)
+    lines = [
+        '| Environment | ' + ' | '.join(f'`{name}`' for name in names) + ' | Result |',
+        '|---|' + '---|' * len(names) + '---|',
+    ]
+    for result in results:
+        cells = []
+        for name in names:
+            check = result['checks'].get(name)
+            cells.append('—' if check is None else '✅' if check['passed'] else '❌')
+        if result['status'] in ('passed', 'failed'):
+            outcome = f"{sum(check['passed'] for check in result['checks'].values())}/{len(result['checks'])}"
+        else:
+            outcome = f"{result['status']}: {result['error'].splitlines()[-1]}"
+        lines.append(f"| {result['name']} | " + ' | '.join(cells) + f" | {outcome} |")
+    return '\n'.join(lines) + '\n'
+
+
+def write_reports(results: List[Dict], suites: List[str], seconds: float) -> List[Path]:
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    json_path = OUTPUT_DIR / f"fleet_{stamp}.json"
+    json_path.write_text(json.dumps({
+        'finished_at': datetime.now().isoformat(),
+        'suites': suites,
+        'seconds': round(seconds, 2),
+        'environments': results,
+    }, indent=2), encoding='utf-8')
+    markdown_path = OUTPUT_DIR / f"fleet_{stamp}.md"
+    markdown_path.write_text(markdown_matrix(results), encoding='utf-8')
+    return [json_path, markdown_path]
+
+
+# ==================
+# MAIN
+# ==================
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Verify many Supabase environments in parallel")
+    parser.add_argument('--manifest', type=Path, help="JSON manifest of environments (see module docstring)")
+    parser.add_argument('--only', action='append', default=[], metavar='GLOB',
+                        help="Only environments whose name matches, e.g. 'pr-*' (repeatable)")
+    parser.add_argument('--suites', default=None, help="Comma-separated check suites (default: all)")
+    parser.add_argument('--parallel', type=int, default=DEFAULT_PARALLEL,
+                        help=f"Environments verified at once (default: {DEFAULT_PARALLEL})")
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT,
+                        help=f"Seconds before an environment's worker is killed (default: {DEFAULT_TIMEOUT:g})")
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    from verify_daemon import SUITES
+    suites = [name.strip() for name in (args.suites or ','.join(SUITES)).split(',') if name.strip()]
+    unknown = [name for name in suites if name not in SUITES]
+    if unknown or not suites:
+        print(f"❌ Error: Unknown suite(s): {', '.join(unknown) or '(none)'} (choose from {', '.join(SUITES)})")
+        return 1
+
+    if args.worker:
+        return run_worker(suites)
+
+    if not args.manifest:
+        print("❌ Error: --manifest is required")
+        return 1
+    if args.parallel < 1 or args.timeout <= 0:
+        print("❌ Error: --parallel and --timeout must be positive")
+        return 1
+    try:
+        environments = load_manifest(args.manifest)
+    except ValueError as e:
+        print(f"❌ Error: {str(e)}")
+        return 1
+    if args.only:
+        environments = [environment for environment in environments
+                        if any(fnmatch.fnmatch(environment['name'], pattern) for pattern in args.only)]
+        if not environments:
+            print(f"❌ Error: No environment matches {', '.join(args.only)}")
+            return 1
+
+    parallel = min(args.parallel, len(environments))
+    print(f"\n[*] Verifying {len(environments)} environment(s), {parallel} at a time (suites: {', '.join(suites)})\n")
+
+    started = time.monotonic()
+    results = run_fleet(environments, suites, parallel, args.timeout)
+    seconds = time.monotonic() - started
+
+    print_matrix(results)
+    paths = write_reports(results, suites, seconds)
+
+    passed = sum(result['status'] == 'passed' for result in results)
+    print(f"\n[*] Result: {passed}/{len(results)} environment(s) passed in {seconds:.1f}s")
+    print(f"[*] Reports written to {paths[0]} and {paths[1].name}")
+    if passed == len(results):
+        print("\n[SUCCESS] Every environment passed every check.")
+        return 0
+    print("\n[WARNING] Some environments failed. Review the matrix above.")
+    return 1
+
+
+if __name__ == "__main__":
+    exit_code = main()
+    sys.exit(exit_code)
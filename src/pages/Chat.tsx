@@ -185,11 +185,9 @@ const Chat = () => {
     try {
       setIsSessionEnded(true);
 
-      // Calculate billable minutes
-      const totalSeconds = sessionTime;
-      const freeSeconds = (advisor.freeMinutes || 0) * 60;
-      const billableSeconds = Math.max(0, totalSeconds - freeSeconds);
-      const billableMinutes = Math.ceil(billableSeconds / 60); // Round up
+      // Whole session minutes: the RPC takes off the free minutes recorded
+      // by start_rtc_session, like the billing ticker does
+      const billableMinutes = Math.ceil(sessionTime / 60); // Round up
 
       // Determine connection quality
       const quality: ConnectionQuality = 'good';
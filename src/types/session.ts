@@ -153,6 +153,7 @@ export interface StartSessionArgs {
  */
 export interface EndSessionArgs {
   p_session_id: string;
+  /** Whole session minutes, free minutes included (the RPC subtracts them) */
   p_billable_minutes: number;
   p_connection_quality?: ConnectionQuality;
 }
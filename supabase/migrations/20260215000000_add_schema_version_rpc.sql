@@ -0,0 +1,40 @@
+-- =====================================================
+-- Migration: Schema Version RPC
+-- Date: 2026-02-15
+-- Description: Expose the latest applied migration version so
+--              execution scripts can fingerprint the server schema
+--              with one tiny request (see execution/verification_cache.py)
+-- =====================================================
+
+-- ==================
+-- 1. CREATE FUNCTION
+-- ==================
+
+-- Returns the newest version recorded by `supabase db push`, or NULL when the
+-- migrations table doesn't exist (schema applied by hand)
+CREATE OR REPLACE FUNCTION public.get_schema_version()
+RETURNS TEXT AS $$
+DECLARE
+  v_version TEXT;
+BEGIN
+  SELECT MAX(version) INTO v_version
+  FROM supabase_migrations.schema_migrations;
+
+  RETURN v_version;
+EXCEPTION
+  WHEN undefined_table OR invalid_schema_name THEN
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql STABLE SECURITY DEFINER SET search_path = '';
+
+-- ==================
+-- 2. GRANT PERMISSIONS
+-- ==================
+
+GRANT EXECUTE ON FUNCTION public.get_schema_version() TO anon, authenticated;
+
+COMMENT ON FUNCTION public.get_schema_version IS 'Latest applied migration version (used to fingerprint the schema for verification caching)';
+
+-- ==================
+-- MIGRATION COMPLETE
+-- ==================
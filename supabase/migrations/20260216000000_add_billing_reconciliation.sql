@@ -0,0 +1,129 @@
+-- =====================================================
+-- Migration: Billing Reconciliation
+-- Date: 2026-02-16
+-- Description: Set-based RPC that finalizes billing for a batch of
+--              completed sessions left in 'pending'/'processing'
+--              (used by execution/reconcile_billing.py)
+-- =====================================================
+
+-- ==================
+-- 1. CREATE FUNCTION
+-- ==================
+
+-- Sessions end up stuck when they're completed outside end_rtc_session
+-- (e.g. a direct UPDATE of status, whose trigger only moves billing to
+-- 'processing') or when a client disconnects before billing runs.
+--
+-- The worker sends the cost it computed for each session; rows whose cost
+-- no longer matches the stored billable_minutes/free_minutes_applied/
+-- rate_per_minute are skipped so the next pass re-reads them. A NULL cost
+-- flags the session as 'failed' (it can't be priced, e.g. no rate).
+--
+-- Credits are debited once per client for the whole batch. A client who
+-- can't cover the batch has those sessions flagged 'failed' instead of
+-- going negative. Rows locked by another transaction are skipped.
+CREATE OR REPLACE FUNCTION public.reconcile_session_billing(
+  p_session_ids UUID[],
+  p_costs DECIMAL[]
+)
+RETURNS TABLE (
+  session_id UUID,
+  final_status billing_status,
+  credits_deducted INTEGER
+) AS $$
+BEGIN
+  RETURN QUERY
+  WITH input AS (
+    -- A repeated id keeps its first entry, so a session can't be debited twice
+    SELECT DISTINCT ON (u.id)
+      u.id,
+      u.cost
+    FROM unnest(p_session_ids, p_costs) WITH ORDINALITY AS u(id, cost, ord)
+    WHERE u.id IS NOT NULL
+    ORDER BY u.id, u.ord
+  ),
+  targets AS (
+    SELECT
+      s.id,
+      s.client_id,
+      u.cost,
+      COALESCE(CEIL(u.cost), 0)::INTEGER AS credits
+    FROM public.sessions s
+    JOIN input u ON u.id = s.id
+    WHERE s.status = 'completed'
+      AND s.billing_status IN ('pending', 'processing')
+      AND (
+        u.cost IS NULL
+        OR u.cost = GREATEST(0, (s.billable_minutes - s.free_minutes_applied) * s.rate_per_minute)
+      )
+    FOR UPDATE OF s SKIP LOCKED
+  ),
+  per_client AS (
+    SELECT t.client_id, SUM(t.credits)::INTEGER AS credits
+    FROM targets t
+    WHERE t.cost IS NOT NULL
+    GROUP BY t.client_id
+  ),
+  client_locks AS MATERIALIZED (
+    -- UPDATE ... FROM locks profiles in plan order; taking the locks here
+    -- in id order first keeps concurrent batches from deadlocking
+    SELECT p.id
+    FROM public.profiles p
+    WHERE p.id IN (SELECT pc.client_id FROM per_client pc)
+    ORDER BY p.id
+    FOR UPDATE
+  ),
+  debited AS (
+    UPDATE public.profiles p
+    SET credits = p.credits - pc.credits,
+        updated_at = NOW()
+    FROM per_client pc
+    JOIN client_locks cl ON cl.id = pc.client_id
+    WHERE p.id = pc.client_id
+      AND p.credits >= pc.credits
+    RETURNING p.id
+  ),
+  finalized AS (
+    UPDATE public.sessions s
+    SET
+      cost_total = COALESCE(t.cost, s.cost_total),
+      billing_status = CASE
+        WHEN t.cost IS NOT NULL AND d.id IS NOT NULL THEN 'completed'
+        ELSE 'failed'
+      END::billing_status,
+      last_billed_at = NOW()
+    FROM targets t
+    LEFT JOIN debited d ON d.id = t.client_id
+    WHERE s.id = t.id
+    RETURNING s.id, s.billing_status, CASE WHEN d.id IS NOT NULL THEN t.credits ELSE 0 END
+  )
+  SELECT * FROM finalized;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- ==================
+-- 2. RECONCILIATION INDEX
+-- ==================
+
+-- reconcile_billing.py pages stuck sessions in (last_billed_at NULLS FIRST,
+-- id) keyset order. The index from 20260214000000 is on last_billed_at
+-- alone, ASC NULLS LAST, so each page sorted the whole stuck set; this one
+-- matches the order and the tie-breaker, so a page is a short index scan.
+DROP INDEX IF EXISTS public.idx_sessions_last_billed_at;
+CREATE INDEX idx_sessions_last_billed_at
+  ON public.sessions(last_billed_at NULLS FIRST, id)
+  WHERE billing_status IN ('pending', 'processing');
+
+-- ==================
+-- 3. GRANT PERMISSIONS
+-- ==================
+
+-- Moves credits for arbitrary clients: back-office (service_role) only
+REVOKE EXECUTE ON FUNCTION public.reconcile_session_billing FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.reconcile_session_billing TO service_role;
+
+COMMENT ON FUNCTION public.reconcile_session_billing IS 'Finalizes billing for a batch of completed sessions stuck in pending/processing; one debit per client';
+
+-- ==================
+-- MIGRATION COMPLETE
+-- ==================
@@ -0,0 +1,376 @@
+-- =====================================================
+-- Migration: Credit Ledger
+-- Date: 2026-02-17
+-- Description: Append-only ledger for every credit movement and a
+--              single-statement conditional debit. add_credits,
+--              deduct_credits, end_rtc_session and
+--              reconcile_session_billing all post through it
+--              (stress-tested by execution/stress_credit_ledger.py)
+-- =====================================================
+
+-- ==================
+-- 1. CREATE LEDGER TABLE
+-- ==================
+
+-- profiles.credits stays the balance the app reads; every change to it has
+-- a matching ledger row, so SUM(delta) per user always equals credits.
+-- No foreign keys: the audit trail outlives deleted users and sessions.
+CREATE TABLE IF NOT EXISTS public.credit_ledger (
+  id BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+  user_id UUID NOT NULL,
+  delta INTEGER NOT NULL CHECK (delta <> 0),
+  balance_after INTEGER NOT NULL CHECK (balance_after >= 0),
+  reason TEXT NOT NULL CHECK (reason IN ('opening', 'credit', 'debit', 'session', 'reconciliation')),
+  session_id UUID,
+  created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW() NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_credit_ledger_user_id ON public.credit_ledger(user_id, id);
+CREATE INDEX IF NOT EXISTS idx_credit_ledger_session_id ON public.credit_ledger(session_id) WHERE session_id IS NOT NULL;
+
+-- Existing balances become opening entries
+INSERT INTO public.credit_ledger (user_id, delta, balance_after, reason)
+SELECT id, credits, credits, 'opening'
+FROM public.profiles
+WHERE credits > 0
+  AND NOT EXISTS (SELECT 1 FROM public.credit_ledger l WHERE l.user_id = profiles.id);
+
+-- New writes can't take a balance negative (existing rows aren't re-checked)
+ALTER TABLE public.profiles DROP CONSTRAINT IF EXISTS profiles_credits_non_negative;
+ALTER TABLE public.profiles
+  ADD CONSTRAINT profiles_credits_non_negative CHECK (credits >= 0) NOT VALID;
+
+-- ==================
+-- 2. APPEND-ONLY AND BALANCE GUARDS
+-- ==================
+
+CREATE OR REPLACE FUNCTION public.reject_credit_ledger_change()
+RETURNS TRIGGER AS $$
+BEGIN
+  RAISE EXCEPTION 'credit_ledger is append-only'
+    USING ERRCODE = '42501';
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS credit_ledger_append_only ON public.credit_ledger;
+CREATE TRIGGER credit_ledger_append_only
+  BEFORE UPDATE OR DELETE ON public.credit_ledger
+  FOR EACH ROW
+  EXECUTE FUNCTION public.reject_credit_ledger_change();
+
+DROP TRIGGER IF EXISTS credit_ledger_no_truncate ON public.credit_ledger;
+CREATE TRIGGER credit_ledger_no_truncate
+  BEFORE TRUNCATE ON public.credit_ledger
+  FOR EACH STATEMENT
+  EXECUTE FUNCTION public.reject_credit_ledger_change();
+
+-- "Users can update own profile" would otherwise let a client write its own
+-- balance column through PostgREST. The ledger functions run as their owner
+-- (SECURITY DEFINER), so only direct anon/authenticated writes are refused;
+-- which balances those functions may move is checked inside them (below).
+CREATE OR REPLACE FUNCTION public.guard_profile_credits()
+RETURNS TRIGGER AS $$
+BEGIN
+  IF NEW.credits IS DISTINCT FROM OLD.credits AND current_user IN ('anon', 'authenticated') THEN
+    RAISE EXCEPTION 'credits can only change through add_credits/deduct_credits'
+      USING ERRCODE = '42501';
+  END IF;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS guard_profile_credits ON public.profiles;
+CREATE TRIGGER guard_profile_credits
+  BEFORE UPDATE OF credits ON public.profiles
+  FOR EACH ROW
+  EXECUTE FUNCTION public.guard_profile_credits();
+
+-- Profiles created with a balance (seed data, admin inserts) get an opening entry
+CREATE OR REPLACE FUNCTION public.open_credit_ledger()
+RETURNS TRIGGER AS $$
+BEGIN
+  IF NEW.credits > 0 THEN
+    INSERT INTO public.credit_ledger (user_id, delta, balance_after, reason)
+    VALUES (NEW.id, NEW.credits, NEW.credits, 'opening');
+  END IF;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+DROP TRIGGER IF EXISTS open_credit_ledger ON public.profiles;
+CREATE TRIGGER open_credit_ledger
+  AFTER INSERT ON public.profiles
+  FOR EACH ROW
+  EXECUTE FUNCTION public.open_credit_ledger();
+
+-- ==================
+-- 3. LEDGER FUNCTIONS
+-- ==================
+
+-- Applies a signed change and records it in ONE statement. The UPDATE's row
+-- lock serializes concurrent entries for the same user and its balance guard
+-- is re-evaluated against the latest committed balance after waiting on that
+-- lock, so concurrent debits can neither lose updates nor overdraw.
+-- Returns the new balance, or NULL for an unknown user / insufficient credits.
+CREATE OR REPLACE FUNCTION public.post_credit_entry(
+  p_user_id UUID,
+  p_delta INTEGER,
+  p_reason TEXT,
+  p_session_id UUID DEFAULT NULL
+)
+RETURNS INTEGER AS $$
+DECLARE
+  v_balance INTEGER;
+BEGIN
+  IF p_delta IS NULL OR p_delta = 0 THEN
+    RAISE EXCEPTION 'Credit entry delta must be non-zero';
+  END IF;
+
+  WITH applied AS (
+    UPDATE public.profiles
+    SET credits = credits + p_delta,
+        updated_at = NOW()
+    WHERE id = p_user_id
+      AND credits + p_delta >= 0
+    RETURNING id, credits
+  )
+  INSERT INTO public.credit_ledger (user_id, delta, balance_after, reason, session_id)
+  SELECT id, p_delta, credits, p_reason, p_session_id
+  FROM applied
+  RETURNING balance_after INTO v_balance;
+
+  RETURN v_balance;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- Same signatures as before; the read-compare-update race is gone. Still
+-- granted to authenticated (AddCredit.tsx tops up through add_credits), so
+-- a signed-in caller may only move its own balance; service_role and direct
+-- connections have no auth.uid() and may move anyone's. An amount of 0 is
+-- a no-op returning true, as before; negative amounts, which used to move
+-- credits the other way unchecked, are refused.
+CREATE OR REPLACE FUNCTION public.check_credit_caller(p_user_id UUID, p_amount INTEGER)
+RETURNS VOID AS $$
+BEGIN
+  IF auth.uid() IS NOT NULL AND p_user_id IS DISTINCT FROM auth.uid() THEN
+    RAISE EXCEPTION 'Can only change your own credits'
+      USING ERRCODE = '42501';
+  END IF;
+  IF p_amount IS NULL OR p_amount < 0 THEN
+    RAISE EXCEPTION 'Amount must be positive';
+  END IF;
+END;
+$$ LANGUAGE plpgsql STABLE;
+
+CREATE OR REPLACE FUNCTION public.deduct_credits(
+  user_id UUID,
+  amount INTEGER
+)
+RETURNS BOOLEAN AS $$
+BEGIN
+  PERFORM public.check_credit_caller(deduct_credits.user_id, amount);
+  IF amount = 0 THEN
+    RETURN TRUE;
+  END IF;
+
+  RETURN public.post_credit_entry(deduct_credits.user_id, -amount, 'debit') IS NOT NULL;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+CREATE OR REPLACE FUNCTION public.add_credits(
+  user_id UUID,
+  amount INTEGER
+)
+RETURNS BOOLEAN AS $$
+BEGIN
+  PERFORM public.check_credit_caller(add_credits.user_id, amount);
+  IF amount = 0 THEN
+    RETURN TRUE;
+  END IF;
+
+  RETURN public.post_credit_entry(add_credits.user_id, amount, 'credit') IS NOT NULL;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- ==================
+-- 4. SESSION BILLING THROUGH THE LEDGER
+-- ==================
+
+-- Locks the session row so two concurrent ends can't both bill it, links the
+-- debit to the session, and marks billing 'failed' (not 'completed') when
+-- the client can't pay.
+CREATE OR REPLACE FUNCTION public.end_rtc_session(
+  p_session_id UUID,
+  p_billable_minutes INTEGER,
+  p_connection_quality connection_quality DEFAULT 'good'
+)
+RETURNS BOOLEAN AS $$
+DECLARE
+  v_session RECORD;
+  v_total_cost DECIMAL;
+  v_credits_to_deduct INTEGER;
+  v_paid BOOLEAN := TRUE;
+BEGIN
+  SELECT * INTO v_session
+  FROM public.sessions
+  WHERE id = p_session_id
+  AND status = 'active'
+  FOR UPDATE;
+
+  IF NOT FOUND THEN
+    RAISE EXCEPTION 'Session not found or not active';
+  END IF;
+
+  v_total_cost := GREATEST(0, (p_billable_minutes - v_session.free_minutes_applied) * v_session.rate_per_minute);
+  v_credits_to_deduct := CEIL(v_total_cost)::INTEGER;
+
+  IF v_credits_to_deduct > 0 THEN
+    v_paid := public.post_credit_entry(v_session.client_id, -v_credits_to_deduct, 'session', p_session_id) IS NOT NULL;
+  END IF;
+
+  UPDATE public.sessions
+  SET
+    status = 'completed',
+    ended_at = NOW(),
+    billable_minutes = p_billable_minutes,
+    cost_total = v_total_cost,
+    connection_quality = p_connection_quality,
+    last_billed_at = NOW(),
+    billing_status = CASE WHEN v_paid THEN 'completed' ELSE 'failed' END::billing_status
+  WHERE id = p_session_id;
+
+  RETURN TRUE;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- As in 20260216000000, plus one ledger row per paid session. balance_after
+-- walks back from the client's final balance in session id order.
+CREATE OR REPLACE FUNCTION public.reconcile_session_billing(
+  p_session_ids UUID[],
+  p_costs DECIMAL[]
+)
+RETURNS TABLE (
+  session_id UUID,
+  final_status billing_status,
+  credits_deducted INTEGER
+) AS $$
+BEGIN
+  RETURN QUERY
+  WITH input AS (
+    -- A repeated id keeps its first entry, so a session can't be debited twice
+    SELECT DISTINCT ON (u.id)
+      u.id,
+      u.cost
+    FROM unnest(p_session_ids, p_costs) WITH ORDINALITY AS u(id, cost, ord)
+    WHERE u.id IS NOT NULL
+    ORDER BY u.id, u.ord
+  ),
+  targets AS (
+    SELECT
+      s.id,
+      s.client_id,
+      u.cost,
+      COALESCE(CEIL(u.cost), 0)::INTEGER AS credits
+    FROM public.sessions s
+    JOIN input u ON u.id = s.id
+    WHERE s.status = 'completed'
+      AND s.billing_status IN ('pending', 'processing')
+      AND (
+        u.cost IS NULL
+        OR u.cost = GREATEST(0, (s.billable_minutes - s.free_minutes_applied) * s.rate_per_minute)
+      )
+    FOR UPDATE OF s SKIP LOCKED
+  ),
+  per_client AS (
+    SELECT t.client_id, SUM(t.credits)::INTEGER AS credits
+    FROM targets t
+    WHERE t.cost IS NOT NULL
+    GROUP BY t.client_id
+  ),
+  client_locks AS MATERIALIZED (
+    -- UPDATE ... FROM locks profiles in plan order; taking the locks here
+    -- in id order first keeps concurrent batches from deadlocking
+    SELECT p.id
+    FROM public.profiles p
+    WHERE p.id IN (SELECT pc.client_id FROM per_client pc)
+    ORDER BY p.id
+    FOR UPDATE
+  ),
+  debited AS (
+    UPDATE public.profiles p
+    SET credits = p.credits - pc.credits,
+        updated_at = NOW()
+    FROM per_client pc
+    JOIN client_locks cl ON cl.id = pc.client_id
+    WHERE p.id = pc.client_id
+      AND p.credits >= pc.credits
+    RETURNING p.id, p.credits AS balance, pc.credits AS debit
+  ),
+  ledger AS (
+    INSERT INTO public.credit_ledger (user_id, delta, balance_after, reason, session_id)
+    SELECT
+      t.client_id,
+      -t.credits,
+      d.balance + d.debit - SUM(t.credits) OVER (PARTITION BY t.client_id ORDER BY t.id),
+      'reconciliation',
+      t.id
+    FROM targets t
+    JOIN debited d ON d.id = t.client_id
+    WHERE t.cost IS NOT NULL
+      AND t.credits > 0
+  ),
+  finalized AS (
+    UPDATE public.sessions s
+    SET
+      cost_total = COALESCE(t.cost, s.cost_total),
+      billing_status = CASE
+        WHEN t.cost IS NOT NULL AND d.id IS NOT NULL THEN 'completed'
+        ELSE 'failed'
+      END::billing_status,
+      last_billed_at = NOW()
+    FROM targets t
+    LEFT JOIN debited d ON d.id = t.client_id
+    WHERE s.id = t.id
+    RETURNING s.id, s.billing_status, CASE WHEN d.id IS NOT NULL THEN t.credits ELSE 0 END
+  )
+  SELECT * FROM finalized;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- ==================
+-- 5. ROW LEVEL SECURITY
+-- ==================
+
+ALTER TABLE public.credit_ledger ENABLE ROW LEVEL SECURITY;
+
+-- Users can read their own history; only the ledger functions write
+DROP POLICY IF EXISTS "Users can view own credit ledger" ON public.credit_ledger;
+CREATE POLICY "Users can view own credit ledger"
+  ON public.credit_ledger FOR SELECT
+  USING (auth.uid() = user_id);
+
+-- ==================
+-- 6. GRANT PERMISSIONS
+-- ==================
+
+-- Posts arbitrary entries for any user: back-office (service_role) only
+REVOKE EXECUTE ON FUNCTION public.post_credit_entry FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.post_credit_entry TO service_role;
+REVOKE EXECUTE ON FUNCTION public.check_credit_caller FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.check_credit_caller TO service_role;
+
+-- ==================
+-- 7. ADD COMMENTS FOR DOCUMENTATION
+-- ==================
+
+COMMENT ON TABLE public.credit_ledger IS 'Append-only record of every credit movement; SUM(delta) per user equals profiles.credits';
+COMMENT ON COLUMN public.credit_ledger.balance_after IS 'profiles.credits immediately after this entry';
+COMMENT ON FUNCTION public.post_credit_entry IS 'Applies a credit change and records it in one statement; NULL if it would overdraw';
+COMMENT ON FUNCTION public.check_credit_caller IS 'Refuses a signed-in caller moving another user''s credits, and negative amounts';
+COMMENT ON FUNCTION public.deduct_credits IS 'Debits credits if the balance covers it (single conditional UPDATE, ledgered); own account only for signed-in callers';
+COMMENT ON FUNCTION public.add_credits IS 'Adds credits to a user (ledgered); own account only for signed-in callers';
+COMMENT ON FUNCTION public.end_rtc_session IS 'Ends an active session, calculates final billing, and deducts credits atomically';
+
+-- ==================
+-- MIGRATION COMPLETE
+-- ==================
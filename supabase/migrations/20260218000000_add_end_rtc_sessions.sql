@@ -0,0 +1,156 @@
+-- =====================================================
+-- Migration: Bulk Session Finalization
+-- Date: 2026-02-18
+-- Description: Set-based end_rtc_sessions RPC that ends and bills a
+--              batch of active sessions in one statement (advisor bulk
+--              disconnects, room teardowns; used by
+--              execution/end_sessions_batch.py)
+-- =====================================================
+
+-- ==================
+-- 1. CREATE FUNCTION
+-- ==================
+
+-- Same pricing as end_rtc_session, but for N sessions it's one UPDATE of
+-- sessions (one trigger run per row instead of two), one debit per client
+-- and one ledger row per paid session, instead of N round-trips.
+--
+-- Sessions, then the batch's client profiles, are locked in id order so
+-- concurrent batches can't deadlock.
+-- Sessions that aren't active (already ended, unknown id) are left out of
+-- the result instead of raising. A client who can't cover all of their
+-- sessions in the batch has those sessions marked 'failed'.
+-- p_connection_qualities may be NULL (all 'good') or match p_session_ids.
+-- A NULL in p_billable_minutes raises, naming the session: it would price
+-- to NULL and fail the whole batch on billable_minutes NOT NULL.
+CREATE OR REPLACE FUNCTION public.end_rtc_sessions(
+  p_session_ids UUID[],
+  p_billable_minutes INTEGER[],
+  p_connection_qualities connection_quality[] DEFAULT NULL
+)
+RETURNS TABLE (
+  session_id UUID,
+  final_status billing_status,
+  credits_deducted INTEGER
+) AS $$
+#variable_conflict use_column
+DECLARE
+  v_missing_minutes UUID;
+BEGIN
+  IF cardinality(p_session_ids) IS DISTINCT FROM cardinality(p_billable_minutes)
+     OR (p_connection_qualities IS NOT NULL
+         AND cardinality(p_connection_qualities) <> cardinality(p_session_ids)) THEN
+    RAISE EXCEPTION 'p_session_ids, p_billable_minutes and p_connection_qualities must have the same length';
+  END IF;
+
+  SELECT u.id INTO v_missing_minutes
+  FROM unnest(p_session_ids, p_billable_minutes) AS u(id, minutes)
+  WHERE u.id IS NOT NULL AND u.minutes IS NULL
+  LIMIT 1;
+  IF FOUND THEN
+    RAISE EXCEPTION 'p_billable_minutes is NULL for session %', v_missing_minutes
+      USING ERRCODE = '22004';
+  END IF;
+
+  RETURN QUERY
+  WITH input AS (
+    -- A repeated id keeps its first entry; multi-array unnest pads a NULL
+    -- qualities array with NULLs
+    SELECT DISTINCT ON (u.id)
+      u.id,
+      u.minutes,
+      COALESCE(u.quality, 'good'::connection_quality) AS quality
+    FROM unnest(p_session_ids, p_billable_minutes, p_connection_qualities)
+      WITH ORDINALITY AS u(id, minutes, quality, ord)
+    WHERE u.id IS NOT NULL
+    ORDER BY u.id, u.ord
+  ),
+  locked AS (
+    SELECT
+      s.id,
+      s.client_id,
+      i.minutes,
+      i.quality,
+      GREATEST(0, (i.minutes - s.free_minutes_applied) * s.rate_per_minute) AS cost
+    FROM public.sessions s
+    JOIN input i ON i.id = s.id
+    WHERE s.status = 'active'
+    ORDER BY s.id
+    FOR UPDATE OF s
+  ),
+  priced AS (
+    SELECT l.*, COALESCE(CEIL(l.cost), 0)::INTEGER AS credits
+    FROM locked l
+  ),
+  per_client AS (
+    SELECT pr.client_id, SUM(pr.credits)::INTEGER AS credits
+    FROM priced pr
+    WHERE pr.credits > 0
+    GROUP BY pr.client_id
+  ),
+  client_locks AS MATERIALIZED (
+    -- UPDATE ... FROM locks profiles in plan order; taking the locks here
+    -- in id order first keeps concurrent batches from deadlocking
+    SELECT p.id
+    FROM public.profiles p
+    WHERE p.id IN (SELECT pc.client_id FROM per_client pc)
+    ORDER BY p.id
+    FOR UPDATE
+  ),
+  debited AS (
+    UPDATE public.profiles p
+    SET credits = p.credits - pc.credits,
+        updated_at = NOW()
+    FROM per_client pc
+    JOIN client_locks cl ON cl.id = pc.client_id
+    WHERE p.id = pc.client_id
+      AND p.credits >= pc.credits
+    RETURNING p.id, p.credits AS balance, pc.credits AS debit
+  ),
+  ledger AS (
+    INSERT INTO public.credit_ledger (user_id, delta, balance_after, reason, session_id)
+    SELECT
+      pr.client_id,
+      -pr.credits,
+      d.balance + d.debit - SUM(pr.credits) OVER (PARTITION BY pr.client_id ORDER BY pr.id),
+      'session',
+      pr.id
+    FROM priced pr
+    JOIN debited d ON d.id = pr.client_id
+    WHERE pr.credits > 0
+  ),
+  finalized AS (
+    UPDATE public.sessions s
+    SET
+      status = 'completed',
+      ended_at = NOW(),
+      billable_minutes = pr.minutes,
+      cost_total = pr.cost,
+      connection_quality = pr.quality,
+      last_billed_at = NOW(),
+      billing_status = CASE
+        WHEN pr.credits = 0 OR d.id IS NOT NULL THEN 'completed'
+        ELSE 'failed'
+      END::billing_status
+    FROM priced pr
+    LEFT JOIN debited d ON d.id = pr.client_id
+    WHERE s.id = pr.id
+    RETURNING s.id, s.billing_status, CASE WHEN pr.credits > 0 AND d.id IS NOT NULL THEN pr.credits ELSE 0 END
+  )
+  SELECT * FROM finalized;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- ==================
+-- 2. GRANT PERMISSIONS
+-- ==================
+
+-- Ends sessions for arbitrary users: back-office (service_role) only
+REVOKE EXECUTE ON FUNCTION public.end_rtc_sessions FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.end_rtc_sessions TO service_role;
+
+COMMENT ON FUNCTION public.end_rtc_sessions IS 'Ends and bills a batch of active sessions in one statement; one debit per client';
+
+-- ==================
+-- MIGRATION COMPLETE
+-- ==================
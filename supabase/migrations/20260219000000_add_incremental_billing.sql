@@ -0,0 +1,513 @@
+-- =====================================================
+-- Migration: Incremental Session Billing
+-- Date: 2026-02-19
+-- Description: Bill active sessions every minute instead of only at the end
+--              (bill_active_sessions, driven by execution/billing_ticker.py).
+--              The end/reconcile paths settle the difference with what
+--              the ticker already took (a debit or a refund).
+-- =====================================================
+
+-- ==================
+-- 1. TRACK CREDITS ALREADY CHARGED
+-- ==================
+
+-- Constant default: metadata-only on Postgres 11+, no table rewrite
+ALTER TABLE public.sessions
+  ADD COLUMN IF NOT EXISTS credits_charged INTEGER DEFAULT 0 NOT NULL;
+
+-- Set while the client can't cover an active session's ticks. Kept apart
+-- from billing_status, which stays 'processing' so a session completed by
+-- a direct status update is still picked up by reconciliation.
+ALTER TABLE public.sessions
+  ADD COLUMN IF NOT EXISTS credits_exhausted_at TIMESTAMP WITH TIME ZONE;
+
+-- The ticker's scan: active sessions, least recently billed first
+CREATE INDEX IF NOT EXISTS idx_sessions_active_last_billed_at
+  ON public.sessions(last_billed_at NULLS FIRST)
+  WHERE status = 'active';
+
+-- Per-shard scan. Session ids hash into 1024 fixed buckets and a shard is a
+-- contiguous bucket range, so each ticker reads only its own sessions
+-- instead of filtering every active one.
+CREATE INDEX IF NOT EXISTS idx_sessions_active_shard_bucket
+  ON public.sessions((hashtext(id::text) & 1023), last_billed_at NULLS FIRST)
+  WHERE status = 'active';
+
+-- ==================
+-- 2. ONE PRICING BASIS
+-- ==================
+
+-- What a session costs after p_minutes of it, free minutes included. The
+-- ticker, the end calls and reconciliation all price through this, so the
+-- ticker's running charge and the final bill can't disagree on the formula;
+-- free minutes are taken off here only (they're stored at start).
+CREATE OR REPLACE FUNCTION public.session_cost(
+  p_minutes INTEGER,
+  p_free_minutes INTEGER,
+  p_rate_per_minute DECIMAL
+)
+RETURNS DECIMAL AS $$
+  SELECT GREATEST(0, (p_minutes - p_free_minutes) * p_rate_per_minute);
+$$ LANGUAGE sql IMMUTABLE;
+
+-- ==================
+-- 3. CREATE TICKER FUNCTION
+-- ==================
+
+-- Bills up to p_limit active sessions in shard p_shard of p_shard_count that
+-- haven't been billed in the last p_interval_seconds.
+--
+-- A session owes CEIL(cost of whole elapsed minutes) - credits_charged, so
+-- the charge is a running total, not an increment: billing the same session
+-- twice in a tick charges nothing the second time, and the end call settles
+-- exactly the difference (a refund if the client reports fewer minutes).
+-- Rows are claimed with SKIP LOCKED, so concurrent callers on one shard
+-- split the work instead of queueing, and sessions being ended right now
+-- are left for the next tick.
+--
+-- Shard p of n covers buckets [p * 1024 / n, (p + 1) * 1024 / n), read
+-- through idx_sessions_active_shard_bucket, so n is at most 1024.
+--
+-- One debit per client per call. A client who can't cover all of their
+-- sessions is charged nothing; those sessions get credits_exhausted_at
+-- (exhausted = TRUE) while they stay active, cleared on a later tick once
+-- the client can pay.
+CREATE OR REPLACE FUNCTION public.bill_active_sessions(
+  p_shard INTEGER DEFAULT 0,
+  p_shard_count INTEGER DEFAULT 1,
+  p_limit INTEGER DEFAULT 500,
+  p_interval_seconds INTEGER DEFAULT 60
+)
+RETURNS TABLE (
+  session_id UUID,
+  credits_debited INTEGER,
+  exhausted BOOLEAN,
+  lag_seconds DOUBLE PRECISION
+) AS $$
+#variable_conflict use_column
+BEGIN
+  IF p_shard_count < 1 OR p_shard_count > 1024 THEN
+    RAISE EXCEPTION 'p_shard_count must be between 1 and 1024';
+  END IF;
+  IF p_shard < 0 OR p_shard >= p_shard_count THEN
+    RAISE EXCEPTION 'Shard % is outside 0..%', p_shard, p_shard_count - 1;
+  END IF;
+  -- With no interval a drained session is due again at once and a caller
+  -- paging until a short page would never stop
+  IF p_interval_seconds < 1 THEN
+    RAISE EXCEPTION 'p_interval_seconds must be at least 1';
+  END IF;
+
+  RETURN QUERY
+  WITH due AS (
+    SELECT
+      s.id,
+      s.client_id,
+      s.last_billed_at,
+      GREATEST(
+        0,
+        CEIL(public.session_cost(
+          floor(EXTRACT(EPOCH FROM (NOW() - s.started_at)) / 60)::INTEGER,
+          s.free_minutes_applied,
+          s.rate_per_minute
+        ))::INTEGER - s.credits_charged
+      ) AS owed
+    FROM public.sessions s
+    WHERE s.status = 'active'
+      AND s.started_at IS NOT NULL
+      AND s.rate_per_minute IS NOT NULL
+      AND (s.last_billed_at IS NULL OR s.last_billed_at <= NOW() - make_interval(secs => p_interval_seconds))
+      AND (hashtext(s.id::text) & 1023) >= p_shard * 1024 / p_shard_count
+      AND (hashtext(s.id::text) & 1023) < (p_shard + 1) * 1024 / p_shard_count
+    ORDER BY s.last_billed_at NULLS FIRST
+    LIMIT p_limit
+    FOR UPDATE OF s SKIP LOCKED
+  ),
+  per_client AS (
+    SELECT d.client_id, SUM(d.owed)::INTEGER AS credits
+    FROM due d
+    WHERE d.owed > 0
+    GROUP BY d.client_id
+  ),
+  client_locks AS MATERIALIZED (
+    -- UPDATE ... FROM locks profiles in plan order; taking the locks here
+    -- in id order first keeps concurrent batches from deadlocking
+    SELECT p.id
+    FROM public.profiles p
+    WHERE p.id IN (SELECT pc.client_id FROM per_client pc)
+    ORDER BY p.id
+    FOR UPDATE
+  ),
+  debited AS (
+    UPDATE public.profiles p
+    SET credits = p.credits - pc.credits,
+        updated_at = NOW()
+    FROM per_client pc
+    JOIN client_locks cl ON cl.id = pc.client_id
+    WHERE p.id = pc.client_id
+      AND p.credits >= pc.credits
+    RETURNING p.id, p.credits AS balance, pc.credits AS debit
+  ),
+  ledger AS (
+    INSERT INTO public.credit_ledger (user_id, delta, balance_after, reason, session_id)
+    SELECT
+      d.client_id,
+      -d.owed,
+      db.balance + db.debit - SUM(d.owed) OVER (PARTITION BY d.client_id ORDER BY d.id),
+      'session',
+      d.id
+    FROM due d
+    JOIN debited db ON db.id = d.client_id
+    WHERE d.owed > 0
+  ),
+  billed AS (
+    UPDATE public.sessions s
+    SET
+      credits_charged = s.credits_charged + CASE WHEN db.id IS NOT NULL THEN d.owed ELSE 0 END,
+      last_billed_at = NOW(),
+      billing_status = 'processing',
+      credits_exhausted_at = CASE
+        WHEN d.owed = 0 OR db.id IS NOT NULL THEN NULL
+        ELSE COALESCE(s.credits_exhausted_at, NOW())
+      END
+    FROM due d
+    LEFT JOIN debited db ON db.id = d.client_id
+    WHERE s.id = d.id
+    RETURNING
+      s.id,
+      CASE WHEN d.owed > 0 AND db.id IS NOT NULL THEN d.owed ELSE 0 END,
+      d.owed > 0 AND db.id IS NULL,
+      COALESCE(EXTRACT(EPOCH FROM (NOW() - d.last_billed_at))::DOUBLE PRECISION - p_interval_seconds, 0)
+  )
+  SELECT * FROM billed;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- ==================
+-- 4. SETTLE AGAINST THE TICKER AT THE END
+-- ==================
+
+-- As in 20260217000000, settled against what the ticker already charged:
+-- the client is debited the rest of CEIL(cost_total), or refunded the
+-- difference when the ticker charged more (the client reported fewer
+-- minutes than the ticker saw elapse). Either way credits_charged and the
+-- session's ledger entries end at CEIL(cost_total).
+CREATE OR REPLACE FUNCTION public.end_rtc_session(
+  p_session_id UUID,
+  p_billable_minutes INTEGER,
+  p_connection_quality connection_quality DEFAULT 'good'
+)
+RETURNS BOOLEAN AS $$
+DECLARE
+  v_session RECORD;
+  v_total_cost DECIMAL;
+  v_credits_due INTEGER;
+  v_paid BOOLEAN := TRUE;
+BEGIN
+  SELECT * INTO v_session
+  FROM public.sessions
+  WHERE id = p_session_id
+  AND status = 'active'
+  FOR UPDATE;
+
+  IF NOT FOUND THEN
+    RAISE EXCEPTION 'Session not found or not active';
+  END IF;
+
+  v_total_cost := public.session_cost(p_billable_minutes, v_session.free_minutes_applied, v_session.rate_per_minute);
+  -- Negative when the ticker charged more than the session costs
+  v_credits_due := CEIL(v_total_cost)::INTEGER - v_session.credits_charged;
+
+  IF v_credits_due > 0 THEN
+    v_paid := public.post_credit_entry(v_session.client_id, -v_credits_due, 'session', p_session_id) IS NOT NULL;
+  ELSIF v_credits_due < 0 THEN
+    -- Only fails for a deleted client; the charge then stays as it is
+    IF public.post_credit_entry(v_session.client_id, -v_credits_due, 'session', p_session_id) IS NULL THEN
+      v_credits_due := 0;
+    END IF;
+  END IF;
+
+  UPDATE public.sessions
+  SET
+    status = 'completed',
+    ended_at = NOW(),
+    billable_minutes = p_billable_minutes,
+    cost_total = v_total_cost,
+    connection_quality = p_connection_quality,
+    credits_charged = credits_charged + CASE WHEN v_paid THEN v_credits_due ELSE 0 END,
+    last_billed_at = NOW(),
+    billing_status = CASE WHEN v_paid THEN 'completed' ELSE 'failed' END::billing_status
+  WHERE id = p_session_id;
+
+  RETURN TRUE;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- As in 20260218000000, settled against the ticker like end_rtc_session.
+-- Per client, refunds always apply; the debits apply only if the balance
+-- plus the refunds covers them. credits_deducted is negative for a refund.
+-- A NULL in p_billable_minutes raises, naming the session, as there.
+CREATE OR REPLACE FUNCTION public.end_rtc_sessions(
+  p_session_ids UUID[],
+  p_billable_minutes INTEGER[],
+  p_connection_qualities connection_quality[] DEFAULT NULL
+)
+RETURNS TABLE (
+  session_id UUID,
+  final_status billing_status,
+  credits_deducted INTEGER
+) AS $$
+#variable_conflict use_column
+DECLARE
+  v_missing_minutes UUID;
+BEGIN
+  IF cardinality(p_session_ids) IS DISTINCT FROM cardinality(p_billable_minutes)
+     OR (p_connection_qualities IS NOT NULL
+         AND cardinality(p_connection_qualities) <> cardinality(p_session_ids)) THEN
+    RAISE EXCEPTION 'p_session_ids, p_billable_minutes and p_connection_qualities must have the same length';
+  END IF;
+
+  SELECT u.id INTO v_missing_minutes
+  FROM unnest(p_session_ids, p_billable_minutes) AS u(id, minutes)
+  WHERE u.id IS NOT NULL AND u.minutes IS NULL
+  LIMIT 1;
+  IF FOUND THEN
+    RAISE EXCEPTION 'p_billable_minutes is NULL for session %', v_missing_minutes
+      USING ERRCODE = '22004';
+  END IF;
+
+  RETURN QUERY
+  WITH input AS (
+    SELECT DISTINCT ON (u.id)
+      u.id,
+      u.minutes,
+      COALESCE(u.quality, 'good'::connection_quality) AS quality
+    FROM unnest(p_session_ids, p_billable_minutes, p_connection_qualities)
+      WITH ORDINALITY AS u(id, minutes, quality, ord)
+    WHERE u.id IS NOT NULL
+    ORDER BY u.id, u.ord
+  ),
+  locked AS (
+    SELECT
+      s.id,
+      s.client_id,
+      s.credits_charged,
+      i.minutes,
+      i.quality,
+      public.session_cost(i.minutes, s.free_minutes_applied, s.rate_per_minute) AS cost
+    FROM public.sessions s
+    JOIN input i ON i.id = s.id
+    WHERE s.status = 'active'
+    ORDER BY s.id
+    FOR UPDATE OF s
+  ),
+  priced AS (
+    -- Signed: negative when the ticker charged more than the session costs
+    SELECT l.*, COALESCE(CEIL(l.cost), 0)::INTEGER - l.credits_charged AS credits
+    FROM locked l
+  ),
+  per_client AS (
+    SELECT
+      pr.client_id,
+      SUM(GREATEST(pr.credits, 0))::INTEGER AS debit,
+      SUM(GREATEST(-pr.credits, 0))::INTEGER AS refund
+    FROM priced pr
+    WHERE pr.credits <> 0
+    GROUP BY pr.client_id
+  ),
+  client_locks AS MATERIALIZED (
+    -- UPDATE ... FROM locks profiles in plan order; taking the locks here
+    -- in id order first keeps concurrent batches from deadlocking
+    SELECT p.id, p.credits
+    FROM public.profiles p
+    WHERE p.id IN (SELECT pc.client_id FROM per_client pc)
+    ORDER BY p.id
+    FOR UPDATE
+  ),
+  settled AS (
+    SELECT pc.*, cl.credits + pc.refund >= pc.debit AS paid
+    FROM per_client pc
+    JOIN client_locks cl ON cl.id = pc.client_id
+  ),
+  debited AS (
+    UPDATE public.profiles p
+    SET credits = p.credits + st.refund - CASE WHEN st.paid THEN st.debit ELSE 0 END,
+        updated_at = NOW()
+    FROM settled st
+    WHERE p.id = st.client_id
+      AND (st.paid OR st.refund > 0)
+    RETURNING p.id, p.credits AS balance, st.paid
+  ),
+  applied AS (
+    SELECT pr.id, pr.client_id, pr.credits
+    FROM priced pr
+    JOIN debited d ON d.id = pr.client_id
+    WHERE pr.credits < 0 OR (pr.credits > 0 AND d.paid)
+  ),
+  ledger AS (
+    -- Refunds first, so no entry's balance_after dips below the final one
+    INSERT INTO public.credit_ledger (user_id, delta, balance_after, reason, session_id)
+    SELECT
+      a.client_id,
+      -a.credits,
+      d.balance + SUM(a.credits) OVER (PARTITION BY a.client_id)
+        - SUM(a.credits) OVER (PARTITION BY a.client_id ORDER BY a.credits > 0, a.id),
+      'session',
+      a.id
+    FROM applied a
+    JOIN debited d ON d.id = a.client_id
+  ),
+  finalized AS (
+    UPDATE public.sessions s
+    SET
+      status = 'completed',
+      ended_at = NOW(),
+      billable_minutes = pr.minutes,
+      cost_total = pr.cost,
+      connection_quality = pr.quality,
+      credits_charged = s.credits_charged + COALESCE(a.credits, 0),
+      last_billed_at = NOW(),
+      billing_status = CASE
+        WHEN pr.credits <= 0 OR a.id IS NOT NULL THEN 'completed'
+        ELSE 'failed'
+      END::billing_status
+    FROM priced pr
+    LEFT JOIN applied a ON a.id = pr.id
+    WHERE s.id = pr.id
+    RETURNING s.id, s.billing_status, COALESCE(a.credits, 0)
+  )
+  SELECT * FROM finalized;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- As in 20260217000000, settled against the ticker like end_rtc_sessions
+-- (sessions completed by a direct status update after some ticks)
+CREATE OR REPLACE FUNCTION public.reconcile_session_billing(
+  p_session_ids UUID[],
+  p_costs DECIMAL[]
+)
+RETURNS TABLE (
+  session_id UUID,
+  final_status billing_status,
+  credits_deducted INTEGER
+) AS $$
+BEGIN
+  RETURN QUERY
+  WITH input AS (
+    -- A repeated id keeps its first entry, so a session can't be debited twice
+    SELECT DISTINCT ON (u.id)
+      u.id,
+      u.cost
+    FROM unnest(p_session_ids, p_costs) WITH ORDINALITY AS u(id, cost, ord)
+    WHERE u.id IS NOT NULL
+    ORDER BY u.id, u.ord
+  ),
+  targets AS (
+    SELECT
+      s.id,
+      s.client_id,
+      u.cost,
+      -- Signed: negative when the ticker charged more than the session costs
+      COALESCE(CEIL(u.cost), 0)::INTEGER - s.credits_charged AS credits
+    FROM public.sessions s
+    JOIN input u ON u.id = s.id
+    WHERE s.status = 'completed'
+      AND s.billing_status IN ('pending', 'processing')
+      AND (
+        u.cost IS NULL
+        OR u.cost = public.session_cost(s.billable_minutes, s.free_minutes_applied, s.rate_per_minute)
+      )
+    FOR UPDATE OF s SKIP LOCKED
+  ),
+  per_client AS (
+    SELECT
+      t.client_id,
+      SUM(GREATEST(t.credits, 0))::INTEGER AS debit,
+      SUM(GREATEST(-t.credits, 0))::INTEGER AS refund
+    FROM targets t
+    WHERE t.cost IS NOT NULL
+      AND t.credits <> 0
+    GROUP BY t.client_id
+  ),
+  client_locks AS MATERIALIZED (
+    -- UPDATE ... FROM locks profiles in plan order; taking the locks here
+    -- in id order first keeps concurrent batches from deadlocking
+    SELECT p.id, p.credits
+    FROM public.profiles p
+    WHERE p.id IN (SELECT pc.client_id FROM per_client pc)
+    ORDER BY p.id
+    FOR UPDATE
+  ),
+  settled AS (
+    SELECT pc.*, cl.credits + pc.refund >= pc.debit AS paid
+    FROM per_client pc
+    JOIN client_locks cl ON cl.id = pc.client_id
+  ),
+  debited AS (
+    UPDATE public.profiles p
+    SET credits = p.credits + st.refund - CASE WHEN st.paid THEN st.debit ELSE 0 END,
+        updated_at = NOW()
+    FROM settled st
+    WHERE p.id = st.client_id
+      AND (st.paid OR st.refund > 0)
+    RETURNING p.id, p.credits AS balance, st.paid
+  ),
+  applied AS (
+    SELECT t.id, t.client_id, t.credits
+    FROM targets t
+    JOIN debited d ON d.id = t.client_id
+    WHERE t.cost IS NOT NULL
+      AND (t.credits < 0 OR (t.credits > 0 AND d.paid))
+  ),
+  ledger AS (
+    -- Refunds first, so no entry's balance_after dips below the final one
+    INSERT INTO public.credit_ledger (user_id, delta, balance_after, reason, session_id)
+    SELECT
+      a.client_id,
+      -a.credits,
+      d.balance + SUM(a.credits) OVER (PARTITION BY a.client_id)
+        - SUM(a.credits) OVER (PARTITION BY a.client_id ORDER BY a.credits > 0, a.id),
+      'reconciliation',
+      a.id
+    FROM applied a
+    JOIN debited d ON d.id = a.client_id
+  ),
+  finalized AS (
+    UPDATE public.sessions s
+    SET
+      cost_total = COALESCE(t.cost, s.cost_total),
+      credits_charged = s.credits_charged + COALESCE(a.credits, 0),
+      billing_status = CASE
+        WHEN t.cost IS NOT NULL AND (t.credits <= 0 OR a.id IS NOT NULL) THEN 'completed'
+        ELSE 'failed'
+      END::billing_status,
+      last_billed_at = NOW()
+    FROM targets t
+    LEFT JOIN applied a ON a.id = t.id
+    WHERE s.id = t.id
+    RETURNING s.id, s.billing_status, COALESCE(a.credits, 0)
+  )
+  SELECT * FROM finalized;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- ==================
+-- 5. GRANT PERMISSIONS
+-- ==================
+
+-- Debits arbitrary users: back-office (service_role) only
+REVOKE EXECUTE ON FUNCTION public.bill_active_sessions FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.bill_active_sessions TO service_role;
+
+-- ==================
+-- 6. ADD COMMENTS FOR DOCUMENTATION
+-- ==================
+
+COMMENT ON COLUMN public.sessions.credits_charged IS 'Credits debited for this session so far, net of refunds; CEIL(cost_total) once settled';
+COMMENT ON COLUMN public.sessions.credits_exhausted_at IS 'Since when the client could not pay for this active session''s ticks; NULL when paid up';
+COMMENT ON FUNCTION public.session_cost IS 'Cost of a session after p_minutes (free minutes included, taken off here)';
+COMMENT ON FUNCTION public.bill_active_sessions IS 'Charges active sessions in one hash shard (range of 1024 buckets) for elapsed whole minutes; one debit per client';
+
+-- ==================
+-- MIGRATION COMPLETE
+-- ==================
@@ -0,0 +1,41 @@
+-- =====================================================
+-- Migration: Composite Indexes for Hot Reads
+-- Date: 2026-02-20
+-- Description: Index the app's hottest reads in the order they're read
+--              (found by execution/query_plan_suite.py): a session's messages
+--              by time, and a client's or advisor's sessions newest first
+-- =====================================================
+
+-- ==================
+-- 1. CREATE COMPOSITE INDEXES
+-- ==================
+
+-- Chat history: WHERE session_id = ? ORDER BY created_at. With only
+-- idx_messages_session_id, every page sorts all of the session's messages.
+CREATE INDEX IF NOT EXISTS idx_messages_session_id_created_at
+  ON public.messages(session_id, created_at);
+
+-- Session history (SessionHistory.tsx): WHERE client_id = ? ORDER BY
+-- started_at DESC LIMIT 50. Read backwards from the newest, the scan stops
+-- after the first 50 matches instead of sorting the client's whole history.
+CREATE INDEX IF NOT EXISTS idx_sessions_client_id_started_at
+  ON public.sessions(client_id, started_at DESC);
+
+-- Advisor dashboard: WHERE advisor_id = ? ORDER BY started_at DESC
+CREATE INDEX IF NOT EXISTS idx_sessions_advisor_id_started_at
+  ON public.sessions(advisor_id, started_at DESC);
+
+-- ==================
+-- 2. DROP REDUNDANT INDEXES
+-- ==================
+
+-- Each is a leading prefix of a composite index above, which serves the
+-- same lookups (including the ON DELETE CASCADE foreign key checks), so
+-- keeping them only costs writes
+DROP INDEX IF EXISTS public.idx_messages_session_id;
+DROP INDEX IF EXISTS public.idx_sessions_client_id;
+DROP INDEX IF EXISTS public.idx_sessions_advisor_id;
+
+-- ==================
+-- MIGRATION COMPLETE
+-- ==================
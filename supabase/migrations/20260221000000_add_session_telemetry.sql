@@ -0,0 +1,301 @@
+-- =====================================================
+-- Migration: Session Telemetry
+-- Date: 2026-02-21
+-- Description: Narrow, day-partitioned store for periodic WebRTC stats
+--              samples (written in COPY micro-batches by
+--              execution/ingest_telemetry.py) and a rollup that writes
+--              per-session quality summaries and sessions.connection_quality
+-- =====================================================
+
+-- ==================
+-- 1. CREATE TELEMETRY TABLE
+-- ==================
+
+-- One row per participant per stats interval (5s in useWebRTC). Samples
+-- never touch the sessions row, so thousands of concurrent calls don't
+-- rewrite and bloat it. Counters are cumulative since the connection
+-- started, as WebRTC getStats() reports them.
+-- No foreign keys: inserts shouldn't look up (or lock) sessions rows, and
+-- old days are dropped a partition at a time rather than cascaded.
+CREATE TABLE IF NOT EXISTS public.session_telemetry (
+  session_id UUID NOT NULL,
+  participant_id UUID NOT NULL,
+  sampled_at TIMESTAMP WITH TIME ZONE NOT NULL,
+  rtt_ms REAL,
+  jitter_ms REAL,
+  packets_lost INTEGER,
+  packets_received INTEGER,
+  bytes_sent BIGINT,
+  bytes_received BIGINT,
+  audio_level REAL,
+  quality connection_quality,
+  -- Also makes re-sent samples no-ops (ingest uses ON CONFLICT DO NOTHING)
+  PRIMARY KEY (session_id, sampled_at, participant_id)
+) PARTITION BY RANGE (sampled_at);
+
+-- ==================
+-- 2. PARTITION MAINTENANCE
+-- ==================
+
+-- Creates the daily partitions covering [p_from, p_to]; returns how many
+-- were new. ingest_telemetry.py calls it for every day it sees, so
+-- partitions exist before the first sample for a day arrives.
+-- PostgREST exposes every table in public, and RLS on the parent doesn't
+-- carry over to partitions, so each one gets RLS with no policies and no
+-- grants; samples are only reachable through the parent.
+-- Days are UTC whatever the caller's TimeZone, so the migration and the
+-- ingester always agree on the bounds. Only the owner of session_telemetry
+-- can add or drop partitions, so both maintenance functions run as their
+-- owner; that is what makes the service_role grants below usable.
+CREATE OR REPLACE FUNCTION public.ensure_session_telemetry_partitions(
+  p_from DATE,
+  p_to DATE
+)
+RETURNS INTEGER AS $$
+DECLARE
+  v_day DATE := p_from;
+  v_created INTEGER := 0;
+  v_name TEXT;
+BEGIN
+  WHILE v_day <= p_to LOOP
+    v_name := 'session_telemetry_p' || to_char(v_day, 'YYYYMMDD');
+    IF to_regclass('public.' || v_name) IS NULL THEN
+      EXECUTE format(
+        'CREATE TABLE IF NOT EXISTS public.%I PARTITION OF public.session_telemetry
+           FOR VALUES FROM (%L) TO (%L)',
+        v_name, v_day::TIMESTAMP AT TIME ZONE 'UTC', (v_day + 1)::TIMESTAMP AT TIME ZONE 'UTC'
+      );
+      EXECUTE format('ALTER TABLE public.%I ENABLE ROW LEVEL SECURITY', v_name);
+      EXECUTE format('REVOKE ALL ON public.%I FROM PUBLIC, anon, authenticated', v_name);
+      v_created := v_created + 1;
+    END IF;
+    v_day := v_day + 1;
+  END LOOP;
+  RETURN v_created;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public, pg_temp;
+
+-- Retention: dropping a day's partition is instant and leaves no dead
+-- tuples behind, unlike DELETE. Returns how many partitions were dropped.
+CREATE OR REPLACE FUNCTION public.drop_session_telemetry_partitions(
+  p_before DATE
+)
+RETURNS INTEGER AS $$
+DECLARE
+  v_partition RECORD;
+  v_dropped INTEGER := 0;
+BEGIN
+  FOR v_partition IN
+    SELECT c.relname
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'public.session_telemetry'::regclass
+      AND c.relname ~ '^session_telemetry_p[0-9]{8}$'
+      AND to_date(substring(c.relname FROM '[0-9]{8}$'), 'YYYYMMDD') < p_before
+  LOOP
+    EXECUTE format('DROP TABLE public.%I', v_partition.relname);
+    v_dropped := v_dropped + 1;
+  END LOOP;
+  RETURN v_dropped;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public, pg_temp;
+
+-- Yesterday through a week ahead; the ingester extends this as days pass
+SELECT public.ensure_session_telemetry_partitions(CURRENT_DATE - 1, CURRENT_DATE + 7);
+
+-- ==================
+-- 3. QUALITY SUMMARIES
+-- ==================
+
+CREATE TABLE IF NOT EXISTS public.session_quality_summaries (
+  session_id UUID PRIMARY KEY REFERENCES public.sessions(id) ON DELETE CASCADE,
+  samples INTEGER NOT NULL,
+  participants SMALLINT NOT NULL,
+  first_sample_at TIMESTAMP WITH TIME ZONE NOT NULL,
+  last_sample_at TIMESTAMP WITH TIME ZONE NOT NULL,
+  avg_rtt_ms REAL,
+  p95_rtt_ms REAL,
+  avg_jitter_ms REAL,
+  p95_jitter_ms REAL,
+  packet_loss_pct REAL,
+  avg_bitrate_kbps REAL,
+  lost_sample_pct REAL NOT NULL,
+  quality connection_quality NOT NULL,
+  updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW() NOT NULL
+);
+
+-- Thresholds follow the usual VoIP guidance: beyond ~1% loss, 250ms RTT or
+-- 30ms jitter calls degrade audibly; beyond 5%, 500ms or 50ms they break up.
+-- A session whose clients reported 'lost' for a quarter of its samples was
+-- effectively lost, whatever the averages say.
+CREATE OR REPLACE FUNCTION public.classify_connection_quality(
+  p_packet_loss_pct REAL,
+  p_p95_rtt_ms REAL,
+  p_p95_jitter_ms REAL,
+  p_lost_sample_pct REAL
+)
+RETURNS connection_quality AS $$
+  SELECT CASE
+    WHEN p_lost_sample_pct >= 25 THEN 'lost'
+    WHEN COALESCE(p_packet_loss_pct, 0) >= 5 OR COALESCE(p_p95_rtt_ms, 0) >= 500
+      OR COALESCE(p_p95_jitter_ms, 0) >= 50 THEN 'poor'
+    WHEN COALESCE(p_packet_loss_pct, 0) >= 1 OR COALESCE(p_p95_rtt_ms, 0) >= 250
+      OR COALESCE(p_p95_jitter_ms, 0) >= 30 THEN 'good'
+    ELSE 'excellent'
+  END::connection_quality;
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Recomputes the summaries of the given sessions from all their samples
+-- and copies the verdict to sessions.connection_quality. Sessions rows are
+-- only written when the quality actually changes. Returns the number of
+-- summaries written.
+CREATE OR REPLACE FUNCTION public.rollup_session_quality(
+  p_session_ids UUID[]
+)
+RETURNS INTEGER AS $$
+DECLARE
+  v_count INTEGER;
+BEGIN
+  WITH per_participant AS (
+    -- Counters are cumulative, so each participant's totals are its last
+    -- values; bitrate is bytes received over the sampled span
+    SELECT
+      t.session_id,
+      t.participant_id,
+      MAX(t.packets_lost) AS packets_lost,
+      MAX(t.packets_received) AS packets_received,
+      CASE WHEN MAX(t.sampled_at) > MIN(t.sampled_at)
+        THEN GREATEST(MAX(t.bytes_received) - MIN(t.bytes_received), 0) * 8 / 1000.0
+             / EXTRACT(EPOCH FROM MAX(t.sampled_at) - MIN(t.sampled_at))
+      END AS bitrate_kbps
+    FROM public.session_telemetry t
+    WHERE t.session_id = ANY(p_session_ids)
+    GROUP BY t.session_id, t.participant_id
+  ),
+  per_session AS (
+    SELECT
+      t.session_id,
+      COUNT(*)::INTEGER AS samples,
+      COUNT(DISTINCT t.participant_id)::SMALLINT AS participants,
+      MIN(t.sampled_at) AS first_sample_at,
+      MAX(t.sampled_at) AS last_sample_at,
+      AVG(t.rtt_ms)::REAL AS avg_rtt_ms,
+      (percentile_cont(0.95) WITHIN GROUP (ORDER BY t.rtt_ms))::REAL AS p95_rtt_ms,
+      AVG(t.jitter_ms)::REAL AS avg_jitter_ms,
+      (percentile_cont(0.95) WITHIN GROUP (ORDER BY t.jitter_ms))::REAL AS p95_jitter_ms,
+      (100.0 * COUNT(*) FILTER (WHERE t.quality = 'lost') / COUNT(*))::REAL AS lost_sample_pct
+    FROM public.session_telemetry t
+    WHERE t.session_id = ANY(p_session_ids)
+    GROUP BY t.session_id
+  ),
+  summary AS (
+    SELECT
+      s.*,
+      (SELECT (100.0 * SUM(p.packets_lost) / NULLIF(SUM(p.packets_lost) + SUM(p.packets_received), 0))::REAL
+       FROM per_participant p WHERE p.session_id = s.session_id) AS packet_loss_pct,
+      (SELECT AVG(p.bitrate_kbps)::REAL
+       FROM per_participant p WHERE p.session_id = s.session_id) AS avg_bitrate_kbps
+    FROM per_session s
+    -- Samples can outlive a deleted session (no foreign key); skip those
+    WHERE EXISTS (SELECT 1 FROM public.sessions WHERE id = s.session_id)
+  ),
+  upserted AS (
+    INSERT INTO public.session_quality_summaries (
+      session_id, samples, participants, first_sample_at, last_sample_at,
+      avg_rtt_ms, p95_rtt_ms, avg_jitter_ms, p95_jitter_ms, packet_loss_pct,
+      avg_bitrate_kbps, lost_sample_pct, quality, updated_at
+    )
+    SELECT
+      session_id, samples, participants, first_sample_at, last_sample_at,
+      avg_rtt_ms, p95_rtt_ms, avg_jitter_ms, p95_jitter_ms, packet_loss_pct,
+      avg_bitrate_kbps, lost_sample_pct,
+      public.classify_connection_quality(packet_loss_pct, p95_rtt_ms, p95_jitter_ms, lost_sample_pct),
+      NOW()
+    FROM summary
+    ON CONFLICT (session_id) DO UPDATE SET
+      samples = EXCLUDED.samples,
+      participants = EXCLUDED.participants,
+      first_sample_at = EXCLUDED.first_sample_at,
+      last_sample_at = EXCLUDED.last_sample_at,
+      avg_rtt_ms = EXCLUDED.avg_rtt_ms,
+      p95_rtt_ms = EXCLUDED.p95_rtt_ms,
+      avg_jitter_ms = EXCLUDED.avg_jitter_ms,
+      p95_jitter_ms = EXCLUDED.p95_jitter_ms,
+      packet_loss_pct = EXCLUDED.packet_loss_pct,
+      avg_bitrate_kbps = EXCLUDED.avg_bitrate_kbps,
+      lost_sample_pct = EXCLUDED.lost_sample_pct,
+      quality = EXCLUDED.quality,
+      updated_at = EXCLUDED.updated_at
+    RETURNING session_id, quality
+  ),
+  updated_sessions AS (
+    UPDATE public.sessions s
+    SET connection_quality = u.quality
+    FROM upserted u
+    WHERE s.id = u.session_id
+      AND s.connection_quality IS DISTINCT FROM u.quality
+    RETURNING s.id
+  )
+  SELECT COUNT(*) INTO v_count FROM upserted;
+
+  RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- ==================
+-- 4. ROW LEVEL SECURITY
+-- ==================
+
+-- Participants can read their sessions' telemetry and summaries; only the
+-- ingester (service role, bypasses RLS) writes
+ALTER TABLE public.session_telemetry ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.session_quality_summaries ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Users can view own session telemetry" ON public.session_telemetry;
+CREATE POLICY "Users can view own session telemetry"
+  ON public.session_telemetry FOR SELECT
+  USING (
+    EXISTS (
+      SELECT 1 FROM public.sessions
+      WHERE sessions.id = session_telemetry.session_id
+        AND (sessions.client_id = auth.uid() OR sessions.advisor_id = auth.uid())
+    )
+  );
+
+DROP POLICY IF EXISTS "Users can view own session quality" ON public.session_quality_summaries;
+CREATE POLICY "Users can view own session quality"
+  ON public.session_quality_summaries FOR SELECT
+  USING (
+    EXISTS (
+      SELECT 1 FROM public.sessions
+      WHERE sessions.id = session_quality_summaries.session_id
+        AND (sessions.client_id = auth.uid() OR sessions.advisor_id = auth.uid())
+    )
+  );
+
+-- ==================
+-- 5. GRANT PERMISSIONS
+-- ==================
+
+-- Maintenance and rollup functions aren't app RPCs
+REVOKE EXECUTE ON FUNCTION public.ensure_session_telemetry_partitions FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.drop_session_telemetry_partitions FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.rollup_session_quality FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.ensure_session_telemetry_partitions TO service_role;
+GRANT EXECUTE ON FUNCTION public.drop_session_telemetry_partitions TO service_role;
+GRANT EXECUTE ON FUNCTION public.rollup_session_quality TO service_role;
+
+-- ==================
+-- 6. ADD COMMENTS FOR DOCUMENTATION
+-- ==================
+
+COMMENT ON TABLE public.session_telemetry IS 'Periodic WebRTC stats samples per participant, partitioned by day on sampled_at';
+COMMENT ON COLUMN public.session_telemetry.packets_lost IS 'Cumulative since the connection started (getStats() semantics)';
+COMMENT ON TABLE public.session_quality_summaries IS 'Per-session quality computed from session_telemetry by rollup_session_quality()';
+COMMENT ON FUNCTION public.rollup_session_quality IS 'Recomputes quality summaries for the given sessions and updates sessions.connection_quality';
+COMMENT ON FUNCTION public.ensure_session_telemetry_partitions IS 'Creates missing daily session_telemetry partitions for a date range';
+COMMENT ON FUNCTION public.drop_session_telemetry_partitions IS 'Drops daily session_telemetry partitions older than a date';
+
+-- ==================
+-- MIGRATION COMPLETE
+-- ==================
@@ -0,0 +1,330 @@
+-- =====================================================
+-- Migration: Usage Rollups
+-- Date: 2026-02-22
+-- Description: Hourly and daily per-advisor / per-client usage and earnings
+--              by session type, maintained incrementally from a high-water
+--              mark on ended_at/last_billed_at by refresh_usage_rollups()
+--              (driven by execution/rollup_usage.py)
+-- =====================================================
+
+-- ==================
+-- 1. CREATE ROLLUP TABLES
+-- ==================
+
+-- One row per party per bucket per session type. Every ended session is
+-- counted once on the advisor side and once on the client side, in the
+-- bucket of its ended_at (UTC). Net earnings/spend are
+-- credits_gross - credits_refunded.
+CREATE TABLE IF NOT EXISTS public.usage_rollups_hourly (
+  role TEXT NOT NULL CHECK (role IN ('advisor', 'client')),
+  profile_id UUID NOT NULL,
+  bucket_start TIMESTAMP WITH TIME ZONE NOT NULL,
+  session_type session_type NOT NULL,
+  sessions INTEGER NOT NULL DEFAULT 0,
+  refunded_sessions INTEGER NOT NULL DEFAULT 0,
+  minutes BIGINT NOT NULL DEFAULT 0,
+  credits_gross BIGINT NOT NULL DEFAULT 0,
+  credits_refunded BIGINT NOT NULL DEFAULT 0,
+  PRIMARY KEY (role, profile_id, bucket_start, session_type)
+);
+
+CREATE TABLE IF NOT EXISTS public.usage_rollups_daily (
+  role TEXT NOT NULL CHECK (role IN ('advisor', 'client')),
+  profile_id UUID NOT NULL,
+  bucket_date DATE NOT NULL,
+  session_type session_type NOT NULL,
+  sessions INTEGER NOT NULL DEFAULT 0,
+  refunded_sessions INTEGER NOT NULL DEFAULT 0,
+  minutes BIGINT NOT NULL DEFAULT 0,
+  credits_gross BIGINT NOT NULL DEFAULT 0,
+  credits_refunded BIGINT NOT NULL DEFAULT 0,
+  PRIMARY KEY (role, profile_id, bucket_date, session_type)
+);
+
+-- Platform-wide dashboards read a date range across every advisor
+CREATE INDEX IF NOT EXISTS idx_usage_rollups_daily_bucket_date
+  ON public.usage_rollups_daily(bucket_date)
+  WHERE role = 'advisor';
+
+-- What each session currently contributes to the rollups. A session seen
+-- again (refunded, re-billed by reconciliation) is applied as new minus
+-- old, so corrections land in the right bucket without rescanning.
+-- No foreign keys: a deleted session's history stays in the rollups.
+CREATE TABLE IF NOT EXISTS public.session_usage_contributions (
+  session_id UUID PRIMARY KEY,
+  advisor_id UUID NOT NULL,
+  client_id UUID NOT NULL,
+  bucket_start TIMESTAMP WITH TIME ZONE NOT NULL,
+  session_type session_type NOT NULL,
+  minutes INTEGER NOT NULL,
+  credits INTEGER NOT NULL,
+  refunded BOOLEAN NOT NULL
+);
+
+-- Single-row high-water mark: sessions are read in (marker, id) order
+CREATE TABLE IF NOT EXISTS public.usage_rollup_state (
+  id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+  watermark TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT '-infinity',
+  last_session_id UUID NOT NULL DEFAULT '00000000-0000-0000-0000-000000000000',
+  updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW() NOT NULL
+);
+
+INSERT INTO public.usage_rollup_state (id) VALUES (TRUE) ON CONFLICT (id) DO NOTHING;
+
+-- ==================
+-- 2. CHANGE MARKER ON SESSIONS
+-- ==================
+
+-- An ended session changes its rollup contribution only through billing,
+-- and every billing path (end_rtc_session(s), reconcile_session_billing,
+-- update_billing_status) stamps last_billed_at. GREATEST() skips NULLs, so
+-- sessions that ended without billing are ordered by ended_at.
+CREATE INDEX IF NOT EXISTS idx_sessions_usage_marker
+  ON public.sessions ((GREATEST(ended_at, last_billed_at)), id)
+  WHERE ended_at IS NOT NULL;
+
+-- Anything else that changes an ended session's billing (a manual refund in
+-- the SQL editor) would be invisible to the mark, so stamp it here. The WHEN
+-- clause keeps the trigger off the ticker's and chat's hot updates.
+CREATE OR REPLACE FUNCTION public.stamp_session_billing_change()
+RETURNS TRIGGER AS $$
+BEGIN
+  NEW.last_billed_at := NOW();
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS sessions_stamp_billing_change ON public.sessions;
+CREATE TRIGGER sessions_stamp_billing_change
+  BEFORE UPDATE ON public.sessions
+  FOR EACH ROW
+  WHEN (
+    NEW.ended_at IS NOT NULL
+    AND NEW.last_billed_at IS NOT DISTINCT FROM OLD.last_billed_at
+    AND (
+      NEW.billing_status IS DISTINCT FROM OLD.billing_status
+      OR NEW.credits_charged IS DISTINCT FROM OLD.credits_charged
+      OR NEW.billable_minutes IS DISTINCT FROM OLD.billable_minutes
+      OR NEW.ended_at IS DISTINCT FROM OLD.ended_at
+      OR NEW.type IS DISTINCT FROM OLD.type
+    )
+  )
+  EXECUTE FUNCTION public.stamp_session_billing_change();
+
+-- ==================
+-- 3. CREATE REFRESH FUNCTION
+-- ==================
+
+-- Applies up to p_limit sessions past the high-water mark and advances it.
+-- Sessions stamped within the last p_settle_seconds are left for the next
+-- call: NOW() is the stamping transaction's start, so a slow transaction
+-- can commit a marker older than one already read. Re-reading a session is
+-- harmless (its delta is zero), which is also what makes
+-- rewind_usage_rollups() safe.
+CREATE OR REPLACE FUNCTION public.refresh_usage_rollups(
+  p_limit INTEGER DEFAULT 5000,
+  p_settle_seconds INTEGER DEFAULT 120
+)
+RETURNS TABLE (
+  sessions_scanned INTEGER,
+  sessions_changed INTEGER,
+  watermark TIMESTAMP WITH TIME ZONE,
+  caught_up BOOLEAN
+) AS $$
+#variable_conflict use_column
+DECLARE
+  v_state public.usage_rollup_state;
+  v_until TIMESTAMP WITH TIME ZONE := clock_timestamp() - make_interval(secs => p_settle_seconds);
+  v_scanned INTEGER;
+  v_changed INTEGER;
+  v_last_marker TIMESTAMP WITH TIME ZONE;
+  v_last_id UUID;
+BEGIN
+  IF p_limit < 1 THEN
+    RAISE EXCEPTION 'p_limit must be at least 1';
+  END IF;
+
+  -- One refresher at a time; a second caller waits for the first's commit
+  SELECT * INTO v_state FROM public.usage_rollup_state WHERE id FOR UPDATE;
+
+  WITH batch AS (
+    SELECT
+      s.id,
+      GREATEST(s.ended_at, s.last_billed_at) AS marker,
+      s.advisor_id,
+      s.client_id,
+      date_trunc('hour', s.ended_at, 'UTC') AS bucket_start,
+      COALESCE(s.type, 'chat'::session_type) AS session_type,
+      s.billable_minutes AS minutes,
+      s.credits_charged AS credits,
+      s.billing_status IS NOT DISTINCT FROM 'refunded' AS refunded
+    FROM public.sessions s
+    WHERE s.ended_at IS NOT NULL
+      AND (GREATEST(s.ended_at, s.last_billed_at), s.id) > (v_state.watermark, v_state.last_session_id)
+      AND GREATEST(s.ended_at, s.last_billed_at) <= v_until
+    ORDER BY GREATEST(s.ended_at, s.last_billed_at), s.id
+    LIMIT p_limit
+  ),
+  previous AS (
+    SELECT c.*
+    FROM public.session_usage_contributions c
+    JOIN batch b ON b.id = c.session_id
+  ),
+  changed AS (
+    SELECT b.*
+    FROM batch b
+    LEFT JOIN previous p ON p.session_id = b.id
+    WHERE p.session_id IS NULL
+       OR (p.advisor_id, p.client_id, p.bucket_start, p.session_type, p.minutes, p.credits, p.refunded)
+          IS DISTINCT FROM (b.advisor_id, b.client_id, b.bucket_start, b.session_type, b.minutes, b.credits, b.refunded)
+  ),
+  deltas AS (
+    -- The new contribution...
+    SELECT c.advisor_id, c.client_id, c.bucket_start, c.session_type,
+           1 AS sessions, c.refunded::INTEGER AS refunded_sessions, c.minutes,
+           c.credits AS credits_gross, CASE WHEN c.refunded THEN c.credits ELSE 0 END AS credits_refunded
+    FROM changed c
+    UNION ALL
+    -- ...minus the one it replaces
+    SELECT p.advisor_id, p.client_id, p.bucket_start, p.session_type,
+           -1, -p.refunded::INTEGER, -p.minutes,
+           -p.credits, CASE WHEN p.refunded THEN -p.credits ELSE 0 END
+    FROM previous p
+    JOIN changed c ON c.id = p.session_id
+  ),
+  by_party AS (
+    SELECT 'advisor' AS role, d.advisor_id AS profile_id, d.bucket_start, d.session_type, d.sessions,
+           d.refunded_sessions, d.minutes, d.credits_gross, d.credits_refunded
+    FROM deltas d
+    UNION ALL
+    SELECT 'client', d.client_id, d.bucket_start, d.session_type, d.sessions,
+           d.refunded_sessions, d.minutes, d.credits_gross, d.credits_refunded
+    FROM deltas d
+  ),
+  hourly AS (
+    INSERT INTO public.usage_rollups_hourly AS r (
+      role, profile_id, bucket_start, session_type,
+      sessions, refunded_sessions, minutes, credits_gross, credits_refunded
+    )
+    SELECT role, profile_id, bucket_start, session_type,
+           SUM(sessions), SUM(refunded_sessions), SUM(minutes), SUM(credits_gross), SUM(credits_refunded)
+    FROM by_party
+    GROUP BY role, profile_id, bucket_start, session_type
+    ON CONFLICT (role, profile_id, bucket_start, session_type) DO UPDATE SET
+      sessions = r.sessions + EXCLUDED.sessions,
+      refunded_sessions = r.refunded_sessions + EXCLUDED.refunded_sessions,
+      minutes = r.minutes + EXCLUDED.minutes,
+      credits_gross = r.credits_gross + EXCLUDED.credits_gross,
+      credits_refunded = r.credits_refunded + EXCLUDED.credits_refunded
+  ),
+  daily AS (
+    INSERT INTO public.usage_rollups_daily AS r (
+      role, profile_id, bucket_date, session_type,
+      sessions, refunded_sessions, minutes, credits_gross, credits_refunded
+    )
+    SELECT role, profile_id, (bucket_start AT TIME ZONE 'UTC')::DATE, session_type,
+           SUM(sessions), SUM(refunded_sessions), SUM(minutes), SUM(credits_gross), SUM(credits_refunded)
+    FROM by_party
+    GROUP BY role, profile_id, (bucket_start AT TIME ZONE 'UTC')::DATE, session_type
+    ON CONFLICT (role, profile_id, bucket_date, session_type) DO UPDATE SET
+      sessions = r.sessions + EXCLUDED.sessions,
+      refunded_sessions = r.refunded_sessions + EXCLUDED.refunded_sessions,
+      minutes = r.minutes + EXCLUDED.minutes,
+      credits_gross = r.credits_gross + EXCLUDED.credits_gross,
+      credits_refunded = r.credits_refunded + EXCLUDED.credits_refunded
+  ),
+  saved AS (
+    INSERT INTO public.session_usage_contributions AS sc (
+      session_id, advisor_id, client_id, bucket_start, session_type, minutes, credits, refunded
+    )
+    SELECT id, advisor_id, client_id, bucket_start, session_type, minutes, credits, refunded
+    FROM changed
+    ON CONFLICT (session_id) DO UPDATE SET
+      advisor_id = EXCLUDED.advisor_id,
+      client_id = EXCLUDED.client_id,
+      bucket_start = EXCLUDED.bucket_start,
+      session_type = EXCLUDED.session_type,
+      minutes = EXCLUDED.minutes,
+      credits = EXCLUDED.credits,
+      refunded = EXCLUDED.refunded
+  ),
+  last_read AS (
+    SELECT b.marker, b.id FROM batch b ORDER BY b.marker DESC, b.id DESC LIMIT 1
+  )
+  SELECT
+    (SELECT COUNT(*) FROM batch)::INTEGER,
+    (SELECT COUNT(*) FROM changed)::INTEGER,
+    (SELECT marker FROM last_read),
+    (SELECT id FROM last_read)
+  INTO v_scanned, v_changed, v_last_marker, v_last_id;
+
+  IF v_scanned > 0 THEN
+    UPDATE public.usage_rollup_state
+    SET watermark = v_last_marker,
+        last_session_id = v_last_id,
+        updated_at = NOW()
+    WHERE id;
+  END IF;
+
+  RETURN QUERY SELECT v_scanned, v_changed, COALESCE(v_last_marker, v_state.watermark), v_scanned < p_limit;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Moves the mark back so the next refreshes re-read everything stamped
+-- since p_to (a safety net for markers that committed very late)
+CREATE OR REPLACE FUNCTION public.rewind_usage_rollups(
+  p_to TIMESTAMP WITH TIME ZONE
+)
+RETURNS TIMESTAMP WITH TIME ZONE AS $$
+  UPDATE public.usage_rollup_state
+  SET watermark = LEAST(watermark, p_to),
+      last_session_id = '00000000-0000-0000-0000-000000000000',
+      updated_at = NOW()
+  WHERE id
+  RETURNING watermark;
+$$ LANGUAGE sql;
+
+-- ==================
+-- 4. ROW LEVEL SECURITY
+-- ==================
+
+-- Advisors read their earnings and clients their spend; only the refresh
+-- job (service role) writes
+ALTER TABLE public.usage_rollups_hourly ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.usage_rollups_daily ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.session_usage_contributions ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.usage_rollup_state ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Users can view own hourly usage" ON public.usage_rollups_hourly;
+CREATE POLICY "Users can view own hourly usage"
+  ON public.usage_rollups_hourly FOR SELECT
+  USING (auth.uid() = profile_id);
+
+DROP POLICY IF EXISTS "Users can view own daily usage" ON public.usage_rollups_daily;
+CREATE POLICY "Users can view own daily usage"
+  ON public.usage_rollups_daily FOR SELECT
+  USING (auth.uid() = profile_id);
+
+-- ==================
+-- 5. GRANT PERMISSIONS
+-- ==================
+
+REVOKE EXECUTE ON FUNCTION public.refresh_usage_rollups FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.rewind_usage_rollups FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.refresh_usage_rollups TO service_role;
+GRANT EXECUTE ON FUNCTION public.rewind_usage_rollups TO service_role;
+
+-- ==================
+-- 6. ADD COMMENTS FOR DOCUMENTATION
+-- ==================
+
+COMMENT ON TABLE public.usage_rollups_hourly IS 'Per-advisor and per-client sessions, minutes and credits per hour and session type (by ended_at, UTC)';
+COMMENT ON TABLE public.usage_rollups_daily IS 'Per-advisor and per-client sessions, minutes and credits per day and session type (by ended_at, UTC)';
+COMMENT ON TABLE public.session_usage_contributions IS 'What each ended session currently contributes to the usage rollups; corrections apply new minus old';
+COMMENT ON TABLE public.usage_rollup_state IS 'High-water mark (GREATEST(ended_at, last_billed_at), id) of refresh_usage_rollups()';
+COMMENT ON FUNCTION public.refresh_usage_rollups IS 'Applies the next batch of ended or re-billed sessions to the usage rollups';
+COMMENT ON FUNCTION public.rewind_usage_rollups IS 'Moves the usage rollup high-water mark back to re-read recent sessions';
+
+-- ==================
+-- MIGRATION COMPLETE
+-- ==================
@@ -0,0 +1,184 @@
+-- =====================================================
+-- Migration: Partition Messages by Month
+-- Date: 2026-02-23
+-- Description: Rebuild public.messages as monthly range partitions on
+--              created_at, with helpers for creating partitions ahead of
+--              time and a registry of cold-archived months (maintained by
+--              execution/manage_message_partitions.py)
+-- =====================================================
+
+-- ==================
+-- 1. MOVE THE EXISTING TABLE ASIDE
+-- ==================
+
+-- A table can't be converted to a partitioned one in place. The old heap is
+-- renamed, its rows are copied into the new table below and it is dropped.
+-- The copy holds the old table's lock for the length of the migration, so
+-- on a large project apply this in a quiet window.
+ALTER TABLE public.messages RENAME TO messages_unpartitioned;
+ALTER INDEX public.messages_pkey RENAME TO messages_unpartitioned_pkey;
+
+-- Free the index names for the partitioned table
+DROP INDEX IF EXISTS public.idx_messages_session_id;
+DROP INDEX IF EXISTS public.idx_messages_session_id_created_at;
+DROP INDEX IF EXISTS public.idx_messages_sender_id;
+DROP INDEX IF EXISTS public.idx_messages_created_at;
+
+-- ==================
+-- 2. CREATE PARTITIONED MESSAGES TABLE
+-- ==================
+
+-- The primary key of a partitioned table must contain the partition key.
+-- Leading with created_at lets it double as the time index (retention,
+-- export_history.py's (created_at, id) keyset), replacing the separate
+-- idx_messages_created_at. ids are still random UUIDs, unique in practice.
+CREATE TABLE IF NOT EXISTS public.messages (
+  id UUID NOT NULL DEFAULT gen_random_uuid(),
+  session_id UUID NOT NULL REFERENCES public.sessions(id) ON DELETE CASCADE,
+  sender_id UUID NOT NULL REFERENCES public.profiles(id) ON DELETE CASCADE,
+  content TEXT NOT NULL,
+  created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW() NOT NULL,
+  PRIMARY KEY (created_at, id)
+) PARTITION BY RANGE (created_at);
+
+-- Created on every partition. A session's messages sit in the months the
+-- session ran, so chat reads bounded by the session's start
+-- (created_at >= sessions.started_at) only touch those partitions.
+CREATE INDEX IF NOT EXISTS idx_messages_session_id_created_at
+  ON public.messages(session_id, created_at);
+
+-- ON DELETE CASCADE from profiles
+CREATE INDEX IF NOT EXISTS idx_messages_sender_id
+  ON public.messages(sender_id);
+
+-- ==================
+-- 3. PARTITION MAINTENANCE
+-- ==================
+
+-- Creates the monthly partitions (UTC months) covering [p_from, p_to];
+-- returns how many were new. manage_message_partitions.py keeps a few
+-- months ahead, so inserts never find their month missing.
+-- PostgREST exposes every table in public, partitions included, and the
+-- policies below only apply through the parent. Each partition therefore
+-- gets RLS with no policies and no grants, so it can't be read directly.
+-- Only the owner of messages can add partitions, so the function runs as
+-- its owner; that is what makes the service_role grant below usable.
+CREATE OR REPLACE FUNCTION public.ensure_message_partitions(
+  p_from DATE,
+  p_to DATE
+)
+RETURNS INTEGER AS $$
+DECLARE
+  v_month DATE := date_trunc('month', p_from)::DATE;
+  v_created INTEGER := 0;
+  v_name TEXT;
+BEGIN
+  WHILE v_month <= p_to LOOP
+    v_name := 'messages_p' || to_char(v_month, 'YYYYMM');
+    -- A detached, not yet archived partition keeps its name; leave it for
+    -- the archive job rather than failing on a duplicate
+    IF to_regclass('public.' || v_name) IS NULL THEN
+      EXECUTE format(
+        'CREATE TABLE public.%I PARTITION OF public.messages FOR VALUES FROM (%L) TO (%L)',
+        v_name,
+        v_month::TIMESTAMP AT TIME ZONE 'UTC',
+        (v_month + INTERVAL '1 month')::TIMESTAMP AT TIME ZONE 'UTC'
+      );
+      EXECUTE format('ALTER TABLE public.%I ENABLE ROW LEVEL SECURITY', v_name);
+      EXECUTE format('REVOKE ALL ON public.%I FROM PUBLIC, anon, authenticated', v_name);
+      v_created := v_created + 1;
+    END IF;
+    v_month := (v_month + INTERVAL '1 month')::DATE;
+  END LOOP;
+  RETURN v_created;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public, pg_temp;
+
+-- ==================
+-- 4. COPY EXISTING MESSAGES
+-- ==================
+
+SELECT public.ensure_message_partitions(
+  COALESCE((SELECT (MIN(created_at) AT TIME ZONE 'UTC')::DATE FROM public.messages_unpartitioned), CURRENT_DATE),
+  GREATEST((SELECT (MAX(created_at) AT TIME ZONE 'UTC')::DATE FROM public.messages_unpartitioned), CURRENT_DATE + 90)
+);
+
+-- created_at is the partition key, so it can no longer be NULL
+INSERT INTO public.messages (id, session_id, sender_id, content, created_at)
+SELECT id, session_id, sender_id, content, COALESCE(created_at, NOW())
+FROM public.messages_unpartitioned;
+
+DROP TABLE public.messages_unpartitioned;
+
+-- ==================
+-- 5. ARCHIVE REGISTRY
+-- ==================
+
+-- One row per month that has been detached and written to an archive file.
+-- A restored month is kept attached until keep_until, then archived again.
+CREATE TABLE IF NOT EXISTS public.message_archives (
+  partition_month DATE PRIMARY KEY,
+  partition_name TEXT NOT NULL,
+  row_count BIGINT NOT NULL,
+  file_name TEXT NOT NULL,
+  file_bytes BIGINT NOT NULL,
+  sha256 TEXT NOT NULL,
+  archived_at TIMESTAMP WITH TIME ZONE DEFAULT NOW() NOT NULL,
+  restored_at TIMESTAMP WITH TIME ZONE,
+  keep_until TIMESTAMP WITH TIME ZONE
+);
+
+-- ==================
+-- 6. ROW LEVEL SECURITY
+-- ==================
+
+ALTER TABLE public.messages ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.message_archives ENABLE ROW LEVEL SECURITY;
+
+-- Same policies as before the rebuild
+DROP POLICY IF EXISTS "Users can view session messages" ON public.messages;
+DROP POLICY IF EXISTS "Users can send messages" ON public.messages;
+
+CREATE POLICY "Users can view session messages"
+  ON public.messages FOR SELECT
+  USING (
+    EXISTS (
+      SELECT 1 FROM public.sessions
+      WHERE sessions.id = messages.session_id
+      AND (sessions.client_id = auth.uid() OR sessions.advisor_id = auth.uid())
+    )
+  );
+
+CREATE POLICY "Users can send messages"
+  ON public.messages FOR INSERT
+  WITH CHECK (
+    auth.uid() = sender_id
+    AND EXISTS (
+      SELECT 1 FROM public.sessions
+      WHERE sessions.id = messages.session_id
+      AND (sessions.client_id = auth.uid() OR sessions.advisor_id = auth.uid())
+    )
+  );
+
+-- ==================
+-- 7. GRANT PERMISSIONS
+-- ==================
+
+-- Partition maintenance and the archive registry are for the job only
+REVOKE ALL ON public.message_archives FROM PUBLIC, anon, authenticated;
+GRANT ALL ON public.message_archives TO service_role;
+REVOKE EXECUTE ON FUNCTION public.ensure_message_partitions FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.ensure_message_partitions TO service_role;
+
+-- ==================
+-- 8. ADD COMMENTS FOR DOCUMENTATION
+-- ==================
+
+COMMENT ON TABLE public.messages IS 'Messages within sessions, partitioned by month (UTC) on created_at';
+COMMENT ON TABLE public.message_archives IS 'Months of messages detached and archived to compressed files by manage_message_partitions.py';
+COMMENT ON COLUMN public.message_archives.keep_until IS 'A restored month stays attached until this time';
+COMMENT ON FUNCTION public.ensure_message_partitions IS 'Creates missing monthly messages partitions for a date range';
+
+-- ==================
+-- MIGRATION COMPLETE
+-- ==================